@@ -3,11 +3,8 @@ import time
 import uuid
 import math
 import hashlib
-import threading
 import logging
 import json
-import csv
-import io
 from datetime import timedelta
 from pathlib import Path
 from flask import Flask, request, jsonify, render_template, abort, Response, g
@@ -19,12 +16,6 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-try:
-    from scipy.spatial import ConvexHull
-    HAS_SCIPY = True
-except ImportError:
-    HAS_SCIPY = False
-
 # --- Security imports ---
 try:
     from flask_limiter import Limiter
@@ -40,6 +31,11 @@ from email_utils import send_email, EMAIL_ENABLED, FROM_EMAIL
 # --- Core modules ---
 import data_enricher
 import ml_models
+import cache
+import clustering
+import cluster_map
+import jobs
+import spatial_index
 import security_utils
 
 # --- PostgreSQL Database ---
@@ -90,6 +86,11 @@ ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',')
 ADMIN_EMAIL = os.getenv('ADMIN_EMAIL', 'hallo@openleg.ch')
 ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '').strip()
 INTERNAL_TOKEN = os.getenv('INTERNAL_TOKEN', '').strip()
+JOB_EMAIL_WORKERS = int(os.getenv('JOB_EMAIL_WORKERS', '2'))
+# Building-months compacted per meter_compaction job (the job re-enqueues itself while more remain)
+METER_COMPACT_BATCH = int(os.getenv('METER_COMPACT_BATCH', '500'))
+# Meter partitions (and compacted months) older than this many months are dropped by cron; 0 keeps all
+METER_RETENTION_MONTHS = int(os.getenv('METER_RETENTION_MONTHS', '0'))
 
 # --- Rate Limiting & Security ---
 if HAS_SECURITY_LIBS:
@@ -153,6 +154,12 @@ def log_security_event(event_type, details, level='INFO'):
         logger.info(log_message)
 
 
+@app.before_request
+def start_job_workers():
+    # Per process and after fork (gunicorn --preload imports this module in the arbiter)
+    jobs.queue.ensure_started()
+
+
 @app.after_request
 def apply_basic_security_headers(response):
     response.headers['X-Content-Type-Options'] = 'nosniff'
@@ -224,10 +231,11 @@ def send_activity_notification(activity_type, details):
     send_email(ADMIN_EMAIL, subject, message_body)
 
 
-def send_confirmation_email(email, unsubscribe_url, building_id=None, address=None):
-    name = _tenant_name()
+def send_confirmation_email(email, unsubscribe_url, building_id=None, address=None,
+                            platform_name=None, city_name=None):
+    name = platform_name or _tenant_name()
     try:
-        city = getattr(g, 'tenant', {}).get('city_name', 'Zürich')
+        city = city_name or getattr(g, 'tenant', {}).get('city_name', 'Zürich')
     except RuntimeError:
         city = 'Zürich'
     subject = f"{name}: Registrierung bestätigt"
@@ -238,7 +246,61 @@ def send_confirmation_email(email, unsubscribe_url, building_id=None, address=No
         f"Abmelden:\n{unsubscribe_url}\n\n"
         f"Ihr {name}-Team"
     )
-    send_email(email, subject, message_body)
+    return send_email(email, subject, message_body)
+
+
+def _run_confirmation_email_job(payload):
+    """Job handler: tenant names travel in the payload (no request context here)."""
+    if not send_confirmation_email(**payload):
+        raise RuntimeError(f"Confirmation email to building {payload.get('building_id')} not sent")
+
+
+def _run_email_sequence_job(payload):
+    email_automation.schedule_sequence_for_user(payload['building_id'], payload['email'])
+
+
+def _run_meter_compaction_job(payload):
+    """One bounded batch per job, so a first run over years of history stays far below any timeout."""
+    result = db.compact_meter_months(limit=METER_COMPACT_BATCH)
+    if result.get("more"):
+        jobs.enqueue('meter_compaction', {}, dedup_key='meter_compaction')
+
+
+def _run_billing_job(payload):
+    """Bill all active communities for the queued period; re-runs replace saved periods."""
+    import billing_run
+    from datetime import datetime
+    report = billing_run.run_billing(datetime.fromisoformat(payload['period_start']),
+                                     datetime.fromisoformat(payload['period_end']))
+    if report["failed"]:
+        raise RuntimeError(f"Billing {payload['period_start']}..{payload['period_end']} failed for "
+                           f"{len(report['failed'])} communities")
+
+
+def _run_meter_partition_migration_job(payload):
+    result = db.migrate_meter_readings_to_partitions(drop_legacy=bool(payload.get('drop_legacy')))
+    if not result["migrated"] and result["reason"] not in ("already partitioned", "no meter_readings table"):
+        raise RuntimeError(f"meter_readings partition migration failed: {result['reason']}")
+
+
+jobs.register('confirmation_email', _run_confirmation_email_job, workers=JOB_EMAIL_WORKERS, max_attempts=5)
+jobs.register('email_sequence', _run_email_sequence_job, workers=1)
+jobs.register('meter_compaction', _run_meter_compaction_job, workers=1)
+jobs.register('meter_partition_migration', _run_meter_partition_migration_job, workers=1, max_attempts=1)
+jobs.register('billing_run', _run_billing_job, workers=1, max_attempts=3)
+
+
+def enqueue_registration_jobs(building_id, email, unsubscribe_url, address, city_id):
+    """Queue the post-registration work: confirmation email, clustering, email sequence."""
+    tenant = getattr(g, 'tenant', None) or {}
+    jobs.enqueue('confirmation_email', {
+        'email': email, 'unsubscribe_url': unsubscribe_url,
+        'building_id': building_id, 'address': address,
+        'platform_name': tenant.get('platform_name'), 'city_name': tenant.get('city_name'),
+    }, dedup_key=f"confirm:{building_id}")
+    clustering.schedule(city_id, added=[building_id])
+    jobs.enqueue('email_sequence', {'building_id': building_id, 'email': email},
+                 dedup_key=f"sequence:{building_id}")
 
 
 def collect_building_locations(city_id=None, exclude_building_id=None):
@@ -262,7 +324,11 @@ def collect_building_locations(city_id=None, exclude_building_id=None):
 
 
 def run_full_ml_task(new_building_id=None, city_id=None):
-    """Background ML clustering task using PostgreSQL data."""
+    """Full ML clustering rebuild using PostgreSQL data.
+
+    Registrations use clustering.schedule (incremental); this stays for
+    manual/cron full recomputes.
+    """
     logger.info("[ML] Starting background clustering...")
     profiles = db.get_all_building_profiles(city_id=city_id)
     if len(profiles) < 2:
@@ -283,24 +349,27 @@ def run_full_ml_task(new_building_id=None, city_id=None):
                 db.save_cluster(bid, cid)
 
     for community in ranked_communities:
-        db.save_cluster_info(community['community_id'], community)
+        db.save_cluster_info(community['community_id'], cluster_map.with_polygon(community))
+    db.sync_cluster_id_seq()
+    clustering.invalidate(all_cities=True)
+    cluster_map.publish_snapshot()
 
     logger.info(f"[ML] Clustering done: {len(ranked_communities)} clusters")
 
 
-def find_provisional_matches(new_profile):
-    """Fast provisional match search (distance only, no DBSCAN)."""
-    profiles = db.get_all_building_profiles()
-    if not profiles:
-        return None
+# In-memory grid over all verified buildings; radius queries touch only nearby cells
+building_index = spatial_index.BuildingIndex(
+    load_all=db.load_building_profiles,
+    load_since=lambda since: db.load_building_profiles_since(None, since),
+    cell_meters=150,
+)
 
-    new_coords = (new_profile['lat'], new_profile['lon'])
-    provisional = [new_profile]
 
-    for p in profiles:
-        dist = ml_models.calculate_distance(new_coords[0], new_coords[1], float(p['lat']), float(p['lon']))
-        if dist <= 150:
-            provisional.append(p)
+def find_provisional_matches(new_profile):
+    """Fast provisional match search (distance only, no DBSCAN)."""
+    nearby = building_index.query(float(new_profile['lat']), float(new_profile['lon']), 150,
+                                  exclude=new_profile.get('building_id'))
+    provisional = [new_profile] + [p for p, _ in nearby]
 
     if len(provisional) < 2:
         return None
@@ -317,33 +386,6 @@ def find_provisional_matches(new_profile):
     }
 
 
-def create_simple_polygon(coords):
-    if len(coords) < 3:
-        if len(coords) == 1:
-            lat, lon = coords[0]
-            o = 0.0005
-            return [[lat-o, lon-o], [lat+o, lon-o], [lat+o, lon+o], [lat-o, lon+o], [lat-o, lon-o]]
-        elif len(coords) == 2:
-            lat1, lon1 = coords[0]
-            lat2, lon2 = coords[1]
-            o = 0.0003
-            return [[lat1-o, lon1-o], [lat2+o, lon1-o], [lat2+o, lon2+o], [lat1-o, lon2+o], [lat1-o, lon1-o]]
-    if HAS_SCIPY:
-        try:
-            points = np.array(coords)
-            hull = ConvexHull(points)
-            polygon = [coords[i] for i in hull.vertices]
-            polygon.append(polygon[0])
-            return polygon
-        except:
-            pass
-    lats = [c[0] for c in coords]
-    lons = [c[1] for c in coords]
-    o = 0.0003
-    return [[min(lats)-o, min(lons)-o], [max(lats)+o, min(lons)-o],
-            [max(lats)+o, max(lons)+o], [min(lats)-o, max(lons)+o], [min(lats)-o, min(lons)-o]]
-
-
 # ===========================
 # Routes
 # ===========================
@@ -447,24 +489,50 @@ def admin_pipeline():
     return jsonify({"entries": entries, "stats": stats})
 
 
+def _export_filters():
+    """city_id, building_id and the from/to range (ISO dates, to inclusive) of an export request."""
+    from datetime import datetime
+    start, end = request.args.get("from"), request.args.get("to")
+    try:
+        start = datetime.fromisoformat(start) if start else None
+        if end:
+            # a plain date includes that whole day
+            end = datetime.fromisoformat(end) + (timedelta(days=1) if len(end) == 10 else timedelta(0))
+    except ValueError:
+        abort(400, description="from/to must be ISO dates")
+    return {"city_id": request.args.get("city_id"), "building_id": request.args.get("building"),
+            "start": start, "end": end}
+
+
+def _export_response(chunks, columns, filename, default_format="csv"):
+    """Chunked download of database row chunks; nothing is buffered beyond one chunk."""
+    import data_export
+    fmt = (request.args.get("format") or default_format).lower()
+    if fmt not in data_export.available_formats():
+        return jsonify({"error": f"Unsupported format, use one of: {', '.join(data_export.available_formats())}"}), 400
+    response = Response(data_export.stream(fmt, chunks, columns), mimetype=data_export.MIMETYPES[fmt])
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}.{fmt}"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
 @app.route("/admin/export")
 def admin_export():
     _require_admin()
-    fmt = (request.args.get("format") or "json").lower()
-    city_id = request.args.get("city_id")
-
-    buildings = db.get_all_building_profiles(city_id=city_id)
-    if fmt == "csv":
-        output = io.StringIO()
-        if buildings:
-            writer = csv.DictWriter(output, fieldnames=buildings[0].keys())
-            writer.writeheader()
-            for row in buildings:
-                writer.writerow(row)
-        response = Response(output.getvalue(), mimetype="text/csv")
-        response.headers["Content-Disposition"] = "attachment; filename=openleg_export.csv"
-        return response
-    return jsonify({"records": buildings, "count": len(buildings)})
+    import data_export
+    filters = _export_filters()
+    return _export_response(db.iter_building_profiles(**filters), data_export.BUILDING_COLUMNS,
+                            "openleg_export", default_format="json")
+
+
+@app.route("/admin/export/meter-readings")
+def admin_export_meter_readings():
+    """Meter readings (compacted months included) ordered by building and timestamp."""
+    _require_admin()
+    import data_export
+    filters = _export_filters()
+    return _export_response(db.iter_meter_readings(**filters), data_export.METER_COLUMNS,
+                            "openleg_meter_readings")
 
 
 # --- LEA Reports ---
@@ -481,6 +549,18 @@ def api_internal_lea_report():
     return jsonify({"ok": True})
 
 
+@app.route("/admin/meter-partitions/migrate", methods=['POST'])
+def admin_migrate_meter_partitions():
+    """Queue the move of a plain meter_readings table into monthly partitions (runs for a while)."""
+    _require_admin()
+    if not USE_POSTGRES:
+        return jsonify({"error": "database unavailable"}), 503
+    drop_legacy = request.args.get('drop_legacy', '').lower() in ('1', 'true', 'yes')
+    job_id = jobs.enqueue('meter_partition_migration', {"drop_legacy": drop_legacy},
+                          dedup_key='meter_partition_migration')
+    return jsonify({"queued": job_id is not None, "job_id": job_id}), 202
+
+
 @app.route("/admin/lea-reports")
 def admin_lea_reports():
     _require_admin()
@@ -537,28 +617,15 @@ def api_get_all_buildings():
 
 @app.route("/api/get_all_clusters")
 def api_get_all_clusters():
-    clusters_raw = db.get_all_clusters()
-    clusters = []
-    for ci in clusters_raw:
-        members = ci.get('members', [])
-        if not members or len(members) < 2:
-            continue
-        coords = []
-        member_list = []
-        for mid in members:
-            b = db.get_building(mid)
-            if b and b.get('lat') and b.get('lon'):
-                coords.append([float(b['lat']), float(b['lon'])])
-                member_list.append({'building_id': mid, 'lat': float(b['lat']), 'lon': float(b['lon'])})
-        if len(coords) >= 2:
-            clusters.append({
-                'cluster_id': ci.get('cluster_id'),
-                'members': member_list,
-                'polygon': create_simple_polygon(coords),
-                'autarky_percent': float(ci.get('autarky_percent', 0)),
-                'num_members': len(member_list)
-            })
-    return jsonify({"clusters": clusters})
+    """Cluster map from the snapshot published by the clustering job (ETag/304)."""
+    etag, payload = cluster_map.get_snapshot()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(payload, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 # --- Check Potential ---
@@ -653,6 +720,7 @@ def api_register_anonymous():
         consents=consents, user_type='anonymous', phone=phone,
         referrer_id=referrer_id, city_id=city_id
     )
+    building_index.add({**profile, 'building_id': building_id, 'user_type': 'anonymous'})
 
     # Create unsubscribe token
     unsub_token = str(uuid.uuid4())
@@ -660,9 +728,7 @@ def api_register_anonymous():
     unsubscribe_url = f"{APP_BASE_URL}/unsubscribe/{unsub_token}"
 
     # Background tasks
-    threading.Thread(target=send_confirmation_email, args=(email, unsubscribe_url, building_id, profile.get('address', '')), daemon=True).start()
-    threading.Thread(target=run_full_ml_task, args=(building_id, city_id), daemon=True).start()
-    threading.Thread(target=email_automation.schedule_sequence_for_user, args=(building_id, email), daemon=True).start()
+    enqueue_registration_jobs(building_id, email, unsubscribe_url, profile.get('address', ''), city_id)
 
     db.track_event('registration', building_id, {'type': 'anonymous', 'city_id': city_id})
 
@@ -740,14 +806,13 @@ def api_register_full():
         consents=consents, user_type='registered', phone=phone,
         referrer_id=referrer_id, city_id=city_id
     )
+    building_index.add({**profile, 'building_id': building_id, 'user_type': 'registered'})
 
     unsub_token = str(uuid.uuid4())
     db.save_token(unsub_token, building_id, 'unsubscribe')
     unsubscribe_url = f"{APP_BASE_URL}/unsubscribe/{unsub_token}"
 
-    threading.Thread(target=send_confirmation_email, args=(email, unsubscribe_url, building_id, profile.get('address', '')), daemon=True).start()
-    threading.Thread(target=run_full_ml_task, args=(building_id, city_id), daemon=True).start()
-    threading.Thread(target=email_automation.schedule_sequence_for_user, args=(building_id, email), daemon=True).start()
+    enqueue_registration_jobs(building_id, email, unsubscribe_url, profile.get('address', ''), city_id)
 
     db.track_event('registration', building_id, {'type': 'registered', 'city_id': city_id})
 
@@ -834,6 +899,8 @@ def unsubscribe_page():
             else:
                 for m in matches:
                     db.delete_building(m['building_id'])
+                    building_index.remove(m['building_id'])
+                    clustering.schedule(m.get('city_id'), removed=[m['building_id']])
                 status = "success"
                 message = "Ihre Daten wurden erfolgreich gelöscht."
 
@@ -852,8 +919,11 @@ def unsubscribe_token(token):
         return "<h1>Link ungültig oder bereits verwendet</h1>", 404
 
     building_id = token_info['building_id']
+    building = db.get_building(building_id) or {}
     db.use_token(token)
     db.delete_building(building_id)
+    building_index.remove(building_id)
+    clustering.schedule(building.get('city_id'), removed=[building_id])
     db.cancel_emails_for_building(building_id)
     return "<h1>Abmeldung erfolgreich</h1><p>Ihre Daten wurden gelöscht.</p>"
 
@@ -989,7 +1059,12 @@ def api_formation_optimize():
     if not building_id:
         return jsonify({"error": "building_id required"}), 400
 
-    clusters = formation_wizard.get_formable_clusters(db, building_id)
+    try:
+        limit = min(max(int(data.get('limit', formation_wizard.FORMATION_PAGE_SIZE)), 1), 100)
+        offset = max(int(data.get('offset', 0)), 0)
+    except (TypeError, ValueError):
+        return jsonify({"error": "limit/offset must be integers"}), 400
+    clusters = formation_wizard.get_formable_clusters(db, building_id, limit=limit, offset=offset)
     return jsonify({"clusters": clusters})
 
 
@@ -1017,16 +1092,58 @@ def api_cron_process_emails():
     return jsonify(result)
 
 
+@app.route("/api/cron/process-jobs", methods=['POST'])
+def api_cron_process_jobs():
+    """Drain due background jobs inline (fallback when worker threads are disabled)."""
+    secret = request.headers.get('X-Cron-Secret') or request.args.get('secret') or ''
+    if CRON_SECRET and secret != CRON_SECRET:
+        abort(403)
+    processed = jobs.queue.run_pending(limit=request.args.get('limit', 100, type=int))
+    purged = db.purge_jobs() if USE_POSTGRES else 0
+    return jsonify({"processed": processed, "purged": purged, "jobs": jobs.queue.metrics()})
+
+
 @app.route("/api/cron/refresh-public-data", methods=['POST'])
 def api_cron_refresh_public_data():
     secret = request.headers.get('X-Cron-Secret') or request.args.get('secret') or ''
     if CRON_SECRET and secret != CRON_SECRET:
         abort(403)
     import public_data
-    result = public_data.refresh_canton('ZH')
+    force = request.args.get('force', '').lower() in ('1', 'true', 'yes')
+    result = public_data.refresh_canton('ZH', force=force)
     return jsonify(result)
 
 
+@app.route("/api/cron/compact-meter-data", methods=['POST'])
+def api_cron_compact_meter_data():
+    """Queue the move of finalized meter months into the compressed per-building blob store."""
+    secret = request.headers.get('X-Cron-Secret') or request.args.get('secret') or ''
+    if CRON_SECRET and secret != CRON_SECRET:
+        abort(403)
+    if not USE_POSTGRES:
+        return jsonify({"error": "database unavailable"}), 503
+    job_id = jobs.enqueue('meter_compaction', {}, dedup_key='meter_compaction')
+    return jsonify({"queued": job_id is not None, "job_id": job_id}), 202
+
+
+@app.route("/api/cron/meter-partitions", methods=['POST'])
+def api_cron_meter_partitions():
+    """Attach meter_readings partitions for the coming months; drop months past METER_RETENTION_MONTHS."""
+    secret = request.headers.get('X-Cron-Secret') or request.args.get('secret') or ''
+    if CRON_SECRET and secret != CRON_SECRET:
+        abort(403)
+    if not USE_POSTGRES:
+        return jsonify({"error": "database unavailable"}), 503
+    from datetime import date
+    created = db.ensure_meter_partitions()
+    removed = []
+    if METER_RETENTION_MONTHS > 0:
+        today = date.today()
+        months = today.year * 12 + today.month - 1 - METER_RETENTION_MONTHS
+        removed = db.drop_meter_partitions(date(months // 12, months % 12 + 1, 1))
+    return jsonify({"created": created, "removed": removed})
+
+
 
 @app.route("/api/email/stats")
 def api_email_stats():
@@ -1050,17 +1167,33 @@ def webhook_deepsign():
 # --- Billing Cron ---
 @app.route("/api/cron/process-billing", methods=['POST'])
 def api_cron_process_billing():
+    """Queue the billing run for a period (default last month); one job per period."""
     secret = request.headers.get('X-Cron-Secret') or request.args.get('secret') or ''
     if CRON_SECRET and secret != CRON_SECRET:
         abort(403)
-    import billing_engine
-    communities = db.get_active_communities()
-    processed = 0
-    for community in communities:
-        cid = community['community_id']
-        # Billing processing runs per active community.
-        processed += 1
-    return jsonify({"processed": processed, "communities": len(communities)})
+    if not USE_POSTGRES:
+        return jsonify({"error": "database unavailable"}), 503
+    import billing_run
+    from datetime import datetime
+    data = request.get_json(silent=True) or {}
+    period_start = data.get('period_start') or request.args.get('period_start')
+    period_end = data.get('period_end') or request.args.get('period_end')
+    if bool(period_start) != bool(period_end):
+        return jsonify({"error": "period_start and period_end must be given together"}), 400
+    try:
+        period_start = datetime.fromisoformat(period_start) if period_start else None
+        period_end = datetime.fromisoformat(period_end) if period_end else None
+    except ValueError:
+        return jsonify({"error": "period_start/period_end must be ISO dates"}), 400
+    if period_start is None:
+        period_start, period_end = billing_run.previous_month()
+    if period_end <= period_start:
+        return jsonify({"error": "period_end must be after period_start"}), 400
+    job_id = jobs.enqueue('billing_run', {"period_start": period_start.isoformat(),
+                                          "period_end": period_end.isoformat()},
+                          dedup_key=f"billing:{period_start.isoformat()}:{period_end.isoformat()}")
+    return jsonify({"queued": job_id is not None, "job_id": job_id,
+                    "period_start": period_start.isoformat(), "period_end": period_end.isoformat()}), 202
 
 
 @app.route("/api/billing/community/<community_id>/period/<int:period_id>")
@@ -1081,6 +1214,8 @@ def metrics():
         "active_communities": len(communities),
         "total_buildings": stats.get('total_buildings', 0),
         "registrations_today": stats.get('registrations_today', 0),
+        "jobs": jobs.queue.metrics(),
+        "cache": cache.cache_stats(),
     })
 
 
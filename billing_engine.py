@@ -13,6 +13,64 @@ DISCOUNT_SAME_LEVEL = 0.40
 DISCOUNT_CROSS_LEVEL = 0.20
 
 
+def allocate_energy_matrix(production, consumption, model="proportional"):
+    """Allocate solar production to consumers for all intervals at once.
+
+    Args:
+        production: 1-D array of production values per interval (kWh)
+        consumption: 2-D array (intervals x participants) of consumption (kWh)
+        model: "proportional" or "einfach"
+
+    Returns:
+        2-D float64 array shaped like consumption, values = allocated kWh
+    """
+    prod = np.asarray(production, dtype=np.float64).reshape(-1)
+    cons = np.asarray(consumption, dtype=np.float64)
+    if cons.ndim == 1:
+        cons = cons.reshape(-1, 1)
+    if cons.shape[0] != prod.shape[0]:
+        raise ValueError("production and consumption must have the same number of intervals")
+
+    result = np.zeros_like(cons)
+    n = cons.shape[1]
+    if n == 0 or model not in ("proportional", "einfach"):
+        return result
+
+    total_cons = np.nansum(cons, axis=1)
+    active = (prod > 0) & (total_cons > 0)
+    if not active.any():
+        return result
+
+    p = prod[active]
+    c = cons[active]
+    total = total_cons[active]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if model == "proportional":
+            available = np.minimum(p, total)
+            allocated = c / total[:, None] * available[:, None]
+            # Cap at actual consumption
+            alloc = np.minimum(allocated, c)
+
+        else:
+            # First pass: allocate equal share, capped by consumption
+            equal_share = p / n
+            alloc = np.minimum(c, equal_share[:, None])
+            remaining = p - np.nansum(alloc, axis=1)
+
+            # Second pass: distribute remainder to those who can absorb
+            unfilled = np.maximum(c - alloc, 0)
+            unfilled_total = np.nansum(unfilled, axis=1)
+            redistribute = (remaining > 0.001) & (unfilled_total > 0)
+            if redistribute.any():
+                u = unfilled[redistribute]
+                extra = u / unfilled_total[redistribute][:, None] * remaining[redistribute][:, None]
+                alloc[redistribute] += np.minimum(extra, u)
+
+    result[active] = alloc
+    return result
+
+
 def allocate_energy(production, consumption, model="proportional"):
     """Allocate solar production to consumers per 15-min interval.
 
@@ -24,6 +82,19 @@ def allocate_energy(production, consumption, model="proportional"):
     Returns:
         pd.DataFrame with same columns as consumption, values = allocated kWh
     """
+    allocated = allocate_energy_matrix(
+        np.asarray(production, dtype=np.float64),
+        consumption.to_numpy(dtype=np.float64),
+        model=model,
+    )
+    return pd.DataFrame(allocated, index=consumption.index, columns=consumption.columns)
+
+
+def _allocate_energy_reference(production, consumption, model="proportional"):
+    """Per-interval reference implementation of allocate_energy.
+
+    Kept only to cross-check the vectorized engine in tests.
+    """
     result = pd.DataFrame(0.0, index=consumption.index, columns=consumption.columns)
 
     for i in range(len(production)):
@@ -100,21 +171,53 @@ def generate_billing_summary(
         dict with total_production_kwh, total_allocated_kwh,
         total_network_discount_chf, participants (list of per-participant summaries)
     """
-    allocation = allocate_energy(production, consumption, model=distribution_model)
+    return generate_billing_summary_matrix(
+        np.asarray(production, dtype=np.float64),
+        consumption.to_numpy(dtype=np.float64),
+        list(consumption.columns),
+        grid_fee_per_kwh,
+        internal_price_per_kwh,
+        network_level,
+        distribution_model=distribution_model,
+    )
+
+
+def generate_billing_summary_matrix(
+    production,
+    consumption,
+    participants,
+    grid_fee_per_kwh,
+    internal_price_per_kwh,
+    network_level,
+    distribution_model="proportional",
+):
+    """generate_billing_summary on plain arrays.
 
-    total_production = float(production.sum())
-    total_allocated = float(allocation.values.sum())
+    Args:
+        production: 1-D array of pooled production per interval (kWh)
+        consumption: 2-D array (intervals x participants) of consumption (kWh)
+        participants: participant ids in column order
+    """
+    production = np.asarray(production, dtype=np.float64).reshape(-1)
+    consumption = np.asarray(consumption, dtype=np.float64)
+    allocation = allocate_energy_matrix(production, consumption, model=distribution_model)
+
+    total_production = float(np.nansum(production))
+    total_allocated = float(np.nansum(allocation))
     total_discount = compute_network_discount(total_allocated, grid_fee_per_kwh, network_level)
 
-    participants = []
-    for col in allocation.columns:
-        alloc_kwh = float(allocation[col].sum())
-        cons_kwh = float(consumption[col].sum())
+    alloc_totals = np.nansum(allocation, axis=0)
+    cons_totals = np.nansum(consumption.reshape(len(production), -1), axis=0)
+
+    summaries = []
+    for i, participant in enumerate(participants):
+        alloc_kwh = float(alloc_totals[i])
+        cons_kwh = float(cons_totals[i])
         discount = compute_network_discount(alloc_kwh, grid_fee_per_kwh, network_level)
         cost = alloc_kwh * internal_price_per_kwh
 
-        participants.append({
-            "id": col,
+        summaries.append({
+            "id": participant,
             "consumption_kwh": round(cons_kwh, 2),
             "allocated_kwh": round(alloc_kwh, 2),
             "self_supply_ratio": round(alloc_kwh / cons_kwh, 4) if cons_kwh > 0 else 0,
@@ -127,5 +230,5 @@ def generate_billing_summary(
         "total_allocated_kwh": round(total_allocated, 2),
         "total_surplus_kwh": round(max(0, total_production - total_allocated), 2),
         "total_network_discount_chf": round(total_discount, 2),
-        "participants": participants,
+        "participants": summaries,
     }
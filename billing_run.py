@@ -0,0 +1,176 @@
+"""
+Batch Billing Run for OpenLEG
+Bills every active community for one period: loads each batch's meter
+readings as one dense matrix (database.load_meter_matrix), runs the billing
+engine on a process pool and persists results per batch.
+"""
+import os
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import database as db
+from billing_engine import generate_billing_summary_matrix
+
+logger = logging.getLogger(__name__)
+
+BILLING_BATCH_SIZE = int(os.getenv('BILLING_BATCH_SIZE', '50'))
+BILLING_WORKERS = int(os.getenv('BILLING_WORKERS', '0')) or (os.cpu_count() or 1)
+GRID_FEE_CHF_KWH = float(os.getenv('BILLING_GRID_FEE_CHF_KWH', '0.095'))
+INTERNAL_PRICE_CHF_KWH = float(os.getenv('BILLING_INTERNAL_PRICE_CHF_KWH', '0.15'))
+
+# communities.distribution_model (formation wizard) -> billing_engine model
+ENGINE_MODELS = {
+    "simple": "einfach",
+    "einfach": "einfach",
+    "proportional": "proportional",
+    "custom": "proportional",
+}
+
+
+def previous_month(now: Optional[datetime] = None):
+    """Return (start, end) of the last full calendar month, end exclusive."""
+    now = now or datetime.now()
+    end = datetime(now.year, now.month, 1)
+    start = datetime(end.year - 1, 12, 1) if end.month == 1 else datetime(end.year, end.month - 1, 1)
+    return start, end
+
+
+def build_payloads(communities: List[Dict], members: Dict[str, List[str]], matrix: db.MeterMatrix) -> List[Dict]:
+    """Slice one dense payload per community out of the batch's meter matrix.
+
+    Production of all members is pooled per interval; consumption stays one
+    column per member. Only intervals in which a member has a reading are
+    billed, communities without readings are left out.
+    """
+    columns = {building_id: i for i, building_id in enumerate(matrix.building_ids)}
+    payloads = []
+    for community in communities:
+        participants = [b for b in members.get(community['community_id'], []) if b in columns]
+        if not participants:
+            continue
+        cols = [columns[b] for b in participants]
+        rows = ~matrix.missing[:, cols].all(axis=1)
+        if not rows.any():
+            continue
+        payloads.append({
+            "community_id": community['community_id'],
+            "participants": participants,
+            "production": matrix.production[rows][:, cols].sum(axis=1),
+            "consumption": matrix.consumption[rows][:, cols],
+            "distribution_model": ENGINE_MODELS.get(community.get('distribution_model') or 'proportional', 'proportional'),
+            "network_level": community.get('network_level') or 'same',
+            "grid_fee_per_kwh": GRID_FEE_CHF_KWH,
+            "internal_price_per_kwh": INTERNAL_PRICE_CHF_KWH,
+        })
+    return payloads
+
+
+def bill_community(payload: Dict) -> Dict:
+    """Worker entry point: run the billing engine for one community payload."""
+    try:
+        summary = generate_billing_summary_matrix(
+            production=payload["production"],
+            consumption=payload["consumption"],
+            participants=payload["participants"],
+            grid_fee_per_kwh=payload["grid_fee_per_kwh"],
+            internal_price_per_kwh=payload["internal_price_per_kwh"],
+            network_level=payload["network_level"],
+            distribution_model=payload["distribution_model"],
+        )
+        return {"community_id": payload["community_id"], "summary": summary,
+                "intervals": len(payload["production"]), "error": None}
+    except Exception as e:
+        return {"community_id": payload["community_id"], "summary": None,
+                "intervals": 0, "error": str(e)}
+
+
+def _map(executor, payloads, workers):
+    if executor is None:
+        return [bill_community(p) for p in payloads]
+    chunksize = max(1, len(payloads) // (workers * 4))
+    return list(executor.map(bill_community, payloads, chunksize=chunksize))
+
+
+def run_billing(period_start=None, period_end=None, batch_size: int = None, workers: int = None) -> Dict:
+    """Bill all active communities for a period and report throughput.
+
+    Args:
+        period_start/period_end: period bounds (end exclusive), both or neither;
+            defaults to last month
+        batch_size: communities loaded and saved per transaction
+        workers: process pool size; 0 runs inline in the calling process
+
+    Returns:
+        Run report with counts, timing and communities/s + intervals/s
+    """
+    if (period_start is None) != (period_end is None):
+        raise ValueError("period_start and period_end must be given together")
+    if period_start is None:
+        period_start, period_end = previous_month()
+    batch_size = batch_size or BILLING_BATCH_SIZE
+    workers = BILLING_WORKERS if workers is None else workers
+
+    started = time.perf_counter()
+    communities = db.get_active_communities()
+    report = {
+        "period_start": period_start.isoformat(),
+        "period_end": period_end.isoformat(),
+        "communities": len(communities),
+        "processed": 0,
+        "skipped": 0,
+        "failed": [],
+        "intervals": 0,
+        "workers": workers,
+    }
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 and communities else None
+    try:
+        for i in range(0, len(communities), batch_size):
+            batch = communities[i:i + batch_size]
+            try:
+                members = db.load_community_members([c['community_id'] for c in batch])
+                building_ids = [b for c in batch for b in members.get(c['community_id'], [])]
+                matrix = db.load_meter_matrix(building_ids, period_start, period_end)
+            except Exception as e:
+                logger.error(f"[BILLING] Loading readings for batch {i // batch_size} failed: {e}")
+                report["failed"].extend(c['community_id'] for c in batch)
+                continue
+            payloads = build_payloads(batch, members, matrix)
+            report["skipped"] += len(batch) - len(payloads)
+
+            records = []
+            for payload, result in zip(payloads, _map(executor, payloads, workers)):
+                if result["error"]:
+                    logger.error(f"[BILLING] {result['community_id']} failed: {result['error']}")
+                    report["failed"].append(result["community_id"])
+                    continue
+                records.append({
+                    "community_id": result["community_id"],
+                    "period_start": period_start,
+                    "period_end": period_end,
+                    "summary": result["summary"],
+                    "distribution_model": payload["distribution_model"],
+                    "network_level": payload["network_level"],
+                    "intervals": result["intervals"],
+                })
+
+            if records and db.save_billing_periods(records):
+                report["processed"] += len(records)
+                report["intervals"] += sum(r["intervals"] for r in records)
+            elif records:
+                report["failed"].extend(r["community_id"] for r in records)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    elapsed = time.perf_counter() - started
+    report["elapsed_s"] = round(elapsed, 3)
+    report["communities_per_s"] = round(report["processed"] / elapsed, 2) if elapsed > 0 else 0.0
+    report["intervals_per_s"] = round(report["intervals"] / elapsed, 1) if elapsed > 0 else 0.0
+    logger.info(f"[BILLING] Run {report['period_start']}..{report['period_end']}: "
+                f"{report['processed']}/{report['communities']} communities, "
+                f"{report['communities_per_s']} communities/s, {report['intervals_per_s']} intervals/s")
+    return report
@@ -2,10 +2,39 @@
 
 Falls back gracefully if Redis is unavailable (returns None, no-ops on writes).
 All keys prefixed with "openleg:" to avoid collisions.
+
+Optional L1: callers passing local_ttl also keep the value in a bounded
+in-process LRU. cache_delete / cache_clear_prefix (and L1-tracked writes)
+are broadcast over Redis pub/sub so every worker evicts its copy.
+
+cached(): decorator with single-flight recompute (Redis lock),
+stale-while-revalidate and refresh-ahead, with per-function metrics.
+
+Values are stored as <marker><body>: a 3-byte header naming the serializer
+(orjson, msgpack or json per CACHE_SERIALIZER) and whether the body is
+zlib-compressed (bodies over CACHE_COMPRESS_THRESHOLD bytes). Entries
+without a header are plain JSON from older releases and still read.
+cache_get_many / cache_set_many batch keys into one MGET / pipeline.
+
+Namespaces: the part of a key before the first ":" ("tenant:baden" ->
+"tenant"). Each namespace has a generation counter embedded in the Redis
+key once bumped ("openleg:tenant:v3:baden"); clearing a namespace is one
+INCR, superseded keys age out by TTL. cache_purge_prefix deletes keys
+physically with a background SCAN sweep.
 """
 import os
+import re
 import json
+import time
+import uuid
 import logging
+import hashlib
+import threading
+import functools
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
 
 logger = logging.getLogger(__name__)
 
@@ -13,7 +42,22 @@ REDIS_URL = os.environ.get("REDIS_URL", "redis://redis:6379/0")
 KEY_PREFIX = "openleg:"
 DEFAULT_TTL = 3600  # 1 hour
 
+# In-process L1 (0 entries disables it)
+L1_MAX_ENTRIES = int(os.environ.get("CACHE_L1_MAX_ENTRIES", "1024"))
+INVALIDATION_CHANNEL = f"{KEY_PREFIX}cache:invalidate"
+GENERATION_KEY_PREFIX = f"{KEY_PREFIX}_gen:"
+# Seconds a worker trusts its copy of a namespace generation (bumps also arrive via pub/sub)
+GENERATION_TTL = float(os.environ.get("CACHE_GENERATION_TTL", "5"))
+SWEEP_BATCH_SIZE = 500
+
+# Serialization: "auto" picks orjson, then msgpack, then json
+SERIALIZER = os.environ.get("CACHE_SERIALIZER", "auto")
+COMPRESS_THRESHOLD = int(os.environ.get("CACHE_COMPRESS_THRESHOLD", "4096"))
+COMPRESS_LEVEL = 3
+FORMAT_MAGIC = b"\x01"
+
 _redis_client = None
+_MISSING = object()
 
 
 def _get_redis():
@@ -24,41 +68,698 @@ def _get_redis():
     return _redis_client
 
 
-def cache_get(key):
-    """Get value from cache. Returns None on miss or error."""
+class LocalCache:
+    """Thread-safe LRU bounded by entry count, each entry with its own TTL."""
+
+    def __init__(self, max_entries=L1_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Value for key, or _MISSING."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return _MISSING
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return _MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl):
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear_prefix(self, prefix=""):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+local_cache = LocalCache()
+
+# --- Serialization ---
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _json_key(key):
+    """A dict key as JSON stores it (json/orjson stringify keys, msgpack would not)."""
+    if isinstance(key, str):
+        return key
+    if key is None or isinstance(key, (bool, int, float)):
+        return json.dumps(key)
+    return _json_default(key)
+
+
+def jsonable(value):
+    """value with Decimal/datetime converted as a cache hit returns them (float/ISO string).
+
+    Dict keys become strings, as JSON makes them, so the result is the same
+    whichever serializer stored it. @cached functions return this so a miss
+    and a hit yield the same types.
+    """
+    if isinstance(value, dict):
+        return {_json_key(k): jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(v) for v in value]
+    if isinstance(value, (Decimal, datetime, date)):
+        return _json_default(value)
+    return value
+
+
+_serializers = {}  # name -> (marker byte, dumps, loads)
+_serializers_by_marker = {}
+
+
+def register_serializer(name, marker, dumps, loads):
+    """Make a serializer available; marker is a single byte stored with each value."""
+    if len(marker) != 1:
+        raise ValueError("marker must be a single byte")
+    _serializers[name] = (marker, dumps, loads)
+    _serializers_by_marker[marker] = (name, dumps, loads)
+
+
+register_serializer(
+    "json", b"j",
+    lambda value: json.dumps(value, default=_json_default, separators=(",", ":")).encode(),
+    json.loads)
+
+try:
+    import orjson  # type: ignore
+    register_serializer(
+        "orjson", b"o",
+        lambda value: orjson.dumps(value, default=_json_default, option=orjson.OPT_NON_STR_KEYS),
+        orjson.loads)
+except ImportError:
+    pass
+
+try:
+    import msgpack  # type: ignore
+    register_serializer(
+        "msgpack", b"m",
+        lambda value: msgpack.packb(value, default=_json_default, use_bin_type=True),
+        lambda raw: msgpack.unpackb(raw, raw=False, strict_map_key=False))
+    _MSGPACK_ERRORS = (msgpack.exceptions.UnpackException,)
+except ImportError:
+    _MSGPACK_ERRORS = ()
+
+
+def _active_serializer():
+    if SERIALIZER in _serializers:
+        return SERIALIZER
+    return next(name for name in ("orjson", "msgpack", "json") if name in _serializers)
+
+
+def _dumps(value):
+    """Encode a value with the active serializer, compressing large bodies."""
+    marker, dumps, _ = _serializers[_active_serializer()]
+    body = dumps(value)
+    if len(body) > COMPRESS_THRESHOLD:
+        return FORMAT_MAGIC + marker + b"z" + zlib.compress(body, COMPRESS_LEVEL)
+    return FORMAT_MAGIC + marker + b"-" + body
+
+
+# Raised by _loads for corrupt or foreign entries; readers treat them as a miss
+_DECODE_ERRORS = (TypeError, ValueError, zlib.error) + _MSGPACK_ERRORS
+
+
+def _loads(raw):
+    """Decode a stored value; headerless data is legacy JSON."""
+    if isinstance(raw, str):
+        raw = raw.encode()
+    if not raw.startswith(FORMAT_MAGIC) or len(raw) < 3:
+        return json.loads(raw)
+    entry = _serializers_by_marker.get(raw[1:2])
+    if entry is None:
+        raise ValueError(f"unknown cache serializer marker {raw[1:2]!r}")
+    body = raw[3:]
+    if raw[2:3] == b"z":
+        body = zlib.decompress(body)
+    return entry[2](body)
+
+
+# --- Namespace generations ---
+
+_generations = {}
+_generations_lock = threading.Lock()
+
+
+def _namespace(key):
+    ns, sep, _ = key.partition(":")
+    return ns if sep and ns else None
+
+
+def _generation(ns):
+    now = time.monotonic()
+    cached = _generations.get(ns)
+    if cached and now - cached[1] < GENERATION_TTL:
+        return cached[0]
+    try:
+        raw = _get_redis().get(f"{GENERATION_KEY_PREFIX}{ns}")
+        gen = int(raw) if raw else 0
+    except Exception as e:
+        logger.debug(f"Cache generation lookup error for {ns}: {e}")
+        gen = cached[0] if cached else 0
+    with _generations_lock:
+        _generations[ns] = (gen, now)
+    return gen
+
+
+def _set_generation(ns, gen):
+    with _generations_lock:
+        current = _generations.get(ns)
+        if current is None or gen >= current[0]:
+            _generations[ns] = (gen, time.monotonic())
+
+
+def _redis_key(key):
+    """Physical Redis key: generation 0 keeps the plain layout."""
+    ns = _namespace(key)
+    if ns:
+        gen = _generation(ns)
+        if gen:
+            return f"{KEY_PREFIX}{ns}:v{gen}:{key[len(ns) + 1:]}"
+    return f"{KEY_PREFIX}{key}"
+
+
+def _glob_escape(text):
+    return "".join(f"\\{c}" if c in "*?[]\\" else c for c in text)
+
+
+# --- Cross-worker invalidation ---
+
+_WORKER_ID = uuid.uuid4().hex
+_listener = None
+_listener_lock = threading.Lock()
+# (prefix, callback) pairs of on_invalidation
+_invalidation_hooks = []
+
+
+def _publish_invalidation(op, target, generation=None):
+    message = {"op": op, "key": target, "origin": _WORKER_ID}
+    if generation is not None:
+        message["gen"] = generation
+    try:
+        _get_redis().publish(INVALIDATION_CHANNEL, json.dumps(message))
+    except Exception as e:
+        logger.debug(f"Cache invalidation publish error for {target}: {e}")
+
+
+def _handle_invalidation(message):
+    try:
+        data = json.loads(message)
+    except (TypeError, ValueError):
+        return
+    if data.get("origin") == _WORKER_ID:
+        return
+    if data.get("op") == "prefix":
+        prefix = data.get("key", "")
+        if data.get("gen") is not None:
+            _set_generation(prefix.rstrip(":"), int(data["gen"]))
+        local_cache.clear_prefix(prefix)
+    elif data.get("op") == "delete":
+        local_cache.delete(data.get("key"))
+    _run_invalidation_hooks(data.get("key"))
+
+
+def _run_invalidation_hooks(key):
+    for prefix, callback in list(_invalidation_hooks):
+        if key is None or key.startswith(prefix) or prefix.startswith(key):
+            try:
+                callback(key)
+            except Exception as e:
+                logger.debug(f"Cache invalidation hook error for {key}: {e}")
+
+
+def _listen_for_invalidations():
+    backoff = 1
+    while True:
+        try:
+            pubsub = _get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Entries cached while disconnected may have missed invalidations
+            local_cache.clear()
+            _run_invalidation_hooks(None)
+            backoff = 1
+            for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _handle_invalidation(message.get("data"))
+        except Exception as e:
+            logger.debug(f"Cache invalidation listener error: {e}")
+        local_cache.clear()
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 30)
+
+
+def _ensure_listener():
+    global _listener
+    # A listener inherited through fork is not alive in the child
+    if (_listener is not None and _listener.is_alive()) or (local_cache.max_entries <= 0
+                                                            and not _invalidation_hooks):
+        return
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = threading.Thread(target=_listen_for_invalidations, daemon=True,
+                                         name="cache-invalidation")
+            _listener.start()
+
+
+# --- Public API ---
+
+def on_invalidation(prefix, callback):
+    """Call callback(key) when another worker invalidates a key under prefix
+    (or a prefix covering it); key is None after the listener reconnected, as
+    invalidations may have been missed. For process-local state outside the
+    cache; call listen() in the process before relying on it.
+    """
+    if (prefix, callback) not in _invalidation_hooks:
+        _invalidation_hooks.append((prefix, callback))
+
+
+def listen():
+    """Start this process's invalidation listener if it is not running (cheap to repeat)."""
+    _ensure_listener()
+
+
+def broadcast_invalidation(key):
+    """Tell other workers' on_invalidation hooks (and L1 caches) that key is stale."""
+    local_cache.delete(key)
+    _publish_invalidation("prefix" if key.endswith(":") else "delete", key)
+
+
+def cache_get(key, local_ttl=None):
+    """Get value from cache. Returns None on miss or error.
+
+    With local_ttl (seconds) the in-process L1 is consulted first and filled
+    on a Redis hit. L1 values are shared objects: do not mutate them.
+    """
+    if local_ttl:
+        value = local_cache.get(key)
+        if value is not _MISSING:
+            return value
     try:
-        raw = _get_redis().get(f"{KEY_PREFIX}{key}")
+        raw = _get_redis().get(_redis_key(key))
         if raw is None:
             return None
-        return json.loads(raw)
+        value = _loads(raw)
     except Exception as e:
         logger.debug(f"Cache get error for {key}: {e}")
         return None
+    if local_ttl:
+        _ensure_listener()
+        local_cache.set(key, value, local_ttl)
+    return value
+
 
+def cache_set(key, value, ttl=DEFAULT_TTL, local_ttl=None):
+    """Set value in cache with TTL (seconds). No-op on error.
 
-def cache_set(key, value, ttl=DEFAULT_TTL):
-    """Set value in cache with TTL (seconds). No-op on error."""
+    With local_ttl the value is also kept in L1 and other workers drop
+    their (now outdated) L1 copy.
+    """
+    if local_ttl:
+        _ensure_listener()
+        local_cache.set(key, value, min(local_ttl, ttl))
     try:
-        _get_redis().setex(f"{KEY_PREFIX}{key}", ttl, json.dumps(value))
+        _get_redis().setex(_redis_key(key), ttl, _dumps(value))
+    except Exception as e:
+        logger.debug(f"Cache set error for {key}: {e}")
+        return
+    if local_ttl:
+        _publish_invalidation("delete", key)
+
+
+def cache_get_many(keys, local_ttl=None):
+    """Get several keys in one round trip. Returns {key: value} for hits only."""
+    result = {}
+    pending = []
+    for key in dict.fromkeys(keys):
+        if local_ttl:
+            value = local_cache.get(key)
+            if value is not _MISSING:
+                result[key] = value
+                continue
+        pending.append(key)
+    if not pending:
+        return result
+    try:
+        raws = _get_redis().mget([_redis_key(key) for key in pending])
+    except Exception as e:
+        logger.debug(f"Cache mget error for {len(pending)} keys: {e}")
+        return result
+    if local_ttl:
+        _ensure_listener()
+    for key, raw in zip(pending, raws):
+        if raw is None:
+            continue
+        try:
+            value = _loads(raw)
+        except Exception as e:
+            logger.debug(f"Cache decode error for {key}: {e}")
+            continue
+        result[key] = value
+        if local_ttl:
+            local_cache.set(key, value, local_ttl)
+    return result
+
+
+def cache_set_many(mapping, ttl=DEFAULT_TTL, local_ttl=None):
+    """Set several keys with one pipelined round trip. No-op on error."""
+    if not mapping:
+        return
+    if local_ttl:
+        _ensure_listener()
+        for key, value in mapping.items():
+            local_cache.set(key, value, min(local_ttl, ttl))
+    try:
+        pipe = _get_redis().pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.setex(_redis_key(key), ttl, _dumps(value))
+        if local_ttl:
+            for key in mapping:
+                pipe.publish(INVALIDATION_CHANNEL, json.dumps({"op": "delete", "key": key, "origin": _WORKER_ID}))
+        pipe.execute()
+    except Exception as e:
+        logger.debug(f"Cache set_many error for {len(mapping)} keys: {e}")
+
+
+def cache_get_raw(key):
+    """Get pre-serialized bytes from cache. Returns None on miss or error."""
+    try:
+        return _get_redis().get(_redis_key(key))
+    except Exception as e:
+        logger.debug(f"Cache get error for {key}: {e}")
+        return None
+
+
+def cache_set_raw(key, value, ttl=DEFAULT_TTL):
+    """Store pre-serialized bytes with TTL (seconds). No-op on error."""
+    try:
+        _get_redis().setex(_redis_key(key), ttl, value)
     except Exception as e:
         logger.debug(f"Cache set error for {key}: {e}")
 
 
 def cache_delete(key):
-    """Delete key from cache. No-op on error."""
+    """Delete key from cache (Redis and every worker's L1). No-op on error."""
+    local_cache.delete(key)
     try:
-        _get_redis().delete(f"{KEY_PREFIX}{key}")
+        _get_redis().delete(_redis_key(key))
     except Exception as e:
         logger.debug(f"Cache delete error for {key}: {e}")
+    _publish_invalidation("delete", key)
 
 
 def cache_clear_prefix(prefix):
-    """Delete all keys matching prefix. Use for tenant invalidation."""
+    """Invalidate all keys under prefix. Use for tenant invalidation.
+
+    A whole namespace ("tenant:") is invalidated in O(1) by bumping its
+    generation; any other prefix is purged with SCAN + UNLINK before this
+    returns, so a read right after the clear never sees an old value.
+    """
+    local_cache.clear_prefix(prefix)
+    ns = prefix[:-1] if prefix.endswith(":") else None
+    if not ns or ":" in ns:
+        cache_purge_prefix(prefix, background=False)
+        _publish_invalidation("prefix", prefix)
+        return
     try:
-        r = _get_redis()
-        pattern = f"{KEY_PREFIX}{prefix}*"
-        keys = r.keys(pattern)
-        if keys:
-            r.delete(*keys)
+        gen = int(_get_redis().incr(f"{GENERATION_KEY_PREFIX}{ns}"))
     except Exception as e:
         logger.debug(f"Cache clear error for {prefix}: {e}")
+        return
+    _set_generation(ns, gen)
+    _publish_invalidation("prefix", prefix, gen)
+
+
+def _sweep_patterns(prefix):
+    """(SCAN pattern, exact regex or None) for prefix: the plain layout, plus the
+    versioned one ("openleg:tenant:v3:zurich...") when the prefix reaches into a namespace."""
+    patterns = [(f"{KEY_PREFIX}{_glob_escape(prefix)}*", None)]
+    ns = _namespace(prefix)
+    rest = prefix[len(ns) + 1:] if ns else ""
+    if rest:
+        # The glob's "*" may span further ":" segments; the regex pins the generation to digits
+        patterns.append((f"{KEY_PREFIX}{_glob_escape(ns)}:v[0-9]*:{_glob_escape(rest)}*",
+                         re.compile(f"{re.escape(KEY_PREFIX + ns)}:v[0-9]+:{re.escape(rest)}")))
+    return patterns
+
+
+def _sweep(prefix, batch_size=SWEEP_BATCH_SIZE):
+    r = _get_redis()
+    deleted = 0
+    batch = []
+    for pattern, exact in _sweep_patterns(prefix):
+        for key in r.scan_iter(match=pattern, count=batch_size):
+            if exact and not exact.match(key.decode() if isinstance(key, bytes) else key):
+                continue
+            batch.append(key)
+            if len(batch) >= batch_size:
+                deleted += r.unlink(*batch)
+                batch = []
+    if batch:
+        deleted += r.unlink(*batch)
+    logger.info(f"Cache sweep {prefix!r}: {deleted} keys deleted")
+    return deleted
+
+
+def cache_purge_prefix(prefix, background=True):
+    """Physically delete keys under prefix with SCAN + UNLINK, in every generation
+    of its namespace ("tenant:zurich" also matches "openleg:tenant:v3:zurich...").
+
+    Runs in a daemon thread by default; with background=False returns the count.
+    """
+    local_cache.clear_prefix(prefix)
+
+    def run():
+        try:
+            return _sweep(prefix)
+        except Exception as e:
+            logger.debug(f"Cache sweep error for {prefix}: {e}")
+            return 0
+
+    if not background:
+        return run()
+    threading.Thread(target=run, daemon=True, name="cache-sweep").start()
+    return None
+
+
+# --- @cached ---
+
+_function_stats = {}
+
+_UNLOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _default_key(args, kwargs):
+    raw = json.dumps([args, sorted(kwargs.items())], default=_json_default)
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def cached(key_fn=None, ttl=DEFAULT_TTL, stale_ttl=0, namespace=None, refresh_ahead=0.1,
+           lock_timeout=30, wait_timeout=5.0):
+    """Cache a function's JSON-serializable result in Redis.
+
+    Args:
+        key_fn: builds the key suffix from the call arguments (default: hash of args)
+        ttl: seconds a value is fresh
+        stale_ttl: extra seconds a value may be served while one worker recomputes
+        namespace: key namespace, defaults to the function name
+        refresh_ahead: fraction of ttl before expiry that triggers a background refresh
+        lock_timeout: seconds the recompute lock is held at most
+        wait_timeout: seconds a caller waits for another worker's recompute on a cold key
+
+    On a cold key one caller takes the lock and computes while the others poll
+    for the result (then compute themselves after wait_timeout). If Redis is
+    unavailable the function is simply called. Decimal/datetime values come
+    back as float/ISO string.
+    """
+    def decorator(fn):
+        ns = namespace or fn.__name__
+        stats = _function_stats.setdefault(ns, {
+            "hits": 0, "stale_hits": 0, "misses": 0, "waits": 0, "refreshes": 0,
+            "errors": 0, "computations": 0, "compute_ms_total": 0.0,
+        })
+
+        def compute(args, kwargs):
+            started = time.perf_counter()
+            value = fn(*args, **kwargs)
+            stats["computations"] += 1
+            stats["compute_ms_total"] += (time.perf_counter() - started) * 1000
+            return value
+
+        def read(key):
+            """(entry or None, redis reachable)."""
+            try:
+                raw = _get_redis().get(_redis_key(key))
+            except Exception as e:
+                logger.debug(f"Cache get error for {key}: {e}")
+                return None, False
+            if raw is None:
+                return None, True
+            try:
+                return _loads(raw), True
+            except _DECODE_ERRORS as e:
+                logger.debug(f"Cache decode error for {key}: {e}")
+                return None, True
+
+        def store(key, value):
+            try:
+                body = _dumps({"v": value, "t": time.time()})
+                _get_redis().setex(_redis_key(key), int(ttl + stale_ttl), body)
+            except Exception as e:
+                logger.debug(f"Cache set error for {key}: {e}")
+
+        def lock(key):
+            token = uuid.uuid4().hex
+            try:
+                if _get_redis().set(_redis_key(f"{key}:lock"), token, nx=True, px=int(lock_timeout * 1000)):
+                    return token
+            except Exception as e:
+                logger.debug(f"Cache lock error for {key}: {e}")
+            return None
+
+        def unlock(key, token):
+            try:
+                _get_redis().eval(_UNLOCK_SCRIPT, 1, _redis_key(f"{key}:lock"), token)
+            except Exception as e:
+                logger.debug(f"Cache unlock error for {key}: {e}")
+
+        def refresh_async(key, args, kwargs):
+            token = lock(key)
+            if token is None:
+                return
+
+            def run():
+                try:
+                    store(key, compute(args, kwargs))
+                    stats["refreshes"] += 1
+                except Exception as e:
+                    stats["errors"] += 1
+                    logger.warning(f"Cache refresh of {key} failed: {e}")
+                finally:
+                    unlock(key, token)
+
+            threading.Thread(target=run, daemon=True, name=f"cache-refresh-{ns}").start()
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            suffix = key_fn(*args, **kwargs) if key_fn else _default_key(args, kwargs)
+            key = f"{ns}:{suffix}"
+            entry, reachable = read(key)
+            if entry is not None:
+                age = time.time() - entry.get("t", 0)
+                if age < ttl:
+                    stats["hits"] += 1
+                    if age > ttl * (1 - refresh_ahead):
+                        refresh_async(key, args, kwargs)
+                    return entry.get("v")
+                if age < ttl + stale_ttl:
+                    stats["stale_hits"] += 1
+                    refresh_async(key, args, kwargs)
+                    return entry.get("v")
+
+            stats["misses"] += 1
+            if not reachable:
+                return compute(args, kwargs)
+            token = lock(key)
+            if token is not None:
+                try:
+                    value = compute(args, kwargs)
+                    store(key, value)
+                    return value
+                finally:
+                    unlock(key, token)
+
+            # Another worker is computing: wait for its result
+            stats["waits"] += 1
+            deadline = time.time() + wait_timeout
+            delay = 0.05
+            while time.time() < deadline:
+                time.sleep(delay)
+                delay = min(delay * 2, 0.5)
+                entry, reachable = read(key)
+                if entry is not None:
+                    return entry.get("v")
+                if not reachable:
+                    break
+            return compute(args, kwargs)
+
+        def invalidate(*args, **kwargs):
+            suffix = key_fn(*args, **kwargs) if key_fn else _default_key(args, kwargs)
+            cache_delete(f"{ns}:{suffix}")
+
+        wrapper.uncached = fn
+        wrapper.invalidate = invalidate
+        wrapper.invalidate_all = lambda: cache_clear_prefix(f"{ns}:")
+        wrapper.cache_namespace = ns
+        return wrapper
+
+    return decorator
+
+
+def cache_stats():
+    """L1 counters and per-@cached-function metrics for this worker."""
+    functions = {}
+    for ns, stats in _function_stats.items():
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+        functions[ns] = {
+            **{k: v for k, v in stats.items() if k != "compute_ms_total"},
+            "hit_rate": round((stats["hits"] + stats["stale_hits"]) / lookups, 4) if lookups else 0.0,
+            "avg_compute_ms": round(stats["compute_ms_total"] / stats["computations"], 1)
+            if stats["computations"] else 0.0,
+        }
+    return {"l1": local_cache.stats(), "functions": functions}
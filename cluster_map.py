@@ -0,0 +1,129 @@
+"""
+Cluster Map Snapshot for OpenLEG
+The clustering job publishes the /api/get_all_clusters payload once per
+change: member coordinates come from one bulk query, hull polygons from
+cluster_info.polygon, and the serialized JSON plus its ETag is cached in
+Redis so the endpoint only has to return bytes.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import cache
+import database as db
+
+try:
+    from scipy.spatial import ConvexHull
+    HAS_SCIPY = True
+except ImportError:
+    HAS_SCIPY = False
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_KEY = f"cluster_map:v{SNAPSHOT_VERSION}"
+SNAPSHOT_TTL = int(os.getenv('CLUSTER_MAP_TTL', '86400'))
+# Per-process copy used when Redis is unavailable; short so workers converge
+LOCAL_SNAPSHOT_TTL = int(os.getenv('CLUSTER_MAP_LOCAL_TTL', '30'))
+
+_local: Dict = {"etag": None, "payload": None, "built_at": 0.0}
+_local_lock = threading.Lock()
+
+
+def create_simple_polygon(coords):
+    if len(coords) < 3:
+        if len(coords) == 1:
+            lat, lon = coords[0]
+            o = 0.0005
+            return [[lat-o, lon-o], [lat+o, lon-o], [lat+o, lon+o], [lat-o, lon+o], [lat-o, lon-o]]
+        elif len(coords) == 2:
+            lat1, lon1 = coords[0]
+            lat2, lon2 = coords[1]
+            o = 0.0003
+            return [[lat1-o, lon1-o], [lat2+o, lon1-o], [lat2+o, lon2+o], [lat1-o, lon2+o], [lat1-o, lon1-o]]
+    if HAS_SCIPY:
+        try:
+            points = np.array(coords)
+            hull = ConvexHull(points)
+            polygon = [coords[i] for i in hull.vertices]
+            polygon.append(polygon[0])
+            return polygon
+        except:
+            pass
+    lats = [c[0] for c in coords]
+    lons = [c[1] for c in coords]
+    o = 0.0003
+    return [[min(lats)-o, min(lons)-o], [max(lats)+o, min(lons)-o],
+            [max(lats)+o, max(lons)+o], [min(lats)-o, max(lons)+o], [min(lats)-o, min(lons)-o]]
+
+
+def with_polygon(info: Dict) -> Dict:
+    """Add the hull polygon to a cluster info dict (from its members) before saving."""
+    coords = [[float(m['lat']), float(m['lon'])] for m in info.get('members', [])
+              if m.get('lat') is not None and m.get('lon') is not None]
+    if coords:
+        info['polygon'] = create_simple_polygon(coords)
+    return info
+
+
+def build_snapshot(rows: List[Dict]) -> Tuple[str, bytes]:
+    """Serialize cluster map rows. Returns (etag, payload bytes)."""
+    clusters = []
+    for row in rows:
+        members = row.get('members') or []
+        if isinstance(members, str):
+            members = json.loads(members)
+        if len(members) < 2:
+            continue
+        polygon = row.get('polygon')
+        if isinstance(polygon, str):
+            polygon = json.loads(polygon)
+        if not polygon:
+            # Rows written before hulls were stored
+            polygon = create_simple_polygon([[m['lat'], m['lon']] for m in members])
+        clusters.append({
+            'cluster_id': row.get('cluster_id'),
+            'members': members,
+            'polygon': polygon,
+            'autarky_percent': float(row.get('autarky_percent') or 0),
+            'num_members': len(members),
+        })
+    body = json.dumps({"clusters": clusters}, separators=(',', ':')).encode()
+    etag = f"v{SNAPSHOT_VERSION}-{hashlib.sha1(body).hexdigest()[:20]}"
+    return etag, body
+
+
+def publish_snapshot() -> Optional[str]:
+    """Rebuild the snapshot from the DB and publish it. Returns the ETag."""
+    rows = db.get_cluster_map_rows()
+    if rows is None:
+        return None
+    etag, payload = build_snapshot(rows)
+    cache.cache_set_raw(SNAPSHOT_KEY, etag.encode() + b"\n" + payload, ttl=SNAPSHOT_TTL)
+    with _local_lock:
+        _local.update(etag=etag, payload=payload, built_at=time.time())
+    logger.info(f"[ML] Cluster map snapshot {etag} published ({len(rows)} clusters, {len(payload)} bytes)")
+    return etag
+
+
+def get_snapshot() -> Tuple[str, bytes]:
+    """(etag, payload) from Redis, the local copy, or a fresh build."""
+    raw = cache.cache_get_raw(SNAPSHOT_KEY)
+    if raw:
+        etag, _, payload = raw.partition(b"\n")
+        return etag.decode(), payload
+    with _local_lock:
+        if _local["payload"] is not None and time.time() - _local["built_at"] < LOCAL_SNAPSHOT_TTL:
+            return _local["etag"], _local["payload"]
+    publish_snapshot()
+    with _local_lock:
+        if _local["payload"] is not None:
+            # Stale copy beats an empty map when the DB is unavailable
+            return _local["etag"], _local["payload"]
+    return build_snapshot([])
@@ -0,0 +1,384 @@
+"""
+Incremental LEG clustering for OpenLEG.
+Keeps a per-city DBSCAN state (spatial grid, neighbour counts, labels) in
+process memory, applies registrations and removals to the affected
+neighbourhood only, and writes just the changed clusters/cluster_info rows.
+Runs are queued as 'clustering' jobs (jobs.py), deduplicated per city.
+A run that changed anything tells the other worker processes (cache
+invalidation channel) to drop their copy of that city's state; cluster ids
+come from a database sequence, so processes never hand out the same id.
+"""
+import os
+import time
+import logging
+import threading
+from collections import Counter, deque
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+import cache
+import cluster_map
+import database as db
+import jobs
+import ml_models
+from spatial_index import GridIndex
+
+logger = logging.getLogger(__name__)
+
+RADIUS_METERS = 150
+MIN_COMMUNITY_SIZE = 2
+# Full reconcile against the DB after this many seconds (a safety net; removals are broadcast)
+CLUSTER_STATE_TTL = int(os.getenv('CLUSTER_STATE_TTL', '900'))
+CLUSTER_DEBOUNCE_SECONDS = float(os.getenv('CLUSTER_DEBOUNCE_SECONDS', '2'))
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', '2'))
+CLUSTERING_JOB = 'clustering'
+# Overlap when pulling new registrations, covers clock skew between workers
+SYNC_OVERLAP_SECONDS = 30
+
+
+class CityClusterState:
+    """
+    DBSCAN state for one city: labels, neighbour counts and the spatial grid.
+
+    Core points have at least min_samples buildings (incl. themselves) within
+    radius_meters, matching sklearn's DBSCAN with the haversine metric.
+    Inserting a building can only grow or merge clusters; removing one can
+    shrink or split its cluster. Both walk only the clusters they touch.
+    """
+
+    def __init__(self, city_id: Optional[str], radius_meters: float = RADIUS_METERS,
+                 min_samples: int = MIN_COMMUNITY_SIZE):
+        self.city_id = city_id
+        self.radius = radius_meters
+        self.min_samples = min_samples
+        self.grid = GridIndex(cell_meters=radius_meters)
+        self.profiles: Dict[str, Dict] = {}
+        self.counts: Dict[str, int] = {}
+        self.labels: Dict[str, int] = {}
+        self.members: Dict[int, Set[str]] = {}
+        self.loaded_at = 0.0
+        self.synced_at = 0.0
+        # Pending changes since the last flush
+        self.changed_buildings: Set[str] = set()
+        self.touched_clusters: Set[int] = set()
+        self.removed_clusters: Set[int] = set()
+
+    # --- core DBSCAN helpers ---
+
+    def _neighbors(self, bid: str) -> List[str]:
+        lat, lon = self.grid.coords(bid)
+        return self.grid.query_radius(lat, lon, self.radius)
+
+    def _is_core(self, bid: str) -> bool:
+        return self.counts.get(bid, 0) >= self.min_samples
+
+    def _component(self, seed: str, visited: Set[str]) -> Set[str]:
+        """All buildings density-reachable from core building `seed`."""
+        members = {seed}
+        queue = deque([seed])
+        visited.add(seed)
+        while queue:
+            core = queue.popleft()
+            for n in self._neighbors(core):
+                members.add(n)
+                if n not in visited and self._is_core(n):
+                    visited.add(n)
+                    queue.append(n)
+        return members
+
+    def _allocate_id(self) -> int:
+        return db.next_cluster_id()
+
+    def _set_label(self, bid: str, label: int):
+        old = self.labels.get(bid, -1)
+        self.labels[bid] = label
+        if old == label:
+            return
+        self.changed_buildings.add(bid)
+        if old >= 0:
+            self.touched_clusters.add(old)
+            self.members[old].discard(bid)
+            if not self.members[old]:
+                del self.members[old]
+                self.removed_clusters.add(old)
+        if label >= 0:
+            self.touched_clusters.add(label)
+            self.members.setdefault(label, set()).add(bid)
+            self.removed_clusters.discard(label)
+
+    def _merge(self, cores: List[str]) -> int:
+        """Join connected new core buildings with the clusters they reach.
+
+        The smallest existing id wins; members of the other clusters are
+        relabelled, border buildings of the new cores are attached.
+        """
+        neighborhoods = {c: self._neighbors(c) for c in cores}
+        labels = {self.labels.get(n, -1) for c in cores for n in neighborhoods[c] if self._is_core(n)}
+        labels.discard(-1)
+        target = min(labels) if labels else self._allocate_id()
+        for old in sorted(labels - {target}, key=lambda l: len(self.members.get(l, ()))):
+            for b in list(self.members.get(old, ())):
+                self._set_label(b, target)
+        for c in cores:
+            self._set_label(c, target)
+            for n in neighborhoods[c]:
+                if self.labels.get(n, -1) < 0:
+                    self._set_label(n, target)
+        return target
+
+    # --- mutations ---
+
+    def add_building(self, profile: Dict):
+        """Insert a building; only its neighbourhood and the clusters it joins are touched."""
+        bid = profile.get('building_id')
+        lat, lon = profile.get('lat'), profile.get('lon')
+        if not bid or lat is None or lon is None:
+            return
+        if bid in self.profiles:
+            self.profiles[bid] = profile
+            if self.grid.coords(bid) == (float(lat), float(lon)):
+                if self.labels.get(bid, -1) >= 0:
+                    self.touched_clusters.add(self.labels[bid])
+                return
+            self.remove_building(bid)
+
+        self.profiles[bid] = profile
+        self.grid.insert(bid, lat, lon)
+        neighbors = self._neighbors(bid)
+        self.counts[bid] = len(neighbors)
+        self.labels[bid] = -1
+        new_cores = [bid] if self._is_core(bid) else []
+        for n in neighbors:
+            if n != bid:
+                self.counts[n] = self.counts.get(n, 0) + 1
+                if self.counts[n] == self.min_samples:
+                    new_cores.append(n)
+
+        # Group new cores that reach each other directly (all are within radius of bid)
+        groups: List[List[str]] = []
+        for c in new_cores:
+            for group in groups:
+                if any(c in self._neighbors(g) for g in group):
+                    group.append(c)
+                    break
+            else:
+                groups.append([c])
+        for group in groups:
+            self._merge(group)
+
+        if self.labels[bid] < 0:
+            core = next((n for n in neighbors if n != bid and self._is_core(n)), None)
+            if core is not None:
+                self._set_label(bid, self.labels[core])
+            else:
+                self.changed_buildings.add(bid)
+
+    def remove_building(self, bid: str):
+        """Remove a building; clusters it (or a neighbour losing core status) held may split."""
+        if bid not in self.profiles:
+            return
+        neighbors = [n for n in self._neighbors(bid) if n != bid]
+        affected = {self.labels.get(bid, -1)}
+        self._set_label(bid, -1)
+        self.labels.pop(bid, None)
+        self.changed_buildings.discard(bid)
+        self.grid.remove(bid)
+        self.profiles.pop(bid, None)
+        self.counts.pop(bid, None)
+        for n in neighbors:
+            self.counts[n] = self.counts.get(n, 1) - 1
+            if self.counts[n] == self.min_samples - 1:
+                affected.add(self.labels.get(n, -1))
+        affected.discard(-1)
+
+        for old in affected:
+            former = list(self.members.get(old, ()))
+            visited: Set[str] = set()
+            components = []
+            for b in former:
+                if b not in visited and self._is_core(b) and self.labels.get(b) == old:
+                    components.append(self._component(b, visited))
+            components.sort(key=len, reverse=True)
+
+            covered = set()
+            for i, component in enumerate(components):
+                cid = old if i == 0 else self._allocate_id()
+                for b in component:
+                    # Border buildings of a neighbouring cluster keep their label
+                    if self._is_core(b) or self.labels.get(b, -1) in (-1, old):
+                        self._set_label(b, cid)
+                covered |= component
+            for b in former:
+                if b not in covered:
+                    self._set_label(b, -1)
+
+    # --- full rebuild / reconcile ---
+
+    def rebuild(self, profiles: List[Dict], stored_labels: Dict[str, int]):
+        """Recompute every cluster from scratch, reusing stored ids where possible."""
+        self.__init__(self.city_id, self.radius, self.min_samples)
+        for p in profiles:
+            bid = p.get('building_id')
+            if bid and p.get('lat') is not None and p.get('lon') is not None:
+                self.profiles[bid] = p
+                self.grid.insert(bid, p['lat'], p['lon'])
+        for bid in self.profiles:
+            self.counts[bid] = len(self._neighbors(bid))
+            self.labels[bid] = -1
+
+        visited: Set[str] = set()
+        components = []
+        for bid in self.profiles:
+            if bid not in visited and self._is_core(bid):
+                components.append(self._component(bid, visited))
+
+        claimed = set()
+        for members in sorted(components, key=len, reverse=True):
+            votes = Counter(stored_labels[b] for b in members if b in stored_labels)
+            cid = next((c for c, _ in votes.most_common() if c not in claimed), None)
+            if cid is None:
+                cid = self._allocate_id()
+            claimed.add(cid)
+            for b in members:
+                if self.labels[b] < 0:
+                    self.labels[b] = cid
+                    self.members.setdefault(cid, set()).add(b)
+
+        # Everything that differs from the DB is a pending change
+        for bid, label in self.labels.items():
+            if stored_labels.get(bid, -1) != label:
+                self.changed_buildings.add(bid)
+                if label >= 0:
+                    self.touched_clusters.add(label)
+        for bid, label in stored_labels.items():
+            if bid not in self.labels:
+                self.changed_buildings.add(bid)
+        self.removed_clusters = set(stored_labels.values()) - claimed
+        self.touched_clusters |= {stored_labels[b] for b in self.changed_buildings
+                                  if stored_labels.get(b, -1) >= 0} - self.removed_clusters
+        self.loaded_at = self.synced_at = time.time()
+
+    # --- persistence ---
+
+    def flush(self) -> Dict:
+        """Write pending changes: clusters rows, cluster_info rows, deletions."""
+        assignments = {b: self.labels[b] for b in self.changed_buildings
+                       if self.labels.get(b, -1) >= 0}
+        noise = [b for b in self.changed_buildings if self.labels.get(b, -1) < 0]
+        touched = {c for c in self.touched_clusters if c not in self.removed_clusters}
+
+        db.save_clusters(assignments)
+        db.delete_clusters(noise)
+
+        infos = []
+        if touched:
+            members = [b for c in touched for b in self.members.get(c, ())]
+            df = pd.DataFrame([self.profiles[b] for b in members])
+            infos = ml_models.describe_clusters(df, np.array([self.labels[b] for b in members]))
+            for info in infos:
+                db.save_cluster_info(info['community_id'], cluster_map.with_polygon(info))
+        db.delete_cluster_info(sorted(self.removed_clusters))
+
+        result = {
+            "buildings_changed": len(self.changed_buildings),
+            "clusters_updated": len(infos),
+            "clusters_removed": len(self.removed_clusters),
+        }
+        self.changed_buildings = set()
+        self.touched_clusters = set()
+        self.removed_clusters = set()
+        return result
+
+
+# --- Per-process state + scheduling ---
+
+_states: Dict[Optional[str], CityClusterState] = {}
+_states_lock = threading.Lock()
+STATE_KEY_PREFIX = 'cluster_state:'
+
+
+def _state_key(city_id: Optional[str]) -> str:
+    return f"{STATE_KEY_PREFIX}{city_id if city_id is not None else '-'}"
+
+
+def _drop_states(key: Optional[str]):
+    """on_invalidation hook: forget one city's state, or all of them."""
+    with _states_lock:
+        if key is None or not key.startswith(STATE_KEY_PREFIX) or key == STATE_KEY_PREFIX:
+            _states.clear()
+            return
+        city = key[len(STATE_KEY_PREFIX):]
+        _states.pop(None if city == '-' else city, None)
+
+
+def invalidate(city_id: Optional[str] = None, all_cities: bool = False):
+    """Make every other process rebuild the city's state (all cities with all_cities)."""
+    cache.broadcast_invalidation(STATE_KEY_PREFIX if all_cities else _state_key(city_id))
+
+
+cache.on_invalidation(STATE_KEY_PREFIX, _drop_states)
+
+
+def _load_state(city_id: Optional[str]) -> CityClusterState:
+    cache.listen()
+    with _states_lock:
+        state = _states.get(city_id)
+        if state is None:
+            state = _states[city_id] = CityClusterState(city_id)
+    if not state.loaded_at or time.time() - state.loaded_at > CLUSTER_STATE_TTL:
+        state.rebuild(db.get_all_building_profiles(city_id=city_id), db.get_cluster_assignments(city_id))
+    return state
+
+
+def run_incremental(city_id: Optional[str], added: Iterable[str] = (), removed: Iterable[str] = ()) -> Dict:
+    """Apply new/removed buildings for a city and persist only what changed."""
+    started = time.perf_counter()
+    state = _load_state(city_id)
+
+    sync_from = state.synced_at - SYNC_OVERLAP_SECONDS
+    state.synced_at = time.time()
+    fresh = {p['building_id']: p for p in db.get_building_profiles_since(city_id, sync_from)}
+    for bid in added:
+        if bid not in fresh and bid not in state.profiles:
+            building = db.get_building(bid)
+            if building and building.get('verified', True):
+                fresh[bid] = building
+    try:
+        for profile in fresh.values():
+            state.add_building(profile)
+        for bid in removed:
+            state.remove_building(bid)
+        result = state.flush()
+    except Exception:
+        # Half-applied (e.g. no cluster id available): rebuild from the database on retry
+        _drop_states(_state_key(city_id))
+        raise
+    if result["buildings_changed"] or result["clusters_updated"] or result["clusters_removed"]:
+        invalidate(city_id)
+        cluster_map.publish_snapshot()
+    result["city_id"] = city_id
+    result["buildings"] = len(state.profiles)
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"[ML] Incremental clustering {city_id}: {result}")
+    return result
+
+
+def _run_job(payload: Dict):
+    added = set(payload.get('added') or [])
+    removed = set(payload.get('removed') or [])
+    return run_incremental(payload.get('city_id'), added=added - removed, removed=removed)
+
+
+jobs.register(CLUSTERING_JOB, _run_job, workers=CLUSTER_WORKERS)
+
+
+def schedule(city_id: Optional[str], added: Iterable[str] = (), removed: Iterable[str] = ()) -> Optional[int]:
+    """Queue an incremental clustering run for city_id.
+
+    One pending job per city: requests arriving within the debounce window
+    (or while a run is in progress) are merged into the next run.
+    """
+    return jobs.enqueue(CLUSTERING_JOB, {"city_id": city_id, "added": list(added), "removed": list(removed)},
+                        dedup_key=f"city:{city_id}", delay_seconds=CLUSTER_DEBOUNCE_SECONDS)
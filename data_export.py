@@ -0,0 +1,142 @@
+"""
+Streaming bulk exports for the OpenLEG admin.
+The database layer yields rows in chunks from server-side cursors; the
+writers here turn each chunk into bytes for a chunked HTTP response, so an
+export holds one chunk in memory however large it is. Formats: CSV, NDJSON,
+JSON and, if pyarrow is installed, Parquet (one row group per chunk).
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+try:
+    import pyarrow  # type: ignore
+    import pyarrow.parquet  # type: ignore
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# (column, type) in export order; types: string, float, int, timestamp
+BUILDING_COLUMNS: Sequence[Tuple[str, str]] = (
+    ('building_id', 'string'), ('address', 'string'), ('lat', 'float'), ('lon', 'float'),
+    ('plz', 'string'), ('building_type', 'string'), ('annual_consumption_kwh', 'float'),
+    ('potential_pv_kwp', 'float'), ('user_type', 'string'), ('city_id', 'string'),
+    ('registered_at', 'timestamp'),
+)
+METER_COLUMNS: Sequence[Tuple[str, str]] = (
+    ('building_id', 'string'), ('timestamp', 'timestamp'), ('consumption_kwh', 'float'),
+    ('production_kwh', 'float'), ('feed_in_kwh', 'float'), ('source', 'string'), ('quality_flag', 'int'),
+)
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def available_formats() -> List[str]:
+    return [fmt for fmt in MIMETYPES if fmt != 'parquet' or HAS_PYARROW]
+
+
+def stream(fmt: str, chunks: Iterable[List[Dict]], columns: Sequence[Tuple[str, str]]) -> Iterator[bytes]:
+    """Encode row chunks (lists of dicts) as fmt, one output block per chunk."""
+    writers = {'csv': _csv, 'ndjson': _ndjson, 'json': _json, 'parquet': _parquet}
+    if fmt not in writers or fmt not in available_formats():
+        raise ValueError(f"Unsupported export format: {fmt}")
+    return writers[fmt](chunks, columns)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+
+def _csv(chunks, columns):
+    names = [name for name, _ in columns]
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(names)
+    yield buf.getvalue().encode('utf-8')
+    for chunk in chunks:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows([row.get(name) for name in names] for row in chunk)
+        yield buf.getvalue().encode('utf-8')
+
+
+def _ndjson(chunks, columns):
+    names = [name for name, _ in columns]
+    for chunk in chunks:
+        yield ''.join(json.dumps({name: row.get(name) for name in names}, default=_json_default) + '\n'
+                      for row in chunk).encode('utf-8')
+
+
+def _json(chunks, columns):
+    """{"records": [...], "count": n}, the shape of the former buffered export; count comes last."""
+    names = [name for name, _ in columns]
+    count = 0
+    yield b'{"records": ['
+    for chunk in chunks:
+        if not chunk:
+            continue
+        body = ', '.join(json.dumps({name: row.get(name) for name in names}, default=_json_default)
+                         for row in chunk)
+        yield ((', ' if count else '') + body).encode('utf-8')
+        count += len(chunk)
+    yield f'], "count": {count}}}'.encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last drain()."""
+
+    def __init__(self):
+        super().__init__()
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _parquet(chunks, columns):
+    pa = pyarrow
+    names = [name for name, _ in columns]
+    types = {'string': pa.string(), 'float': pa.float64(), 'int': pa.int32(), 'timestamp': pa.timestamp('s')}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    floats = [name for name, kind in columns if kind == 'float']
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            data = {name: [row.get(name) for row in chunk] for name in names}
+            for name in floats:
+                data[name] = [None if v is None else float(v) for v in data[name]]
+            writer.write_table(pa.Table.from_pydict(data, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()  # footer
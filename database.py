@@ -2,11 +2,17 @@
 PostgreSQL Database Layer for OpenLEG
 Replaces JSON file persistence with proper database storage.
 """
+import io
 import os
 import time
 import logging
+import threading
+from collections import namedtuple
 from contextlib import contextmanager
-from typing import Optional, Dict, List, Any, Tuple
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Iterator, List, Any, Tuple
+
+import cache
 
 logger = logging.getLogger(__name__)
 
@@ -25,8 +31,55 @@ DATABASE_URL = os.getenv('DATABASE_URL', '')
 DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '2'))
 DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
 
+# Meter readings: batches at or above this size are ingested via COPY
+METER_COPY_THRESHOLD = int(os.getenv('METER_COPY_THRESHOLD', '2000'))
+METER_COPY_BUFFER = 64 * 1024
+
+# Meter rollups: advisory lock serializing rollup refreshes against ingests
+METER_ROLLUP_LOCK_ID = 4815162342
+METER_ROLLUP_STATE = 'meter_rollups'
+# Readings from before ingest_seq existed (NULL) numbered per rollup refresh
+METER_SEQ_BACKFILL_BATCH = int(os.getenv('METER_SEQ_BACKFILL_BATCH', '50000'))
+
+# Meter matrix loader: grid resolution, buildings per COPY round trip, and characters of
+# COPY output held before they are binned (bounds the text buffer whatever the chunk size)
+METER_INTERVAL_MINUTES = 15
+METER_MATRIX_CHUNK = int(os.getenv('METER_MATRIX_CHUNK', '200'))
+METER_MATRIX_BUFFER = int(os.getenv('METER_MATRIX_BUFFER', str(4 * 1024 * 1024)))
+# quality_flag from which a reading is an estimate (meter_normalize.FLAG_INTERPOLATED)
+METER_FLAG_ESTIMATED = 2
+
+# Months before this many months ago are compacted into meter_month_blobs (1 = all but the current month)
+METER_BLOB_HOT_MONTHS = int(os.getenv('METER_BLOB_HOT_MONTHS', '1'))
+
+# Bulk exports: rows per server-side cursor FETCH (and per streamed chunk)
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', '5000'))
+
+# New installs create meter_readings range-partitioned by month (see migrate_meter_readings_to_partitions)
+METER_PARTITIONING = os.getenv('METER_PARTITIONING', 'true').lower() in ('1', 'true', 'yes')
+# Monthly partitions created ahead of time (beyond the current month) at startup and by cron
+METER_PARTITIONS_AHEAD = int(os.getenv('METER_PARTITIONS_AHEAD', '2'))
+METER_PARTITION_LOCK_ID = 4815162343
+
+# Municipality profile list cache (public API), seconds fresh / served stale
+MUNICIPALITY_CACHE_TTL = int(os.getenv('MUNICIPALITY_CACHE_TTL', '600'))
+MUNICIPALITY_CACHE_STALE_TTL = int(os.getenv('MUNICIPALITY_CACHE_STALE_TTL', '3600'))
+
+# Public data refresh: rows per bulk upsert statement
+PUBLIC_DATA_FLUSH_SIZE = int(os.getenv('PUBLIC_DATA_FLUSH_SIZE', '500'))
+
+# Dense meter data on a fixed grid: index (datetime64[m], interval starts), building_ids,
+# consumption/production float64 (intervals x buildings), missing bool (no reading in slot),
+# estimated bool (a reading in the slot has quality_flag >= 2, i.e. a gap filled in by meter_normalize)
+MeterMatrix = namedtuple('MeterMatrix', ['index', 'building_ids', 'consumption', 'production', 'missing',
+                                         'estimated'])
+
 # Connection pool
 _connection_pool = None
+# Set by _create_tables when the earthdistance GiST index exists
+HAS_EARTHDISTANCE = False
+# Set by _create_tables / the partition migration when meter_readings is partitioned
+METER_READINGS_PARTITIONED = False
 
 
 def init_db():
@@ -75,8 +128,28 @@ def get_connection():
             _connection_pool.putconn(conn)
 
 
+def _create_earthdistance_index(cur):
+    """GiST proximity index via the earthdistance extension, when it can be installed."""
+    global HAS_EARTHDISTANCE
+    cur.execute("SAVEPOINT earthdistance")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS cube")
+        cur.execute("CREATE EXTENSION IF NOT EXISTS earthdistance")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_buildings_earth ON buildings
+            USING gist (ll_to_earth(lat::float8, lon::float8)) WHERE verified = TRUE
+        """)
+        cur.execute("RELEASE SAVEPOINT earthdistance")
+        HAS_EARTHDISTANCE = True
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT earthdistance")
+        HAS_EARTHDISTANCE = False
+        logger.info(f"[DB] earthdistance unavailable, using lat/lon box index: {e}")
+
+
 def _create_tables():
     """Create database tables if they don't exist."""
+    global METER_READINGS_PARTITIONED
     with get_connection() as conn:
         with conn.cursor() as cur:
             # Users/Buildings table
@@ -150,6 +223,9 @@ def _create_tables():
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            # Cluster ids for incremental clustering, shared by all worker processes
+            cur.execute("CREATE SEQUENCE IF NOT EXISTS cluster_id_seq MINVALUE 0 START 0")
+            _sync_cluster_id_seq(cur)
 
             # Referrals tracking table
             cur.execute("""
@@ -297,6 +373,11 @@ def _create_tables():
             """)
 
             # Meter readings (15-min smart meter data)
+            cur.execute("CREATE SEQUENCE IF NOT EXISTS meter_ingest_seq")
+            if _meter_readings_kind(cur) is None and METER_PARTITIONING:
+                cur.execute("CREATE SEQUENCE IF NOT EXISTS meter_readings_id_seq")
+                cur.execute(_meter_readings_ddl('meter_readings'))
+                cur.execute("ALTER SEQUENCE meter_readings_id_seq OWNED BY meter_readings.id")
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS meter_readings (
                     id BIGSERIAL PRIMARY KEY,
@@ -310,6 +391,69 @@ def _create_tables():
                     UNIQUE(building_id, timestamp)
                 )
             """)
+            METER_READINGS_PARTITIONED = _meter_readings_kind(cur) == 'p'
+            if METER_READINGS_PARTITIONED:
+                _ensure_meter_partitions(cur, _upcoming_months())
+
+            # Rollups of meter_readings (insights), maintained by refresh_meter_rollups().
+            # Sums with counts (and sum of squares) so averages/stddev aggregate exactly.
+            # Added without a default: a volatile default would rewrite the whole table here.
+            # Rows from before the column stay NULL until refresh_meter_rollups numbers them.
+            cur.execute("ALTER TABLE meter_readings ADD COLUMN IF NOT EXISTS ingest_seq BIGINT")
+            cur.execute("ALTER TABLE meter_readings ALTER COLUMN ingest_seq SET DEFAULT nextval('meter_ingest_seq')")
+            # 0 measured, else estimated by meter_normalize (1 resampled, 2 interpolated, 3 profile)
+            cur.execute("ALTER TABLE meter_readings ADD COLUMN IF NOT EXISTS quality_flag SMALLINT DEFAULT 0")
+            for table, bucket, key in (
+                ('meter_readings_hourly', 'hour TIMESTAMP NOT NULL', 'hour'),
+                ('meter_readings_daily', 'day DATE NOT NULL', 'day'),
+                ('meter_profile_rollup', 'day_of_week SMALLINT NOT NULL, hour_of_day SMALLINT NOT NULL',
+                 'day_of_week, hour_of_day'),
+            ):
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        building_id VARCHAR(64) NOT NULL REFERENCES buildings(building_id) ON DELETE CASCADE,
+                        {bucket},
+                        consumption_kwh DECIMAL(14, 4),
+                        consumption_sq DOUBLE PRECISION,
+                        consumption_max DECIMAL(10, 4),
+                        consumption_n INTEGER NOT NULL DEFAULT 0,
+                        production_kwh DECIMAL(14, 4),
+                        production_n INTEGER NOT NULL DEFAULT 0,
+                        feed_in_kwh DECIMAL(14, 4),
+                        readings INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (building_id, {key})
+                    )
+                """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS rollup_state (
+                    name VARCHAR(64) PRIMARY KEY,
+                    high_water BIGINT NOT NULL DEFAULT 0,
+                    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Finalized months of meter_readings, one compressed payload per building
+            # and month (meter_blob format, written by compact_meter_months)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS meter_month_blobs (
+                    building_id VARCHAR(64) NOT NULL REFERENCES buildings(building_id) ON DELETE CASCADE,
+                    month DATE NOT NULL,
+                    start_ts TIMESTAMP NOT NULL,
+                    step_seconds INTEGER NOT NULL,
+                    slots INTEGER NOT NULL,
+                    codec VARCHAR(8) NOT NULL,
+                    payload BYTEA NOT NULL,
+                    source VARCHAR(32),
+                    readings INTEGER NOT NULL,
+                    first_reading TIMESTAMP,
+                    last_reading TIMESTAMP,
+                    consumption_kwh DOUBLE PRECISION,
+                    production_kwh DOUBLE PRECISION,
+                    feed_in_kwh DOUBLE PRECISION,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (building_id, month)
+                )
+            """)
 
             # Data consent tiers
             cur.execute("""
@@ -495,7 +639,7 @@ def _create_tables():
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS billing_periods (
                     id SERIAL PRIMARY KEY,
-                    community_id INTEGER NOT NULL,
+                    community_id VARCHAR(64) NOT NULL,
                     period_start TIMESTAMP NOT NULL,
                     period_end TIMESTAMP NOT NULL,
                     total_production_kwh DECIMAL(12, 4) DEFAULT 0,
@@ -579,12 +723,29 @@ def _create_tables():
                 END $$;
             """)
 
+            # Migration: billing_periods.community_id must hold community UUIDs
+            cur.execute("""
+                DO $$
+                BEGIN
+                    IF EXISTS (
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'billing_periods' AND column_name = 'community_id'
+                          AND data_type = 'integer'
+                    ) THEN
+                        ALTER TABLE billing_periods ALTER COLUMN community_id TYPE VARCHAR(64);
+                    END IF;
+                END $$;
+            """)
+
             # Create indexes for common queries
             cur.execute("CREATE INDEX IF NOT EXISTS idx_buildings_email ON buildings(email)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_buildings_user_type ON buildings(user_type)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_buildings_verified ON buildings(verified)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_buildings_referrer ON buildings(referrer_id)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_buildings_city_id ON buildings(city_id)")
+            # Bounding-box proximity prefilter (formation_wizard.get_formable_clusters)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_buildings_lat_lon ON buildings(lat, lon) WHERE verified = TRUE")
+            _create_earthdistance_index(cur)
 
             cur.execute("CREATE INDEX IF NOT EXISTS idx_tokens_building ON tokens(building_id)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_tokens_type ON tokens(token_type)")
@@ -603,15 +764,40 @@ def _create_tables():
             cur.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_emails_building ON scheduled_emails(building_id)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_municipalities_kanton ON municipalities(kanton)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_municipalities_subdomain ON municipalities(subdomain)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_meter_readings_building ON meter_readings(building_id)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_meter_readings_timestamp ON meter_readings(timestamp)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_meter_readings_building_time ON meter_readings(building_id, timestamp)")
+            _create_meter_indexes(cur, METER_READINGS_PARTITIONED)
             cur.execute("CREATE INDEX IF NOT EXISTS idx_data_consents_building ON data_consents(building_id)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_data_consents_tier ON data_consents(tier)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_api_clients_key ON api_clients(api_key_hash)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_api_usage_client ON api_usage(client_id)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_api_usage_called ON api_usage(called_at)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_insights_cache_type ON insights_cache(insight_type)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_billing_periods_community ON billing_periods(community_id, period_start)")
+            # One billing period per community and period: re-runs replace it. Older
+            # duplicates are merged into the newest one before the unique index is built.
+            cur.execute("""
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (
+                        SELECT 1 FROM pg_indexes WHERE indexname = 'uq_billing_periods_period'
+                    ) THEN
+                        WITH ranked AS (
+                            SELECT id, first_value(id) OVER (
+                                PARTITION BY community_id, period_start, period_end ORDER BY id DESC) AS keep_id
+                            FROM billing_periods
+                        ), dups AS (
+                            SELECT id, keep_id FROM ranked WHERE id <> keep_id
+                        ), moved AS (
+                            UPDATE invoices i SET billing_period_id = d.keep_id
+                            FROM dups d WHERE i.billing_period_id = d.id
+                        ), items AS (
+                            DELETE FROM billing_line_items li USING dups d WHERE li.billing_period_id = d.id
+                        )
+                        DELETE FROM billing_periods bp USING dups d WHERE bp.id = d.id;
+                        CREATE UNIQUE INDEX uq_billing_periods_period
+                            ON billing_periods(community_id, period_start, period_end);
+                    END IF;
+                END $$;
+            """)
 
             cur.execute("CREATE INDEX IF NOT EXISTS idx_elcom_tariffs_bfs ON elcom_tariffs(bfs_number)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_elcom_tariffs_year ON elcom_tariffs(year)")
@@ -642,6 +828,31 @@ def _create_tables():
             cur.execute("CREATE INDEX IF NOT EXISTS idx_lea_reports_job ON lea_reports(job_name)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_lea_reports_created ON lea_reports(created_at DESC)")
 
+            # Background job queue (jobs.py)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS background_jobs (
+                    id BIGSERIAL PRIMARY KEY,
+                    job_type VARCHAR(64) NOT NULL,
+                    dedup_key VARCHAR(255),
+                    payload JSONB NOT NULL DEFAULT '{}',
+                    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 3,
+                    run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP,
+                    heartbeat_at TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            """)
+            cur.execute("ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP")
+            cur.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_background_jobs_dedup
+                ON background_jobs(job_type, dedup_key) WHERE status = 'pending'
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_background_jobs_claim ON background_jobs(job_type, status, run_after)")
+
             logger.info("[DB] Tables and indexes created successfully")
 
 
@@ -757,7 +968,7 @@ def get_building_by_email(email: str) -> List[Dict]:
         with get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
-                    SELECT building_id FROM buildings
+                    SELECT building_id, city_id FROM buildings
                     WHERE LOWER(email) = LOWER(%s)
                 """, (email,))
                 return [dict(row) for row in cur.fetchall()]
@@ -829,28 +1040,96 @@ def get_vnb_pipeline_stats() -> Dict:
 def get_all_building_profiles(city_id: Optional[str] = None) -> List[Dict]:
     """Get all building profiles for ML clustering, optionally scoped by city_id."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                if city_id:
-                    cur.execute("""
-                        SELECT building_id, address, lat, lon, plz, building_type,
-                               annual_consumption_kwh, potential_pv_kwp, user_type
-                        FROM buildings
-                        WHERE verified = TRUE AND city_id = %s
-                    """, (city_id,))
-                else:
-                    cur.execute("""
-                        SELECT building_id, address, lat, lon, plz, building_type,
-                               annual_consumption_kwh, potential_pv_kwp, user_type
-                        FROM buildings
-                        WHERE verified = TRUE
-                    """)
-                return [dict(row) for row in cur.fetchall()]
+        return load_building_profiles(city_id)
     except Exception as e:
         logger.error(f"[DB] Error getting building profiles: {e}")
         return []
 
 
+def load_building_profiles(city_id: Optional[str] = None) -> List[Dict]:
+    """get_all_building_profiles, but errors propagate (callers that must not mistake them for no data)."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            if city_id:
+                cur.execute("""
+                    SELECT building_id, address, lat, lon, plz, building_type,
+                           annual_consumption_kwh, potential_pv_kwp, user_type
+                    FROM buildings
+                    WHERE verified = TRUE AND city_id = %s
+                """, (city_id,))
+            else:
+                cur.execute("""
+                    SELECT building_id, address, lat, lon, plz, building_type,
+                           annual_consumption_kwh, potential_pv_kwp, user_type
+                    FROM buildings
+                    WHERE verified = TRUE
+                """)
+            return [dict(row) for row in cur.fetchall()]
+
+
+def get_building_profiles_since(city_id: Optional[str], since: float) -> List[Dict]:
+    """Building profiles registered or updated after a unix timestamp."""
+    try:
+        return load_building_profiles_since(city_id, since)
+    except Exception as e:
+        logger.error(f"[DB] Error getting building profiles since {since}: {e}")
+        return []
+
+
+def load_building_profiles_since(city_id: Optional[str], since: float) -> List[Dict]:
+    """get_building_profiles_since, but errors propagate."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            query = """
+                SELECT building_id, address, lat, lon, plz, building_type,
+                       annual_consumption_kwh, potential_pv_kwp, user_type
+                FROM buildings
+                WHERE verified = TRUE AND GREATEST(registered_at, updated_at) > to_timestamp(%s)
+            """
+            params = [since]
+            if city_id:
+                query += " AND city_id = %s"
+                params.append(city_id)
+            cur.execute(query, params)
+            return [dict(row) for row in cur.fetchall()]
+
+
+def iter_building_profiles(city_id: Optional[str] = None, building_id: Optional[str] = None,
+                           start=None, end=None, chunk_size: int = EXPORT_FETCH_SIZE) -> Iterator[List[Dict]]:
+    """Verified building profiles for bulk export, in chunks of chunk_size.
+
+    Rows come from a server-side cursor, so memory stays constant however
+    many buildings match; start/end bound registered_at to [start, end).
+    Errors are logged and re-raised: a half-sent export must fail visibly.
+    """
+    query = """
+        SELECT building_id, address, lat::float8 AS lat, lon::float8 AS lon, plz, building_type,
+               annual_consumption_kwh::float8 AS annual_consumption_kwh,
+               potential_pv_kwp::float8 AS potential_pv_kwp, user_type, city_id, registered_at
+        FROM buildings
+        WHERE verified = TRUE
+    """
+    params: List[Any] = []
+    for clause, value in (("city_id = %s", city_id), ("building_id = %s", building_id),
+                          ("registered_at >= %s", start), ("registered_at < %s", end)):
+        if value is not None:
+            query += f" AND {clause}"
+            params.append(value)
+    try:
+        with get_connection() as conn:
+            with conn.cursor(name='export_building_profiles') as cur:
+                cur.itersize = chunk_size
+                cur.execute(query + " ORDER BY building_id", params)
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield [dict(row) for row in rows]
+    except Exception as e:
+        logger.error(f"[DB] Error exporting building profiles: {e}")
+        raise
+
+
 def delete_building(building_id: str) -> bool:
     """Delete a building and all related records."""
     try:
@@ -1001,6 +1280,112 @@ def save_cluster_info(cluster_id: int, info: Dict) -> bool:
         return False
 
 
+def save_clusters(assignments: Dict[str, int]) -> int:
+    """Upsert many building -> cluster assignments in one statement."""
+    if not assignments:
+        return 0
+    try:
+        from psycopg2.extras import execute_values
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, """
+                    INSERT INTO clusters (building_id, cluster_id)
+                    VALUES %s
+                    ON CONFLICT (building_id) DO UPDATE SET
+                        cluster_id = EXCLUDED.cluster_id,
+                        updated_at = CURRENT_TIMESTAMP
+                """, [(bid, int(cid)) for bid, cid in assignments.items()])
+                return len(assignments)
+    except Exception as e:
+        logger.error(f"[DB] Error saving clusters: {e}")
+        return 0
+
+
+def delete_clusters(building_ids: List[str]) -> int:
+    """Remove cluster assignments (buildings that became noise)."""
+    if not building_ids:
+        return 0
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM clusters WHERE building_id = ANY(%s)", (list(building_ids),))
+                return cur.rowcount
+    except Exception as e:
+        logger.error(f"[DB] Error deleting clusters: {e}")
+        return 0
+
+
+def delete_cluster_info(cluster_ids: List[int]) -> int:
+    """Remove metadata of clusters that were merged away or dissolved."""
+    if not cluster_ids:
+        return 0
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM cluster_info WHERE cluster_id = ANY(%s)", ([int(c) for c in cluster_ids],))
+                return cur.rowcount
+    except Exception as e:
+        logger.error(f"[DB] Error deleting cluster info: {e}")
+        return 0
+
+
+def next_cluster_id() -> int:
+    """A cluster id no other process has been given (cluster_id_seq).
+
+    Errors are logged and re-raised: there is no id that is safe to invent.
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT nextval('cluster_id_seq') AS next_id")
+                return int(cur.fetchone()['next_id'])
+    except Exception as e:
+        logger.error(f"[DB] Error getting next cluster id: {e}")
+        raise
+
+
+def _sync_cluster_id_seq(cur):
+    """Move cluster_id_seq past ids written without it (full clustering runs, older releases)."""
+    cur.execute("""
+        SELECT setval('cluster_id_seq', used.next_id, false)
+        FROM (SELECT GREATEST(
+                  (SELECT COALESCE(MAX(cluster_id), -1) FROM cluster_info),
+                  (SELECT COALESCE(MAX(cluster_id), -1) FROM clusters)
+              ) + 1 AS next_id) used, cluster_id_seq s
+        WHERE used.next_id > s.last_value + CASE WHEN s.is_called THEN 1 ELSE 0 END
+    """)
+
+
+def sync_cluster_id_seq() -> bool:
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                _sync_cluster_id_seq(cur)
+                return True
+    except Exception as e:
+        logger.error(f"[DB] Error syncing cluster id sequence: {e}")
+        return False
+
+
+def get_cluster_assignments(city_id: Optional[str] = None) -> Dict[str, int]:
+    """Current building -> cluster_id mapping, optionally scoped by city_id."""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                if city_id:
+                    cur.execute("""
+                        SELECT c.building_id, c.cluster_id FROM clusters c
+                        JOIN buildings b ON b.building_id = c.building_id
+                        WHERE b.city_id = %s
+                    """, (city_id,))
+                else:
+                    cur.execute("SELECT building_id, cluster_id FROM clusters")
+                return {row['building_id']: row['cluster_id'] for row in cur.fetchall()}
+    except Exception as e:
+        logger.error(f"[DB] Error getting cluster assignments: {e}")
+        return {}
+
+
 def get_all_clusters() -> List[Dict]:
     """Get all clusters with their info."""
     try:
@@ -1019,6 +1404,35 @@ def get_all_clusters() -> List[Dict]:
         return []
 
 
+def get_cluster_map_rows() -> Optional[List[Dict]]:
+    """All clusters with member coordinates in one query (cluster map snapshot).
+
+    Returns None on error so callers do not publish an empty map.
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT ci.cluster_id, ci.autarky_percent, ci.polygon,
+                           json_agg(json_build_object(
+                               'building_id', b.building_id,
+                               'lat', b.lat::float8,
+                               'lon', b.lon::float8
+                           ) ORDER BY b.building_id) AS members
+                    FROM cluster_info ci
+                    JOIN clusters c ON c.cluster_id = ci.cluster_id
+                    JOIN buildings b ON b.building_id = c.building_id
+                    WHERE b.lat IS NOT NULL AND b.lon IS NOT NULL
+                    GROUP BY ci.cluster_id, ci.autarky_percent, ci.polygon
+                    HAVING COUNT(*) >= 2
+                    ORDER BY ci.cluster_id
+                """)
+                return [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        logger.error(f"[DB] Error getting cluster map rows: {e}")
+        return None
+
+
 # === Referral Operations ===
 
 def get_referral_code(building_id: str) -> Optional[str]:
@@ -1553,28 +1967,560 @@ def update_municipality_status(bfs_number, status, admin_email=None):
 
 # === Meter Reading Operations ===
 
+# --- meter_readings partitioning ---
+
+_meter_partitions = set()  # month starts known to have a partition
+_meter_partitions_lock = threading.Lock()
+
+
+def _meter_readings_ddl(table: str) -> str:
+    """Monthly range-partitioned meter_readings (the unique key includes the partition key)."""
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id BIGINT NOT NULL DEFAULT nextval('meter_readings_id_seq'),
+            building_id VARCHAR(64) REFERENCES buildings(building_id) ON DELETE CASCADE,
+            timestamp TIMESTAMP NOT NULL,
+            consumption_kwh DECIMAL(10, 4),
+            production_kwh DECIMAL(10, 4),
+            feed_in_kwh DECIMAL(10, 4),
+            source VARCHAR(32) DEFAULT 'csv',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ingest_seq BIGINT DEFAULT nextval('meter_ingest_seq'),
+            quality_flag SMALLINT DEFAULT 0,
+            UNIQUE(building_id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """
+
+
+def _meter_readings_kind(cur, table: str = 'meter_readings') -> Optional[str]:
+    """'p' partitioned, 'r' plain table, None if missing."""
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return row['relkind'] if row else None
+
+
+def _create_meter_indexes(cur, partitioned: bool):
+    if partitioned:
+        # Unique (building_id, timestamp) serves per-building lookups; BRIN covers time ranges
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_meter_readings_timestamp_brin
+            ON meter_readings USING brin (timestamp) WITH (pages_per_range = 32)
+        """)
+    else:
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_meter_readings_building ON meter_readings(building_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_meter_readings_timestamp ON meter_readings(timestamp)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_meter_readings_building_time ON meter_readings(building_id, timestamp)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_meter_readings_ingest_seq ON meter_readings(ingest_seq)")
+
+
+def _month_start(value):
+    return value.replace(day=1) if not hasattr(value, 'hour') else value.date().replace(day=1)
+
+
+def _next_month(month):
+    return month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+
+
+def _meter_partition_name(month) -> str:
+    return f"meter_readings_y{month.year}m{month.month:02d}"
+
+
+def _upcoming_months(ahead: Optional[int] = None) -> List:
+    """The current month and the `ahead` (default METER_PARTITIONS_AHEAD) following month starts."""
+    month = _month_start(datetime.now().date())
+    months = [month]
+    for _ in range(METER_PARTITIONS_AHEAD if ahead is None else ahead):
+        month = _next_month(month)
+        months.append(month)
+    return months
+
+
+def _ensure_meter_partitions(cur, months, parent: str = 'meter_readings') -> List[str]:
+    """Create missing monthly partitions of a partitioned meter table in the caller's transaction.
+
+    CREATE TABLE ... PARTITION OF holds an ACCESS EXCLUSIVE lock on the parent
+    until commit, so this is for startup and the migration only; live ingest
+    goes through ensure_meter_partitions(). Returns created names.
+    """
+    cache = parent == 'meter_readings'
+    if cache and not METER_READINGS_PARTITIONED:
+        return []
+    missing = sorted(m for m in months if not (cache and m in _meter_partitions))
+    if not missing:
+        return []
+    created = []
+    for month in missing:
+        name = _meter_partition_name(month)
+        if parent != 'meter_readings':
+            name = f"{name}_new"
+        cur.execute("SELECT to_regclass(%s) AS existing", (name,))
+        if cur.fetchone()['existing'] is None:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {name} PARTITION OF {parent}
+                FOR VALUES FROM (%s) TO (%s)
+            """, (month, _next_month(month)))
+            created.append(name)
+    if cache:
+        with _meter_partitions_lock:
+            _meter_partitions.update(missing)
+    if created:
+        logger.info(f"[DB] Created meter partitions: {', '.join(created)}")
+    return created
+
+
+def ensure_meter_partitions(months=None) -> List[str]:
+    """Create missing monthly partitions of meter_readings, each in its own short transaction.
+
+    A month is created as a standalone table and then attached, which locks
+    meter_readings only in SHARE UPDATE EXCLUSIVE mode: reads and ingests keep
+    running. Call it before opening an ingest transaction. months defaults to
+    the current month and METER_PARTITIONS_AHEAD months after it.
+    Returns created names.
+    """
+    if not METER_READINGS_PARTITIONED:
+        return []
+    with _meter_partitions_lock:
+        missing = sorted(m for m in (_upcoming_months() if months is None else months)
+                         if m not in _meter_partitions)
+    created = []
+    for month in missing:
+        name = _meter_partition_name(month)
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    # Serializes creators across processes; the attach check below is then race-free
+                    cur.execute("SELECT pg_advisory_xact_lock(%s)", (METER_PARTITION_LOCK_ID,))
+                    cur.execute("""
+                        SELECT c.relispartition AS attached FROM pg_class c WHERE c.oid = to_regclass(%s)
+                    """, (name,))
+                    row = cur.fetchone()
+                    if not (row and row['attached']):
+                        cur.execute(f"""
+                            CREATE TABLE IF NOT EXISTS {name}
+                            (LIKE meter_readings INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+                        """)
+                        cur.execute(f"""
+                            ALTER TABLE meter_readings ATTACH PARTITION {name}
+                            FOR VALUES FROM (%s) TO (%s)
+                        """, (month, _next_month(month)))
+                        created.append(name)
+            with _meter_partitions_lock:
+                _meter_partitions.add(month)
+        except Exception as e:
+            # The ingest that needs this month then fails and reports the error
+            logger.error(f"[DB] Error creating meter partition {name}: {e}")
+    if created:
+        logger.info(f"[DB] Attached meter partitions: {', '.join(created)}")
+    return created
+
+
+def list_meter_partitions() -> List[Dict]:
+    """Monthly partitions of meter_readings: [{"name", "month", "estimated_rows"}]."""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT c.relname AS name, c.reltuples::bigint AS estimated_rows
+                    FROM pg_inherits i
+                    JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = to_regclass('meter_readings')
+                    ORDER BY c.relname
+                """)
+                result = []
+                for row in cur.fetchall():
+                    name = row['name']
+                    try:
+                        month = datetime.strptime(name[-7:], '%Ym%m').date()
+                    except ValueError:
+                        month = None
+                    result.append({"name": name, "month": month,
+                                   "estimated_rows": max(int(row['estimated_rows'] or 0), 0)})
+                return result
+    except Exception as e:
+        logger.error(f"[DB] Error listing meter partitions: {e}")
+        return []
+
+
+def drop_meter_partitions(before, detach_only: bool = False) -> List[str]:
+    """Retention: detach (and unless detach_only, drop) monthly partitions entirely before `before`.
+
+    Dropping also deletes compacted months (meter_month_blobs) before that
+    month. Rollup tables keep their aggregates for the removed months.
+    """
+    cutoff = _month_start(before)
+    removed = []
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                for partition in list_meter_partitions():
+                    if partition['month'] is None or _next_month(partition['month']) > cutoff:
+                        continue
+                    cur.execute(f"ALTER TABLE meter_readings DETACH PARTITION {partition['name']}")
+                    if not detach_only:
+                        cur.execute(f"DROP TABLE {partition['name']}")
+                    removed.append(partition['name'])
+                if not detach_only:
+                    # Compacted months of the same range live in meter_month_blobs
+                    cur.execute("DELETE FROM meter_month_blobs WHERE month < %s", (cutoff,))
+        with _meter_partitions_lock:
+            _meter_partitions.clear()
+        if removed:
+            logger.info(f"[DB] {'Detached' if detach_only else 'Dropped'} meter partitions: {', '.join(removed)}")
+        return removed
+    except Exception as e:
+        logger.error(f"[DB] Error dropping meter partitions: {e}")
+        return []
+
+
+def migrate_meter_readings_to_partitions(drop_legacy: bool = False) -> Dict:
+    """Move a plain meter_readings table into the monthly partitioned layout.
+
+    Rows are copied month by month (one transaction each) into
+    meter_readings_part while the app keeps running; the final transaction
+    locks the old table against writes, copies everything ingested since the
+    copy started (by ingest_seq), and swaps the tables. That transaction also
+    holds the meter advisory lock exclusively, like compact_meter_months, and
+    drops the copies of months compacted away while the copy ran. The old
+    table stays as meter_readings_legacy unless drop_legacy is set. Safe to
+    re-run.
+
+    Returns:
+        {"migrated": bool, "months": int, "rows": int, "delta_rows": int, "reason": str}
+    """
+    global METER_READINGS_PARTITIONED
+    result = {"migrated": False, "months": 0, "rows": 0, "delta_rows": 0, "reason": ""}
+    columns = ("id, building_id, timestamp, consumption_kwh, production_kwh, feed_in_kwh, source, created_at, "
+               "ingest_seq, quality_flag")
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                kind = _meter_readings_kind(cur)
+                if kind != 'r':
+                    result["reason"] = "already partitioned" if kind == 'p' else "no meter_readings table"
+                    return result
+                cur.execute("""
+                    SELECT MIN(timestamp) AS lo, MAX(timestamp) AS hi, MAX(ingest_seq) AS seq,
+                           LOCALTIMESTAMP AS started
+                    FROM meter_readings
+                """)
+                bounds = cur.fetchone()
+                cur.execute(_meter_readings_ddl('meter_readings_part'))
+        mark = int(bounds['seq'] or 0)
+
+        month = _month_start(bounds['lo']) if bounds['lo'] else None
+        while month and month <= _month_start(bounds['hi']):
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    _ensure_meter_partitions(cur, {month}, parent='meter_readings_part')
+                    cur.execute(f"""
+                        INSERT INTO meter_readings_part ({columns})
+                        SELECT {columns} FROM meter_readings
+                        WHERE timestamp >= %s AND timestamp < %s AND COALESCE(ingest_seq, 0) <= %s
+                        ON CONFLICT (building_id, timestamp) DO NOTHING
+                    """, (month, _next_month(month), mark))
+                    result["rows"] += max(cur.rowcount, 0)
+            result["months"] += 1
+            month = _next_month(month)
+
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                # Waits for running ingests and compactions, then keeps both out until the swap commits
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (METER_ROLLUP_LOCK_ID,))
+                cur.execute("LOCK TABLE meter_readings IN EXCLUSIVE MODE")
+                cur.execute("""
+                    SELECT DISTINCT date_trunc('month', timestamp)::date AS month
+                    FROM meter_readings WHERE ingest_seq > %s
+                """, (mark,))
+                _ensure_meter_partitions(cur, {r['month'] for r in cur.fetchall()}, parent='meter_readings_part')
+                cur.execute(f"""
+                    INSERT INTO meter_readings_part ({columns})
+                    SELECT {columns} FROM meter_readings WHERE ingest_seq > %s
+                    ON CONFLICT (building_id, timestamp) DO UPDATE SET
+                        consumption_kwh = EXCLUDED.consumption_kwh,
+                        production_kwh = EXCLUDED.production_kwh,
+                        feed_in_kwh = EXCLUDED.feed_in_kwh,
+                        ingest_seq = EXCLUDED.ingest_seq,
+                        quality_flag = EXCLUDED.quality_flag
+                """, (mark,))
+                result["delta_rows"] = max(cur.rowcount, 0)
+                # Months compacted during the copy left meter_readings; their copies must go too
+                cur.execute("""
+                    DELETE FROM meter_readings_part p USING meter_month_blobs b
+                    WHERE b.created_at >= %s AND p.building_id = b.building_id
+                      AND p.timestamp >= b.month AND p.timestamp < b.month + INTERVAL '1 month'
+                      AND NOT EXISTS (SELECT 1 FROM meter_readings m
+                                      WHERE m.building_id = p.building_id AND m.timestamp = p.timestamp)
+                """, (bounds['started'],))
+
+                for index in ('idx_meter_readings_building', 'idx_meter_readings_timestamp',
+                              'idx_meter_readings_building_time', 'idx_meter_readings_ingest_seq'):
+                    cur.execute(f"ALTER INDEX IF EXISTS {index} RENAME TO {index}_legacy")
+                cur.execute("ALTER TABLE meter_readings RENAME TO meter_readings_legacy")
+                cur.execute("ALTER TABLE meter_readings_part RENAME TO meter_readings")
+                cur.execute("""
+                    SELECT c.relname AS name FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = to_regclass('meter_readings')
+                """)
+                for row in cur.fetchall():
+                    if row['name'].endswith('_new'):
+                        cur.execute(f"ALTER TABLE {row['name']} RENAME TO {row['name'][:-4]}")
+                cur.execute("ALTER SEQUENCE meter_readings_id_seq OWNED BY meter_readings.id")
+                _create_meter_indexes(cur, partitioned=True)
+                if drop_legacy:
+                    cur.execute("DROP TABLE meter_readings_legacy")
+        METER_READINGS_PARTITIONED = True
+        with _meter_partitions_lock:
+            _meter_partitions.clear()
+        result["migrated"] = True
+        logger.info(f"[DB] meter_readings migrated to monthly partitions: {result}")
+        return result
+    except Exception as e:
+        logger.error(f"[DB] Error migrating meter_readings to partitions: {e}")
+        result["reason"] = str(e)
+        return result
+
+
+def _lock_meter_ingest(cur):
+    """Shared lock held until commit, so a rollup refresh never sees a half-committed ingest_seq range."""
+    cur.execute("SELECT pg_advisory_xact_lock_shared(%s)", (METER_ROLLUP_LOCK_ID,))
+
+
+_METER_BLOB_COLUMNS = "building_id, month, start_ts, step_seconds, slots, codec, payload, source"
+
+
+def _fetch_meter_blobs(cur, building_ids, start=None, end=None) -> List[Dict]:
+    """meter_month_blobs rows of the given buildings for months overlapping [start, end]."""
+    query = f"SELECT {_METER_BLOB_COLUMNS} FROM meter_month_blobs WHERE building_id = ANY(%s)"
+    params: List[Any] = [list(building_ids)]
+    if start is not None:
+        query += " AND month >= date_trunc('month', %s::timestamp)::date"
+        params.append(start)
+    if end is not None:
+        query += " AND month <= date_trunc('month', %s::timestamp)::date"
+        params.append(end)
+    cur.execute(query + " ORDER BY building_id, month", params)
+    return list(cur.fetchall())
+
+
+def _decode_meter_blob(blob, start=None, end=None):
+    """Readings of one meter_month_blobs row as (epoch seconds, values kWh (n x 3), flags),
+    cut to [start, end) when given. NULL values are NaN."""
+    import numpy as np
+    import meter_blob
+    month = meter_blob.decode(blob['payload'], blob['slots'], blob['codec'])
+    slots = np.flatnonzero(month.present)
+    epochs = np.datetime64(blob['start_ts'], 's').astype(np.int64) + slots * int(blob['step_seconds'])
+    keep = np.ones(slots.size, dtype=bool)
+    if start is not None:
+        keep &= epochs >= np.datetime64(start, 's').astype(np.int64)
+    if end is not None:
+        keep &= epochs < np.datetime64(end, 's').astype(np.int64)
+    return epochs[keep], month.values[slots[keep]], month.flags[slots[keep]]
+
+
+def _epochs_to_datetimes(epochs) -> List[datetime]:
+    return epochs.astype('datetime64[s]').astype(datetime).tolist()
+
+
+def _meter_blob_readings(blob, start=None, end=None) -> List[Dict]:
+    """Readings of one meter_month_blobs row as meter_readings-style dicts, cut to [start, end)."""
+    epochs, values, flags = _decode_meter_blob(blob, start, end)
+    return [{
+        'building_id': blob['building_id'], 'timestamp': ts,
+        'consumption_kwh': None if v[0] != v[0] else v[0],
+        'production_kwh': None if v[1] != v[1] else v[1],
+        'feed_in_kwh': None if v[2] != v[2] else v[2],
+        'source': blob['source'], 'quality_flag': flag,
+    } for ts, v, flag in zip(_epochs_to_datetimes(epochs), values.tolist(), flags.tolist())]
+
+
+def _thaw_meter_blobs(cur, blobs) -> int:
+    """Move compacted building-months back into meter_readings (before they take new readings).
+
+    Runs inside the caller's transaction, which has ensured the months' partitions
+    beforehand; returns the number of restored rows.
+    """
+    blobs = list(blobs)
+    if not blobs:
+        return 0
+    from psycopg2.extras import execute_values
+    rows = []
+    for blob in blobs:
+        epochs, values, flags = _decode_meter_blob(blob)
+        columns = [[None if v != v else v for v in values[:, i].tolist()] for i in range(3)]
+        rows.extend((blob['building_id'], ts, c, p, f, blob['source'], flag)
+                    for ts, c, p, f, flag in zip(_epochs_to_datetimes(epochs), *columns, flags.tolist()))
+    execute_values(cur, """
+        INSERT INTO meter_readings (building_id, timestamp, consumption_kwh, production_kwh, feed_in_kwh,
+                                    source, quality_flag)
+        VALUES %s
+        ON CONFLICT (building_id, timestamp) DO NOTHING
+    """, rows, page_size=1000)
+    cur.execute("""
+        DELETE FROM meter_month_blobs
+        WHERE (building_id, month) IN (SELECT * FROM unnest(%s::text[], %s::date[]))
+    """, ([b['building_id'] for b in blobs], [b['month'] for b in blobs]))
+    logger.info(f"[DB] Thawed {len(blobs)} compacted meter months ({len(rows)} readings)")
+    return len(rows)
+
+
 def save_meter_readings(building_id, readings, source='csv'):
-    """Bulk insert meter readings. readings = list of (timestamp, consumption, production, feed_in)."""
+    """Bulk insert meter readings. readings = list of (timestamp, consumption, production, feed_in),
+    optionally with a fifth quality_flag element (see meter_normalize).
+
+    Batches of METER_COPY_THRESHOLD rows or more go through the COPY-based
+    save_meter_readings_bulk path.
+    """
+    if len(readings) >= METER_COPY_THRESHOLD:
+        return save_meter_readings_bulk(building_id, readings, source=source)['total']
     try:
+        months = {_month_start(r[0]) for r in readings}
+        ensure_meter_partitions(months)
         with get_connection() as conn:
             with conn.cursor() as cur:
                 from psycopg2.extras import execute_values
-                values = [(building_id, r[0], r[1], r[2], r[3], source) for r in readings]
+                values = [(building_id, r[0], r[1], r[2], r[3], source, r[4] if len(r) > 4 else 0)
+                          for r in readings]
+                _lock_meter_ingest(cur)
+                cur.execute(f"""
+                    SELECT {_METER_BLOB_COLUMNS} FROM meter_month_blobs
+                    WHERE building_id = %s AND month = ANY(%s) FOR UPDATE
+                """, (building_id, sorted(months)))
+                _thaw_meter_blobs(cur, cur.fetchall())
                 execute_values(cur, """
-                    INSERT INTO meter_readings (building_id, timestamp, consumption_kwh, production_kwh, feed_in_kwh, source)
+                    INSERT INTO meter_readings (building_id, timestamp, consumption_kwh, production_kwh, feed_in_kwh,
+                                                source, quality_flag)
                     VALUES %s
                     ON CONFLICT (building_id, timestamp) DO UPDATE SET
                         consumption_kwh = EXCLUDED.consumption_kwh,
                         production_kwh = EXCLUDED.production_kwh,
-                        feed_in_kwh = EXCLUDED.feed_in_kwh
+                        feed_in_kwh = EXCLUDED.feed_in_kwh,
+                        ingest_seq = EXCLUDED.ingest_seq,
+                        quality_flag = EXCLUDED.quality_flag
                 """, values)
                 return len(values)
     except Exception as e:
         logger.error(f"[DB] Error saving meter readings: {e}")
+        _meter_partitions.clear()  # a partition dropped by another process must be re-created
         return 0
 
 
+class _CopyStream:
+    """Minimal file-like reader over an iterator of text chunks, for COPY FROM STDIN."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def save_meter_readings_bulk(building_id, readings, source='csv') -> Dict:
+    """Ingest meter readings via COPY into a staging table and one set-based upsert.
+
+    readings = iterable of (timestamp, consumption, production, feed_in), or
+    (building_id, timestamp, consumption, production, feed_in) when building_id
+    is None, so one call can carry data for many buildings. A trailing
+    quality_flag element is optional (default 0, measured).
+    Duplicate (building_id, timestamp) rows in the input keep the last value.
+
+    Returns:
+        {"inserted": int, "updated": int, "total": int}
+    """
+    empty = {"inserted": 0, "updated": 0, "total": 0}
+
+    def csv_chunks(rows_per_chunk=1000):
+        import csv
+        import io
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator='\n')
+        for seq, r in enumerate(readings):
+            row = (building_id, *r) if building_id is not None else tuple(r)
+            writer.writerow((seq, *row[:5], source, row[5] if len(row) > 5 else 0))
+            if seq % rows_per_chunk == rows_per_chunk - 1:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TEMP TABLE IF NOT EXISTS meter_readings_stage (
+                        seq BIGINT,
+                        building_id VARCHAR(64),
+                        timestamp TIMESTAMP,
+                        consumption_kwh DECIMAL(10, 4),
+                        production_kwh DECIMAL(10, 4),
+                        feed_in_kwh DECIMAL(10, 4),
+                        source VARCHAR(32),
+                        quality_flag SMALLINT
+                    ) ON COMMIT DELETE ROWS
+                """)
+                cur.copy_expert("""
+                    COPY meter_readings_stage (seq, building_id, timestamp, consumption_kwh,
+                                               production_kwh, feed_in_kwh, source, quality_flag)
+                    FROM STDIN WITH (FORMAT csv)
+                """, _CopyStream(csv_chunks()), size=METER_COPY_BUFFER)
+
+                # Nothing in this transaction has touched meter_readings yet, so the
+                # partition attach on its own connection does not wait for us
+                cur.execute("SELECT DISTINCT date_trunc('month', timestamp)::date AS month FROM meter_readings_stage")
+                ensure_meter_partitions({r['month'] for r in cur.fetchall()})
+                _lock_meter_ingest(cur)
+                cur.execute(f"""
+                    SELECT {_METER_BLOB_COLUMNS} FROM meter_month_blobs
+                    WHERE (building_id, month) IN (
+                        SELECT DISTINCT building_id, date_trunc('month', timestamp)::date FROM meter_readings_stage
+                    ) FOR UPDATE
+                """)
+                _thaw_meter_blobs(cur, cur.fetchall())
+                cur.execute("""
+                    WITH latest AS (
+                        SELECT DISTINCT ON (building_id, timestamp)
+                               building_id, timestamp, consumption_kwh, production_kwh, feed_in_kwh, source, quality_flag
+                        FROM meter_readings_stage
+                        ORDER BY building_id, timestamp, seq DESC
+                    ), upserted AS (
+                        INSERT INTO meter_readings (building_id, timestamp, consumption_kwh, production_kwh, feed_in_kwh,
+                                                    source, quality_flag)
+                        SELECT building_id, timestamp, consumption_kwh, production_kwh, feed_in_kwh, source, quality_flag
+                        FROM latest
+                        ON CONFLICT (building_id, timestamp) DO UPDATE SET
+                            consumption_kwh = EXCLUDED.consumption_kwh,
+                            production_kwh = EXCLUDED.production_kwh,
+                            feed_in_kwh = EXCLUDED.feed_in_kwh,
+                            ingest_seq = EXCLUDED.ingest_seq,
+                            quality_flag = EXCLUDED.quality_flag
+                        RETURNING (xmax = 0) AS inserted
+                    )
+                    SELECT COUNT(*) FILTER (WHERE inserted) AS inserted,
+                           COUNT(*) FILTER (WHERE NOT inserted) AS updated
+                    FROM upserted
+                """)
+                row = cur.fetchone()
+                inserted, updated = int(row['inserted'] or 0), int(row['updated'] or 0)
+                logger.info(f"[DB] Bulk meter ingest: {inserted} inserted, {updated} updated")
+                return {"inserted": inserted, "updated": updated, "total": inserted + updated}
+    except Exception as e:
+        logger.error(f"[DB] Error bulk saving meter readings: {e}")
+        _meter_partitions.clear()  # a partition dropped by another process must be re-created
+        return empty
+
+
 def get_meter_readings(building_id, start=None, end=None, limit=1000):
+    """Latest readings of a building (newest first), including compacted months."""
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
@@ -1589,25 +2535,239 @@ def get_meter_readings(building_id, start=None, end=None, limit=1000):
                 query += " ORDER BY timestamp DESC LIMIT %s"
                 params.append(limit)
                 cur.execute(query, params)
-                return [dict(row) for row in cur.fetchall()]
+                rows = [dict(row) for row in cur.fetchall()]
+
+                blobs = _fetch_meter_blobs(cur, [building_id], start, end)
+                if not blobs:
+                    return rows
+                for blob in reversed(blobs):
+                    if len(rows) >= limit and rows[limit - 1]['timestamp'] >= datetime.combine(_next_month(blob['month']), datetime.min.time()):
+                        break  # every reading of this and older months is beyond the limit
+                    rows.extend(r for r in _meter_blob_readings(blob, start) if not end or r['timestamp'] <= end)
+                    rows.sort(key=lambda r: r['timestamp'], reverse=True)
+                    del rows[limit:]
+                return rows
     except Exception as e:
         logger.error(f"[DB] Error getting meter readings: {e}")
         return []
 
 
+def get_meter_building_ids(since=None) -> List[str]:
+    """Buildings with meter readings, optionally only those with readings since a timestamp."""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                if since is not None:
+                    cur.execute("""
+                        SELECT building_id FROM meter_readings WHERE timestamp >= %s
+                        UNION
+                        SELECT building_id FROM meter_month_blobs WHERE last_reading >= %s
+                        ORDER BY building_id
+                    """, (since, since))
+                else:
+                    cur.execute("""
+                        SELECT building_id FROM meter_readings
+                        UNION
+                        SELECT building_id FROM meter_month_blobs
+                        ORDER BY building_id
+                    """)
+                return [row['building_id'] for row in cur.fetchall()]
+    except Exception as e:
+        logger.error(f"[DB] Error listing meter buildings: {e}")
+        return []
+
+
+_METER_EXPORT_FIELDS = ('building_id', 'timestamp', 'consumption_kwh', 'production_kwh', 'feed_in_kwh',
+                        'source', 'quality_flag')
+
+
+def iter_meter_readings(city_id: Optional[str] = None, building_id: Optional[str] = None,
+                        start=None, end=None, chunk_size: int = EXPORT_FETCH_SIZE) -> Iterator[List[Dict]]:
+    """Meter readings in [start, end) for bulk export, ordered by building and timestamp.
+
+    One server-side cursor walks meter_readings and meter_month_blobs
+    together: each compacted month appears as a marker row at its start_ts
+    and is decoded in place, so compacted and row-stored months interleave in
+    order while only one fetch (plus one decoded month) is held in memory.
+    Chunks hold about chunk_size readings. Errors are logged and re-raised.
+    """
+    row_filters, blob_filters, params = [], [], []
+    for row_clause, blob_clause, value in (
+        ("building_id IN (SELECT building_id FROM buildings WHERE city_id = %s)",
+         "building_id IN (SELECT building_id FROM buildings WHERE city_id = %s)", city_id),
+        ("building_id = %s", "building_id = %s", building_id),
+        ("timestamp >= %s", "month >= date_trunc('month', %s::timestamp)::date", start),
+        ("timestamp < %s", "month < %s::timestamp", end),
+    ):
+        if value is not None:
+            row_filters.append(row_clause)
+            blob_filters.append(blob_clause)
+            params.append(value)
+    row_where = f"WHERE {' AND '.join(row_filters)}" if row_filters else ""
+    blob_where = f"WHERE {' AND '.join(blob_filters)}" if blob_filters else ""
+    query = f"""
+        SELECT building_id, timestamp, consumption_kwh::float8 AS consumption_kwh,
+               production_kwh::float8 AS production_kwh, feed_in_kwh::float8 AS feed_in_kwh,
+               source, quality_flag, NULL::integer AS step_seconds, NULL::integer AS slots,
+               NULL::varchar AS codec, NULL::bytea AS payload
+        FROM meter_readings {row_where}
+        UNION ALL
+        SELECT building_id, start_ts, NULL, NULL, NULL, source, NULL, step_seconds, slots, codec, payload
+        FROM meter_month_blobs {blob_where}
+        ORDER BY building_id, timestamp
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor(name='export_meter_readings') as cur:
+                cur.itersize = chunk_size
+                cur.execute(query, params + params)
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    chunk = []
+                    for row in rows:
+                        if row['payload'] is None:
+                            chunk.append({k: row[k] for k in _METER_EXPORT_FIELDS})
+                        else:
+                            chunk.extend(_meter_blob_readings(dict(row, start_ts=row['timestamp']), start, end))
+                    yield chunk
+    except Exception as e:
+        logger.error(f"[DB] Error exporting meter readings: {e}")
+        raise
+
+
+class _CopyRowSink(io.TextIOBase):
+    """Text file for COPY TO STDOUT that hands complete CSV lines to consume(rows) every
+    METER_MATRIX_BUFFER characters, as a float64 array, instead of keeping the output."""
+
+    def __init__(self, consume, limit: int = None):
+        super().__init__()
+        self._consume = consume
+        self._limit = limit or METER_MATRIX_BUFFER
+        self._parts: List[str] = []
+        self._size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(data)
+        self._size += len(data)
+        if self._size >= self._limit:
+            self.drain(final=False)
+        return len(data)
+
+    def drain(self, final: bool = True):
+        import numpy as np
+        text = ''.join(self._parts)
+        cut = len(text) if final else text.rfind('\n') + 1
+        rest = text[cut:]
+        self._parts, self._size = ([rest], len(rest)) if rest else ([], 0)
+        if cut:
+            self._consume(np.loadtxt(io.StringIO(text[:cut]), delimiter=',', dtype=np.float64, ndmin=2))
+
+
+def load_meter_matrix(building_ids: List[str], start: datetime, end: datetime,
+                      interval_minutes: int = METER_INTERVAL_MINUTES) -> MeterMatrix:
+    """Load meter readings of several buildings as aligned float64 arrays.
+
+    Readings in [start, end) are streamed with COPY TO STDOUT (one round trip
+    per METER_MATRIX_CHUNK buildings) and binned every METER_MATRIX_BUFFER
+    characters, compacted months are decoded from meter_month_blobs; both land
+    on a shared grid of interval_minutes slots, several readings in one slot
+    are summed. Slots without a reading are 0.0 in the value arrays and True
+    in ``missing``; slots holding gap-filled readings (quality_flag >= 2,
+    interpolated or profile; resampled readings are measurements) are True
+    in ``estimated``. Errors are logged and re-raised: an unreadable
+    database must not look like buildings without data.
+    """
+    import numpy as np
+
+    building_ids = list(dict.fromkeys(building_ids))
+    step = np.timedelta64(interval_minutes, 'm')
+    first = np.datetime64(start, 'm')
+    slots = max(0, int(-(-(np.datetime64(end, 'm') - first) // step)))
+    shape = (slots, len(building_ids))
+    matrix = MeterMatrix(
+        index=first + np.arange(slots) * step,
+        building_ids=building_ids,
+        consumption=np.zeros(shape, dtype=np.float64),
+        production=np.zeros(shape, dtype=np.float64),
+        missing=np.ones(shape, dtype=bool),
+        estimated=np.zeros(shape, dtype=bool),
+    )
+    if not slots or not building_ids:
+        return matrix
+
+    columns = {building_id: i for i, building_id in enumerate(building_ids)}
+    first_epoch = first.astype('datetime64[s]').astype(np.int64)
+
+    def bin_rows(rows, offset):
+        cols = rows[:, 0].astype(np.intp) + offset
+        slot = rows[:, 1].astype(np.intp)
+        np.add.at(matrix.consumption, (slot, cols), rows[:, 2])
+        np.add.at(matrix.production, (slot, cols), rows[:, 3])
+        matrix.missing[slot, cols] = False
+        matrix.estimated[slot[rows[:, 4] > 0], cols[rows[:, 4] > 0]] = True
+
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as blob_cur, conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                for offset in range(0, len(building_ids), METER_MATRIX_CHUNK):
+                    chunk = building_ids[offset:offset + METER_MATRIX_CHUNK]
+                    query = cur.mogrify("""
+                        SELECT array_position(%s::text[], building_id::text) - 1,
+                               floor(EXTRACT(EPOCH FROM timestamp - %s) / %s)::int,
+                               COALESCE(consumption_kwh, 0)::float8,
+                               COALESCE(production_kwh, 0)::float8,
+                               (COALESCE(quality_flag, 0) >= %s)::int
+                        FROM meter_readings
+                        WHERE building_id = ANY(%s) AND timestamp >= %s AND timestamp < %s
+                    """, (chunk, start, interval_minutes * 60, METER_FLAG_ESTIMATED, chunk, start, end)).decode()
+                    sink = _CopyRowSink(lambda rows, offset=offset: bin_rows(rows, offset))
+                    cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", sink, size=METER_COPY_BUFFER)
+                    sink.drain()
+
+                    # Compacted months: twelve blobs per building-year instead of 35k rows
+                    for blob in _fetch_meter_blobs(blob_cur, chunk, start, end):
+                        epochs, values, flags = _decode_meter_blob(blob, start, end)
+                        slot = ((epochs - first_epoch) // (interval_minutes * 60)).astype(np.intp)
+                        cols = np.full(slot.size, columns[blob['building_id']], dtype=np.intp)
+                        np.add.at(matrix.consumption, (slot, cols), np.nan_to_num(values[:, 0]))
+                        np.add.at(matrix.production, (slot, cols), np.nan_to_num(values[:, 1]))
+                        matrix.missing[slot, cols] = False
+                        gap_filled = flags >= METER_FLAG_ESTIMATED
+                        matrix.estimated[slot[gap_filled], cols[gap_filled]] = True
+        return matrix
+    except Exception as e:
+        logger.error(f"[DB] Error loading meter matrix: {e}")
+        raise
+
+
 def get_meter_reading_stats(building_id):
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
-                    SELECT COUNT(*) as total_readings,
-                           MIN(timestamp) as first_reading,
-                           MAX(timestamp) as last_reading,
-                           SUM(consumption_kwh) as total_consumption,
-                           SUM(production_kwh) as total_production,
-                           SUM(feed_in_kwh) as total_feed_in
-                    FROM meter_readings WHERE building_id = %s
-                """, (building_id,))
+                    WITH parts AS (
+                        SELECT COUNT(*) AS readings, MIN(timestamp) AS first_reading, MAX(timestamp) AS last_reading,
+                               SUM(consumption_kwh)::float8 AS consumption, SUM(production_kwh)::float8 AS production,
+                               SUM(feed_in_kwh)::float8 AS feed_in
+                        FROM meter_readings WHERE building_id = %s
+                        UNION ALL
+                        SELECT SUM(readings), MIN(first_reading), MAX(last_reading),
+                               SUM(consumption_kwh), SUM(production_kwh), SUM(feed_in_kwh)
+                        FROM meter_month_blobs WHERE building_id = %s
+                    )
+                    SELECT COALESCE(SUM(readings), 0)::bigint as total_readings,
+                           MIN(first_reading) as first_reading,
+                           MAX(last_reading) as last_reading,
+                           SUM(consumption) as total_consumption,
+                           SUM(production) as total_production,
+                           SUM(feed_in) as total_feed_in
+                    FROM parts
+                """, (building_id, building_id))
                 row = cur.fetchone()
                 return dict(row) if row else {}
     except Exception as e:
@@ -1615,6 +2775,240 @@ def get_meter_reading_stats(building_id):
         return {}
 
 
+def refresh_meter_rollups() -> Dict:
+    """Bring the meter rollup tables up to date with readings ingested since the high-water mark.
+
+    Every (building, hour) touched by a reading with ingest_seq above the mark
+    is recomputed from meter_readings; the affected days and weekday/hour
+    profile cells are then recomputed from the hourly rollup. Cost scales
+    with the newly ingested data, not the table size. Readings stored before
+    the ingest_seq column existed are numbered METER_SEQ_BACKFILL_BATCH at a
+    time first, so they reach the rollups like new ones; "more" tells
+    whether unnumbered readings are left.
+
+    Returns:
+        {"hours": int, "days": int, "profile_cells": int, "high_water": int,
+         "backfilled": int, "more": bool}
+    """
+    result = {"hours": 0, "days": 0, "profile_cells": 0, "high_water": 0, "backfilled": 0, "more": False}
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                # Waits for running ingests; their ingest_seq values are committed after this
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (METER_ROLLUP_LOCK_ID,))
+                cur.execute("SELECT high_water FROM rollup_state WHERE name = %s", (METER_ROLLUP_STATE,))
+                row = cur.fetchone()
+                high_water = int(row['high_water']) if row else 0
+                cur.execute("""
+                    UPDATE meter_readings SET ingest_seq = nextval('meter_ingest_seq')
+                    WHERE (building_id, timestamp) IN (
+                        SELECT building_id, timestamp FROM meter_readings WHERE ingest_seq IS NULL LIMIT %s
+                    )
+                """, (METER_SEQ_BACKFILL_BATCH,))
+                result["backfilled"] = max(cur.rowcount, 0)
+                result["more"] = result["backfilled"] >= METER_SEQ_BACKFILL_BATCH
+                cur.execute("SELECT MAX(ingest_seq) AS top FROM meter_readings WHERE ingest_seq > %s",
+                            (high_water,))
+                top = cur.fetchone()['top']
+                result["high_water"] = high_water
+                if top is None:
+                    return result
+
+                cur.execute("""
+                    CREATE TEMP TABLE rollup_dirty_hours ON COMMIT DROP AS
+                    SELECT DISTINCT building_id, date_trunc('hour', timestamp) AS hour
+                    FROM meter_readings
+                    WHERE ingest_seq > %s AND ingest_seq <= %s
+                """, (high_water, top))
+
+                cur.execute("""
+                    DELETE FROM meter_readings_hourly h USING rollup_dirty_hours d
+                    WHERE h.building_id = d.building_id AND h.hour = d.hour
+                """)
+                cur.execute("""
+                    INSERT INTO meter_readings_hourly (building_id, hour, consumption_kwh, consumption_sq,
+                        consumption_max, consumption_n, production_kwh, production_n, feed_in_kwh, readings)
+                    SELECT d.building_id, d.hour,
+                           SUM(mr.consumption_kwh), SUM((mr.consumption_kwh::float8) ^ 2),
+                           MAX(mr.consumption_kwh), COUNT(mr.consumption_kwh),
+                           SUM(mr.production_kwh), COUNT(mr.production_kwh),
+                           SUM(mr.feed_in_kwh), COUNT(*)
+                    FROM rollup_dirty_hours d
+                    JOIN meter_readings mr ON mr.building_id = d.building_id
+                     AND mr.timestamp >= d.hour AND mr.timestamp < d.hour + INTERVAL '1 hour'
+                    GROUP BY d.building_id, d.hour
+                """)
+                result["hours"] = cur.rowcount
+
+                for table, bucket, dirty_select, match in (
+                    ('meter_readings_daily', 'day',
+                     "SELECT DISTINCT building_id, hour::date AS day FROM rollup_dirty_hours",
+                     "h.hour::date = k.day"),
+                    ('meter_profile_rollup', 'day_of_week, hour_of_day',
+                     """SELECT DISTINCT building_id, EXTRACT(DOW FROM hour)::smallint AS day_of_week,
+                               EXTRACT(HOUR FROM hour)::smallint AS hour_of_day
+                        FROM rollup_dirty_hours""",
+                     "EXTRACT(DOW FROM h.hour) = k.day_of_week AND EXTRACT(HOUR FROM h.hour) = k.hour_of_day"),
+                ):
+                    keys = ' AND '.join(f"t.{c.strip()} = k.{c.strip()}" for c in bucket.split(','))
+                    cur.execute(f"""
+                        WITH k AS ({dirty_select})
+                        DELETE FROM {table} t USING k WHERE t.building_id = k.building_id AND {keys}
+                    """)
+                    k_columns = ', '.join(f"k.{c.strip()}" for c in bucket.split(','))
+                    cur.execute(f"""
+                        WITH k AS ({dirty_select})
+                        INSERT INTO {table} (building_id, {bucket}, consumption_kwh, consumption_sq,
+                            consumption_max, consumption_n, production_kwh, production_n, feed_in_kwh, readings)
+                        SELECT k.building_id, {k_columns},
+                               SUM(h.consumption_kwh), SUM(h.consumption_sq), MAX(h.consumption_max),
+                               SUM(h.consumption_n), SUM(h.production_kwh), SUM(h.production_n),
+                               SUM(h.feed_in_kwh), SUM(h.readings)
+                        FROM k
+                        JOIN meter_readings_hourly h ON h.building_id = k.building_id AND {match}
+                        GROUP BY k.building_id, {k_columns}
+                    """)
+                    result["days" if table == 'meter_readings_daily' else "profile_cells"] = cur.rowcount
+
+                cur.execute("""
+                    INSERT INTO rollup_state (name, high_water, refreshed_at)
+                    VALUES (%s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (name) DO UPDATE SET
+                        high_water = EXCLUDED.high_water, refreshed_at = EXCLUDED.refreshed_at
+                """, (METER_ROLLUP_STATE, top))
+                result["high_water"] = int(top)
+        logger.info(f"[DB] Meter rollups refreshed: {result}")
+        return result
+    except Exception as e:
+        logger.error(f"[DB] Error refreshing meter rollups: {e}")
+        return result
+
+
+def compact_meter_months(before=None, building_ids: Optional[List[str]] = None,
+                         limit: Optional[int] = None) -> Dict:
+    """Move finalized months of meter_readings into meter_month_blobs.
+
+    Months starting before `before` (default: all but the last
+    METER_BLOB_HOT_MONTHS months) are encoded per building with meter_blob
+    and their rows deleted. Rollups are refreshed first; a building-month
+    with readings the rollups have not seen yet is skipped until the next
+    run, so dropping its rows never loses rollup input. Each building-month
+    moves in its own short transaction under the exclusive ingest lock.
+    At most `limit` building-months are handled per call; "more" tells
+    whether candidates were left over.
+
+    Returns:
+        {"months": int, "readings": int, "bytes": int, "skipped": int, "more": bool}
+    """
+    result = {"months": 0, "readings": 0, "bytes": 0, "skipped": 0, "more": False}
+    if before is not None:
+        cutoff = _month_start(before)
+    else:
+        cutoff = _month_start(datetime.now())
+        for _ in range(METER_BLOB_HOT_MONTHS - 1):
+            cutoff = _month_start(cutoff.replace(day=1) - timedelta(days=1))
+    refresh_meter_rollups()
+
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                query = """
+                    SELECT DISTINCT building_id, date_trunc('month', timestamp)::date AS month
+                    FROM meter_readings WHERE timestamp < %s
+                """
+                params: List[Any] = [cutoff]
+                if building_ids is not None:
+                    query += " AND building_id = ANY(%s)"
+                    params.append(list(building_ids))
+                query += " ORDER BY month, building_id"
+                if limit is not None:
+                    query += " LIMIT %s"
+                    params.append(limit + 1)
+                cur.execute(query, params)
+                candidates = cur.fetchall()
+    except Exception as e:
+        logger.error(f"[DB] Error listing meter months to compact: {e}")
+        return result
+
+    if limit is not None and len(candidates) > limit:
+        candidates = candidates[:limit]
+        result["more"] = True
+    for candidate in candidates:
+        moved = _compact_meter_month(candidate['building_id'], candidate['month'])
+        if moved is None:
+            result["skipped"] += 1
+            continue
+        result["months"] += 1
+        result["readings"] += moved[0]
+        result["bytes"] += moved[1]
+    logger.info(f"[DB] Compacted meter months before {cutoff}: {result}")
+    return result
+
+
+def _compact_meter_month(building_id: str, month) -> Optional[Tuple[int, int]]:
+    """Encode one building-month into meter_month_blobs; (readings, payload bytes) or None if skipped."""
+    import numpy as np
+    from collections import Counter
+    import meter_blob
+    try:
+        ensure_meter_partitions({month})  # a late re-encode thaws the month back into meter_readings
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (METER_ROLLUP_LOCK_ID,))
+                cur.execute("SELECT high_water FROM rollup_state WHERE name = %s", (METER_ROLLUP_STATE,))
+                row = cur.fetchone()
+                high_water = int(row['high_water']) if row else 0
+                # A month compacted earlier that took late readings is re-encoded as a whole
+                cur.execute(f"""
+                    SELECT {_METER_BLOB_COLUMNS} FROM meter_month_blobs
+                    WHERE building_id = %s AND month = %s FOR UPDATE
+                """, (building_id, month))
+                _thaw_meter_blobs(cur, cur.fetchall())
+
+                end = _next_month(month)
+                cur.execute("""
+                    SELECT EXTRACT(EPOCH FROM timestamp)::bigint AS epoch,
+                           consumption_kwh::float8 AS consumption, production_kwh::float8 AS production,
+                           feed_in_kwh::float8 AS feed_in, COALESCE(quality_flag, 0) AS flag,
+                           source, ingest_seq AS seq
+                    FROM meter_readings
+                    WHERE building_id = %s AND timestamp >= %s AND timestamp < %s
+                    ORDER BY timestamp
+                """, (building_id, month, end))
+                rows = cur.fetchall()
+                # Unnumbered (NULL) readings have not reached the rollups yet either
+                if not rows or any(r['seq'] is None or r['seq'] > high_water for r in rows):
+                    return None
+
+                start_epoch = np.datetime64(month, 's').astype(np.int64)
+                epochs = np.array([r['epoch'] for r in rows], dtype=np.int64)
+                step = meter_blob.grid_step(epochs - start_epoch)
+                if not step:
+                    logger.warning(f"[DB] {building_id} {month}: readings off the minute grid, not compacted")
+                    return None
+                slots = int((np.datetime64(end, 's').astype(np.int64) - start_epoch) // step)
+                values = np.array([(r['consumption'], r['production'], r['feed_in']) for r in rows],
+                                  dtype=np.float64)
+                flags = np.array([r['flag'] for r in rows], dtype=np.uint8)
+                payload = meter_blob.encode(slots, (epochs - start_epoch) // step, values, flags)
+                totals = np.nansum(values, axis=0)
+
+                cur.execute("""
+                    INSERT INTO meter_month_blobs (building_id, month, start_ts, step_seconds, slots, codec, payload,
+                        source, readings, first_reading, last_reading, consumption_kwh, production_kwh, feed_in_kwh)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, (building_id, month, month, step, slots, meter_blob.CODEC, payload,
+                      Counter(r['source'] for r in rows).most_common(1)[0][0], len(rows),
+                      *_epochs_to_datetimes(epochs[[0, -1]]), *(float(t) for t in totals)))
+                cur.execute("""
+                    DELETE FROM meter_readings WHERE building_id = %s AND timestamp >= %s AND timestamp < %s
+                """, (building_id, month, end))
+                return len(rows), len(payload)
+    except Exception as e:
+        logger.error(f"[DB] Error compacting meter month {building_id} {month}: {e}")
+        return None
+
+
 # === Data Consent Operations ===
 
 def save_data_consent(building_id, tier=1, share_municipality=True, share_research=False, share_providers=False, version='1.0'):
@@ -1772,34 +3166,41 @@ _db_initialized = False
 
 # === ElCom Tariff Operations ===
 
+def _dedupe_last(rows: List[Dict], key) -> List[Dict]:
+    """ON CONFLICT DO UPDATE may touch a row only once per statement: keep the last record per key."""
+    return list({key(r): r for r in rows}.values())
+
+
+def _upsert_elcom_tariffs(cur, tariffs: List[Dict]) -> int:
+    from psycopg2.extras import execute_values
+    rows = _dedupe_last(tariffs, lambda t: (t['bfs_number'], t.get('operator_name', ''), t['year'], t['category']))
+    execute_values(cur, """
+        INSERT INTO elcom_tariffs (bfs_number, operator_name, year, category,
+            total_rp_kwh, energy_rp_kwh, grid_rp_kwh, municipality_fee_rp_kwh, kev_rp_kwh)
+        VALUES %s
+        ON CONFLICT (bfs_number, operator_name, year, category) DO UPDATE SET
+            total_rp_kwh = EXCLUDED.total_rp_kwh,
+            energy_rp_kwh = EXCLUDED.energy_rp_kwh,
+            grid_rp_kwh = EXCLUDED.grid_rp_kwh,
+            municipality_fee_rp_kwh = EXCLUDED.municipality_fee_rp_kwh,
+            kev_rp_kwh = EXCLUDED.kev_rp_kwh,
+            fetched_at = CURRENT_TIMESTAMP
+    """, [(
+        t['bfs_number'], t.get('operator_name', ''), t['year'], t['category'],
+        t.get('total_rp_kwh'), t.get('energy_rp_kwh'), t.get('grid_rp_kwh'),
+        t.get('municipality_fee_rp_kwh'), t.get('kev_rp_kwh')
+    ) for t in rows], page_size=PUBLIC_DATA_FLUSH_SIZE)
+    return len(rows)
+
+
 def save_elcom_tariffs(tariffs: List[Dict]) -> int:
     """Bulk upsert ElCom tariff records. Returns count saved."""
     if not tariffs:
         return 0
     try:
-        import json
         with get_connection() as conn:
             with conn.cursor() as cur:
-                count = 0
-                for t in tariffs:
-                    cur.execute("""
-                        INSERT INTO elcom_tariffs (bfs_number, operator_name, year, category,
-                            total_rp_kwh, energy_rp_kwh, grid_rp_kwh, municipality_fee_rp_kwh, kev_rp_kwh)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (bfs_number, operator_name, year, category) DO UPDATE SET
-                            total_rp_kwh = EXCLUDED.total_rp_kwh,
-                            energy_rp_kwh = EXCLUDED.energy_rp_kwh,
-                            grid_rp_kwh = EXCLUDED.grid_rp_kwh,
-                            municipality_fee_rp_kwh = EXCLUDED.municipality_fee_rp_kwh,
-                            kev_rp_kwh = EXCLUDED.kev_rp_kwh,
-                            fetched_at = CURRENT_TIMESTAMP
-                    """, (
-                        t['bfs_number'], t.get('operator_name', ''), t['year'], t['category'],
-                        t.get('total_rp_kwh'), t.get('energy_rp_kwh'), t.get('grid_rp_kwh'),
-                        t.get('municipality_fee_rp_kwh'), t.get('kev_rp_kwh')
-                    ))
-                    count += 1
-                return count
+                return _upsert_elcom_tariffs(cur, tariffs)
     except Exception as e:
         logger.error(f"[DB] Error saving ElCom tariffs: {e}")
         return 0
@@ -1830,6 +3231,55 @@ def get_elcom_tariffs(bfs_number: int, year: int = None) -> List[Dict]:
 
 # === Municipality Profile Operations ===
 
+def _upsert_municipality_profiles(cur, profiles: List[Dict]) -> int:
+    import json
+    from psycopg2.extras import execute_values
+    rows = _dedupe_last(profiles, lambda p: p['bfs_number'])
+    execute_values(cur, """
+        INSERT INTO municipality_profiles (bfs_number, name, kanton, population,
+            solar_potential_pct, solar_installed_kwp, ev_share_pct, renewable_heating_pct,
+            electricity_consumption_mwh, renewable_production_mwh,
+            leg_value_gap_chf, energy_transition_score, data_sources)
+        VALUES %s
+        ON CONFLICT (bfs_number) DO UPDATE SET
+            name = EXCLUDED.name, kanton = EXCLUDED.kanton, population = EXCLUDED.population,
+            solar_potential_pct = EXCLUDED.solar_potential_pct,
+            solar_installed_kwp = EXCLUDED.solar_installed_kwp,
+            ev_share_pct = EXCLUDED.ev_share_pct,
+            renewable_heating_pct = EXCLUDED.renewable_heating_pct,
+            electricity_consumption_mwh = EXCLUDED.electricity_consumption_mwh,
+            renewable_production_mwh = EXCLUDED.renewable_production_mwh,
+            leg_value_gap_chf = EXCLUDED.leg_value_gap_chf,
+            energy_transition_score = EXCLUDED.energy_transition_score,
+            data_sources = EXCLUDED.data_sources,
+            updated_at = CURRENT_TIMESTAMP
+    """, [(
+        p['bfs_number'], p['name'], p.get('kanton', 'ZH'),
+        p.get('population'), p.get('solar_potential_pct'),
+        p.get('solar_installed_kwp'), p.get('ev_share_pct'),
+        p.get('renewable_heating_pct'), p.get('electricity_consumption_mwh'),
+        p.get('renewable_production_mwh'), p.get('leg_value_gap_chf'),
+        p.get('energy_transition_score'),
+        json.dumps(p.get('data_sources', {}))
+    ) for p in rows], page_size=PUBLIC_DATA_FLUSH_SIZE)
+    return len(rows)
+
+
+def save_municipality_profiles(profiles: List[Dict]) -> int:
+    """Bulk upsert municipality profiles. Returns count saved."""
+    if not profiles:
+        return 0
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                count = _upsert_municipality_profiles(cur, profiles)
+        _load_municipality_profiles.invalidate_all()
+        return count
+    except Exception as e:
+        logger.error(f"[DB] Error saving municipality profiles: {e}")
+        return 0
+
+
 def save_municipality_profile(profile: Dict) -> bool:
     """Upsert a municipality profile."""
     try:
@@ -1863,7 +3313,8 @@ def save_municipality_profile(profile: Dict) -> bool:
                     profile.get('energy_transition_score'),
                     json.dumps(profile.get('data_sources', {}))
                 ))
-                return True
+        _load_municipality_profiles.invalidate_all()
+        return True
     except Exception as e:
         logger.error(f"[DB] Error saving municipality profile: {e}")
         return False
@@ -1883,27 +3334,132 @@ def get_municipality_profile(bfs_number: int) -> Optional[Dict]:
 
 
 def get_all_municipality_profiles(kanton: str = None, order_by: str = 'name') -> List[Dict]:
-    """Get all municipality profiles, optionally filtered by kanton."""
+    """Get all municipality profiles, optionally filtered by kanton (cached; see _load_municipality_profiles)."""
+    try:
+        return _load_municipality_profiles(kanton, order_by)
+    except Exception as e:
+        logger.error(f"[DB] Error getting municipality profiles: {e}")
+        return []
+
+
+@cache.cached(key_fn=lambda kanton=None, order_by='name': f"{kanton or 'all'}:{order_by}",
+              ttl=MUNICIPALITY_CACHE_TTL, stale_ttl=MUNICIPALITY_CACHE_STALE_TTL,
+              namespace='get_all_municipality_profiles')
+def _load_municipality_profiles(kanton: str = None, order_by: str = 'name') -> List[Dict]:
+    """Profiles with JSON-plain values (float/ISO string), so hits and misses match.
+
+    Raises on DB errors: a failed load must not be cached.
+    """
     allowed_orders = {'name', 'population', 'energy_transition_score', 'leg_value_gap_chf', 'bfs_number'}
     if order_by not in allowed_orders:
         order_by = 'name'
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            if kanton:
+                cur.execute(f"""
+                    SELECT * FROM municipality_profiles
+                    WHERE kanton = %s ORDER BY {order_by}
+                """, (kanton,))
+            else:
+                cur.execute(f"SELECT * FROM municipality_profiles ORDER BY {order_by}")
+            return cache.jsonable([dict(row) for row in cur.fetchall()])
+
+
+# === Sonnendach Municipal Operations ===
+
+def _upsert_sonnendach_municipal(cur, rows: List[Dict]) -> int:
+    from psycopg2.extras import execute_values
+    rows = _dedupe_last(rows, lambda d: d['bfs_number'])
+    execute_values(cur, """
+        INSERT INTO sonnendach_municipal (bfs_number, total_roof_area_m2, suitable_roof_area_m2,
+            potential_kwh_year, potential_kwp, utilization_pct)
+        VALUES %s
+        ON CONFLICT (bfs_number) DO UPDATE SET
+            total_roof_area_m2 = EXCLUDED.total_roof_area_m2,
+            suitable_roof_area_m2 = EXCLUDED.suitable_roof_area_m2,
+            potential_kwh_year = EXCLUDED.potential_kwh_year,
+            potential_kwp = EXCLUDED.potential_kwp,
+            utilization_pct = EXCLUDED.utilization_pct,
+            fetched_at = CURRENT_TIMESTAMP
+    """, [(
+        d['bfs_number'], d.get('total_roof_area_m2'),
+        d.get('suitable_roof_area_m2'), d.get('potential_kwh_year'),
+        d.get('potential_kwp'), d.get('utilization_pct')
+    ) for d in rows], page_size=PUBLIC_DATA_FLUSH_SIZE)
+    return len(rows)
+
+
+def save_sonnendach_municipal_bulk(rows: List[Dict]) -> int:
+    """Bulk upsert sonnendach municipal rows. Returns count saved."""
+    if not rows:
+        return 0
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
-                if kanton:
-                    cur.execute(f"""
-                        SELECT * FROM municipality_profiles
-                        WHERE kanton = %s ORDER BY {order_by}
-                    """, (kanton,))
-                else:
-                    cur.execute(f"SELECT * FROM municipality_profiles ORDER BY {order_by}")
-                return [dict(row) for row in cur.fetchall()]
+                return _upsert_sonnendach_municipal(cur, rows)
     except Exception as e:
-        logger.error(f"[DB] Error getting municipality profiles: {e}")
-        return []
+        logger.error(f"[DB] Error saving sonnendach data: {e}")
+        return 0
 
 
-# === Sonnendach Municipal Operations ===
+class PublicDataBatch:
+    """Buffers public-data rows and upserts them in bulk on one cursor.
+
+    Rows are flushed every `flush_size` records per table; everything is
+    committed together when the surrounding public_data_batch() exits.
+    """
+
+    _WRITERS = {
+        'sonnendach': _upsert_sonnendach_municipal,
+        'tariffs': _upsert_elcom_tariffs,
+        'profiles': _upsert_municipality_profiles,
+    }
+
+    def __init__(self, cur, flush_size: int = PUBLIC_DATA_FLUSH_SIZE):
+        self.cur = cur
+        self.flush_size = max(1, flush_size)
+        self.pending = {table: [] for table in self._WRITERS}
+        self.saved = {table: 0 for table in self._WRITERS}
+        self.statements = 0
+
+    def _add(self, table: str, rows: List[Dict]):
+        self.pending[table].extend(rows)
+        if len(self.pending[table]) >= self.flush_size:
+            self._flush_table(table)
+
+    def add_sonnendach(self, row: Dict):
+        self._add('sonnendach', [row])
+
+    def add_tariffs(self, tariffs: List[Dict]):
+        self._add('tariffs', tariffs)
+
+    def add_profile(self, profile: Dict):
+        self._add('profiles', [profile])
+
+    def _flush_table(self, table: str):
+        rows = self.pending[table]
+        if rows:
+            self.saved[table] += self._WRITERS[table](self.cur, rows)
+            self.statements += 1
+            self.pending[table] = []
+
+    def flush(self):
+        for table in self._WRITERS:
+            self._flush_table(table)
+
+
+@contextmanager
+def public_data_batch(flush_size: int = PUBLIC_DATA_FLUSH_SIZE):
+    """Yield a PublicDataBatch; all its rows commit in one transaction (rolled back on error)."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            batch = PublicDataBatch(cur, flush_size)
+            yield batch
+            batch.flush()
+    if batch.saved['profiles']:
+        _load_municipality_profiles.invalidate_all()
+    logger.info(f"[DB] Public data batch: {batch.saved} in {batch.statements} statements")
+
 
 def save_sonnendach_municipal(data: Dict) -> bool:
     """Upsert sonnendach municipal solar data."""
@@ -2304,8 +3860,25 @@ def list_leg_documents(community_id: int) -> List[Dict]:
         return []
 
 
+# Re-billing a period replaces its totals; the caller replaces its line items
+_BILLING_PERIOD_UPSERT = """
+    ON CONFLICT (community_id, period_start, period_end) DO UPDATE SET
+        total_production_kwh = EXCLUDED.total_production_kwh,
+        total_allocated_kwh = EXCLUDED.total_allocated_kwh,
+        total_surplus_kwh = EXCLUDED.total_surplus_kwh,
+        total_network_discount_chf = EXCLUDED.total_network_discount_chf,
+        distribution_model = EXCLUDED.distribution_model,
+        network_level = EXCLUDED.network_level,
+        status = EXCLUDED.status
+    RETURNING id
+"""
+
+
 def save_billing_period(community_id: int, period_start, period_end, summary: dict) -> int:
-    """Save billing period and line items from billing engine output."""
+    """Save billing period and line items from billing engine output.
+
+    A period that was billed before is replaced, line items included.
+    """
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
@@ -2313,11 +3886,13 @@ def save_billing_period(community_id: int, period_start, period_end, summary: di
                     INSERT INTO billing_periods
                     (community_id, period_start, period_end, total_production_kwh, total_allocated_kwh,
                      total_surplus_kwh, total_network_discount_chf, status)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, 'final') RETURNING id
-                """, (community_id, period_start, period_end,
-                      summary['total_production_kwh'], summary['total_allocated_kwh'],
-                      summary.get('total_surplus_kwh', 0), summary['total_network_discount_chf']))
-                period_id = cur.fetchone()[0]
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, 'final')
+                """ + _BILLING_PERIOD_UPSERT, (community_id, period_start, period_end,
+                                               summary['total_production_kwh'], summary['total_allocated_kwh'],
+                                               summary.get('total_surplus_kwh', 0),
+                                               summary['total_network_discount_chf']))
+                period_id = cur.fetchone()['id']
+                cur.execute("DELETE FROM billing_line_items WHERE billing_period_id = %s", (period_id,))
 
                 for p in summary.get('participants', []):
                     cur.execute("""
@@ -2334,6 +3909,80 @@ def save_billing_period(community_id: int, period_start, period_end, summary: di
         return 0
 
 
+def save_billing_periods(periods: List[Dict]) -> List[int]:
+    """Save many billing periods and their line items in one transaction.
+
+    Each entry needs community_id, period_start, period_end and summary;
+    distribution_model and network_level are optional. A period that was
+    billed before is replaced, line items included. Returns the period ids
+    in input order, or an empty list if the batch was rolled back.
+    """
+    if not periods:
+        return []
+    try:
+        from psycopg2.extras import execute_values
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                period_ids = []
+                line_items = []
+                for p in periods:
+                    summary = p['summary']
+                    cur.execute("""
+                        INSERT INTO billing_periods
+                        (community_id, period_start, period_end, total_production_kwh, total_allocated_kwh,
+                         total_surplus_kwh, total_network_discount_chf, distribution_model, network_level, status)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 'final')
+                    """ + _BILLING_PERIOD_UPSERT, (p['community_id'], p['period_start'], p['period_end'],
+                          summary['total_production_kwh'], summary['total_allocated_kwh'],
+                          summary.get('total_surplus_kwh', 0), summary['total_network_discount_chf'],
+                          p.get('distribution_model', 'proportional'), p.get('network_level', 'same')))
+                    period_id = cur.fetchone()['id']
+                    period_ids.append(period_id)
+                    for item in summary.get('participants', []):
+                        line_items.append((period_id, item['id'], item['consumption_kwh'], item['allocated_kwh'],
+                                           item['self_supply_ratio'], item['internal_cost_chf'],
+                                           item['network_discount_chf']))
+
+                cur.execute("DELETE FROM billing_line_items WHERE billing_period_id = ANY(%s)", (period_ids,))
+                if line_items:
+                    execute_values(cur, """
+                        INSERT INTO billing_line_items
+                        (billing_period_id, participant_id, consumption_kwh, allocated_kwh,
+                         self_supply_ratio, internal_cost_chf, network_discount_chf)
+                        VALUES %s
+                    """, line_items, page_size=1000)
+                return period_ids
+    except Exception as e:
+        logger.error(f"[DB] Error saving billing periods batch: {e}")
+        return []
+
+
+def load_community_members(community_ids: List[str]) -> Dict[str, List[str]]:
+    """Confirmed member building_ids of several communities in one query.
+
+    Returns {community_id: [building_id, ...]}, communities without confirmed
+    members are left out. Errors are logged and re-raised, so a billing run
+    cannot mistake them for empty communities.
+    """
+    if not community_ids:
+        return {}
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT community_id, building_id FROM community_members
+                    WHERE community_id = ANY(%s) AND status = 'confirmed'
+                    ORDER BY community_id, building_id
+                """, (list(community_ids),))
+                members: Dict[str, List[str]] = {}
+                for row in cur.fetchall():
+                    members.setdefault(row['community_id'], []).append(row['building_id'])
+                return members
+    except Exception as e:
+        logger.error(f"[DB] Error loading community members: {e}")
+        raise
+
+
 def get_active_communities() -> List[Dict]:
     """Get all communities with status='active'."""
     try:
@@ -2414,6 +4063,230 @@ def get_lea_reports(limit: int = 50) -> List[Dict]:
         return []
 
 
+# === Background Jobs ===
+
+def enqueue_job(job_type: str, payload: Dict, dedup_key: Optional[str] = None,
+                max_attempts: int = 3, delay_seconds: float = 0) -> Optional[int]:
+    """Insert a pending job. With dedup_key, merges into an existing pending job instead."""
+    import json
+    from jobs import merge_payload
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                for _ in range(2):
+                    if dedup_key is not None:
+                        cur.execute("""
+                            SELECT id, payload FROM background_jobs
+                            WHERE job_type = %s AND dedup_key = %s AND status = 'pending'
+                            FOR UPDATE
+                        """, (job_type, dedup_key))
+                        row = cur.fetchone()
+                        if row:
+                            cur.execute("UPDATE background_jobs SET payload = %s WHERE id = %s",
+                                        (json.dumps(merge_payload(row['payload'], payload)), row['id']))
+                            return row['id']
+                    cur.execute("""
+                        INSERT INTO background_jobs (job_type, dedup_key, payload, max_attempts, run_after)
+                        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+                        ON CONFLICT DO NOTHING
+                        RETURNING id
+                    """, (job_type, dedup_key, json.dumps(payload), max_attempts, delay_seconds))
+                    row = cur.fetchone()
+                    if row:
+                        return row['id']
+                    # Lost an insert race on the dedup index, merge into the winner
+                return None
+    except Exception as e:
+        logger.error(f"[DB] Error enqueuing {job_type} job: {e}")
+        return None
+
+
+def claim_jobs(job_type: str, limit: int = 1) -> List[Dict]:
+    """Mark up to `limit` due jobs as running and return them.
+
+    SKIP LOCKED lets several workers/processes claim concurrently; a dedup key
+    that already has a running job is skipped so those jobs run single-flight.
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE background_jobs SET
+                        status = 'running', started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP,
+                        attempts = attempts + 1
+                    WHERE id IN (
+                        SELECT j.id FROM background_jobs j
+                        WHERE j.job_type = %s AND j.status = 'pending' AND j.run_after <= CURRENT_TIMESTAMP
+                          AND (j.dedup_key IS NULL OR NOT EXISTS (
+                              SELECT 1 FROM background_jobs r
+                              WHERE r.job_type = j.job_type AND r.dedup_key = j.dedup_key
+                                AND r.status = 'running'))
+                        ORDER BY j.run_after, j.id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, job_type, dedup_key, payload, attempts, max_attempts,
+                              EXTRACT(EPOCH FROM created_at) AS created_ts
+                """, (job_type, limit))
+                return [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        logger.error(f"[DB] Error claiming {job_type} jobs: {e}")
+        return []
+
+
+def complete_job(job_id: int) -> bool:
+    """Mark a running job as done."""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE background_jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP, last_error = NULL
+                    WHERE id = %s
+                """, (job_id,))
+                return cur.rowcount > 0
+    except Exception as e:
+        logger.error(f"[DB] Error completing job {job_id}: {e}")
+        return False
+
+
+def fail_job(job_id: int, error: str, retry_delay_seconds: Optional[float] = None) -> str:
+    """Record a failed attempt. Retries (status 'pending') unless out of attempts.
+
+    Returns the new status: 'pending', 'failed' or 'merged' (folded into a
+    newer pending job with the same dedup key).
+    """
+    import json
+    from jobs import merge_payload
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT job_type, dedup_key, payload, attempts, max_attempts
+                    FROM background_jobs WHERE id = %s FOR UPDATE
+                """, (job_id,))
+                job = cur.fetchone()
+                if not job:
+                    return 'failed'
+                if retry_delay_seconds is None or job['attempts'] >= job['max_attempts']:
+                    cur.execute("""
+                        UPDATE background_jobs SET status = 'failed', last_error = %s,
+                            finished_at = CURRENT_TIMESTAMP
+                        WHERE id = %s
+                    """, (error, job_id))
+                    return 'failed'
+                if job['dedup_key'] is not None:
+                    cur.execute("""
+                        SELECT id, payload FROM background_jobs
+                        WHERE job_type = %s AND dedup_key = %s AND status = 'pending'
+                        FOR UPDATE
+                    """, (job['job_type'], job['dedup_key']))
+                    pending = cur.fetchone()
+                    if pending:
+                        cur.execute("UPDATE background_jobs SET payload = %s WHERE id = %s",
+                                    (json.dumps(merge_payload(job['payload'], pending['payload'])), pending['id']))
+                        cur.execute("""
+                            UPDATE background_jobs SET status = 'merged', last_error = %s,
+                                finished_at = CURRENT_TIMESTAMP
+                            WHERE id = %s
+                        """, (error, job_id))
+                        return 'merged'
+                cur.execute("""
+                    UPDATE background_jobs SET status = 'pending', last_error = %s,
+                        run_after = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                    WHERE id = %s
+                """, (error, retry_delay_seconds, job_id))
+                return 'pending'
+    except Exception as e:
+        logger.error(f"[DB] Error failing job {job_id}: {e}")
+        return 'failed'
+
+
+def heartbeat_jobs(job_ids: List[int]) -> int:
+    """Mark running jobs as alive, so requeue_stale_jobs leaves long runs alone."""
+    if not job_ids:
+        return 0
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE background_jobs SET heartbeat_at = CURRENT_TIMESTAMP
+                    WHERE id = ANY(%s) AND status = 'running'
+                """, (list(job_ids),))
+                return cur.rowcount
+    except Exception as e:
+        logger.error(f"[DB] Error renewing job heartbeats: {e}")
+        return 0
+
+
+def requeue_stale_jobs(timeout_seconds: float) -> int:
+    """Put jobs stuck in 'running' without a heartbeat (worker died/restarted) back to pending."""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE background_jobs j SET status = 'pending'
+                    WHERE j.status = 'running'
+                      AND COALESCE(j.heartbeat_at, j.started_at) < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                      AND (j.dedup_key IS NULL OR NOT EXISTS (
+                          SELECT 1 FROM background_jobs p
+                          WHERE p.job_type = j.job_type AND p.dedup_key = j.dedup_key
+                            AND p.status = 'pending'))
+                """, (timeout_seconds,))
+                requeued = cur.rowcount
+                # A newer pending job with the same dedup key already covers the rest
+                cur.execute("""
+                    UPDATE background_jobs SET status = 'merged', finished_at = CURRENT_TIMESTAMP
+                    WHERE status = 'running'
+                      AND COALESCE(heartbeat_at, started_at) < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                """, (timeout_seconds,))
+                return requeued
+    except Exception as e:
+        logger.error(f"[DB] Error requeuing stale jobs: {e}")
+        return 0
+
+
+def purge_jobs(older_than_days: int = 7) -> int:
+    """Delete finished jobs older than the retention window."""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM background_jobs
+                    WHERE status IN ('done', 'merged', 'failed')
+                      AND finished_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+                """, (older_than_days,))
+                return cur.rowcount
+    except Exception as e:
+        logger.error(f"[DB] Error purging jobs: {e}")
+        return 0
+
+
+def get_job_queue_stats() -> Dict[str, Dict]:
+    """Pending/running counts and oldest pending age per job type."""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT job_type,
+                           COUNT(*) FILTER (WHERE status = 'pending') AS pending,
+                           COUNT(*) FILTER (WHERE status = 'running') AS running,
+                           COUNT(*) FILTER (WHERE status = 'failed') AS failed,
+                           EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - MIN(created_at) FILTER (WHERE status = 'pending'))
+                               AS oldest_pending_s
+                    FROM background_jobs
+                    GROUP BY job_type
+                """)
+                return {row['job_type']: {
+                    "pending": row['pending'],
+                    "running": row['running'],
+                    "failed": row['failed'],
+                    "oldest_pending_s": float(row['oldest_pending_s'] or 0),
+                } for row in cur.fetchall()}
+    except Exception as e:
+        logger.error(f"[DB] Error getting job queue stats: {e}")
+        return {}
+
+
 def is_db_available() -> bool:
     """Check if PostgreSQL database is available."""
     global _db_initialized
@@ -2,6 +2,7 @@
 Formation Wizard Module for OpenLEG
 Handles LEG community formation workflow, document generation, and status tracking.
 """
+import math
 import uuid
 import time
 import logging
@@ -40,6 +41,10 @@ FORMATION_CONFIG = {
     "signature_timeout_days": 14,
 }
 
+# Nearby buildings returned per page by get_formable_clusters
+FORMATION_PAGE_SIZE = 10
+METERS_PER_DEGREE_LAT = 111195.0
+
 def get_contract_templates(jurisdiction="Kanton Zürich", dso_contact="EKZ Verteilnetz AG"):
     """Return contract templates parameterized by jurisdiction and DSO."""
     return {
@@ -530,15 +535,30 @@ def get_user_communities(db, building_id: str) -> List[Dict]:
         return []
 
 
-def get_formable_clusters(db, building_id: str, radius_meters: int = 150) -> List[Dict]:
+def _proximity_prefilter(db) -> str:
+    """Index-backed candidate filter: earthdistance GiST if available, else lat/lon box."""
+    if getattr(db, 'HAS_EARTHDISTANCE', False):
+        return ("earth_box(ll_to_earth(%(lat)s, %(lon)s), %(radius)s)"
+                " @> ll_to_earth(b.lat::float8, b.lon::float8)")
+    return ("b.lat BETWEEN %(lat_min)s AND %(lat_max)s"
+            " AND b.lon BETWEEN %(lon_min)s AND %(lon_max)s")
+
+
+def get_formable_clusters(db, building_id: str, radius_meters: int = 150,
+                          limit: int = FORMATION_PAGE_SIZE, offset: int = 0) -> List[Dict]:
     """
     Get clusters that are ready for formation (have enough members).
-    
+
+    Candidates are narrowed by an index (bounding box or earthdistance),
+    exact haversine distance is computed only for those.
+
     Args:
         db: Database module
         building_id: Building ID to center search
         radius_meters: Search radius
-    
+        limit: Nearby buildings per page
+        offset: Page offset into the distance-ordered list
+
     Returns:
         List of formable cluster dicts
     """
@@ -549,44 +569,73 @@ def get_formable_clusters(db, building_id: str, radius_meters: int = 150) -> Lis
                 cur.execute("""
                     SELECT lat, lon FROM buildings WHERE building_id = %s
                 """, (building_id,))
-                
+
                 user = cur.fetchone()
                 if not user:
                     return []
-                
+
+                lat, lon = float(user['lat']), float(user['lon'])
+                dlat = radius_meters / METERS_PER_DEGREE_LAT
+                dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+                params = {
+                    "building_id": building_id, "lat": lat, "lon": lon, "radius": radius_meters,
+                    "lat_min": lat - dlat, "lat_max": lat + dlat,
+                    "lon_min": lon - dlon, "lon_max": lon + dlon,
+                    "limit": limit, "offset": offset,
+                }
+
                 # Find nearby buildings not in communities
-                cur.execute("""
-                    SELECT 
-                        b.building_id,
-                        b.address,
-                        b.email,
-                        b.lat,
-                        b.lon,
-                        (6371000 * acos(
-                            cos(radians(%s)) * cos(radians(b.lat)) *
-                            cos(radians(b.lon) - radians(%s)) +
-                            sin(radians(%s)) * sin(radians(b.lat))
-                        )) as distance
-                    FROM buildings b
-                    WHERE b.verified = TRUE
-                    AND b.building_id != %s
-                    AND NOT EXISTS (
-                        SELECT 1 FROM community_members cm
-                        WHERE cm.building_id = b.building_id
-                        AND cm.status IN ('confirmed', 'invited')
+                measured = f"""
+                    WITH candidates AS (
+                        SELECT b.building_id, b.address, b.email,
+                               b.lat::float8 AS lat, b.lon::float8 AS lon
+                        FROM buildings b
+                        WHERE b.verified = TRUE
+                        AND b.building_id != %(building_id)s
+                        AND {_proximity_prefilter(db)}
+                        AND NOT EXISTS (
+                            SELECT 1 FROM community_members cm
+                            WHERE cm.building_id = b.building_id
+                            AND cm.status IN ('confirmed', 'invited')
+                        )
+                    ), measured AS (
+                        SELECT c.*, 2 * 6371000 * asin(LEAST(1, sqrt(
+                            power(sin(radians(c.lat - %(lat)s) / 2), 2) +
+                            cos(radians(%(lat)s)) * cos(radians(c.lat)) *
+                            power(sin(radians(c.lon - %(lon)s) / 2), 2)
+                        ))) AS distance
+                        FROM candidates c
                     )
-                    HAVING distance <= %s
-                    ORDER BY distance
-                """, (user['lat'], user['lon'], user['lat'], building_id, radius_meters))
-                
-                nearby = [dict(row) for row in cur.fetchall()]
-                
-                if len(nearby) >= FORMATION_CONFIG["min_community_size"] - 1:
+                """
+                cur.execute(measured + """
+                    SELECT *, COUNT(*) OVER () AS total
+                    FROM measured
+                    WHERE distance <= %(radius)s
+                    ORDER BY distance, building_id
+                    LIMIT %(limit)s OFFSET %(offset)s
+                """, params)
+
+                rows = [dict(row) for row in cur.fetchall()]
+                total = int(rows[0]['total']) if rows else 0
+                for row in rows:
+                    row.pop('total', None)
+                if not rows and offset > 0:
+                    # Page past the end: count without paging
+                    cur.execute(measured + """
+                        SELECT COUNT(*) AS total FROM measured WHERE distance <= %(radius)s
+                    """, params)
+                    total = int(cur.fetchone()['total'])
+
+                if total >= FORMATION_CONFIG["min_community_size"] - 1:
                     return [{
-                        "potential_members": len(nearby) + 1,  # +1 for user
-                        "nearby_buildings": nearby[:10],  # Top 10
+                        "potential_members": total + 1,  # +1 for user
+                        "nearby_buildings": rows,
+                        "total_nearby": total,
+                        "limit": limit,
+                        "offset": offset,
+                        "has_more": offset + len(rows) < total,
                         "radius_meters": radius_meters,
-                        "ready_to_form": len(nearby) + 1 >= FORMATION_CONFIG["min_community_size"]
+                        "ready_to_form": total + 1 >= FORMATION_CONFIG["min_community_size"]
                     }]
                 return []
     except Exception as e:
@@ -2,32 +2,39 @@
 OpenLEG Insights Engine.
 Aggregates anonymized smart meter data into intelligence products for B2B API.
 """
+import os
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 
+import cache
 import database as db
 
 logger = logging.getLogger(__name__)
 
+# Demand signal (admin strategy, outreach) is recomputed at most this often
+DEMAND_SIGNAL_CACHE_TTL = int(os.getenv('DEMAND_SIGNAL_CACHE_TTL', '300'))
+DEMAND_SIGNAL_CACHE_STALE_TTL = int(os.getenv('DEMAND_SIGNAL_CACHE_STALE_TTL', '900'))
+
 
 def compute_load_profiles(plz: str = None, period: str = 'month') -> Dict:
     """Compute average load profiles by PLZ, building type, time-of-day."""
     try:
         with db.get_connection() as conn:
             with conn.cursor() as cur:
+                # Weekday x hour rollup per building; consent is applied per building at read time
                 query = """
                     SELECT
                         b.plz,
                         b.building_type,
-                        EXTRACT(HOUR FROM mr.timestamp) as hour,
-                        EXTRACT(DOW FROM mr.timestamp) as day_of_week,
-                        AVG(mr.consumption_kwh) as avg_consumption,
-                        AVG(mr.production_kwh) as avg_production,
-                        COUNT(DISTINCT mr.building_id) as sample_size
-                    FROM meter_readings mr
-                    JOIN buildings b ON mr.building_id = b.building_id
-                    JOIN data_consents dc ON mr.building_id = dc.building_id
+                        p.hour_of_day as hour,
+                        p.day_of_week,
+                        SUM(p.consumption_kwh) / NULLIF(SUM(p.consumption_n), 0) as avg_consumption,
+                        SUM(p.production_kwh) / NULLIF(SUM(p.production_n), 0) as avg_production,
+                        COUNT(DISTINCT p.building_id) as sample_size
+                    FROM meter_profile_rollup p
+                    JOIN buildings b ON p.building_id = b.building_id
+                    JOIN data_consents dc ON p.building_id = dc.building_id
                     WHERE dc.tier >= 2 AND dc.revoked_at IS NULL
                 """
                 params = []
@@ -36,7 +43,7 @@ def compute_load_profiles(plz: str = None, period: str = 'month') -> Dict:
                     params.append(plz)
 
                 query += """
-                    GROUP BY b.plz, b.building_type, hour, day_of_week
+                    GROUP BY b.plz, b.building_type, p.hour_of_day, p.day_of_week
                     ORDER BY b.plz, hour
                 """
                 cur.execute(query, params)
@@ -74,9 +81,9 @@ def compute_solar_index(kanton: str = 'ZH') -> Dict:
                         COUNT(CASE WHEN mr.production_kwh > 0 THEN 1 END) as active_producers
                     FROM buildings b
                     LEFT JOIN (
-                        SELECT DISTINCT building_id,
+                        SELECT building_id,
                                CASE WHEN SUM(production_kwh) > 0 THEN 1 ELSE 0 END as production_kwh
-                        FROM meter_readings
+                        FROM meter_profile_rollup
                         GROUP BY building_id
                     ) mr ON b.building_id = mr.building_id
                     JOIN data_consents dc ON b.building_id = dc.building_id
@@ -105,13 +112,15 @@ def compute_flexibility_potential() -> Dict:
                 cur.execute("""
                     SELECT
                         b.plz,
-                        COUNT(DISTINCT mr.building_id) as households,
-                        AVG(mr.consumption_kwh) as avg_load_kwh,
-                        STDDEV(mr.consumption_kwh) as load_variability,
-                        MAX(mr.consumption_kwh) as peak_load_kwh
-                    FROM meter_readings mr
-                    JOIN buildings b ON mr.building_id = b.building_id
-                    JOIN data_consents dc ON mr.building_id = dc.building_id
+                        COUNT(DISTINCT p.building_id) as households,
+                        SUM(p.consumption_kwh) / NULLIF(SUM(p.consumption_n), 0) as avg_load_kwh,
+                        SQRT(GREATEST(SUM(p.consumption_sq)
+                                      - SUM(p.consumption_kwh)::float8 ^ 2 / NULLIF(SUM(p.consumption_n), 0), 0)
+                             / NULLIF(SUM(p.consumption_n) - 1, 0)) as load_variability,
+                        MAX(p.consumption_max) as peak_load_kwh
+                    FROM meter_profile_rollup p
+                    JOIN buildings b ON p.building_id = b.building_id
+                    JOIN data_consents dc ON p.building_id = dc.building_id
                     WHERE dc.tier >= 3 AND dc.revoked_at IS NULL
                     GROUP BY b.plz
                 """)
@@ -162,7 +171,9 @@ def compute_community_signals() -> Dict:
 
 def refresh_all_insights():
     """Recompute and cache all insight types."""
+    import meter_data
     results = {}
+    db.refresh_meter_rollups()
 
     for name, fn in [
         ('load_profiles', lambda: compute_load_profiles()),
@@ -170,6 +181,7 @@ def refresh_all_insights():
         ('flexibility', lambda: compute_flexibility_potential()),
         ('community_signals', lambda: compute_community_signals()),
         ('municipality_demand', lambda: compute_municipality_demand_signal()),
+        ('meter_quality', lambda: meter_data.sweep_meter_quality()),
     ]:
         data = fn()
         db.save_insight(name, scope='ZH', period='current', data=data, ttl_hours=24)
@@ -302,115 +314,125 @@ def compute_municipality_demand_signal(bfs_number: int = None) -> Dict:
         }
     """
     try:
-        with db.get_connection() as conn:
-            with conn.cursor() as cur:
-                where = "WHERE m.bfs_number = %s" if bfs_number else ""
-                params: list = [bfs_number] if bfs_number else []
-
-                cur.execute(f"""
-                    SELECT
-                        m.bfs_number,
-                        m.name,
-                        m.kanton,
-                        m.subdomain,
-                        COUNT(DISTINCT b.building_id) AS total_registered,
-                        COUNT(DISTINCT CASE WHEN b.verified = TRUE THEN b.building_id END)
-                            AS verified_buildings,
-                        COUNT(DISTINCT CASE
-                            WHEN b.registered_at > CURRENT_TIMESTAMP - INTERVAL '90 days'
-                            THEN b.building_id END) AS recent_signups_90d,
-                        COUNT(DISTINCT CASE WHEN cm.status = 'confirmed' THEN cm.building_id END)
-                            AS confirmed_leg_members,
-                        COUNT(DISTINCT mr_sub.building_id) AS meter_data_uploads
-                    FROM municipalities m
-                    LEFT JOIN buildings b ON b.city_id = m.subdomain
-                    LEFT JOIN community_members cm ON cm.building_id = b.building_id
-                    LEFT JOIN (
-                        SELECT DISTINCT building_id FROM meter_readings
-                    ) mr_sub ON mr_sub.building_id = b.building_id
-                    {where}
-                    GROUP BY m.bfs_number, m.name, m.kanton, m.subdomain
-                    ORDER BY verified_buildings DESC, m.name
-                """, params)
-                rows = [dict(r) for r in cur.fetchall()]
-
-                cur.execute(f"""
-                    SELECT
-                        m.bfs_number,
-                        COUNT(DISTINCT co.community_id) AS communities_in_formation
-                    FROM municipalities m
-                    JOIN buildings b ON b.city_id = m.subdomain
-                    JOIN community_members cm ON cm.building_id = b.building_id
-                    JOIN communities co
-                        ON co.community_id = cm.community_id
-                        AND co.formation_started_at IS NOT NULL
-                    {where}
-                    GROUP BY m.bfs_number
-                """, params)
-                formation_counts = {
-                    int(r["bfs_number"]): int(r["communities_in_formation"])
-                    for r in cur.fetchall()
-                }
-
-        signals = []
-        for row in rows:
-            bfs = int(row["bfs_number"]) if row["bfs_number"] else None
-            verified = int(row["verified_buildings"] or 0)
-            recent = int(row["recent_signups_90d"] or 0)
-            members = int(row["confirmed_leg_members"] or 0)
-            uploads = int(row["meter_data_uploads"] or 0)
-            in_formation = formation_counts.get(bfs, 0) if bfs else 0
-
-            # Demand score: weighted composite of verified resident signals only.
-            # Each component is capped so a single metric cannot dominate.
-            demand_score = float(
-                min(verified * 2, 40)
-                + min(recent, 15)
-                + min(members * 3, 30)
-                + min(in_formation * 5, 15)
-            )
-
-            has_resident_data = verified > 0 or recent > 0
-
-            if demand_score >= 40:
-                demand_level = "high"
-            elif demand_score >= 15:
-                demand_level = "medium"
-            elif demand_score > 0:
-                demand_level = "low"
-            else:
-                demand_level = "none"
-
-            signals.append({
-                "bfs_number": bfs,
-                "name": row.get("name"),
-                "kanton": row.get("kanton", "ZH"),
-                "verified_demand": {
-                    "verified_buildings": verified,
-                    "recent_signups_90d": recent,
-                    "confirmed_leg_members": members,
-                    "communities_in_formation": in_formation,
-                    "meter_data_uploads": uploads,
-                    "demand_score": demand_score,
-                },
-                "heuristic_baseline": {
-                    "source": "public_data_only",
-                    "has_resident_data": has_resident_data,
-                },
-                "demand_level": demand_level,
-                "signal_type": "verified" if has_resident_data else "heuristic_only",
-            })
-
-        return {
-            "signals": signals,
-            "computed_at": datetime.now().isoformat(),
-            "bfs_number": bfs_number,
-        }
+        return _compute_demand_signal(bfs_number)
     except Exception as e:
         logger.error(f"[INSIGHTS] Error computing municipality demand signal: {e}")
         return {"signals": [], "error": str(e), "bfs_number": bfs_number}
 
 
+@cache.cached(key_fn=lambda bfs_number=None: str(bfs_number or 'all'),
+              ttl=DEMAND_SIGNAL_CACHE_TTL, stale_ttl=DEMAND_SIGNAL_CACHE_STALE_TTL,
+              namespace='compute_municipality_demand_signal')
+def _compute_demand_signal(bfs_number: int = None) -> Dict:
+    """compute_municipality_demand_signal(), cached; raises on DB errors so failures are not cached."""
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            where = "WHERE m.bfs_number = %s" if bfs_number else ""
+            params: list = [bfs_number] if bfs_number else []
+
+            cur.execute(f"""
+                SELECT
+                    m.bfs_number,
+                    m.name,
+                    m.kanton,
+                    m.subdomain,
+                    COUNT(DISTINCT b.building_id) AS total_registered,
+                    COUNT(DISTINCT CASE WHEN b.verified = TRUE THEN b.building_id END)
+                        AS verified_buildings,
+                    COUNT(DISTINCT CASE
+                        WHEN b.registered_at > CURRENT_TIMESTAMP - INTERVAL '90 days'
+                        THEN b.building_id END) AS recent_signups_90d,
+                    COUNT(DISTINCT CASE WHEN cm.status = 'confirmed' THEN cm.building_id END)
+                        AS confirmed_leg_members,
+                    COUNT(DISTINCT mr_sub.building_id) AS meter_data_uploads
+                FROM municipalities m
+                LEFT JOIN buildings b ON b.city_id = m.subdomain
+                LEFT JOIN community_members cm ON cm.building_id = b.building_id
+                LEFT JOIN (
+                    SELECT building_id FROM meter_readings
+                    UNION
+                    SELECT building_id FROM meter_month_blobs
+                ) mr_sub ON mr_sub.building_id = b.building_id
+                {where}
+                GROUP BY m.bfs_number, m.name, m.kanton, m.subdomain
+                ORDER BY verified_buildings DESC, m.name
+            """, params)
+            rows = [dict(r) for r in cur.fetchall()]
+
+            cur.execute(f"""
+                SELECT
+                    m.bfs_number,
+                    COUNT(DISTINCT co.community_id) AS communities_in_formation
+                FROM municipalities m
+                JOIN buildings b ON b.city_id = m.subdomain
+                JOIN community_members cm ON cm.building_id = b.building_id
+                JOIN communities co
+                    ON co.community_id = cm.community_id
+                    AND co.formation_started_at IS NOT NULL
+                {where}
+                GROUP BY m.bfs_number
+            """, params)
+            formation_counts = {
+                int(r["bfs_number"]): int(r["communities_in_formation"])
+                for r in cur.fetchall()
+            }
+
+    signals = []
+    for row in rows:
+        bfs = int(row["bfs_number"]) if row["bfs_number"] else None
+        verified = int(row["verified_buildings"] or 0)
+        recent = int(row["recent_signups_90d"] or 0)
+        members = int(row["confirmed_leg_members"] or 0)
+        uploads = int(row["meter_data_uploads"] or 0)
+        in_formation = formation_counts.get(bfs, 0) if bfs else 0
+
+        # Demand score: weighted composite of verified resident signals only.
+        # Each component is capped so a single metric cannot dominate.
+        demand_score = float(
+            min(verified * 2, 40)
+            + min(recent, 15)
+            + min(members * 3, 30)
+            + min(in_formation * 5, 15)
+        )
+
+        has_resident_data = verified > 0 or recent > 0
+
+        if demand_score >= 40:
+            demand_level = "high"
+        elif demand_score >= 15:
+            demand_level = "medium"
+        elif demand_score > 0:
+            demand_level = "low"
+        else:
+            demand_level = "none"
+
+        signals.append({
+            "bfs_number": bfs,
+            "name": row.get("name"),
+            "kanton": row.get("kanton", "ZH"),
+            "verified_demand": {
+                "verified_buildings": verified,
+                "recent_signups_90d": recent,
+                "confirmed_leg_members": members,
+                "communities_in_formation": in_formation,
+                "meter_data_uploads": uploads,
+                "demand_score": demand_score,
+            },
+            "heuristic_baseline": {
+                "source": "public_data_only",
+                "has_resident_data": has_resident_data,
+            },
+            "demand_level": demand_level,
+            "signal_type": "verified" if has_resident_data else "heuristic_only",
+        })
+
+    return cache.jsonable({
+        "signals": signals,
+        "computed_at": datetime.now().isoformat(),
+        "bfs_number": bfs_number,
+    })
+
+
 # Maximum CHF value gap used to normalise leg_value_gap_chf to the 0-100 scale.
 _VALUE_GAP_MAX_CHF = 500.0
 
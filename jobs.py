@@ -0,0 +1,364 @@
+"""
+Background Job Queue for OpenLEG
+Replaces ad-hoc daemon threads with a durable queue: jobs are stored in
+PostgreSQL (background_jobs) and processed by bounded worker pools per job
+type. Dedup keys collapse duplicate pending jobs, a dedup key runs
+single-flight, failures are retried with backoff. Workers renew a heartbeat
+on their running jobs, so only jobs of dead workers count as stale, however
+long a job runs.
+
+Without a database the queue runs on an in-process MemoryJobStore (tests,
+local development).
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', '2'))
+JOB_RETRY_BASE_SECONDS = float(os.getenv('JOB_RETRY_BASE_SECONDS', '30'))
+# A running job without a heartbeat for this long belongs to a dead worker and is requeued
+JOB_STALE_SECONDS = float(os.getenv('JOB_STALE_SECONDS', '900'))
+JOB_HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS', '60'))
+JOBS_AUTOSTART = os.getenv('JOBS_AUTOSTART', 'true').lower() in ('1', 'true', 'yes')
+LATENCY_WINDOW = 200
+
+
+def merge_payload(old: Dict, new: Dict) -> Dict:
+    """Fold a duplicate job into the pending one: lists are unioned, scalars take the newer value."""
+    merged = dict(old or {})
+    for key, value in (new or {}).items():
+        if isinstance(value, list) and isinstance(merged.get(key), list):
+            merged[key] = merged[key] + [v for v in value if v not in merged[key]]
+        else:
+            merged[key] = value
+    return merged
+
+
+class MemoryJobStore:
+    """In-process stand-in for the background_jobs table (same semantics)."""
+
+    def __init__(self):
+        self._jobs: Dict[int, Dict] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def _pending_duplicate(self, job_type, dedup_key):
+        if dedup_key is None:
+            return None
+        return next((j for j in self._jobs.values() if j['job_type'] == job_type
+                     and j['dedup_key'] == dedup_key and j['status'] == 'pending'), None)
+
+    def enqueue(self, job_type, payload, dedup_key=None, max_attempts=3, delay_seconds=0):
+        with self._lock:
+            existing = self._pending_duplicate(job_type, dedup_key)
+            if existing:
+                existing['payload'] = merge_payload(existing['payload'], payload)
+                return existing['id']
+            job_id = self._next_id
+            self._next_id += 1
+            now = time.time()
+            self._jobs[job_id] = {
+                'id': job_id, 'job_type': job_type, 'dedup_key': dedup_key,
+                'payload': dict(payload), 'status': 'pending', 'attempts': 0,
+                'max_attempts': max_attempts, 'run_after': now + delay_seconds,
+                'created_ts': now, 'started_ts': None, 'heartbeat_ts': None, 'last_error': None,
+            }
+            return job_id
+
+    def claim(self, job_type, limit=1):
+        with self._lock:
+            now = time.time()
+            running = {j['dedup_key'] for j in self._jobs.values() if j['job_type'] == job_type
+                       and j['status'] == 'running' and j['dedup_key'] is not None}
+            due = sorted((j for j in self._jobs.values() if j['job_type'] == job_type
+                          and j['status'] == 'pending' and j['run_after'] <= now
+                          and j['dedup_key'] not in running),
+                         key=lambda j: (j['run_after'], j['id']))
+            claimed = []
+            for job in due[:limit]:
+                job.update(status='running', started_ts=now, heartbeat_ts=now, attempts=job['attempts'] + 1)
+                claimed.append(dict(job, payload=dict(job['payload'])))
+            return claimed
+
+    def complete(self, job_id):
+        with self._lock:
+            self._jobs[job_id]['status'] = 'done'
+            return True
+
+    def fail(self, job_id, error, retry_delay_seconds=None):
+        with self._lock:
+            job = self._jobs[job_id]
+            job['last_error'] = error
+            if retry_delay_seconds is None or job['attempts'] >= job['max_attempts']:
+                job['status'] = 'failed'
+                return 'failed'
+            pending = self._pending_duplicate(job['job_type'], job['dedup_key'])
+            if pending:
+                pending['payload'] = merge_payload(job['payload'], pending['payload'])
+                job['status'] = 'merged'
+                return 'merged'
+            job.update(status='pending', run_after=time.time() + retry_delay_seconds)
+            return 'pending'
+
+    def heartbeat(self, job_ids):
+        with self._lock:
+            now = time.time()
+            alive = [self._jobs[i] for i in job_ids if i in self._jobs and self._jobs[i]['status'] == 'running']
+            for job in alive:
+                job['heartbeat_ts'] = now
+            return len(alive)
+
+    def requeue_stale(self, timeout_seconds):
+        with self._lock:
+            cutoff = time.time() - timeout_seconds
+            requeued = 0
+            for job in self._jobs.values():
+                if job['status'] == 'running' and job['heartbeat_ts'] < cutoff:
+                    if self._pending_duplicate(job['job_type'], job['dedup_key']):
+                        job['status'] = 'merged'
+                    else:
+                        job['status'] = 'pending'
+                        requeued += 1
+            return requeued
+
+    def stats(self):
+        with self._lock:
+            now = time.time()
+            result = {}
+            for job in self._jobs.values():
+                s = result.setdefault(job['job_type'], {"pending": 0, "running": 0, "failed": 0,
+                                                        "oldest_pending_s": 0.0})
+                if job['status'] in s:
+                    s[job['status']] += 1
+                if job['status'] == 'pending':
+                    s["oldest_pending_s"] = max(s["oldest_pending_s"], now - job['created_ts'])
+            return result
+
+
+class PostgresJobStore:
+    """background_jobs table via database.py."""
+
+    def enqueue(self, job_type, payload, dedup_key=None, max_attempts=3, delay_seconds=0):
+        return db.enqueue_job(job_type, payload, dedup_key=dedup_key,
+                              max_attempts=max_attempts, delay_seconds=delay_seconds)
+
+    def claim(self, job_type, limit=1):
+        return db.claim_jobs(job_type, limit)
+
+    def complete(self, job_id):
+        return db.complete_job(job_id)
+
+    def fail(self, job_id, error, retry_delay_seconds=None):
+        return db.fail_job(job_id, error, retry_delay_seconds)
+
+    def heartbeat(self, job_ids):
+        return db.heartbeat_jobs(job_ids)
+
+    def requeue_stale(self, timeout_seconds):
+        return db.requeue_stale_jobs(timeout_seconds)
+
+    def stats(self):
+        return db.get_job_queue_stats()
+
+
+def default_store():
+    return PostgresJobStore() if db.is_db_available() else MemoryJobStore()
+
+
+class _JobType:
+    def __init__(self, name, handler, workers, max_attempts):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.wakeup = threading.Event()
+        self.threads: List[threading.Thread] = []
+        self.counters = {"enqueued": 0, "processed": 0, "retried": 0, "failed": 0}
+        self.wait_ms = deque(maxlen=LATENCY_WINDOW)
+        self.run_ms = deque(maxlen=LATENCY_WINDOW)
+
+
+class JobQueue:
+    """Job types with bounded worker pools on top of a job store."""
+
+    def __init__(self, store=None, autostart: bool = False):
+        self._store = store
+        self._types: Dict[str, _JobType] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._autostart = autostart
+        self._started_pid: Optional[int] = None
+        self._running: Dict[int, str] = {}  # job id -> type, jobs this process is executing
+        self._heartbeat: Optional[threading.Thread] = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = default_store()
+        return self._store
+
+    def register(self, job_type: str, handler: Callable[[Dict], object],
+                 workers: int = 1, max_attempts: int = 3):
+        """Register handler(payload) for job_type with a pool of `workers` threads."""
+        with self._lock:
+            self._types[job_type] = _JobType(job_type, handler, max(1, workers), max_attempts)
+
+    def enqueue(self, job_type: str, payload: Optional[Dict] = None, dedup_key: Optional[str] = None,
+                delay_seconds: float = 0) -> Optional[int]:
+        """Store a job; returns its id (the existing pending id when deduplicated)."""
+        spec = self._types.get(job_type)
+        if spec is None:
+            raise ValueError(f"Unknown job type: {job_type}")
+        job_id = self.store.enqueue(job_type, payload or {}, dedup_key=dedup_key,
+                                    max_attempts=spec.max_attempts, delay_seconds=delay_seconds)
+        if job_id is None:
+            logger.error(f"[JOBS] Could not enqueue {job_type} job")
+            return None
+        spec.counters["enqueued"] += 1
+        self.ensure_started()
+        if not delay_seconds:
+            spec.wakeup.set()
+        return job_id
+
+    def _execute(self, spec: _JobType, job: Dict):
+        started = time.time()
+        spec.wait_ms.append(max(0.0, started - float(job.get('created_ts') or started)) * 1000)
+        self._running[job['id']] = spec.name
+        try:
+            spec.handler(job['payload'])
+        except Exception as e:
+            spec.run_ms.append((time.time() - started) * 1000)
+            retry_delay = JOB_RETRY_BASE_SECONDS * 2 ** (job['attempts'] - 1)
+            status = self.store.fail(job['id'], str(e), retry_delay)
+            spec.counters["retried" if status == 'pending' else "failed"] += 1
+            logger.error(f"[JOBS] {spec.name} job {job['id']} failed (attempt {job['attempts']}, {status}): {e}")
+            return False
+        finally:
+            self._running.pop(job['id'], None)
+        spec.run_ms.append((time.time() - started) * 1000)
+        self.store.complete(job['id'])
+        spec.counters["processed"] += 1
+        return True
+
+    def run_pending(self, job_type: Optional[str] = None, limit: int = 100) -> int:
+        """Process due jobs in the calling thread (cron fallback, tests). Returns jobs run."""
+        done = 0
+        for spec in list(self._types.values()):
+            if job_type and spec.name != job_type:
+                continue
+            while done < limit:
+                jobs = self.store.claim(spec.name, 1)
+                if not jobs:
+                    break
+                self._execute(spec, jobs[0])
+                done += 1
+        return done
+
+    def _worker(self, spec: _JobType):
+        while not self._stop.is_set():
+            try:
+                jobs = self.store.claim(spec.name, 1)
+            except Exception as e:
+                logger.error(f"[JOBS] Claim for {spec.name} failed: {e}")
+                jobs = []
+            if jobs:
+                self._execute(spec, jobs[0])
+                continue
+            spec.wakeup.wait(JOB_POLL_SECONDS)
+            spec.wakeup.clear()
+
+    def _beat(self):
+        """Renew the heartbeat of this process's running jobs until stopped."""
+        while not self._stop.wait(JOB_HEARTBEAT_SECONDS):
+            job_ids = list(self._running)
+            if not job_ids:
+                continue
+            try:
+                self.store.heartbeat(job_ids)
+            except Exception as e:
+                logger.error(f"[JOBS] Heartbeat for {len(job_ids)} jobs failed: {e}")
+
+    def ensure_started(self):
+        """Start the worker pools once per process if autostart is on.
+
+        Called on the first enqueue and request of each process rather than at
+        import: with gunicorn --preload the import runs in the arbiter, and its
+        threads would hold the pool connections the forked workers inherit
+        while the workers themselves ran no jobs.
+        """
+        if self._autostart and self._started_pid != os.getpid():
+            self.start()
+
+    def start(self):
+        """Start the worker pools (idempotent) after requeuing jobs of dead workers."""
+        with self._lock:
+            if self._started_pid != os.getpid():
+                # threads of a parent process do not survive fork
+                for spec in self._types.values():
+                    spec.threads = []
+                self._heartbeat = None
+                self._running.clear()
+            self._started_pid = os.getpid()
+            self._stop.clear()
+            requeued = self.store.requeue_stale(JOB_STALE_SECONDS)
+            if requeued:
+                logger.info(f"[JOBS] Requeued {requeued} stale jobs")
+            if self._heartbeat is None or not self._heartbeat.is_alive():
+                self._heartbeat = threading.Thread(target=self._beat, daemon=True, name="job-heartbeat")
+                self._heartbeat.start()
+            for spec in self._types.values():
+                spec.threads = [t for t in spec.threads if t.is_alive()]
+                while len(spec.threads) < spec.workers:
+                    t = threading.Thread(target=self._worker, args=(spec,), daemon=True,
+                                         name=f"job-{spec.name}-{len(spec.threads)}")
+                    t.start()
+                    spec.threads.append(t)
+
+    def stop(self, timeout: float = 5):
+        self._started_pid = None
+        self._stop.set()
+        for spec in self._types.values():
+            spec.wakeup.set()
+        for spec in self._types.values():
+            for t in spec.threads:
+                t.join(timeout)
+            spec.threads = []
+        if self._heartbeat is not None:
+            self._heartbeat.join(timeout)
+            self._heartbeat = None
+
+    def metrics(self) -> Dict[str, Dict]:
+        """Per job type: queue depth from the store, counters and latency (ms)."""
+        depth = self.store.stats()
+        result = {}
+        for name, spec in self._types.items():
+            waits, runs = list(spec.wait_ms), list(spec.run_ms)
+            result[name] = {
+                **depth.get(name, {"pending": 0, "running": 0, "failed": 0, "oldest_pending_s": 0.0}),
+                **spec.counters,
+                "workers": spec.workers,
+                "avg_wait_ms": round(sum(waits) / len(waits), 1) if waits else 0.0,
+                "max_wait_ms": round(max(waits), 1) if waits else 0.0,
+                "avg_run_ms": round(sum(runs) / len(runs), 1) if runs else 0.0,
+                "max_run_ms": round(max(runs), 1) if runs else 0.0,
+            }
+        return result
+
+
+queue = JobQueue(autostart=JOBS_AUTOSTART)
+
+
+def register(job_type: str, handler: Callable[[Dict], object], workers: int = 1, max_attempts: int = 3):
+    queue.register(job_type, handler, workers=workers, max_attempts=max_attempts)
+
+
+def enqueue(job_type: str, payload: Optional[Dict] = None, dedup_key: Optional[str] = None,
+            delay_seconds: float = 0) -> Optional[int]:
+    return queue.enqueue(job_type, payload, dedup_key=dedup_key, delay_seconds=delay_seconds)
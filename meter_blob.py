@@ -0,0 +1,108 @@
+"""
+Compact storage format for finalized months of OpenLEG meter readings.
+One payload per building and month covers the month's slot grid: values as
+delta-encoded int32 in units of 0.1 Wh (the DECIMAL(10, 4) kWh resolution of
+meter_readings, so compaction is lossless), bitmaps for present rows and NULL values, and the
+per-slot quality flags, compressed as one block (zlib, or zstd if installed).
+"""
+import os
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    import zstandard  # type: ignore
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+# consumption, production, feed_in
+BLOB_COLUMNS = 3
+# Version 1 stored whole Wh; version 2 stores 0.1 Wh. Both decode.
+FORMAT_VERSION = 2
+UNITS_PER_KWH = {1: 1000, 2: 10000}
+ZLIB_LEVEL = int(os.getenv('METER_BLOB_ZLIB_LEVEL', '6'))
+ZSTD_LEVEL = int(os.getenv('METER_BLOB_ZSTD_LEVEL', '9'))
+CODEC = os.getenv('METER_BLOB_CODEC', 'zstd' if HAS_ZSTD else 'zlib')
+# Values must stay below this many units (about 107 MWh per slot) so int32 deltas cannot overflow
+MAX_UNITS = 2 ** 30
+
+# present: bool (slots,); values: float64 (slots x 3) in kWh, NaN for NULL or absent; flags: uint8 (slots,)
+DecodedMonth = namedtuple('DecodedMonth', ['present', 'values', 'flags'])
+
+
+def compress(data: bytes, codec: str = CODEC) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if codec == 'zlib':
+        return zlib.compress(data, ZLIB_LEVEL)
+    raise ValueError(f"Unknown meter blob codec: {codec}")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown meter blob codec: {codec}")
+
+
+def grid_step(offsets: np.ndarray, default: int = 900) -> int:
+    """Largest step in seconds that every offset from the month start lies on.
+
+    Returns 0 when the readings are not on a whole-minute grid.
+    """
+    step = int(np.gcd.reduce(offsets.astype(np.int64))) if offsets.size else 0
+    if step == 0:
+        return default
+    return step if step % 60 == 0 else 0
+
+
+def encode(slots: int, index: np.ndarray, values: np.ndarray, flags: np.ndarray, codec: str = CODEC) -> bytes:
+    """Pack readings at slot positions index into one compressed payload.
+
+    values is (n, 3) kWh with NaN for NULL; flags is (n,) quality flags.
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(-1, BLOB_COLUMNS)
+    finite = np.isfinite(values)
+    units = np.zeros((BLOB_COLUMNS, slots), dtype=np.int64)
+    units[:, index] = np.rint(np.where(finite, values, 0.0) * UNITS_PER_KWH[FORMAT_VERSION]).T
+    if np.abs(units).max(initial=0) >= MAX_UNITS:
+        raise ValueError("Meter value out of range for int32 encoding")
+    nulls = np.zeros((BLOB_COLUMNS, slots), dtype=bool)
+    nulls[:, index] = ~finite.T
+    present = np.zeros(slots, dtype=bool)
+    present[index] = True
+    slot_flags = np.zeros(slots, dtype=np.uint8)
+    slot_flags[index] = flags
+
+    deltas = np.diff(units, axis=1, prepend=0).astype('<i4')
+    raw = b''.join((bytes([FORMAT_VERSION]), deltas.tobytes(), np.packbits(present).tobytes(),
+                    np.packbits(nulls.ravel()).tobytes(), slot_flags.tobytes()))
+    return compress(raw, codec)
+
+
+def decode(payload: bytes, slots: int, codec: str) -> DecodedMonth:
+    """Inverse of encode()."""
+    raw = decompress(bytes(payload), codec)
+    if not raw or raw[0] not in UNITS_PER_KWH:
+        raise ValueError("Unsupported meter blob format")
+    scale = UNITS_PER_KWH[raw[0]]
+    pos = 1
+    deltas = np.frombuffer(raw, dtype='<i4', count=BLOB_COLUMNS * slots, offset=pos).reshape(BLOB_COLUMNS, slots)
+    pos += deltas.nbytes
+    present_bytes = (slots + 7) // 8
+    present = np.unpackbits(np.frombuffer(raw, dtype=np.uint8, count=present_bytes, offset=pos),
+                            count=slots).astype(bool)
+    pos += present_bytes
+    null_bytes = (BLOB_COLUMNS * slots + 7) // 8
+    nulls = np.unpackbits(np.frombuffer(raw, dtype=np.uint8, count=null_bytes, offset=pos),
+                          count=BLOB_COLUMNS * slots).astype(bool).reshape(BLOB_COLUMNS, slots)
+    pos += null_bytes
+    flags = np.frombuffer(raw, dtype=np.uint8, count=slots, offset=pos)
+
+    values = np.cumsum(deltas, axis=1, dtype=np.int64).T / scale
+    values[nulls.T] = np.nan
+    values[~present] = np.nan
+    return DecodedMonth(present, values, flags)
@@ -1,14 +1,19 @@
 """
 Smart meter data ingestion for OpenLEG.
-Parses EKZ CSV exports, validates readings, stores in database.
+Parses EKZ/ewz/CKW/BKW CSV exports as a stream, validates readings, stores in database.
 """
 import csv
 import io
+import itertools
 import logging
-from datetime import datetime
-from typing import List, Tuple, Optional, Dict
+import os
+from datetime import datetime, timedelta
+from typing import List, Tuple, Optional, Dict, Iterator
 
 import database as db
+import jobs
+import meter_normalize
+import meter_quality
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +21,19 @@ logger = logging.getLogger(__name__)
 EKZ_EXPECTED_HEADERS = ['Zeitstempel', 'Verbrauch (kWh)', 'Produktion (kWh)', 'Einspeisung (kWh)']
 EKZ_ALT_HEADERS = ['Timestamp', 'Consumption (kWh)', 'Production (kWh)', 'Feed-in (kWh)']
 
+# Streaming parser: rows per yielded batch, rows sampled for format detection
+METER_CHUNK_SIZE = 5000
+TIMESTAMP_SAMPLE_ROWS = 20
+
+# Rollup refresh after ingest (one pending job at a time, coalesced)
+METER_ROLLUP_JOB = 'meter_rollups'
+
+# Uploads are resampled onto the 15-min grid and gap-filled before storage (meter_normalize)
+METER_NORMALIZE = os.getenv('METER_NORMALIZE', 'true').lower() in ('1', 'true', 'yes')
+
+# Nightly quality sweep (refresh_all_insights): days of readings checked per building
+QUALITY_SWEEP_DAYS = int(os.getenv('METER_QUALITY_SWEEP_DAYS', '35'))
+
 
 def parse_ekz_csv(file_content: str) -> Tuple[List[tuple], List[str]]:
     """Parse EKZ smart meter CSV export.
@@ -23,53 +41,124 @@ def parse_ekz_csv(file_content: str) -> Tuple[List[tuple], List[str]]:
     Returns:
         (readings, errors) where readings = [(timestamp, consumption, production, feed_in), ...]
     """
+    return _collect(iter_meter_csv(io.StringIO(file_content or '')))
+
+
+def iter_meter_csv(stream, chunk_size: int = METER_CHUNK_SIZE) -> Iterator[Tuple[List[tuple], List[str]]]:
+    """Stream-parse a Swiss utility meter CSV from a file-like object.
+
+    Delimiter, column layout and timestamp/decimal format are detected once
+    from the header and the first rows; the rest of the file is parsed with
+    those compiled parsers and yielded in batches of up to chunk_size readings.
+
+    Yields:
+        (readings, errors) per chunk, readings = [(timestamp, consumption, production, feed_in), ...]
+    """
+    if isinstance(stream, str):
+        stream = io.StringIO(stream)
+    elif isinstance(stream, (bytes, bytearray)):
+        stream = io.StringIO(stream.decode('utf-8-sig', errors='replace'))
+    elif isinstance(stream, io.BufferedIOBase) or 'b' in getattr(stream, 'mode', ''):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace')
+
+    header_line = stream.readline().lstrip('\ufeff')
+    delimiter, layout = _detect_layout(header_line)
+    if layout is None:
+        yield [], ["Keine Messdaten in der Datei gefunden. Bitte EKZ-CSV-Export verwenden."]
+        return
+
+    reader = csv.reader(stream, delimiter=delimiter)
+    sample = list(itertools.islice(reader, TIMESTAMP_SAMPLE_ROWS))
+    rows = itertools.chain(sample, reader)
+    sample = [r for r in sample if r and not all(c.strip() == '' for c in r)]
+
+    ts_samples = []
+    for r in sample:
+        try:
+            ts_samples.append(_timestamp_text(r, layout))
+        except IndexError:
+            continue
+
+    parse_ts = _compile_timestamp_parser(ts_samples)
+    parse_value = _compile_decimal_parser([r[i] for r in sample for i in layout['values'].values() if i < len(r)])
+    col_consumption = layout['values'].get('consumption')
+    col_production = layout['values'].get('production')
+    col_feed_in = layout['values'].get('feed_in')
+
     readings = []
     errors = []
-
-    # Try semicolon first (EKZ standard), then comma
-    for delimiter in [';', ',', '\t']:
+    for i, row in enumerate(rows, start=2):
+        if not row or all(c.strip() == '' for c in row):
+            continue
         try:
-            reader = csv.reader(io.StringIO(file_content), delimiter=delimiter)
-            header = next(reader, None)
-            if not header or len(header) < 2:
+            raw_ts = _timestamp_text(row, layout)
+            ts = parse_ts(raw_ts)
+            if not ts:
+                errors.append(f"Zeile {i}: Ungültiger Zeitstempel '{raw_ts}'")
                 continue
 
-            # Normalize headers
-            header_clean = [h.strip().lower() for h in header]
+            consumption = parse_value(row[col_consumption]) if col_consumption is not None else 0.0
+            production = parse_value(row[col_production]) if col_production is not None else 0.0
+            feed_in = parse_value(row[col_feed_in]) if col_feed_in is not None else 0.0
 
-            # Detect column mapping
-            col_map = _detect_columns(header_clean)
-            if not col_map:
-                continue
+            readings.append((ts, consumption, production, feed_in))
+        except (IndexError, ValueError) as e:
+            errors.append(f"Zeile {i}: {str(e)}")
+
+        if len(readings) >= chunk_size:
+            yield readings, errors
+            readings, errors = [], []
+
+    if readings or errors:
+        yield readings, errors
 
-            for i, row in enumerate(reader, start=2):
-                if not row or all(c.strip() == '' for c in row):
-                    continue
-                try:
-                    ts = _parse_timestamp(row[col_map['timestamp']].strip())
-                    if not ts:
-                        errors.append(f"Zeile {i}: Ungültiger Zeitstempel '{row[col_map['timestamp']]}'")
-                        continue
-
-                    consumption = _parse_decimal(row[col_map.get('consumption', -1)]) if 'consumption' in col_map else 0
-                    production = _parse_decimal(row[col_map.get('production', -1)]) if 'production' in col_map else 0
-                    feed_in = _parse_decimal(row[col_map.get('feed_in', -1)]) if 'feed_in' in col_map else 0
-
-                    readings.append((ts, consumption, production, feed_in))
-                except (IndexError, ValueError) as e:
-                    errors.append(f"Zeile {i}: {str(e)}")
-
-            if readings:
-                break  # Found working delimiter
-        except Exception as e:
-            errors.append(f"Parse-Fehler mit Delimiter '{delimiter}': {str(e)}")
 
+def _collect(chunks) -> Tuple[List[tuple], List[str]]:
+    """Concatenate streamed chunks into the (readings, errors) contract."""
+    readings = []
+    errors = []
+    for chunk_readings, chunk_errors in chunks:
+        readings.extend(chunk_readings)
+        errors.extend(chunk_errors)
     if not readings and not errors:
         errors.append("Keine Messdaten in der Datei gefunden. Bitte EKZ-CSV-Export verwenden.")
-
     return readings, errors
 
 
+def _detect_layout(header_line: str) -> Tuple[str, Optional[Dict]]:
+    """Pick delimiter and column layout from the header line.
+
+    Layout: {'timestamp': idx} or {'date': idx, 'time': idx} (CKW), plus
+    'values' mapping consumption/production/feed_in to column indexes.
+    """
+    for delimiter in [';', ',', '\t']:
+        header = next(csv.reader([header_line], delimiter=delimiter), None)
+        if not header or len(header) < 2:
+            continue
+        header_clean = [h.strip().lower() for h in header]
+
+        date_col = next((i for i, h in enumerate(header_clean) if 'datum' in h or h == 'date'), None)
+        time_col = next((i for i, h in enumerate(header_clean) if h in ('zeit', 'time')), None)
+        col_map = _detect_columns(header_clean)
+        if not col_map:
+            continue
+
+        values = {k: v for k, v in col_map.items() if k != 'timestamp'}
+        if date_col is not None and time_col is not None and date_col != time_col:
+            return delimiter, {'date': date_col, 'time': time_col, 'values': values}
+        return delimiter, {'timestamp': col_map['timestamp'], 'values': values}
+    return ';', None
+
+
+def _timestamp_text(row: List[str], layout: Dict) -> str:
+    if 'timestamp' in layout:
+        return row[layout['timestamp']].strip()
+    if layout['date'] >= len(row):
+        raise IndexError("list index out of range")
+    time_str = row[layout['time']].strip() if layout['time'] < len(row) else "00:00"
+    return f"{row[layout['date']].strip()} {time_str}"
+
+
 def _detect_columns(header: List[str]) -> Optional[Dict[str, int]]:
     """Map header columns to our schema."""
     col_map = {}
@@ -82,7 +171,7 @@ def _detect_columns(header: List[str]) -> Optional[Dict[str, int]]:
             col_map['consumption'] = i
         elif any(kw in h_lower for kw in ['produktion', 'production', 'erzeugung']):
             col_map['production'] = i
-        elif any(kw in h_lower for kw in ['einspeisung', 'feed-in', 'feed_in', 'rücklieferung']):
+        elif any(kw in h_lower for kw in ['einspeisung', 'feed-in', 'feed_in', 'rücklieferung', 'ruecklieferung']):
             col_map['feed_in'] = i
 
     if 'timestamp' not in col_map:
@@ -93,18 +182,32 @@ def _detect_columns(header: List[str]) -> Optional[Dict[str, int]]:
     return col_map
 
 
+TIMESTAMP_FORMATS = [
+    '%d.%m.%Y %H:%M',      # 01.01.2026 00:15
+    '%d.%m.%Y %H:%M:%S',   # 01.01.2026 00:15:00
+    '%Y-%m-%d %H:%M',      # 2026-01-01 00:15
+    '%Y-%m-%d %H:%M:%S',   # 2026-01-01 00:15:00
+    '%Y-%m-%dT%H:%M:%S',   # ISO format
+    '%Y-%m-%dT%H:%M',      # ISO without seconds
+    '%d/%m/%Y %H:%M',      # DD/MM/YYYY
+]
+
+# Fixed-width layouts sliced directly instead of going through strptime:
+# format -> (length, (year, month, day, hour, minute[, second]) slices)
+_TIMESTAMP_SLICES = {
+    '%d.%m.%Y %H:%M': (16, (slice(6, 10), slice(3, 5), slice(0, 2), slice(11, 13), slice(14, 16))),
+    '%d.%m.%Y %H:%M:%S': (19, (slice(6, 10), slice(3, 5), slice(0, 2), slice(11, 13), slice(14, 16), slice(17, 19))),
+    '%Y-%m-%d %H:%M': (16, (slice(0, 4), slice(5, 7), slice(8, 10), slice(11, 13), slice(14, 16))),
+    '%Y-%m-%d %H:%M:%S': (19, (slice(0, 4), slice(5, 7), slice(8, 10), slice(11, 13), slice(14, 16), slice(17, 19))),
+    '%Y-%m-%dT%H:%M:%S': (19, (slice(0, 4), slice(5, 7), slice(8, 10), slice(11, 13), slice(14, 16), slice(17, 19))),
+    '%Y-%m-%dT%H:%M': (16, (slice(0, 4), slice(5, 7), slice(8, 10), slice(11, 13), slice(14, 16))),
+    '%d/%m/%Y %H:%M': (16, (slice(6, 10), slice(3, 5), slice(0, 2), slice(11, 13), slice(14, 16))),
+}
+
+
 def _parse_timestamp(value: str) -> Optional[datetime]:
     """Parse various timestamp formats from Swiss utility CSVs."""
-    formats = [
-        '%d.%m.%Y %H:%M',      # 01.01.2026 00:15
-        '%d.%m.%Y %H:%M:%S',   # 01.01.2026 00:15:00
-        '%Y-%m-%d %H:%M',      # 2026-01-01 00:15
-        '%Y-%m-%d %H:%M:%S',   # 2026-01-01 00:15:00
-        '%Y-%m-%dT%H:%M:%S',   # ISO format
-        '%Y-%m-%dT%H:%M',      # ISO without seconds
-        '%d/%m/%Y %H:%M',      # DD/MM/YYYY
-    ]
-    for fmt in formats:
+    for fmt in TIMESTAMP_FORMATS:
         try:
             return datetime.strptime(value, fmt)
         except ValueError:
@@ -112,6 +215,52 @@ def _parse_timestamp(value: str) -> Optional[datetime]:
     return None
 
 
+def _compile_timestamp_parser(samples: List[str]):
+    """Return a single-format timestamp parser chosen from sample values.
+
+    Picks the known format matching most samples (first one wins on ties);
+    values that do not match it fall back to the multi-format _parse_timestamp.
+    """
+    best_fmt, best_hits = None, 0
+    for f in TIMESTAMP_FORMATS:
+        hits = sum(1 for s in samples if _matches(s, f))
+        if hits > best_hits:
+            best_fmt, best_hits = f, hits
+    if best_fmt is None:
+        return _parse_timestamp
+
+    fmt = best_fmt
+    length, parts = _TIMESTAMP_SLICES[fmt]
+    first = next(s for s in samples if _matches(s, fmt))
+    template = datetime.strptime(first, fmt).strftime(fmt)
+    sep_chars = [(i, template[i]) for i in _separator_positions(template)]
+
+    def parse(value: str) -> Optional[datetime]:
+        if len(value) == length and all(value[i] == ch for i, ch in sep_chars):
+            try:
+                return datetime(*(int(value[s]) for s in parts))
+            except ValueError:
+                pass
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            return _parse_timestamp(value)
+
+    return parse
+
+
+def _separator_positions(text: str) -> List[int]:
+    return [i for i, ch in enumerate(text) if not ch.isdigit()]
+
+
+def _matches(value: str, fmt: str) -> bool:
+    try:
+        datetime.strptime(value, fmt)
+        return True
+    except ValueError:
+        return False
+
+
 def _parse_decimal(value: str) -> float:
     """Parse European decimal format (comma as decimal separator)."""
     if not value or value.strip() == '' or value.strip() == '-':
@@ -126,6 +275,25 @@ def _parse_decimal(value: str) -> float:
     return float(cleaned)
 
 
+def _compile_decimal_parser(samples: List[str]):
+    """Return a float parser for the decimal style seen in sample values."""
+    comma_decimal = any(',' in s and '.' not in s for s in samples)
+
+    if comma_decimal:
+        def parse(value: str) -> float:
+            try:
+                return float(value.replace(',', '.'))
+            except ValueError:
+                return _parse_decimal(value)
+    else:
+        def parse(value: str) -> float:
+            try:
+                return float(value)
+            except ValueError:
+                return _parse_decimal(value)
+    return parse
+
+
 def detect_format(file_content: str) -> str:
     """Auto-detect CSV format from header line.
 
@@ -144,46 +312,6 @@ def detect_format(file_content: str) -> str:
     return "generic"
 
 
-def _parse_ckw_csv(file_content: str) -> Tuple[List[tuple], List[str]]:
-    """Parse CKW format with separate Datum and Zeit columns."""
-    readings = []
-    errors = []
-    try:
-        reader = csv.reader(io.StringIO(file_content), delimiter=';')
-        header = next(reader, None)
-        if not header:
-            return [], ["Leere Datei"]
-
-        header_clean = [h.strip().lower() for h in header]
-        date_col = next((i for i, h in enumerate(header_clean) if 'datum' in h), None)
-        time_col = next((i for i, h in enumerate(header_clean) if h == 'zeit'), None)
-        bezug_col = next((i for i, h in enumerate(header_clean) if 'bezug' in h), None)
-        rueck_col = next((i for i, h in enumerate(header_clean) if 'rücklieferung' in h or 'ruecklieferung' in h or 'einspeisung' in h), None)
-
-        if date_col is None or bezug_col is None:
-            return [], ["CKW-Format: Datum oder Bezug Spalte fehlt"]
-
-        for i, row in enumerate(reader, start=2):
-            if not row or all(c.strip() == '' for c in row):
-                continue
-            try:
-                date_str = row[date_col].strip()
-                time_str = row[time_col].strip() if time_col is not None else "00:00"
-                ts = _parse_timestamp(f"{date_str} {time_str}")
-                if not ts:
-                    errors.append(f"Zeile {i}: Ungültiger Zeitstempel")
-                    continue
-                consumption = _parse_decimal(row[bezug_col])
-                feed_in = _parse_decimal(row[rueck_col]) if rueck_col is not None else 0.0
-                readings.append((ts, consumption, 0.0, feed_in))
-            except (IndexError, ValueError) as e:
-                errors.append(f"Zeile {i}: {str(e)}")
-    except Exception as e:
-        errors.append(f"CKW Parse-Fehler: {str(e)}")
-
-    return readings, errors
-
-
 def parse_meter_csv(file_content: str) -> Tuple[List[tuple], List[str]]:
     """Auto-detect format and parse any Swiss utility CSV.
 
@@ -192,47 +320,83 @@ def parse_meter_csv(file_content: str) -> Tuple[List[tuple], List[str]]:
     if not file_content or not file_content.strip():
         return [], ["Leere Datei"]
 
-    fmt = detect_format(file_content)
+    # ekz, ewz, ckw, bkw and generic exports share the streaming parser;
+    # the layout (incl. CKW's separate Datum/Zeit columns) comes from the header.
+    return _collect(iter_meter_csv(io.StringIO(file_content)))
 
-    if fmt == "ckw":
-        return _parse_ckw_csv(file_content)
-    else:
-        # ekz, ewz, bkw, generic all handled by the generic parser
-        return parse_ekz_csv(file_content)
+
+def _save_normalized(building_id: str, series, source: str) -> int:
+    """Store a normalized series in chunks of METER_CHUNK_SIZE; returns the stored count."""
+    rows = meter_normalize.to_readings(series)
+    stored = 0
+    for i in range(0, len(rows), METER_CHUNK_SIZE):
+        stored += db.save_meter_readings(building_id, rows[i:i + METER_CHUNK_SIZE], source=source)
+    return stored
 
 
-def ingest_csv(building_id: str, file_content: str, source: str = 'csv') -> Dict:
+def ingest_csv(building_id: str, file_content, source: str = 'csv', normalize: Optional[bool] = None) -> Dict:
     """Parse and store meter readings from CSV upload.
 
+    file_content may be a string or a file-like object; readings are parsed
+    chunk by chunk. With normalize (default METER_NORMALIZE) the chunks go
+    through a meter_normalize.StreamNormalizer, which puts them onto the
+    15-min grid with gaps filled window by window, and each finished window
+    is stored right away; otherwise each parsed chunk is stored as is. The
+    quality report always describes the raw upload.
+
     Returns:
-        {"success": bool, "readings_count": int, "errors": [...], "stats": {...}}
+        {"success": bool, "readings_count": int, "estimated_count": int,
+         "errors": [...], "stats": {...}, "quality": {...}}
     """
-    readings, errors = parse_ekz_csv(file_content)
+    normalize = METER_NORMALIZE if normalize is None else normalize
+    stream = io.StringIO(file_content or '') if isinstance(file_content, str) else file_content
 
-    if not readings:
+    stored = 0
+    parsed = 0
+    errors = []
+    quality = meter_quality.QualityAccumulator()
+    normalizer = meter_normalize.StreamNormalizer() if normalize else None
+    for readings, chunk_errors in iter_meter_csv(stream):
+        errors.extend(chunk_errors)
+        if readings:
+            parsed += len(readings)
+            quality.add(readings)
+            if normalizer:
+                stored += _save_normalized(building_id, normalizer.add(readings), source)
+            else:
+                stored += db.save_meter_readings(building_id, readings, source=source)
+
+    estimated = 0
+    if normalizer:
+        for series in normalizer.finish():
+            stored += _save_normalized(building_id, series, source)
+        estimated = normalizer.estimated
+
+    if not parsed:
         return {
             "success": False,
             "readings_count": 0,
             "errors": errors or ["Keine gültigen Messdaten gefunden."]
         }
 
-    # Store in database
-    stored = db.save_meter_readings(building_id, readings, source=source)
-
     # Get updated stats
     stats = db.get_meter_reading_stats(building_id)
 
     result = {
         "success": stored > 0,
         "readings_count": stored,
+        "estimated_count": estimated,
         "errors": errors,
-        "stats": stats
+        "stats": stats,
+        "quality": quality.report(),
     }
 
     if stored > 0:
         logger.info(f"[METER] Ingested {stored} readings for building {building_id}")
+        jobs.enqueue(METER_ROLLUP_JOB, dedup_key='all')
         db.track_event('meter_data_uploaded', building_id, {
             'readings_count': stored,
+            'estimated_count': estimated,
             'source': source,
             'error_count': len(errors)
         })
@@ -240,34 +404,69 @@ def ingest_csv(building_id: str, file_content: str, source: str = 'csv') -> Dict
     return result
 
 
+def _run_rollup_job(payload: Dict):
+    if db.refresh_meter_rollups().get("more"):
+        jobs.enqueue(METER_ROLLUP_JOB, dedup_key='all')
+
+
+jobs.register(METER_ROLLUP_JOB, _run_rollup_job)
+
+
 def validate_readings_quality(readings: List[tuple]) -> Dict:
-    """Check data quality: gaps, duplicates, outliers."""
-    if not readings:
-        return {"quality": "no_data", "issues": []}
+    """Check data quality: gaps, duplicates, DST, flat-lines, negatives, outliers.
 
-    issues = []
-    timestamps = sorted([r[0] for r in readings])
+    See meter_quality.analyze for the report layout.
+    """
+    return meter_quality.analyze_readings(readings)
 
-    # Check for gaps (expect 15-min intervals)
-    gap_count = 0
-    for i in range(1, len(timestamps)):
-        diff = (timestamps[i] - timestamps[i-1]).total_seconds()
-        if diff > 1800:  # > 30 min gap
-            gap_count += 1
 
-    if gap_count > 0:
-        issues.append(f"{gap_count} Datenlücken erkannt (> 30 Min.)")
+def sweep_meter_quality(days: int = QUALITY_SWEEP_DAYS) -> Dict:
+    """Run the quality checks over the last days of every building with readings.
 
-    # Check for negative values
-    neg_count = sum(1 for r in readings if r[1] < 0 or r[2] < 0 or r[3] < 0)
-    if neg_count > 0:
-        issues.append(f"{neg_count} negative Messwerte")
+    Returns:
+        {"buildings": {building_id: {quality, completeness, issues}}, "checked": int,
+         "by_quality": {quality: count}, "period_start", "period_end", "computed_at"},
+        or with "error" set when the meter data could not be read.
+    """
+    import numpy as np
 
-    quality = "good" if not issues else ("fair" if len(issues) <= 2 else "poor")
+    end = datetime.now().replace(minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    building_ids = db.get_meter_building_ids(since=start)
 
+    buildings = {}
+    for offset in range(0, len(building_ids), db.METER_MATRIX_CHUNK):
+        try:
+            matrix = db.load_meter_matrix(building_ids[offset:offset + db.METER_MATRIX_CHUNK], start, end)
+        except Exception as e:
+            # A partial sweep would report the unread buildings as having no data
+            logger.error(f"[METER] Quality sweep aborted: {e}")
+            return {"buildings": {}, "checked": 0, "by_quality": {}, "error": str(e)}
+        epochs = matrix.index.astype('datetime64[s]').astype(np.int64)
+        for j, building_id in enumerate(matrix.building_ids):
+            # Gap-filled readings are estimates, not measurements: they count as missing here
+            present = ~(matrix.missing[:, j] | matrix.estimated[:, j])
+            if not present.any():
+                continue
+            report = meter_quality.analyze(
+                epochs[present],
+                np.column_stack([matrix.consumption[present, j], matrix.production[present, j]]),
+                interval_seconds=db.METER_INTERVAL_MINUTES * 60)
+            buildings[building_id] = {
+                "quality": report["quality"],
+                "completeness": report["completeness"],
+                "issues": report["issues"],
+            }
+
+    by_quality = {}
+    for summary in buildings.values():
+        by_quality[summary["quality"]] = by_quality.get(summary["quality"], 0) + 1
+    logger.info(f"[METER] Quality sweep: {len(buildings)} buildings, {by_quality}")
     return {
-        "quality": quality,
-        "total_readings": len(readings),
-        "date_range": f"{timestamps[0]} bis {timestamps[-1]}",
-        "issues": issues
+        "buildings": buildings,
+        "checked": len(buildings),
+        "by_quality": by_quality,
+        "period_start": start.isoformat(),
+        "period_end": end.isoformat(),
+        "computed_at": datetime.now().isoformat(),
     }
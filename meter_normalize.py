@@ -0,0 +1,285 @@
+"""
+Normalization of OpenLEG smart meter series onto a fixed 15-minute grid.
+Each reading's energy is spread over its interval, so 5-minute and hourly
+exports resample exactly; short gaps are interpolated, longer ones up to
+PROFILE_MAX_SLOTS estimated from the building's own weekday/time-of-day
+profile, and every slot that is not a plain measurement is flagged. Gaps
+beyond that stay gaps.
+"""
+import os
+from collections import namedtuple
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+import meter_quality
+
+GRID_SECONDS = 900
+# Gaps up to this many grid slots are interpolated linearly, longer ones profile-filled
+INTERPOLATE_MAX_SLOTS = int(os.getenv('METER_INTERPOLATE_MAX_SLOTS', '4'))
+# Longer gaps up to this many slots (default one day) are profile-filled; longer ones are left missing
+PROFILE_MAX_SLOTS = int(os.getenv('METER_PROFILE_MAX_SLOTS', '96'))
+# Readings per normalization window of a streamed upload (StreamNormalizer)
+STREAM_WINDOW = int(os.getenv('METER_NORMALIZE_WINDOW', '20000'))
+
+# Per-slot quality flags (stored as meter_readings.quality_flag). RESAMPLED is measured
+# energy redistributed onto the grid; INTERPOLATED and PROFILE are estimates of gaps.
+FLAG_MEASURED = 0
+FLAG_RESAMPLED = 1
+FLAG_INTERPOLATED = 2
+FLAG_PROFILE = 3
+
+# index: datetime64[m] slot starts; values: float64 (slots x columns, meter_quality.COLUMNS order),
+# NaN where a gap was too long to fill; flags: uint8 per value; source_interval: input interval in seconds
+NormalizedSeries = namedtuple('NormalizedSeries', ['index', 'values', 'flags', 'source_interval'])
+
+
+def normalize_readings(readings: Sequence[tuple], interval_seconds: Optional[int] = None,
+                       grid_seconds: int = GRID_SECONDS) -> NormalizedSeries:
+    """normalize() for parser tuples (timestamp, consumption, production, feed_in)."""
+    timestamps, values = meter_quality.readings_to_arrays(readings)
+    return normalize(timestamps, values, interval_seconds=interval_seconds, grid_seconds=grid_seconds)
+
+
+def normalize(timestamps, values, interval_seconds: Optional[int] = None,
+              grid_seconds: int = GRID_SECONDS) -> NormalizedSeries:
+    """Resample a meter series onto a dense grid and fill its gaps.
+
+    Args:
+        timestamps: interval starts as epoch seconds (int64) or datetime64, any order
+        values: (n, k) energy per reading (kWh), NaN = not measured
+        interval_seconds: input interval, inferred from the median step if omitted
+        grid_seconds: output slot length
+
+    Every slot holds the energy of its full interval: partly covered slots
+    are scaled up and flagged FLAG_RESAMPLED, empty ones filled by
+    _fill_gaps where the gap is short enough. Slots with no value left at
+    all are dropped, so long gaps remain gaps in storage. Duplicate
+    timestamps keep the last reading, except in the repeated local 02:00
+    hour of the autumn DST switch, where both readings are real energy and
+    are summed. Slots of the skipped spring hour are left out.
+    """
+    ts = np.asarray(timestamps)
+    ts = ts.astype('datetime64[s]').astype(np.int64) if ts.dtype.kind == 'M' else ts.astype(np.int64)
+    n = ts.size
+    vals = np.asarray(values, dtype=np.float64).reshape(n, -1)
+    if not n:
+        return _empty(vals.shape[1])
+
+    order = np.argsort(ts, kind='stable')
+    ts, vals = ts[order], vals[order]
+    first, last = meter_quality.year_of(ts[0]), meter_quality.year_of(ts[-1])
+    spring, autumn = meter_quality.dst_transitions(first, last)
+    ts, vals = _collapse_duplicates(ts, vals, autumn)
+
+    source = int(interval_seconds or meter_quality.infer_interval(np.diff(ts)))
+    # A reading covers [ts, ts + source), cut short where the next reading starts earlier
+    ends = np.minimum(ts + source, np.r_[ts[1:], ts[-1] + source])
+    edges = np.arange(ts[0] // grid_seconds * grid_seconds,
+                      -(-ends[-1] // grid_seconds) * grid_seconds + grid_seconds, grid_seconds)
+    slots = edges.size - 1
+    knots = np.column_stack([ts, ends]).ravel()
+    exact = source <= grid_seconds and grid_seconds % source == 0 and not np.any(ts % source)
+
+    out = np.zeros((slots, vals.shape[1]), dtype=np.float64)
+    flags = np.zeros((slots, vals.shape[1]), dtype=np.uint8)
+    coverage = np.zeros((slots, vals.shape[1]), dtype=np.float64)
+    for c in range(vals.shape[1]):
+        measured = np.isfinite(vals[:, c])
+        energy = np.where(measured, vals[:, c], 0.0)
+        seconds = np.where(measured, ends - ts, 0)
+        slot_energy = np.diff(_cumulative_at(edges, knots, energy))
+        cover = np.diff(_cumulative_at(edges, knots, seconds)) / grid_seconds
+        coverage[:, c] = cover
+
+        full = cover > 1 - 1e-9
+        partial = (cover > 1e-9) & ~full
+        out[:, c] = np.where(partial, slot_energy / np.where(partial, cover, 1.0), slot_energy)
+        flags[:, c] = np.where(full & exact, FLAG_MEASURED, FLAG_RESAMPLED)
+        _fill_gaps(edges[:-1], out[:, c], flags[:, c], cover <= 1e-9, grid_seconds)
+
+    # The skipped spring hour does not exist in local time; drop it unless it was measured
+    keep = ~(meter_quality.in_hours(edges[:-1], spring) & (coverage.max(axis=1) <= 1e-9)) \
+        if spring.size else np.ones(slots, dtype=bool)
+    keep &= np.isfinite(out).any(axis=1)
+    index = edges[:-1][keep].astype('datetime64[s]').astype('datetime64[m]')
+    return NormalizedSeries(index, out[keep], flags[keep], source)
+
+
+class StreamNormalizer:
+    """normalize() over a streamed, time-ordered upload in bounded windows.
+
+    Readings are normalized every `window` readings. Slots within the
+    context span (the longest fillable gap plus one reading) of the newest
+    reading are held back, and so are the readings they depend on; the
+    next window normalizes them again together with its own readings. Every
+    gap is therefore filled as if the whole upload had been normalized at
+    once, except that profiles come from the window's own readings.
+    Readings older than what was already emitted (out-of-order input) are
+    normalized on their own in finish().
+    """
+
+    def __init__(self, interval_seconds: Optional[int] = None, grid_seconds: int = GRID_SECONDS,
+                 window: Optional[int] = None):
+        self.interval_seconds = interval_seconds
+        self.grid_seconds = grid_seconds
+        self.window = window or STREAM_WINDOW
+        self.estimated = 0
+        self._timestamps: List[np.ndarray] = []
+        self._values: List[np.ndarray] = []
+        self._pending = 0
+        self._late = meter_quality.QualityAccumulator()
+        self._emitted: Optional[int] = None  # slots before this epoch are final
+
+    def _context_seconds(self) -> int:
+        slots = max(PROFILE_MAX_SLOTS, INTERPOLATE_MAX_SLOTS) + 1
+        return slots * self.grid_seconds + int(self.interval_seconds or self.grid_seconds)
+
+    def add(self, readings: Sequence[tuple]) -> NormalizedSeries:
+        """Add parser tuples; returns the slots that became final (often none)."""
+        timestamps, values = meter_quality.readings_to_arrays(readings)
+        if self._emitted is not None:
+            late = timestamps < self._emitted
+            if late.any():
+                self._late.add([r for r, old in zip(readings, late.tolist()) if old])
+                timestamps, values = timestamps[~late], values[~late]
+        if timestamps.size:
+            self._timestamps.append(timestamps)
+            self._values.append(values)
+            self._pending += timestamps.size
+        if self._pending < self.window:
+            return _empty(len(meter_quality.COLUMNS))
+        return self._flush(final=False)
+
+    def finish(self) -> List[NormalizedSeries]:
+        """The remaining slots, and the separately normalized out-of-order readings."""
+        result = [self._flush(final=True)] if self._pending else []
+        timestamps, values = self._late.arrays()
+        if timestamps.size:
+            late = normalize(timestamps, values, self.interval_seconds, self.grid_seconds)
+            self.estimated += estimated_count(late)
+            result.append(late)
+        return result
+
+    def _flush(self, final: bool) -> NormalizedSeries:
+        timestamps, values = np.concatenate(self._timestamps), np.concatenate(self._values)
+        series = normalize(timestamps, values, self.interval_seconds, self.grid_seconds)
+        self.interval_seconds = self.interval_seconds or series.source_interval
+        epochs = series.index.astype('datetime64[s]').astype(np.int64)
+        keep = np.ones(epochs.size, dtype=bool) if self._emitted is None else epochs >= self._emitted
+        if not final:
+            context = self._context_seconds()
+            cutoff = (int(timestamps.max()) - context) // self.grid_seconds * self.grid_seconds
+            if self._emitted is not None and cutoff <= self._emitted:
+                return _empty(values.shape[1])  # not enough new span yet; wait for more readings
+            keep &= epochs < cutoff
+            carry = timestamps >= cutoff - context
+            self._timestamps, self._values = [timestamps[carry]], [values[carry]]
+            self._pending = int(carry.sum())
+            self._emitted = cutoff
+        else:
+            self._timestamps, self._values, self._pending = [], [], 0
+        out = NormalizedSeries(series.index[keep], series.values[keep], series.flags[keep], series.source_interval)
+        self.estimated += estimated_count(out)
+        return out
+
+
+def _empty(columns: int) -> NormalizedSeries:
+    return NormalizedSeries(np.empty(0, dtype='datetime64[m]'), np.empty((0, columns)),
+                            np.empty((0, columns), dtype=np.uint8), 0)
+
+
+def to_readings(series: NormalizedSeries) -> List[tuple]:
+    """Storage tuples (timestamp, consumption, production, feed_in, quality_flag).
+
+    The row flag is the strongest estimate among its values; unfilled values are None.
+    """
+    stamps = series.index.astype('datetime64[s]').astype(datetime).tolist()
+    values = np.round(series.values, 4)
+    columns = [[None if v != v else v for v in values[:, i].tolist()] if i < values.shape[1]
+               else [None] * len(stamps) for i in range(len(meter_quality.COLUMNS))]
+    row_flags = series.flags.max(axis=1).tolist() if series.flags.size else []
+    return list(zip(stamps, *columns, row_flags))
+
+
+def estimated_count(series: NormalizedSeries) -> int:
+    """Slots with at least one gap-filled value (resampling alone is not an estimate)."""
+    return int((series.flags >= FLAG_INTERPOLATED).any(axis=1).sum())
+
+
+def _collapse_duplicates(ts, vals, autumn):
+    start = np.r_[True, ts[1:] != ts[:-1]]
+    if start.all():
+        return ts, vals
+    last = np.r_[start[1:], True]
+    group = np.cumsum(start) - 1
+    uniq = ts[start]
+    out = vals[last].copy()
+    repeated = meter_quality.in_hours(uniq, autumn) & (np.bincount(group) > 1)
+    if repeated.any():
+        sums = np.zeros_like(out)
+        np.add.at(sums, group, np.nan_to_num(vals))
+        out[repeated] = sums[repeated]
+    return uniq, out
+
+
+def _cumulative_at(edges, knots, amounts):
+    """Cumulative amount at each edge, spreading each amount evenly over its reading."""
+    total = np.cumsum(amounts, dtype=np.float64)
+    levels = np.column_stack([total - amounts, total]).ravel()
+    return np.interp(edges, knots, levels)
+
+
+def _fill_gaps(starts, values, flags, missing, grid_seconds):
+    """Interpolate short gaps and profile-fill longer ones up to PROFILE_MAX_SLOTS, in place.
+
+    Gaps beyond that, and columns without any measurement, are set to NaN.
+    """
+    if not missing.any():
+        return
+    valid = ~missing
+    if not valid.any():
+        values[:] = np.nan
+        flags[:] = FLAG_MEASURED  # nothing estimated: the value is NULL
+        return
+
+    edges = np.diff(np.r_[0, missing.astype(np.int8), 0])
+    run_start = np.flatnonzero(edges == 1)
+    run_end = np.flatnonzero(edges == -1)  # exclusive
+    inner = (run_start > 0) & (run_end < missing.size)
+    length = run_end - run_start
+    short = inner & (length <= INTERPOLATE_MAX_SLOTS)
+    run_id = np.maximum(np.cumsum(edges[:-1] == 1) - 1, 0)
+    interpolate = missing & short[run_id]
+    fillable = missing & (length <= max(PROFILE_MAX_SLOTS, INTERPOLATE_MAX_SLOTS))[run_id]
+
+    positions = np.arange(values.size)
+    values[interpolate] = np.interp(positions[interpolate], positions[valid], values[valid])
+    flags[interpolate] = FLAG_INTERPOLATED
+
+    profile = fillable & ~interpolate
+    if profile.any():
+        values[profile] = _profile(starts, values, valid, grid_seconds)[profile]
+        flags[profile] = FLAG_PROFILE
+    values[missing & ~fillable] = np.nan
+    flags[missing & ~fillable] = FLAG_MEASURED
+
+
+def _profile(starts, values, valid, grid_seconds):
+    """Mean of the measured slots per weekday and time of day, with coarser fallbacks."""
+    per_day = 86400 // grid_seconds
+    time_of_day = (starts % 86400) // grid_seconds
+    weekday = (starts // 86400 + 3) % 7  # 1970-01-01 was a Thursday
+    key = weekday * per_day + time_of_day
+
+    def means(k, size):
+        sums = np.bincount(k[valid], weights=values[valid], minlength=size)
+        counts = np.bincount(k[valid], minlength=size)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return sums / counts
+
+    estimate = means(key, 7 * per_day)[key]
+    fallback = means(time_of_day, per_day)[time_of_day]
+    estimate = np.where(np.isfinite(estimate), estimate, fallback)
+    return np.where(np.isfinite(estimate), estimate, values[valid].mean())
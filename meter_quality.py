@@ -0,0 +1,299 @@
+"""
+Vectorized quality checks for OpenLEG smart meter series.
+Works on int64 epoch seconds (wall-clock time as exported by the utilities)
+and float64 value columns; every check is one NumPy pass over the sorted series.
+"""
+import os
+import calendar
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Default metering interval; the actual one is inferred from the data
+INTERVAL_SECONDS = 900
+# Consecutive identical consumption readings reported as a flat-line (16 x 15 min = 4 h)
+FLATLINE_MIN_READINGS = int(os.getenv('METER_FLATLINE_MIN_READINGS', '16'))
+# Outliers must exceed both the z-score and the IQR fence; short series are skipped
+ZSCORE_THRESHOLD = float(os.getenv('METER_ZSCORE_THRESHOLD', '4.0'))
+IQR_FACTOR = float(os.getenv('METER_IQR_FACTOR', '3.0'))
+OUTLIER_MIN_READINGS = 96
+# Ranges listed per check in the report (counts always cover everything)
+MAX_RANGES = 50
+
+COLUMNS = ('consumption', 'production', 'feed_in')
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+def readings_to_arrays(readings: Sequence[tuple]) -> Tuple[np.ndarray, np.ndarray]:
+    """Convert parser tuples (timestamp, consumption, production, feed_in) to arrays.
+
+    Returns (epoch seconds int64, values float64 of shape (n, 3)); None becomes NaN.
+    """
+    n = len(readings)
+    if not n:
+        return np.empty(0, dtype=np.int64), np.empty((0, len(COLUMNS)), dtype=np.float64)
+    columns = list(zip(*readings))
+    timestamps = np.fromiter(((t - _EPOCH) // _SECOND for t in columns[0]), dtype=np.int64, count=n)
+    values = np.empty((n, len(COLUMNS)), dtype=np.float64)
+    for i in range(len(COLUMNS)):
+        if i + 1 < len(columns):
+            values[:, i] = np.fromiter((np.nan if v is None else v for v in columns[i + 1]),
+                                       dtype=np.float64, count=n)
+        else:
+            values[:, i] = np.nan
+    return timestamps, values
+
+
+class QualityAccumulator:
+    """Collects streamed reading chunks and analyzes them once at the end."""
+
+    def __init__(self):
+        self._timestamps: List[np.ndarray] = []
+        self._values: List[np.ndarray] = []
+
+    def add(self, readings: Sequence[tuple]):
+        timestamps, values = readings_to_arrays(readings)
+        if timestamps.size:
+            self._timestamps.append(timestamps)
+            self._values.append(values)
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """All readings added so far as (epoch seconds, values), in arrival order."""
+        if not self._timestamps:
+            return np.empty(0, dtype=np.int64), np.empty((0, len(COLUMNS)), dtype=np.float64)
+        return np.concatenate(self._timestamps), np.concatenate(self._values)
+
+    def report(self, interval_seconds: Optional[int] = None) -> Dict:
+        timestamps, values = self.arrays()
+        return analyze(timestamps, values, interval_seconds=interval_seconds)
+
+
+def analyze_readings(readings: Sequence[tuple], interval_seconds: Optional[int] = None) -> Dict:
+    """Quality report for parser tuples, see analyze()."""
+    timestamps, values = readings_to_arrays(readings)
+    return analyze(timestamps, values, interval_seconds=interval_seconds)
+
+
+def analyze(timestamps, values=None, interval_seconds: Optional[int] = None) -> Dict:
+    """Check one meter series for gaps, duplicates, DST anomalies, flat-lines,
+    negative values and outliers.
+
+    Args:
+        timestamps: epoch seconds (int64) or datetime64 values, any order
+        values: (n, k) array with k <= 3 columns in COLUMNS order, NaN = empty
+        interval_seconds: metering interval, inferred from the median step if omitted
+
+    Returns:
+        Report dict with quality ('good'/'fair'/'poor'/'no_data'), total_readings,
+        date_range, issues (German, for the upload UI) and the structured sections
+        gaps, duplicates, dst, flatlines, negatives, outliers and months.
+    """
+    ts = np.asarray(timestamps)
+    ts = ts.astype('datetime64[s]').astype(np.int64) if ts.dtype.kind == 'M' else ts.astype(np.int64)
+    n = ts.size
+    if not n:
+        return {"quality": "no_data", "total_readings": 0, "issues": []}
+    if values is None:
+        vals = np.full((n, 1), np.nan)
+    else:
+        vals = np.asarray(values, dtype=np.float64).reshape(n, -1)
+    columns = COLUMNS[:vals.shape[1]]
+
+    order = np.argsort(ts, kind='stable')
+    ts, vals = ts[order], vals[order]
+    repeated = np.diff(ts) == 0
+    first = np.r_[True, ~repeated]
+    uniq, uvals = ts[first], vals[first]
+    steps = np.diff(uniq)
+    interval = int(interval_seconds or infer_interval(steps))
+    spring, autumn = dst_transitions(int(year_of(uniq[0])), int(year_of(uniq[-1])))
+
+    duplicates, dst_repeated = _duplicates(ts, vals, repeated, autumn)
+    gaps, dst, gap_starts, gap_ends, skipped = _gaps(uniq, steps, interval, spring)
+    dst["repeated_hour_readings"] = dst_repeated
+    flatlines = _flatlines(uniq, steps, uvals[:, 0], interval)
+    negatives = _negatives(vals, columns)
+    outliers = _outliers(uniq, uvals[:, 0])
+    months = _months(uniq, gap_starts, gap_ends, interval, skipped)
+
+    missing = gaps["missing_intervals"]
+    issues = []
+    if gaps["count"]:
+        issues.append(f"{gaps['count']} Datenlücken erkannt ({missing} fehlende Intervalle)")
+    if duplicates["count"]:
+        issues.append(f"{duplicates['count']} doppelte Zeitstempel"
+                      + (f", davon {duplicates['conflicting']} mit abweichenden Werten"
+                         if duplicates['conflicting'] else ""))
+    if negatives["count"]:
+        issues.append(f"{negatives['count']} negative Messwerte")
+    if flatlines["count"]:
+        issues.append(f"{flatlines['count']} konstante Abschnitte (Flat-Line, ≥ {FLATLINE_MIN_READINGS} Werte)")
+    if outliers["count"]:
+        issues.append(f"{outliers['count']} Ausreisser beim Verbrauch")
+
+    return {
+        "quality": "good" if not issues else ("fair" if len(issues) <= 2 else "poor"),
+        "total_readings": int(n),
+        "date_range": f"{_fmt(uniq[0])} bis {_fmt(uniq[-1])}",
+        "issues": issues,
+        "interval_seconds": interval,
+        "unique_readings": int(uniq.size),
+        "expected_readings": int(uniq.size + missing),
+        "completeness": round(uniq.size / (uniq.size + missing), 4),
+        "gaps": gaps,
+        "duplicates": duplicates,
+        "dst": dst,
+        "flatlines": flatlines,
+        "negatives": negatives,
+        "outliers": outliers,
+        "months": months,
+    }
+
+
+def infer_interval(steps: np.ndarray) -> int:
+    """Metering interval in seconds: the median positive step between readings."""
+    positive = steps[steps > 0]
+    return int(np.median(positive)) if positive.size else INTERVAL_SECONDS
+
+
+def year_of(epoch) -> int:
+    return int(np.datetime64(int(epoch), 's').astype('datetime64[Y]').astype(int)) + 1970
+
+
+def _fmt(epoch) -> str:
+    return str(np.datetime64(int(epoch), 's').astype(datetime))
+
+
+def _last_sunday(year: int, month: int) -> int:
+    last = calendar.monthrange(year, month)[1]
+    return last - (calendar.weekday(year, month, last) + 1) % 7
+
+
+def dst_transitions(first_year: int, last_year: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Epoch seconds of the local 02:00 hour that is skipped (spring) / repeated (autumn)."""
+    years = range(first_year, last_year + 1)
+    spring = [calendar.timegm((y, 3, _last_sunday(y, 3), 2, 0, 0)) for y in years]
+    autumn = [calendar.timegm((y, 10, _last_sunday(y, 10), 2, 0, 0)) for y in years]
+    return np.array(spring, dtype=np.int64), np.array(autumn, dtype=np.int64)
+
+
+def in_hours(ts: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Mask of timestamps inside any [start, start + 1h)."""
+    pos = np.searchsorted(starts, ts, side='right') - 1
+    return (pos >= 0) & (ts - starts[np.maximum(pos, 0)] < 3600)
+
+
+def _duplicates(ts, vals, repeated, autumn) -> Tuple[Dict, int]:
+    dup_ts = ts[1:][repeated]
+    later, earlier = vals[1:][repeated], vals[:-1][repeated]
+    conflicting = ~((later == earlier) | (np.isnan(later) & np.isnan(earlier))).all(axis=1)
+    # The repeated local 02:00 hour on the autumn transition is expected, not a duplicate
+    dst_hour = in_hours(dup_ts, autumn)
+    real = ~dst_hour
+    listed = np.unique(dup_ts[real])[:MAX_RANGES]
+    return {
+        "count": int(real.sum()),
+        "conflicting": int((conflicting & real).sum()),
+        "timestamps": [_fmt(t) for t in listed],
+    }, int(dst_hour.sum())
+
+
+def _gaps(uniq, steps, interval, spring) -> Tuple[Dict, Dict, np.ndarray, np.ndarray, np.ndarray]:
+    idx = np.flatnonzero(steps > interval)
+    starts = uniq[idx] + interval
+    ends = uniq[idx + 1]
+    missing = (ends - starts) // interval
+
+    # A gap covering the skipped local 02:00 hour in spring is the DST switch, not missing data
+    covering = np.zeros(idx.size, dtype=bool)
+    skipped = np.empty(0, dtype=np.int64)
+    if spring.size and idx.size:
+        hour = spring[np.minimum(np.searchsorted(spring, starts), spring.size - 1)]
+        covering = (hour >= starts) & (hour + 3600 <= ends)
+        skipped = np.unique(hour[covering])
+        missing = missing - covering * max(1, 3600 // interval)
+    real = missing > 0
+
+    order = np.argsort(-missing[real], kind='stable')[:MAX_RANGES]
+    gaps = {
+        "count": int(real.sum()),
+        "missing_intervals": int(missing[real].sum()),
+        "longest_seconds": int(missing[real].max() * interval) if real.any() else 0,
+        "ranges": [{"start": _fmt(s), "end": _fmt(e), "missing": int(m)}
+                   for s, e, m in zip(starts[real][order], ends[real][order], missing[real][order])],
+    }
+    dst = {
+        "skipped_hours": [_fmt(t) for t in skipped],
+        "nonexistent_hour_readings": int(in_hours(uniq, spring).sum()) if spring.size else 0,
+    }
+    return gaps, dst, starts[real], ends[real], skipped
+
+
+def _flatlines(uniq, steps, consumption, interval) -> Dict:
+    link = (steps == interval) & (np.diff(consumption) == 0)
+    edges = np.diff(np.r_[0, link.astype(np.int8), 0])
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)  # index of the last reading in the run
+    lengths = ends - starts + 1
+    long = lengths >= FLATLINE_MIN_READINGS
+    order = np.argsort(-lengths[long], kind='stable')[:MAX_RANGES]
+    s, e, l = starts[long][order], ends[long][order], lengths[long][order]
+    return {
+        "count": int(long.sum()),
+        "readings": int(lengths[long].sum()),
+        "ranges": [{"start": _fmt(uniq[a]), "end": _fmt(uniq[b]), "readings": int(c),
+                    "value": float(consumption[a])} for a, b, c in zip(s, e, l)],
+    }
+
+
+def _negatives(vals, columns) -> Dict:
+    negative = vals < 0
+    return {
+        "count": int(negative.any(axis=1).sum()),
+        "by_column": {name: int(negative[:, i].sum()) for i, name in enumerate(columns)},
+    }
+
+
+def _outliers(uniq, consumption) -> Dict:
+    valid = np.isfinite(consumption)
+    c = consumption[valid]
+    empty = {"count": 0, "zscore": 0, "iqr": 0, "timestamps": []}
+    if c.size < OUTLIER_MIN_READINGS:
+        return empty
+    std = c.std()
+    zscore = np.abs(c - c.mean()) > ZSCORE_THRESHOLD * std if std > 0 else np.zeros(c.size, dtype=bool)
+    q1, q3 = np.percentile(c, [25, 75])
+    spread = IQR_FACTOR * (q3 - q1)
+    iqr = ((c < q1 - spread) | (c > q3 + spread)) if q3 > q1 else np.zeros(c.size, dtype=bool)
+    both = zscore & iqr
+    return {
+        "count": int(both.sum()),
+        "zscore": int(zscore.sum()),
+        "iqr": int(iqr.sum()),
+        "timestamps": [_fmt(t) for t in uniq[valid][both][:MAX_RANGES]],
+    }
+
+
+def _months(uniq, gap_starts, gap_ends, interval, skipped) -> Dict:
+    """Readings, expected readings and completeness per calendar month."""
+    months = np.arange(np.datetime64(int(uniq[0]), 's').astype('datetime64[M]'),
+                       np.datetime64(int(uniq[-1]), 's').astype('datetime64[M]') + 1)
+    bounds = np.r_[months, months[-1] + 1].astype('datetime64[s]').astype(np.int64)
+    present = np.diff(np.searchsorted(uniq, bounds))
+
+    # Missing slots: overlap of every gap with every month
+    lo = np.maximum(gap_starts[:, None], bounds[None, :-1])
+    hi = np.minimum(gap_ends[:, None], bounds[None, 1:])
+    missing = (np.maximum(hi - lo, 0) // interval).sum(axis=0)
+    # Gaps spanning the spring DST switch were shortened by the skipped hour
+    np.subtract.at(missing, np.searchsorted(bounds, skipped, side='right') - 1, max(1, 3600 // interval))
+    missing = np.maximum(missing, 0)
+
+    expected = present + missing
+    return {
+        str(m): {"readings": int(p), "expected": int(e), "completeness": round(p / e, 4) if e else 0.0}
+        for m, p, e in zip(months, present, expected)
+    }
@@ -1,3 +1,6 @@
+from collections import namedtuple
+from functools import lru_cache
+
 import pandas as pd
 import numpy as np
 from sklearn.cluster import DBSCAN
@@ -21,102 +24,163 @@ def calculate_distance(lat1, lon1, lat2, lon2):
 
 # --- Profil-Generator ---
 
-def generate_mock_profiles(annual_consumption_kwh, potential_pv_kwp, num_intervals=35040):
-    """Generiert vereinfachte 15-Minuten-Zeitreihenprofile."""
+INTERVAL_HOURS = 0.25
+INTERVALS_PER_YEAR = 35040
+
+# Einheitsprofile: Verbrauch pro 1 kWh Jahresverbrauch, Produktion pro 1 kWp.
+UnitProfiles = namedtuple('UnitProfiles', ['index', 'consumption_kw', 'production_kw'])
+
+
+@lru_cache(maxsize=4)
+def get_unit_profiles(num_intervals=INTERVALS_PER_YEAR):
+    """
+    Einmal pro Prozess berechnete, unveränderliche Einheitsprofile.
+    Verbrauch und PV hängen nur vom Kalender ab; jedes Gebäudeprofil ist eine
+    lineare Skalierung dieser beiden Formen.
+    """
     timestamps = pd.date_range(start='2025-01-01', periods=num_intervals, freq='15min')
-    
-    # Konvertiere zu numpy arrays, um Index-Probleme zu vermeiden
-    time_of_day = np.array(timestamps.hour) + np.array(timestamps.minute) / 60.0
+
+    time_of_day = np.asarray(timestamps.hour) + np.asarray(timestamps.minute) / 60.0
     consumption_shape = np.cos((time_of_day - 13.5) * (np.pi / 12))**2
-    # Stelle sicher, dass consumption_shape ein numpy array ist
-    consumption_shape = np.array(consumption_shape)
-    consumption_shape[ (time_of_day < 6) | (time_of_day > 22) ] *= 0.5
-    
+    consumption_shape[(time_of_day < 6) | (time_of_day > 22)] *= 0.5
+
     # Verhindere Division durch Null, wenn Summe 0 ist
     if consumption_shape.sum() == 0:
-        normalized_consumption = np.zeros_like(consumption_shape)
+        unit_consumption = np.zeros_like(consumption_shape)
     else:
-        normalized_consumption = consumption_shape / consumption_shape.sum()
-        
-    consumption_profile_kw = normalized_consumption * (annual_consumption_kwh / 0.25)
-    
-    # Konvertiere day_of_year zu numpy array
-    day_of_year = np.array(timestamps.dayofyear)
+        unit_consumption = consumption_shape / consumption_shape.sum() / INTERVAL_HOURS
+
+    day_of_year = np.asarray(timestamps.dayofyear)
     seasonal_factor = 1 + 0.5 * np.cos((day_of_year - 172) * (2 * np.pi / 365))
-    # Berechne pv_shape mit numpy, um Index-Probleme zu vermeiden
-    pv_time_factor = np.maximum(0, (time_of_day - 6) * (np.pi / 12))
-    pv_sin = np.sin(pv_time_factor)
-    # Verwende np.power statt ** um Warnungen zu vermeiden
-    pv_shape = np.power(np.where(pv_sin > 0, pv_sin, 0), 1.5)
-    # Stelle sicher, dass pv_shape ein numpy array ist
-    pv_shape = np.array(pv_shape) * np.array(seasonal_factor)
-    
+    pv_sin = np.sin(np.maximum(0, (time_of_day - 6) * (np.pi / 12)))
+    pv_shape = np.power(np.where(pv_sin > 0, pv_sin, 0), 1.5) * seasonal_factor
+
     if pv_shape.max() > 0:
-        normalized_pv = pv_shape / pv_shape.max()
+        unit_production = pv_shape / pv_shape.max()
     else:
-        normalized_pv = np.zeros_like(pv_shape)
-        
-    pv_profile_kw = normalized_pv * potential_pv_kwp
+        unit_production = np.zeros_like(pv_shape)
+
+    unit_consumption.flags.writeable = False
+    unit_production.flags.writeable = False
+    return UnitProfiles(timestamps, unit_consumption, unit_production)
+
+
+class MockProfile:
+    """
+    Skaliertes Gebäudeprofil über den geteilten Einheitsprofilen.
+    Arrays werden erst beim Zugriff skaliert, der DataFrame nur bei to_frame().
+    """
+    __slots__ = ('annual_consumption_kwh', 'potential_pv_kwp', 'units')
+
+    def __init__(self, annual_consumption_kwh, potential_pv_kwp, num_intervals=INTERVALS_PER_YEAR):
+        self.annual_consumption_kwh = _as_float(annual_consumption_kwh)
+        self.potential_pv_kwp = _as_float(potential_pv_kwp)
+        self.units = get_unit_profiles(num_intervals)
+
+    @property
+    def consumption_kw(self):
+        return self.units.consumption_kw * self.annual_consumption_kwh
 
-    return pd.DataFrame({
-        'consumption_kw': consumption_profile_kw,
-        'production_kw': pv_profile_kw
-    }, index=timestamps)
+    @property
+    def production_kw(self):
+        return self.units.production_kw * self.potential_pv_kwp
+
+    def to_frame(self):
+        return pd.DataFrame({
+            'consumption_kw': self.consumption_kw,
+            'production_kw': self.production_kw
+        }, index=self.units.index)
+
+
+def _as_float(value):
+    """Decimal/None/NaN aus DB-Zeilen robust in float umwandeln."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if np.isnan(value) else value
+
+
+def generate_mock_profiles(annual_consumption_kwh, potential_pv_kwp, num_intervals=INTERVALS_PER_YEAR):
+    """Generiert vereinfachte 15-Minuten-Zeitreihenprofile."""
+    return MockProfile(annual_consumption_kwh, potential_pv_kwp, num_intervals).to_frame()
 
 # --- Autarkie-Simulator ---
 
 def calculate_community_autarky(community_buildings_df, all_profiles):
     """
     (Schnell) Berechnet den Autarkie-Score für einen Cluster.
-    `all_profiles` wird ignoriert (kann None sein), da Profile neu generiert werden.
+    `all_profiles` wird ignoriert (kann None sein), da Profile aus den
+    Einheitsprofilen skaliert werden: die Summe der Gebäudeprofile ist
+    Einheitsprofil × Summe der Jahresverbräuche bzw. kWp.
     """
-    
-    # 1. Profile für Simulation generieren
-    all_profiles_sim = {}
     if community_buildings_df.empty:
         return 0.0, 0, 0
 
-    first_building_id = None
-    
-    for _, row in community_buildings_df.iterrows():
-        building_id = row['building_id']
-        if first_building_id is None:
-            first_building_id = building_id
-            
-        all_profiles_sim[building_id] = generate_mock_profiles(
-            row['annual_consumption_kwh'],
-            row['potential_pv_kwp']
-        )
-
-    if first_building_id is None:
-         return 0.0, 0, 0
-
-    # Holen Sie sich einen gültigen Index aus dem ersten Profil
-    # Verwende .values um nur die Werte zu verwenden, nicht den DatetimeIndex
-    first_profile = all_profiles_sim[first_building_id]
-    num_points = len(first_profile)
-    
-    # Erstelle Series mit numerischem Index statt DatetimeIndex
-    # Dies vermeidet "Index does not support mutable operations" Fehler
-    community_consumption = pd.Series(0.0, index=range(num_points))
-    community_production = pd.Series(0.0, index=range(num_points))
-    
-    # Verwende .values um sicherzustellen, dass wir über die Werte iterieren, nicht den Index
-    for building_id in community_buildings_df['building_id'].values:
-        profile = all_profiles_sim[building_id]
-        # Verwende .values um nur die numerischen Werte zu bekommen
-        community_consumption += pd.Series(profile['consumption_kw'].values, index=range(num_points))
-        community_production += pd.Series(profile['production_kw'].values, index=range(num_points))
-        
-    net_load_kw = community_consumption - community_production
-    energy_kwh = net_load_kw * 0.25
+    total_annual_kwh = sum(_as_float(v) for v in community_buildings_df.get('annual_consumption_kwh', ()))
+    total_kwp = sum(_as_float(v) for v in community_buildings_df.get('potential_pv_kwp', ()))
+    units = get_unit_profiles()
+
+    community_consumption = units.consumption_kw * total_annual_kwh
+    community_production = units.production_kw * total_kwp
+
+    energy_kwh = (community_consumption - community_production) * INTERVAL_HOURS
     grid_import_kwh = energy_kwh[energy_kwh > 0].sum()
-    total_consumption_kwh = community_consumption.sum() * 0.25
-    
+    total_consumption_kwh = community_consumption.sum() * INTERVAL_HOURS
+
     if total_consumption_kwh == 0: return 0.0, 0, 0
-        
+
     autarky_score = (total_consumption_kwh - grid_import_kwh) / total_consumption_kwh
-    return autarky_score, total_consumption_kwh, (community_production.sum() * 0.25)
+    return autarky_score, total_consumption_kwh, (community_production.sum() * INTERVAL_HOURS)
+
+
+# Cluster pro Block im Batch-Simulator (Block × 35040 float64 ≈ 36 MB bei 128)
+SIMULATION_BLOCK_SIZE = 128
+
+
+def simulate_clusters(labels, annual_consumption_kwh, potential_pv_kwp, block_size=SIMULATION_BLOCK_SIZE):
+    """
+    (Schnell) Simuliert Autarkie, Verbrauch und Produktion aller Cluster in einem Durchgang.
+
+    Die Cluster-Summen entsprechen dem Produkt einer (dünnbesetzten)
+    Mitgliedschaftsmatrix mit den Gebäudewerten (np.bincount); die Lastgänge
+    aller Cluster werden blockweise als Matrix (Cluster × Intervalle) aus den
+    Einheitsprofilen skaliert. Label -1 (Rauschen) wird ignoriert.
+
+    Returns:
+        dict mit cluster_ids, autarky, total_consumption_kwh, total_production_kwh (je ein Array)
+    """
+    labels = np.asarray(labels)
+    consumption = np.array([_as_float(v) for v in annual_consumption_kwh], dtype=np.float64)
+    production = np.array([_as_float(v) for v in potential_pv_kwp], dtype=np.float64)
+
+    valid = labels >= 0
+    cluster_ids, inverse = np.unique(labels[valid], return_inverse=True)
+    k = len(cluster_ids)
+    cluster_kwh = np.bincount(inverse, weights=consumption[valid], minlength=k)
+    cluster_kwp = np.bincount(inverse, weights=production[valid], minlength=k)
+
+    units = get_unit_profiles()
+    grid_import_kwh = np.zeros(k)
+    for start in range(0, k, block_size):
+        stop = min(start + block_size, k)
+        net_kw = np.outer(cluster_kwh[start:stop], units.consumption_kw)
+        net_kw -= np.outer(cluster_kwp[start:stop], units.production_kw)
+        np.maximum(net_kw, 0, out=net_kw)
+        grid_import_kwh[start:stop] = net_kw.sum(axis=1) * INTERVAL_HOURS
+
+    total_consumption_kwh = cluster_kwh * (units.consumption_kw.sum() * INTERVAL_HOURS)
+    total_production_kwh = cluster_kwp * (units.production_kw.sum() * INTERVAL_HOURS)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        autarky = np.where(total_consumption_kwh > 0,
+                           (total_consumption_kwh - grid_import_kwh) / total_consumption_kwh, 0.0)
+
+    return {
+        'cluster_ids': cluster_ids,
+        'autarky': autarky,
+        'total_consumption_kwh': total_consumption_kwh,
+        'total_production_kwh': total_production_kwh,
+    }
 
 
 # --- Cluster-Analyse ---
@@ -149,6 +213,38 @@ def get_cluster_info(community_df, cluster_id):
         'total_production_mwh': total_production / 1000,
     }
 
+def describe_clusters(buildings_df, labels):
+    """
+    (Schnell) Cluster-Details für alle Labels >= 0 im Format von get_cluster_info,
+    simuliert in einem Batch über simulate_clusters.
+    """
+    labels = np.asarray(labels)
+    if len(buildings_df) == 0:
+        return []
+    zeros = np.zeros(len(buildings_df))
+    sim = simulate_clusters(
+        labels,
+        buildings_df['annual_consumption_kwh'] if 'annual_consumption_kwh' in buildings_df else zeros,
+        buildings_df['potential_pv_kwp'] if 'potential_pv_kwp' in buildings_df else zeros,
+    )
+
+    member_cols = [c for c in ('building_id', 'lat', 'lon') if c in buildings_df.columns]
+    members_by_cluster = buildings_df.reset_index(drop=True).groupby(labels)
+    results = []
+    for i, cluster_id in enumerate(sim['cluster_ids']):
+        community_df = members_by_cluster.get_group(cluster_id)
+        building_ids = list(community_df['building_id']) if 'building_id' in community_df else []
+        results.append({
+            'community_id': int(cluster_id),
+            'num_members': len(community_df),
+            'building_ids': building_ids,
+            'members': community_df[member_cols].to_dict('records'),
+            'autarky_percent': float(sim['autarky'][i]) * 100,
+            'total_consumption_mwh': float(sim['total_consumption_kwh'][i]) / 1000,
+            'total_production_mwh': float(sim['total_production_kwh'][i]) / 1000,
+        })
+    return results
+
 def find_optimal_communities(building_data_df, radius_meters=150, min_community_size=3):
     """
     (Langsam) Main ML function (DBSCAN + Simulation).
@@ -183,18 +279,8 @@ def find_optimal_communities(building_data_df, radius_meters=150, min_community_
     num_clusters = len(set(db.labels_)) - (1 if -1 in db.labels_ else 0)
     print(f"[ML] DBSCAN fand {num_clusters} potenzielle Gemeinschaften.")
 
-    print("[ML] Simuliere Autarkie für jeden Cluster...")
-    results = []
-    for cluster_id in set(db.labels_):
-        if cluster_id == -1: continue # Rauscht-Cluster (isolierte Gebäude)
-            
-        # Erstelle einen neuen DataFrame statt copy(), um Index-Probleme zu vermeiden
-        cluster_mask = working_df['cluster'] == cluster_id
-        community_buildings_df = pd.DataFrame(working_df[cluster_mask].to_dict('records'))
-        
-        # Ruft die aktualisierte Funktion auf
-        cluster_info = get_cluster_info(community_buildings_df, cluster_id)
-        results.append(cluster_info)
+    print("[ML] Simuliere Autarkie für alle Cluster (Batch)...")
+    results = describe_clusters(working_df, db.labels_)
 
     # Sortiere nach höchster Autarkie
     ranked_results = sorted(results, key=lambda x: x['autarky_percent'], reverse=True)
@@ -3,10 +3,19 @@ Public data fetchers for OpenLEG.
 Aggregates Swiss government open data: ElCom tariffs, Energie Reporter, Sonnendach.
 All functions are pure: fetch, parse, return dict. DB persistence handled by callers.
 """
-import logging
+import os
+import re
 import csv
 import io
-from typing import Dict, List, Optional
+import json
+import hashlib
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 from datetime import datetime
 
 import requests
@@ -17,6 +26,16 @@ logger = logging.getLogger(__name__)
 
 LINDAS_ENDPOINT = "https://lindas.admin.ch/query"
 
+# Concurrent ElCom fetching
+ELCOM_WORKERS = int(os.getenv('ELCOM_WORKERS', '8'))
+ELCOM_MAX_PER_HOST = int(os.getenv('ELCOM_MAX_PER_HOST', '4'))
+ELCOM_BATCH_SIZE = int(os.getenv('ELCOM_BATCH_SIZE', '25'))
+ELCOM_RETRIES = int(os.getenv('ELCOM_RETRIES', '3'))
+ELCOM_BACKOFF_SECONDS = float(os.getenv('ELCOM_BACKOFF_SECONDS', '0.5'))
+ELCOM_TIMEOUT = 30
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MUNICIPALITY_URI = "https://ld.admin.ch/municipality/"
+
 ELCOM_SPARQL_TEMPLATE = """
 PREFIX schema: <http://schema.org/>
 PREFIX cube: <https://cube.link/>
@@ -43,6 +62,48 @@ ORDER BY ?operator ?category
 """
 
 
+# Same query for many municipalities at once; ?municipality maps rows back to BFS numbers
+ELCOM_SPARQL_BATCH_TEMPLATE = """
+PREFIX schema: <http://schema.org/>
+PREFIX cube: <https://cube.link/>
+PREFIX elcom: <https://energy.ld.admin.ch/elcom/electricityprice/dimension/>
+
+SELECT ?municipality ?operator ?category ?total ?energy ?grid ?municipality_fee ?kev
+WHERE {{
+  VALUES ?municipality {{ {municipalities} }}
+  ?obs a cube:Observation ;
+       elcom:municipality ?municipality ;
+       elcom:period "{year}"^^<http://www.w3.org/2001/XMLSchema#gYear> ;
+       elcom:operator ?operatorUri ;
+       elcom:category ?categoryUri ;
+       elcom:total ?total .
+
+  OPTIONAL {{ ?obs elcom:gridusage ?grid }}
+  OPTIONAL {{ ?obs elcom:energy ?energy }}
+  OPTIONAL {{ ?obs elcom:charge ?municipality_fee }}
+  OPTIONAL {{ ?obs elcom:aidfee ?kev }}
+
+  ?operatorUri schema:name ?operator .
+  ?categoryUri schema:name ?category .
+}}
+ORDER BY ?municipality ?operator ?category
+"""
+
+
+def _tariff_from_binding(binding: Dict, bfs_number: int, year: int) -> Dict:
+    return {
+        "bfs_number": bfs_number,
+        "year": year,
+        "operator_name": binding.get("operator", {}).get("value", ""),
+        "category": binding.get("category", {}).get("value", ""),
+        "total_rp_kwh": _parse_decimal(binding.get("total")),
+        "energy_rp_kwh": _parse_decimal(binding.get("energy")),
+        "grid_rp_kwh": _parse_decimal(binding.get("grid")),
+        "municipality_fee_rp_kwh": _parse_decimal(binding.get("municipality_fee")),
+        "kev_rp_kwh": _parse_decimal(binding.get("kev")),
+    }
+
+
 def fetch_elcom_tariffs(bfs_number: int, year: int = 2026) -> List[Dict]:
     """Query LINDAS SPARQL endpoint for ElCom tariffs of a municipality."""
     sparql = ELCOM_SPARQL_TEMPLATE.format(bfs=bfs_number, year=year)
@@ -55,19 +116,8 @@ def fetch_elcom_tariffs(bfs_number: int, year: int = 2026) -> List[Dict]:
         )
         resp.raise_for_status()
         data = resp.json()
-        results = []
-        for binding in data.get("results", {}).get("bindings", []):
-            results.append({
-                "bfs_number": bfs_number,
-                "year": year,
-                "operator_name": binding.get("operator", {}).get("value", ""),
-                "category": binding.get("category", {}).get("value", ""),
-                "total_rp_kwh": _parse_decimal(binding.get("total")),
-                "energy_rp_kwh": _parse_decimal(binding.get("energy")),
-                "grid_rp_kwh": _parse_decimal(binding.get("grid")),
-                "municipality_fee_rp_kwh": _parse_decimal(binding.get("municipality_fee")),
-                "kev_rp_kwh": _parse_decimal(binding.get("kev")),
-            })
+        results = [_tariff_from_binding(binding, bfs_number, year)
+                   for binding in data.get("results", {}).get("bindings", [])]
         logger.info(f"[PUBLIC_DATA] ElCom: {len(results)} tariff records for BFS {bfs_number}/{year}")
         return results
     except Exception as e:
@@ -75,14 +125,132 @@ def fetch_elcom_tariffs(bfs_number: int, year: int = 2026) -> List[Dict]:
         return []
 
 
+class ElcomFetcher:
+    """Concurrent ElCom client: one keep-alive session, bounded pool, per-host limit.
+
+    Municipalities are queried in batches (VALUES clause). A batch that still
+    fails after retries is split into single-BFS queries, so one bad
+    municipality only costs its own result.
+    """
+
+    def __init__(self, endpoint: str = None, workers: int = None, max_per_host: int = None,
+                 batch_size: int = None, retries: int = None, backoff_seconds: float = None,
+                 timeout: float = ELCOM_TIMEOUT):
+        self.endpoint = endpoint or LINDAS_ENDPOINT
+        self.workers = max(1, workers or ELCOM_WORKERS)
+        self.max_per_host = max(1, max_per_host or ELCOM_MAX_PER_HOST)
+        self.batch_size = max(1, batch_size or ELCOM_BATCH_SIZE)
+        self.retries = ELCOM_RETRIES if retries is None else retries
+        self.backoff_seconds = ELCOM_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self.timeout = timeout
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=self.max_per_host)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept"] = "application/sparql-results+json"
+        self.stats = {"requests": 0, "retries": 0, "batches": 0, "split_batches": 0}
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_slots[host]
+
+    def _query(self, sparql: str) -> List[Dict]:
+        """POST a SPARQL query with retry/backoff; returns the bindings."""
+        attempt = 0
+        while True:
+            try:
+                with self._host_slot(self.endpoint):
+                    self.stats["requests"] += 1
+                    resp = self.session.post(self.endpoint, data={"query": sparql}, timeout=self.timeout)
+                if resp.status_code not in RETRY_STATUS:
+                    resp.raise_for_status()
+                    return resp.json().get("results", {}).get("bindings", [])
+                error = requests.HTTPError(f"{resp.status_code} from {self.endpoint}", response=resp)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt >= self.retries:
+                raise error
+            attempt += 1
+            self.stats["retries"] += 1
+            time.sleep(self.backoff_seconds * 2 ** (attempt - 1) * (1 + random.random() * 0.25))
+
+    def fetch_batch(self, bfs_numbers: List[int], year: int) -> Dict[int, List[Dict]]:
+        values = " ".join(f"<{MUNICIPALITY_URI}{int(bfs)}>" for bfs in bfs_numbers)
+        bindings = self._query(ELCOM_SPARQL_BATCH_TEMPLATE.format(municipalities=values, year=year))
+        self.stats["batches"] += 1
+        by_bfs = {bfs: [] for bfs in bfs_numbers}
+        for binding in bindings:
+            uri = binding.get("municipality", {}).get("value", "")
+            match = re.search(r"/(\d+)$", uri)
+            bfs = int(match.group(1)) if match else None
+            if bfs in by_bfs:
+                by_bfs[bfs].append(_tariff_from_binding(binding, bfs, year))
+        return by_bfs
+
+    def _fetch_isolated(self, batch: List[int], year: int) -> Tuple[Dict[int, List[Dict]], Dict[int, str]]:
+        try:
+            return self.fetch_batch(batch, year), {}
+        except Exception as e:
+            if len(batch) == 1:
+                return {}, {batch[0]: str(e)}
+            logger.warning(f"[PUBLIC_DATA] ElCom batch of {len(batch)} failed ({e}), retrying per BFS")
+            self.stats["split_batches"] += 1
+        tariffs, errors = {}, {}
+        for bfs in batch:
+            try:
+                tariffs.update(self.fetch_batch([bfs], year))
+            except Exception as e:
+                errors[bfs] = str(e)
+        return tariffs, errors
+
+    def fetch_many(self, bfs_numbers: List[int], year: int = 2026) -> Tuple[Dict[int, List[Dict]], Dict[int, str]]:
+        """Tariffs per BFS number plus {bfs: error} for municipalities that failed."""
+        unique = list(dict.fromkeys(int(b) for b in bfs_numbers))
+        batches = [unique[i:i + self.batch_size] for i in range(0, len(unique), self.batch_size)]
+        tariffs: Dict[int, List[Dict]] = {}
+        errors: Dict[int, str] = {}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(batches) or 1),
+                                thread_name_prefix="elcom") as pool:
+            futures = [pool.submit(self._fetch_isolated, batch, year) for batch in batches]
+            for future in as_completed(futures):
+                batch_tariffs, batch_errors = future.result()
+                tariffs.update(batch_tariffs)
+                errors.update(batch_errors)
+        for bfs, error in errors.items():
+            logger.error(f"[PUBLIC_DATA] ElCom fetch failed for BFS {bfs}: {error}")
+        logger.info(f"[PUBLIC_DATA] ElCom: {sum(len(t) for t in tariffs.values())} tariff records for "
+                    f"{len(tariffs)}/{len(unique)} municipalities in {len(batches)} batches "
+                    f"({self.stats['requests']} requests)")
+        return tariffs, errors
+
+
+def fetch_elcom_tariffs_many(bfs_numbers: List[int], year: int = 2026,
+                             endpoint: str = None) -> Tuple[Dict[int, List[Dict]], Dict[int, str]]:
+    """Concurrently fetch tariffs for many municipalities: ({bfs: tariffs}, {bfs: error})."""
+    with ElcomFetcher(endpoint=endpoint) as fetcher:
+        return fetcher.fetch_many(bfs_numbers, year)
+
+
 def fetch_all_elcom_tariffs(kanton: str = 'ZH', year: int = 2026, bfs_numbers: List[int] = None) -> List[Dict]:
     """Batch fetch ElCom tariffs for multiple municipalities."""
     if bfs_numbers is None:
         bfs_numbers = ZH_BFS_NUMBERS
-    all_tariffs = []
-    for bfs in bfs_numbers:
-        tariffs = fetch_elcom_tariffs(bfs, year)
-        all_tariffs.extend(tariffs)
+    tariffs_by_bfs, _ = fetch_elcom_tariffs_many(bfs_numbers, year)
+    all_tariffs = [t for bfs in bfs_numbers for t in tariffs_by_bfs.pop(bfs, [])]
     logger.info(f"[PUBLIC_DATA] Batch ElCom: {len(all_tariffs)} total records for {len(bfs_numbers)} municipalities")
     return all_tariffs
 
@@ -97,50 +265,219 @@ def _parse_decimal(binding_value):
         return None
 
 
+# === Raw dataset cache ===
+
+# Downloaded resources keyed by scope and URL: <sha1(scope:url)>.json (ETag,
+# Last-Modified, content hash, encoding) next to <sha1(scope:url)>.body (raw bytes)
+PUBLIC_DATA_CACHE_DIR = os.getenv('PUBLIC_DATA_CACHE_DIR', '/data/public_data_cache')
+
+
+class RawResourceCache:
+    """Local copy of downloaded resources with conditional re-download.
+
+    get() sends If-None-Match / If-Modified-Since; a 304 or a body with the
+    same SHA-256 as the stored copy counts as unchanged. New content is only
+    written by commit(), so callers persist it once it has been processed.
+    A scope (e.g. the canton) keeps a separate baseline per consumer of the
+    same URL: a resource committed by one canton's refresh is still new to
+    the next canton's.
+    """
+
+    def __init__(self, directory: str = None, session=None, scope: str = None):
+        self.directory = directory or PUBLIC_DATA_CACHE_DIR
+        self.session = session or requests
+        self.scope = scope
+
+    def load_state(self, name: str) -> Dict:
+        """Small JSON document stored next to the resources (e.g. per-BFS digests)."""
+        try:
+            with open(os.path.join(self.directory, f"{name}.state.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self, name: str, state: Dict) -> bool:
+        path = os.path.join(self.directory, f"{name}.state.json")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(state, f)
+            os.replace(f"{path}.tmp", path)
+            return True
+        except OSError as e:
+            logger.warning(f"[PUBLIC_DATA] Could not write {name} state: {e}")
+            return False
+
+    def _paths(self, url: str) -> Tuple[str, str]:
+        key = f"{self.scope}:{url}" if self.scope else url
+        stem = os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+        return stem + ".json", stem + ".body"
+
+    def load(self, url: str) -> Tuple[Optional[Dict], Optional[bytes]]:
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None, None
+        if hashlib.sha256(body).hexdigest() != meta.get("sha256"):
+            return None, None
+        return meta, body
+
+    def get(self, url: str, timeout: float = 30) -> Dict:
+        """{"url", "body", "text", "sha256", "changed", "previous_text", "meta"}."""
+        meta, cached_body = self.load(url)
+        headers = {}
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        resp = self.session.get(url, headers=headers, timeout=timeout)
+        if resp.status_code == 304 and cached_body is not None:
+            return self._result(url, meta, cached_body, changed=False, previous=cached_body)
+        resp.raise_for_status()
+
+        body = resp.content
+        new_meta = {
+            "url": url,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "sha256": hashlib.sha256(body).hexdigest(),
+            "encoding": (meta or {}).get("encoding"),
+            "fetched_at": datetime.now().isoformat(),
+        }
+        changed = not meta or meta.get("sha256") != new_meta["sha256"]
+        if changed or not new_meta["encoding"]:
+            new_meta["encoding"] = resp.encoding if resp.encoding and resp.encoding.lower() != "iso-8859-1" \
+                else (resp.apparent_encoding or "utf-8")
+        return self._result(url, new_meta, body, changed=changed, previous=cached_body,
+                            previous_encoding=(meta or {}).get("encoding"))
+
+    def _result(self, url, meta, body, changed, previous=None, previous_encoding=None):
+        encoding = meta.get("encoding") or "utf-8"
+        return {
+            "url": url,
+            "meta": meta,
+            "body": body,
+            "text": body.decode(encoding, errors="replace"),
+            "sha256": meta["sha256"],
+            "changed": changed,
+            "previous_text": previous.decode(previous_encoding or encoding, errors="replace")
+            if previous is not None and changed else None,
+        }
+
+    def commit(self, resource: Dict) -> bool:
+        """Persist a fetched resource as the new baseline. False if the cache dir is unusable."""
+        meta_path, body_path = self._paths(resource["url"])
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for path, data, mode in ((body_path, resource["body"], "wb"),
+                                     (meta_path, json.dumps(resource["meta"]), "w")):
+                tmp = f"{path}.tmp"
+                with open(tmp, mode) as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            return True
+        except OSError as e:
+            logger.warning(f"[PUBLIC_DATA] Could not write raw cache for {resource['url']}: {e}")
+            return False
+
+
+def _find_csv_url(pkg: Dict, name_hints: Tuple[str, ...] = ()) -> Optional[str]:
+    """CSV resource of an opendata.swiss package, preferring names containing a hint."""
+    csv_resources = [r for r in pkg.get("resources", []) if r.get("format", "").upper() == "CSV"]
+    for resource in csv_resources:
+        name = (resource.get("name") or "").lower()
+        if any(hint in name for hint in name_hints):
+            return resource.get("url")
+    return csv_resources[0].get("url") if csv_resources else None
+
+
+def diff_rows_by_bfs(previous: List[Dict], current: List[Dict]) -> Dict:
+    """Per-BFS diff of two parsed datasets: added/changed/removed BFS numbers."""
+    before = {row["bfs_number"]: row for row in previous}
+    after = {row["bfs_number"]: row for row in current}
+    return {
+        "added": sorted(set(after) - set(before)),
+        "changed": sorted(b for b in set(after) & set(before) if after[b] != before[b]),
+        "removed": sorted(set(before) - set(after)),
+    }
+
+
+def load_dataset(package_url: str, parse_csv, name_hints: Tuple[str, ...] = (),
+                 cache: RawResourceCache = None) -> Dict:
+    """Conditionally fetch an opendata.swiss CSV dataset and diff it per BFS.
+
+    Returns {"rows", "changed", "changed_bfs", "diff", "resources"}; pass
+    "resources" to RawResourceCache.commit once the rows are saved. When the
+    content hash is unchanged, changed_bfs is empty and nothing needs writing.
+    """
+    cache = cache or RawResourceCache()
+    meta = cache.get(package_url, timeout=15)
+    pkg = json.loads(meta["text"]).get("result", {})
+    csv_url = _find_csv_url(pkg, name_hints)
+    if not csv_url:
+        return {"rows": [], "changed": False, "changed_bfs": set(), "diff": None, "resources": [meta],
+                "csv_url": None}
+
+    resource = cache.get(csv_url, timeout=30)
+    rows = parse_csv(resource["text"])
+    if not resource["changed"]:
+        return {"rows": rows, "changed": False, "changed_bfs": set(), "diff": None,
+                "resources": [meta, resource], "csv_url": csv_url}
+
+    if resource["previous_text"] is not None:
+        diff = diff_rows_by_bfs(parse_csv(resource["previous_text"]), rows)
+        changed_bfs = set(diff["added"]) | set(diff["changed"])
+    else:
+        diff = None
+        changed_bfs = {row["bfs_number"] for row in rows}
+    return {"rows": rows, "changed": True, "changed_bfs": changed_bfs, "diff": diff,
+            "resources": [meta, resource], "csv_url": csv_url}
+
+
 # === Energie Reporter ===
 
 ENERGIE_REPORTER_URL = "https://opendata.swiss/api/3/action/package_show?id=energie-reporter"
 
 
+def _parse_energie_reporter_csv(text: str) -> List[Dict]:
+    reader = csv.DictReader(io.StringIO(text), delimiter=';')
+    results = []
+    for row in reader:
+        bfs = _safe_int(row.get('BFS_NR') or row.get('bfs_nr') or row.get('gemeinde_bfs'))
+        if not bfs:
+            continue
+        results.append({
+            "bfs_number": bfs,
+            "name": row.get('GEMEINDENAME') or row.get('gemeindename') or row.get('name', ''),
+            "kanton": row.get('KANTON') or row.get('kanton', ''),
+            "solar_potential_pct": _safe_float(row.get('anteil_dachflaechen_solar') or row.get('solar_potential_pct')),
+            "ev_share_pct": _safe_float(row.get('anteil_ev') or row.get('ev_share_pct')),
+            "renewable_heating_pct": _safe_float(row.get('anteil_erneuerbar_heizen') or row.get('renewable_heating_pct')),
+            "electricity_consumption_mwh": _safe_float(row.get('stromverbrauch_mwh') or row.get('electricity_consumption_mwh')),
+            "renewable_production_mwh": _safe_float(row.get('erneuerbare_produktion_mwh') or row.get('renewable_production_mwh')),
+        })
+    return results
+
+
+def load_energie_reporter(cache: RawResourceCache = None) -> Dict:
+    """Energie Reporter via the raw cache, with per-BFS change set (see load_dataset)."""
+    return load_dataset(ENERGIE_REPORTER_URL, _parse_energie_reporter_csv, cache=cache)
+
+
 def fetch_energie_reporter() -> List[Dict]:
     """Download Energie Reporter data from opendata.swiss and parse into per-municipality dicts."""
     try:
-        # Get dataset metadata to find CSV resource
-        resp = requests.get(ENERGIE_REPORTER_URL, timeout=15)
-        resp.raise_for_status()
-        pkg = resp.json().get("result", {})
-        csv_url = None
-        for resource in pkg.get("resources", []):
-            if resource.get("format", "").upper() == "CSV":
-                csv_url = resource.get("url")
-                break
-
-        if not csv_url:
+        data = load_energie_reporter()
+        if not data["csv_url"]:
             logger.warning("[PUBLIC_DATA] Energie Reporter: no CSV resource found")
             return []
-
-        csv_resp = requests.get(csv_url, timeout=30)
-        csv_resp.raise_for_status()
-        csv_resp.encoding = csv_resp.apparent_encoding or 'utf-8'
-
-        reader = csv.DictReader(io.StringIO(csv_resp.text), delimiter=';')
-        results = []
-        for row in reader:
-            bfs = _safe_int(row.get('BFS_NR') or row.get('bfs_nr') or row.get('gemeinde_bfs'))
-            if not bfs:
-                continue
-            results.append({
-                "bfs_number": bfs,
-                "name": row.get('GEMEINDENAME') or row.get('gemeindename') or row.get('name', ''),
-                "kanton": row.get('KANTON') or row.get('kanton', ''),
-                "solar_potential_pct": _safe_float(row.get('anteil_dachflaechen_solar') or row.get('solar_potential_pct')),
-                "ev_share_pct": _safe_float(row.get('anteil_ev') or row.get('ev_share_pct')),
-                "renewable_heating_pct": _safe_float(row.get('anteil_erneuerbar_heizen') or row.get('renewable_heating_pct')),
-                "electricity_consumption_mwh": _safe_float(row.get('stromverbrauch_mwh') or row.get('electricity_consumption_mwh')),
-                "renewable_production_mwh": _safe_float(row.get('erneuerbare_produktion_mwh') or row.get('renewable_production_mwh')),
-            })
-        logger.info(f"[PUBLIC_DATA] Energie Reporter: {len(results)} municipalities parsed")
-        return results
+        logger.info(f"[PUBLIC_DATA] Energie Reporter: {len(data['rows'])} municipalities parsed")
+        return data["rows"]
     except Exception as e:
         logger.error(f"[PUBLIC_DATA] Energie Reporter fetch failed: {e}")
         return []
@@ -149,52 +486,41 @@ def fetch_energie_reporter() -> List[Dict]:
 # === Sonnendach ===
 
 SONNENDACH_URL = "https://opendata.swiss/api/3/action/package_show?id=sonnendach-ch"
+SONNENDACH_NAME_HINTS = ("gemeinde", "municipal", "kommun")
+
+
+def _parse_sonnendach_csv(text: str) -> List[Dict]:
+    reader = csv.DictReader(io.StringIO(text), delimiter=';')
+    results = []
+    for row in reader:
+        bfs = _safe_int(row.get('BFS_NR') or row.get('bfs_nr') or row.get('gemeinde_bfs'))
+        if not bfs:
+            continue
+        results.append({
+            "bfs_number": bfs,
+            "total_roof_area_m2": _safe_float(row.get('dachflaeche_total_m2') or row.get('total_roof_area_m2')),
+            "suitable_roof_area_m2": _safe_float(row.get('dachflaeche_geeignet_m2') or row.get('suitable_roof_area_m2')),
+            "potential_kwh_year": _safe_float(row.get('potenzial_kwh_jahr') or row.get('potential_kwh_year')),
+            "potential_kwp": _safe_float(row.get('potenzial_kwp') or row.get('potential_kwp')),
+            "utilization_pct": _safe_float(row.get('auslastung_pct') or row.get('utilization_pct')),
+        })
+    return results
+
+
+def load_sonnendach_municipal(cache: RawResourceCache = None) -> Dict:
+    """Sonnendach municipal data via the raw cache, with per-BFS change set."""
+    return load_dataset(SONNENDACH_URL, _parse_sonnendach_csv, SONNENDACH_NAME_HINTS, cache=cache)
 
 
 def fetch_sonnendach_municipal() -> List[Dict]:
     """Download municipal-level solar potential from opendata.swiss."""
     try:
-        resp = requests.get(SONNENDACH_URL, timeout=15)
-        resp.raise_for_status()
-        pkg = resp.json().get("result", {})
-        csv_url = None
-        for resource in pkg.get("resources", []):
-            fmt = resource.get("format", "").upper()
-            name = (resource.get("name") or "").lower()
-            if fmt == "CSV" and ("gemeinde" in name or "municipal" in name or "kommun" in name):
-                csv_url = resource.get("url")
-                break
-        # Fallback: any CSV
-        if not csv_url:
-            for resource in pkg.get("resources", []):
-                if resource.get("format", "").upper() == "CSV":
-                    csv_url = resource.get("url")
-                    break
-
-        if not csv_url:
+        data = load_sonnendach_municipal()
+        if not data["csv_url"]:
             logger.warning("[PUBLIC_DATA] Sonnendach: no CSV resource found")
             return []
-
-        csv_resp = requests.get(csv_url, timeout=30)
-        csv_resp.raise_for_status()
-        csv_resp.encoding = csv_resp.apparent_encoding or 'utf-8'
-
-        reader = csv.DictReader(io.StringIO(csv_resp.text), delimiter=';')
-        results = []
-        for row in reader:
-            bfs = _safe_int(row.get('BFS_NR') or row.get('bfs_nr') or row.get('gemeinde_bfs'))
-            if not bfs:
-                continue
-            results.append({
-                "bfs_number": bfs,
-                "total_roof_area_m2": _safe_float(row.get('dachflaeche_total_m2') or row.get('total_roof_area_m2')),
-                "suitable_roof_area_m2": _safe_float(row.get('dachflaeche_geeignet_m2') or row.get('suitable_roof_area_m2')),
-                "potential_kwh_year": _safe_float(row.get('potenzial_kwh_jahr') or row.get('potential_kwh_year')),
-                "potential_kwp": _safe_float(row.get('potenzial_kwp') or row.get('potential_kwp')),
-                "utilization_pct": _safe_float(row.get('auslastung_pct') or row.get('utilization_pct')),
-            })
-        logger.info(f"[PUBLIC_DATA] Sonnendach: {len(results)} municipalities parsed")
-        return results
+        logger.info(f"[PUBLIC_DATA] Sonnendach: {len(data['rows'])} municipalities parsed")
+        return data["rows"]
     except Exception as e:
         logger.error(f"[PUBLIC_DATA] Sonnendach fetch failed: {e}")
         return []
@@ -287,16 +613,38 @@ def refresh_municipality(bfs_number: int, year: int = 2026) -> Dict:
     return result
 
 
-def refresh_canton(kanton: str = 'ZH', year: int = 2026) -> Dict:
-    """Batch refresh: fetch Energie Reporter + Sonnendach, then per-municipality ElCom."""
+def _tariff_digest(tariffs: List[Dict]) -> str:
+    return hashlib.sha256(json.dumps(tariffs, sort_keys=True).encode()).hexdigest()
+
+
+def _load_source(loader, name: str, cache: RawResourceCache, result: Dict) -> Dict:
+    try:
+        return loader(cache)
+    except Exception as e:
+        logger.error(f"[PUBLIC_DATA] {name} fetch failed: {e}")
+        result["errors"].append({"bfs": None, "error": f"{name}: {e}"})
+        return {"rows": [], "changed": False, "changed_bfs": set(), "diff": None, "resources": []}
+
+
+def refresh_canton(kanton: str = 'ZH', year: int = 2026, force: bool = False) -> Dict:
+    """Batch refresh: Energie Reporter + Sonnendach + ElCom, writing only what changed.
+
+    Datasets come through the raw cache (conditional requests, content hash)
+    and are diffed per BFS number; ElCom tariffs are compared against the
+    digests of the last successful refresh. Only municipalities touched by a
+    change are re-derived and saved, unless force is set. Baselines are kept
+    per canton; municipalities whose profile could not be built are retried
+    on the next run.
+    """
     import database as db
 
     result = {"kanton": kanton, "municipalities": 0, "errors": []}
+    raw_cache = RawResourceCache(scope=kanton.upper() if kanton else None)
 
     # 1. Energie Reporter (bulk)
-    er_data = fetch_energie_reporter()
+    er = _load_source(load_energie_reporter, "energie_reporter", raw_cache, result)
     er_by_bfs = {}
-    for entry in er_data:
+    for entry in er["rows"]:
         bfs = entry.get("bfs_number")
         k = entry.get("kanton", "")
         if bfs and (not kanton or k.upper() == kanton.upper()):
@@ -304,56 +652,109 @@ def refresh_canton(kanton: str = 'ZH', year: int = 2026) -> Dict:
     result["energie_reporter_records"] = len(er_by_bfs)
 
     # 2. Sonnendach (bulk)
-    sd_data = fetch_sonnendach_municipal()
+    sd = _load_source(load_sonnendach_municipal, "sonnendach", raw_cache, result)
     sd_by_bfs = {}
-    for entry in sd_data:
+    for entry in sd["rows"]:
         bfs = entry.get("bfs_number")
         if bfs:
             sd_by_bfs[bfs] = entry
-            db.save_sonnendach_municipal(entry)
     result["sonnendach_records"] = len(sd_by_bfs)
 
-    # 3. Merge and save profiles
+    # 3. ElCom tariffs (concurrent, batched)
     all_bfs = set(list(er_by_bfs.keys()) + ZH_BFS_NUMBERS)
-    for bfs in all_bfs:
-        try:
-            er = er_by_bfs.get(bfs, {})
-            sd = sd_by_bfs.get(bfs, {})
-
-            # ElCom tariffs
-            tariffs = fetch_elcom_tariffs(bfs, year)
-            if tariffs:
-                db.save_elcom_tariffs(tariffs)
-
-            h4 = next((t for t in tariffs if t.get("category", "").startswith("H4")), None)
-            value_gap = compute_leg_value_gap(h4) if h4 else {"annual_savings_chf": 0}
-
-            profile = {
-                "bfs_number": bfs,
-                "name": er.get("name", ""),
-                "kanton": er.get("kanton", kanton),
-                "population": er.get("population"),
-                "solar_potential_pct": er.get("solar_potential_pct"),
-                "solar_installed_kwp": sd.get("potential_kwp"),
-                "ev_share_pct": er.get("ev_share_pct"),
-                "renewable_heating_pct": er.get("renewable_heating_pct"),
-                "electricity_consumption_mwh": er.get("electricity_consumption_mwh"),
-                "renewable_production_mwh": er.get("renewable_production_mwh"),
-                "leg_value_gap_chf": value_gap.get("annual_savings_chf", 0),
-                "data_sources": {
-                    "elcom": bool(tariffs),
-                    "energie_reporter": bfs in er_by_bfs,
-                    "sonnendach": bfs in sd_by_bfs,
-                    "last_refresh": datetime.now().isoformat(),
-                },
-            }
-            profile["energy_transition_score"] = compute_energy_transition_score(profile)
-            db.save_municipality_profile(profile)
-            result["municipalities"] += 1
-        except Exception as e:
-            logger.error(f"[PUBLIC_DATA] Error refreshing BFS {bfs}: {e}")
-            result["errors"].append({"bfs": bfs, "error": str(e)})
-
+    tariffs_by_bfs, elcom_errors = fetch_elcom_tariffs_many(sorted(all_bfs), year)
+    for bfs, error in elcom_errors.items():
+        result["errors"].append({"bfs": bfs, "error": f"elcom: {error}"})
+    state_name = f"elcom_{kanton}_{year}"
+    digests = raw_cache.load_state(state_name)
+    new_digests = {str(bfs): _tariff_digest(t) for bfs, t in tariffs_by_bfs.items()}
+    elcom_changed = {bfs for bfs in tariffs_by_bfs if digests.get(str(bfs)) != new_digests[str(bfs)]}
+    # Profiles that failed last time: their upstream change is already in the baseline
+    failed_state = f"failed_{kanton}_{year}"
+    retry = {int(b) for b in raw_cache.load_state(failed_state).get("bfs", [])} & all_bfs
+
+    # 4. Change set
+    if force:
+        dirty = set(all_bfs)
+        sonnendach_rows = list(sd_by_bfs.values())
+        elcom_changed = set(tariffs_by_bfs)
+    else:
+        dirty = ((er["changed_bfs"] | sd["changed_bfs"]) & all_bfs) | elcom_changed | retry
+        sonnendach_rows = [sd_by_bfs[b] for b in sd["changed_bfs"] if b in sd_by_bfs]
+    result["changed"] = {
+        "energie_reporter": len(er["changed_bfs"]),
+        "sonnendach": len(sd["changed_bfs"]),
+        "elcom": len(elcom_changed),
+    }
+    result["retried"] = len(retry)
+    result["unchanged_municipalities"] = len(all_bfs - dirty)
+    if not dirty and not sonnendach_rows:
+        logger.info(f"[PUBLIC_DATA] Canton {kanton}: upstream data unchanged, nothing to write")
+        for resource in er["resources"] + sd["resources"]:
+            raw_cache.commit(resource)  # refreshed validators (ETag etc.)
+        return result
+
+    # 5. Merge profiles; all rows are written in bulk within one transaction
+    failed = set()
+    try:
+        with db.public_data_batch() as batch:
+            for entry in sonnendach_rows:
+                batch.add_sonnendach(entry)
+
+            for bfs in dirty:
+                try:
+                    er_row = er_by_bfs.get(bfs, {})
+                    sd_row = sd_by_bfs.get(bfs, {})
+                    tariffs = tariffs_by_bfs.get(bfs, [])
+
+                    h4 = next((t for t in tariffs if t.get("category", "").startswith("H4")), None)
+                    value_gap = compute_leg_value_gap(h4) if h4 else {"annual_savings_chf": 0}
+
+                    profile = {
+                        "bfs_number": bfs,
+                        "name": er_row.get("name", ""),
+                        "kanton": er_row.get("kanton", kanton),
+                        "population": er_row.get("population"),
+                        "solar_potential_pct": er_row.get("solar_potential_pct"),
+                        "solar_installed_kwp": sd_row.get("potential_kwp"),
+                        "ev_share_pct": er_row.get("ev_share_pct"),
+                        "renewable_heating_pct": er_row.get("renewable_heating_pct"),
+                        "electricity_consumption_mwh": er_row.get("electricity_consumption_mwh"),
+                        "renewable_production_mwh": er_row.get("renewable_production_mwh"),
+                        "leg_value_gap_chf": value_gap.get("annual_savings_chf", 0),
+                        "data_sources": {
+                            "elcom": bool(tariffs),
+                            "energie_reporter": bfs in er_by_bfs,
+                            "sonnendach": bfs in sd_by_bfs,
+                            "last_refresh": datetime.now().isoformat(),
+                        },
+                    }
+                    profile["energy_transition_score"] = compute_energy_transition_score(profile)
+                except Exception as e:
+                    logger.error(f"[PUBLIC_DATA] Error refreshing BFS {bfs}: {e}")
+                    result["errors"].append({"bfs": bfs, "error": str(e)})
+                    failed.add(bfs)
+                    continue
+                # Write errors abort the transaction and are handled below
+                if tariffs and bfs in elcom_changed:
+                    batch.add_tariffs(tariffs)
+                batch.add_profile(profile)
+                result["municipalities"] += 1
+        result["db_statements"] = batch.statements
+    except Exception as e:
+        # The whole refresh is one transaction: nothing was saved, keep the old baseline
+        logger.error(f"[PUBLIC_DATA] Saving canton {kanton} refresh failed: {e}")
+        result["errors"].append({"bfs": None, "error": f"database: {e}"})
+        result["municipalities"] = 0
+        return result
+
+    # 6. Saved: the fetched data becomes the baseline for the next diff
+    for resource in er["resources"] + sd["resources"]:
+        raw_cache.commit(resource)
+    # Failed municipalities keep their old tariff digest and are retried next run
+    digests.update({bfs: digest for bfs, digest in new_digests.items() if int(bfs) not in failed})
+    raw_cache.save_state(state_name, digests)
+    raw_cache.save_state(failed_state, {"bfs": sorted(failed)})
     return result
 
 
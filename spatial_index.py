@@ -0,0 +1,201 @@
+"""
+Spatial grid index for OpenLEG building coordinates.
+Buckets points into fixed-size lat/lon cells so radius queries only touch
+neighbouring cells; exact distances come from a vectorized haversine.
+"""
+import math
+import time
+import logging
+import threading
+from typing import Callable, Dict, Hashable, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371e3
+METERS_PER_DEGREE_LAT = EARTH_RADIUS_M * math.pi / 180
+
+
+def haversine_m(lat, lon, lats, lons):
+    """Great-circle distance in meters from one point to arrays of points."""
+    phi1 = np.radians(lat)
+    phi2 = np.radians(np.asarray(lats, dtype=np.float64))
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+class GridIndex:
+    """
+    Mutable point index on a lat/lon grid with cell_meters edge length.
+
+    Latitude cells are cell_meters tall; longitude cells are sized at
+    ref_lat, and queries widen the column range by 1/cos(lat) so results
+    stay exact at any latitude. A radius query costs the number of touched
+    cells plus the candidates inside them, independent of the index size.
+    """
+
+    def __init__(self, cell_meters: float = 150.0, ref_lat: float = 47.0):
+        self.cell_lat = cell_meters / METERS_PER_DEGREE_LAT
+        self.cell_lon = self.cell_lat / math.cos(math.radians(ref_lat))
+        self._cells: Dict[Tuple[int, int], set] = {}
+        self._coords: Dict[Hashable, Tuple[float, float]] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._coords)
+
+    def __contains__(self, key):
+        return key in self._coords
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_lat)), int(math.floor(lon / self.cell_lon))
+
+    def coords(self, key) -> Tuple[float, float]:
+        return self._coords[key]
+
+    def keys(self) -> List[Hashable]:
+        return list(self._coords)
+
+    def insert(self, key, lat: float, lon: float):
+        """Insert or move a point."""
+        with self._lock:
+            if key in self._coords:
+                self.remove(key)
+            lat, lon = float(lat), float(lon)
+            self._coords[key] = (lat, lon)
+            self._cells.setdefault(self._cell(lat, lon), set()).add(key)
+
+    def remove(self, key) -> bool:
+        with self._lock:
+            coords = self._coords.pop(key, None)
+            if coords is None:
+                return False
+            cell = self._cell(*coords)
+            bucket = self._cells.get(cell)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._cells[cell]
+            return True
+
+    def query_radius(self, lat: float, lon: float, radius_m: float, with_distance: bool = False) -> List:
+        """Keys within radius_m of (lat, lon), nearest first.
+
+        Returns a list of keys, or (key, distance_m) pairs when with_distance.
+        """
+        lat, lon = float(lat), float(lon)
+        row, col = self._cell(lat, lon)
+        d_rows = int(math.ceil(radius_m / METERS_PER_DEGREE_LAT / self.cell_lat))
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + radius_m / METERS_PER_DEGREE_LAT, 89.9))), 1e-6)
+        d_cols = int(math.ceil(radius_m / (METERS_PER_DEGREE_LAT * cos_lat) / self.cell_lon))
+
+        with self._lock:
+            candidates = []
+            for r in range(row - d_rows, row + d_rows + 1):
+                for c in range(col - d_cols, col + d_cols + 1):
+                    bucket = self._cells.get((r, c))
+                    if bucket:
+                        candidates.extend(bucket)
+            if not candidates:
+                return []
+            coords = np.array([self._coords[k] for k in candidates], dtype=np.float64)
+
+        dist = haversine_m(lat, lon, coords[:, 0], coords[:, 1])
+        hits = np.flatnonzero(dist <= radius_m)
+        hits = hits[np.argsort(dist[hits], kind='stable')]
+        if with_distance:
+            return [(candidates[i], float(dist[i])) for i in hits]
+        return [candidates[i] for i in hits]
+
+
+class BuildingIndex:
+    """
+    Process-wide GridIndex over building profiles, kept fresh incrementally.
+
+    Registrations/removals in this process are applied directly (add/remove).
+    Registrations in other worker processes are pulled every refresh_seconds
+    through load_since(unix_ts); a full reload every reload_seconds picks up
+    removals made elsewhere. Both loaders should raise on errors: a failed
+    load keeps the current index and is retried after refresh_seconds, and a
+    reload that comes back empty never replaces a non-empty index.
+    """
+
+    SYNC_OVERLAP_SECONDS = 30
+
+    def __init__(self, load_all: Callable[[], List[Dict]], load_since: Callable[[float], List[Dict]],
+                 cell_meters: float = 150.0, refresh_seconds: float = 60, reload_seconds: float = 900):
+        self._load_all = load_all
+        self._load_since = load_since
+        self.cell_meters = cell_meters
+        self.refresh_seconds = refresh_seconds
+        self.reload_seconds = reload_seconds
+        self._grid = GridIndex(cell_meters)
+        self._profiles: Dict[Hashable, Dict] = {}
+        self._loaded_at = 0.0
+        self._synced_at = 0.0  # last sync attempt
+        self._sync_from = 0.0  # registrations up to here are in the index
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def _reload(self):
+        grid, profiles = GridIndex(self.cell_meters), {}
+        started = time.time()
+        try:
+            loaded = self._load_all()
+        except Exception as e:
+            logger.warning(f"[INDEX] Building reload failed, keeping {len(self._profiles)} buildings: {e}")
+            loaded = None
+        if not loaded and self._profiles:
+            # Retry after refresh_seconds rather than on every query
+            self._loaded_at = started - self.reload_seconds + self.refresh_seconds
+            return
+        for p in loaded or []:
+            if p.get('building_id') and p.get('lat') is not None and p.get('lon') is not None:
+                grid.insert(p['building_id'], p['lat'], p['lon'])
+                profiles[p['building_id']] = p
+        self._grid, self._profiles = grid, profiles
+        self._loaded_at = self._synced_at = self._sync_from = started
+
+    def refresh(self, force: bool = False):
+        """Full reload when stale, otherwise pull registrations since the last sync."""
+        now = time.time()
+        with self._lock:
+            if force or not self._loaded_at or now - self._loaded_at > self.reload_seconds:
+                self._reload()
+            elif now - self._synced_at > self.refresh_seconds:
+                since = self._sync_from - self.SYNC_OVERLAP_SECONDS
+                self._synced_at = now
+                try:
+                    pulled = self._load_since(since)
+                except Exception as e:
+                    logger.warning(f"[INDEX] Building sync failed: {e}")
+                    return
+                self._sync_from = now
+                for p in pulled:
+                    self.add(p)
+
+    def add(self, profile: Dict):
+        bid = profile.get('building_id')
+        if not bid or profile.get('lat') is None or profile.get('lon') is None:
+            return
+        with self._lock:
+            self._grid.insert(bid, profile['lat'], profile['lon'])
+            self._profiles[bid] = profile
+
+    def remove(self, building_id):
+        with self._lock:
+            self._grid.remove(building_id)
+            self._profiles.pop(building_id, None)
+
+    def query(self, lat: float, lon: float, radius_m: float, exclude=None) -> List[Tuple[Dict, float]]:
+        """(profile, distance_m) pairs within radius_m, nearest first."""
+        self.refresh()
+        with self._lock:
+            grid, profiles = self._grid, self._profiles
+        return [(profiles[k], d) for k, d in grid.query_radius(lat, lon, radius_m, with_distance=True)
+                if k != exclude and k in profiles]
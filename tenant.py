@@ -15,6 +15,7 @@ logger = logging.getLogger(__name__)
 _tenant_cache: Dict[str, tuple] = {}
 CACHE_TTL_SECONDS = 300  # 5 min
 REDIS_TENANT_TTL = 300  # 5 min Redis TTL
+L1_TENANT_TTL = 60  # in-process copy, evicted on invalidation by pub/sub
 
 DEFAULT_TENANT = {
     "territory": "zurich",
@@ -73,11 +74,11 @@ def resolve_tenant(hostname: str) -> str:
 
 
 def get_tenant_config(territory: str, db=None) -> Dict:
-    """Load tenant config: Redis -> DB -> defaults. Graceful fallback at each layer."""
+    """Load tenant config: L1 -> Redis -> DB -> defaults. Graceful fallback at each layer."""
     redis_key = f"tenant:{territory}"
 
-    # 1. Try Redis
-    cached = cache.cache_get(redis_key)
+    # 1. Try in-process L1, then Redis
+    cached = cache.cache_get(redis_key, local_ttl=L1_TENANT_TTL)
     if cached and isinstance(cached, dict):
         return cached
 
@@ -94,7 +95,7 @@ def get_tenant_config(territory: str, db=None) -> Dict:
             row = _load_tenant_from_db(territory, db)
             if row:
                 config = _merge_tenant_row(row)
-                cache.cache_set(redis_key, config, ttl=REDIS_TENANT_TTL)
+                cache.cache_set(redis_key, config, ttl=REDIS_TENANT_TTL, local_ttl=L1_TENANT_TTL)
                 _tenant_cache[territory] = (config, now)
                 return config
         except Exception as e:
@@ -110,7 +111,7 @@ def get_tenant_config(territory: str, db=None) -> Dict:
         config["platform_name"] = "OpenLEG"
         config["brand_prefix"] = "OpenLEG"
 
-    cache.cache_set(redis_key, config, ttl=REDIS_TENANT_TTL)
+    cache.cache_set(redis_key, config, ttl=REDIS_TENANT_TTL, local_ttl=L1_TENANT_TTL)
     _tenant_cache[territory] = (config, now)
     return config
 
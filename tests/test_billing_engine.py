@@ -167,3 +167,44 @@ class TestEdgeCases:
         consumption = pd.DataFrame({"a": [7.0]})
         result = allocate_energy(production, consumption, model="proportional")
         assert abs(result["a"].iloc[0] - 7.0) < 0.01
+
+
+class TestVectorizedParity:
+    """Vectorized engine must match the per-interval reference loop."""
+
+    @staticmethod
+    def _random_period(seed, intervals=672, participants=12):
+        rng = np.random.default_rng(seed)
+        index = pd.date_range("2026-06-01", periods=intervals, freq="15min")
+        production = pd.Series(rng.uniform(-1.0, 30.0, intervals), index=index)
+        production[rng.random(intervals) < 0.3] = 0.0
+        consumption = pd.DataFrame(
+            rng.uniform(0.0, 3.0, (intervals, participants)),
+            index=index,
+            columns=[f"p{i}" for i in range(participants)],
+        )
+        consumption[rng.random((intervals, participants)) < 0.1] = 0.0
+        return production, consumption
+
+    @pytest.mark.parametrize("model", ["proportional", "einfach"])
+    def test_matches_reference(self, model):
+        from billing_engine import allocate_energy, _allocate_energy_reference
+        for seed in range(3):
+            production, consumption = self._random_period(seed)
+            fast = allocate_energy(production, consumption, model=model)
+            slow = _allocate_energy_reference(production, consumption, model=model)
+            assert list(fast.columns) == list(slow.columns)
+            assert fast.index.equals(slow.index)
+            np.testing.assert_allclose(fast.values, slow.values, rtol=1e-9, atol=1e-9)
+
+    def test_matrix_shape_mismatch_raises(self):
+        from billing_engine import allocate_energy_matrix
+        with pytest.raises(ValueError):
+            allocate_energy_matrix(np.ones(3), np.ones((4, 2)))
+
+    def test_unknown_model_allocates_nothing(self):
+        from billing_engine import allocate_energy
+        production = pd.Series([10.0])
+        consumption = pd.DataFrame({"a": [4.0], "b": [6.0]})
+        result = allocate_energy(production, consumption, model="unknown")
+        assert result.values.sum() == 0.0
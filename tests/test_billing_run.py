@@ -0,0 +1,165 @@
+"""Tests for billing_run.py - batched multi-community billing."""
+import numpy as np
+import pytest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+
+def _matrix(members, intervals=96, start=datetime(2026, 5, 1), missing=()):
+    import database as db
+    index = np.datetime64(start, 'm') + np.arange(intervals) * np.timedelta64(15, 'm')
+    consumption = np.tile([0.5 + 0.1 * n for n in range(len(members))], (intervals, 1))
+    production = np.zeros((intervals, len(members)))
+    production[24:72, 0] = 2.0
+    absent = np.zeros((intervals, len(members)), dtype=bool)
+    for building_id in missing:
+        col = members.index(building_id)
+        absent[:, col] = True
+        consumption[:, col] = production[:, col] = 0.0
+    return db.MeterMatrix(index, list(members), consumption, production, absent, np.zeros_like(absent))
+
+
+MEMBERS = {"c1": ["a", "b"], "c2": ["x", "y", "z"], "c3": ["q"]}
+BATCH_MATRIX_IDS = ["a", "b", "x", "y", "z", "q"]
+
+
+COMMUNITIES = [
+    {"community_id": "c1", "distribution_model": "proportional"},
+    {"community_id": "c2", "distribution_model": "simple"},
+    {"community_id": "c3", "distribution_model": "proportional"},
+]
+
+
+class TestPreviousMonth:
+    def test_mid_year(self):
+        from billing_run import previous_month
+        assert previous_month(datetime(2026, 6, 15)) == (datetime(2026, 5, 1), datetime(2026, 6, 1))
+
+    def test_january_wraps_year(self):
+        from billing_run import previous_month
+        assert previous_month(datetime(2026, 1, 3)) == (datetime(2025, 12, 1), datetime(2026, 1, 1))
+
+
+class TestBuildPayloads:
+    def test_slices_members_and_pools_production(self):
+        from billing_run import build_payloads
+        payloads = build_payloads(COMMUNITIES[:1], MEMBERS, _matrix(["a", "b"]))
+        assert len(payloads) == 1
+        p = payloads[0]
+        assert p["participants"] == ["a", "b"]
+        assert p["consumption"].shape == (96, 2)
+        assert p["production"].sum() == pytest.approx(96.0)
+
+    def test_maps_simple_to_einfach(self):
+        from billing_run import build_payloads
+        payloads = build_payloads(COMMUNITIES[1:2], MEMBERS, _matrix(["x", "y", "z"]))
+        assert payloads[0]["distribution_model"] == "einfach"
+
+    def test_communities_without_readings_are_left_out(self):
+        from billing_run import build_payloads
+        matrix = _matrix(BATCH_MATRIX_IDS, missing=["q"])
+        payloads = build_payloads(COMMUNITIES, MEMBERS, matrix)
+        assert [p["community_id"] for p in payloads] == ["c1", "c2"]
+        assert build_payloads(COMMUNITIES, {}, matrix) == []
+
+
+class TestRunBilling:
+    def _run(self, workers=0, save_return=None):
+        with patch("database.get_active_communities", return_value=COMMUNITIES), \
+             patch("database.load_community_members", return_value=MEMBERS), \
+             patch("database.load_meter_matrix", return_value=_matrix(BATCH_MATRIX_IDS, missing=["q"])) as load, \
+             patch("database.save_billing_periods", return_value=save_return or [1, 2]) as save:
+            import billing_run
+            report = billing_run.run_billing(datetime(2026, 5, 1), datetime(2026, 6, 1), workers=workers)
+        return report, load, save
+
+    def test_report_counts_and_throughput(self):
+        report, load, save = self._run()
+        assert report["communities"] == 3
+        assert report["processed"] == 2
+        assert report["skipped"] == 1
+        assert report["intervals"] == 192
+        assert report["failed"] == []
+        assert report["communities_per_s"] > 0
+        assert report["intervals_per_s"] > 0
+
+    def test_one_load_and_one_save_per_batch(self):
+        report, load, save = self._run()
+        assert load.call_count == 1
+        assert load.call_args[0][0] == BATCH_MATRIX_IDS
+        assert save.call_count == 1
+        records = save.call_args[0][0]
+        assert {r["community_id"] for r in records} == {"c1", "c2"}
+        assert all(r["summary"]["participants"] for r in records)
+
+    def test_matches_billing_engine(self):
+        import pandas as pd
+        from billing_engine import generate_billing_summary
+        report, load, save = self._run()
+        m = _matrix(["a", "b"])
+        expected = generate_billing_summary(pd.Series(m.production.sum(axis=1)),
+                                            pd.DataFrame(m.consumption, columns=["a", "b"]),
+                                            0.095, 0.15, "same", "proportional")
+        assert save.call_args[0][0][0]["summary"] == expected
+
+    def test_failed_save_marks_batch_failed(self):
+        with patch("database.get_active_communities", return_value=COMMUNITIES[:1]), \
+             patch("database.load_community_members", return_value=MEMBERS), \
+             patch("database.load_meter_matrix", return_value=_matrix(["a", "b"])), \
+             patch("database.save_billing_periods", return_value=[]):
+            import billing_run
+            report = billing_run.run_billing(datetime(2026, 5, 1), datetime(2026, 6, 1), workers=0)
+        assert report["processed"] == 0
+        assert report["failed"] == ["c1"]
+
+    def test_failed_load_marks_batch_failed(self):
+        with patch("database.get_active_communities", return_value=COMMUNITIES), \
+             patch("database.load_community_members", return_value=MEMBERS), \
+             patch("database.load_meter_matrix", side_effect=RuntimeError("connection lost")), \
+             patch("database.save_billing_periods") as save:
+            import billing_run
+            report = billing_run.run_billing(datetime(2026, 5, 1), datetime(2026, 6, 1), workers=0)
+        assert report["skipped"] == 0
+        assert report["failed"] == ["c1", "c2", "c3"]
+        save.assert_not_called()
+
+    def test_half_given_period_is_rejected(self):
+        import billing_run
+        with pytest.raises(ValueError):
+            billing_run.run_billing(datetime(2026, 5, 1), None)
+
+    def test_process_pool_matches_inline(self):
+        inline, _, save_inline = self._run(workers=0)
+        pooled, _, save_pooled = self._run(workers=2)
+        assert pooled["processed"] == inline["processed"]
+        assert [r["summary"] for r in save_pooled.call_args[0][0]] == \
+               [r["summary"] for r in save_inline.call_args[0][0]]
+
+
+class TestSaveBillingPeriods:
+    def test_rerun_replaces_period_and_line_items(self):
+        import database as db
+        cur = MagicMock()
+        cur.fetchone.side_effect = [{"id": 7}]
+        conn = MagicMock()
+        conn.cursor.return_value.__enter__.return_value = cur
+
+        @contextmanager
+        def get_connection():
+            yield conn
+
+        summary = {"total_production_kwh": 1.0, "total_allocated_kwh": 1.0, "total_network_discount_chf": 0.1,
+                   "participants": [{"id": "a", "consumption_kwh": 1.0, "allocated_kwh": 1.0,
+                                     "self_supply_ratio": 1.0, "internal_cost_chf": 0.15,
+                                     "network_discount_chf": 0.1}]}
+        with patch.object(db, "get_connection", get_connection), \
+             patch("psycopg2.extras.execute_values") as ev:
+            ids = db.save_billing_periods([{"community_id": "c1", "period_start": datetime(2026, 5, 1),
+                                            "period_end": datetime(2026, 6, 1), "summary": summary}])
+        assert ids == [7]
+        sql = [c[0][0] for c in cur.execute.call_args_list]
+        assert "ON CONFLICT (community_id, period_start, period_end) DO UPDATE" in sql[0]
+        assert sql[1].startswith("DELETE FROM billing_line_items")
+        assert cur.execute.call_args_list[1][0][1] == ([7],)
+        assert ev.call_args[0][2][0][:2] == (7, "a")
@@ -9,8 +9,11 @@ def mock_redis():
     mock.get.return_value = None
     mock.setex.return_value = True
     mock.delete.return_value = True
+    import cache
+    cache._generations.clear()
     with patch('cache._get_redis', return_value=mock):
         yield mock
+    cache._generations.clear()
 
 
 class TestCacheOperations:
@@ -52,3 +55,375 @@ class TestTenantCache:
             from cache import cache_get, cache_set
             assert cache_get("key") is None
             cache_set("key", "val")  # should not raise
+
+
+@pytest.fixture
+def l1():
+    import cache
+    cache.local_cache.clear()
+    with patch('cache._ensure_listener'):
+        yield cache.local_cache
+    cache.local_cache.clear()
+
+
+class TestLocalCache:
+    """In-process L1 in front of Redis."""
+
+    def test_lru_eviction_and_counters(self):
+        import cache
+        lc = cache.LocalCache(max_entries=2)
+        lc.set("a", 1, 60)
+        lc.set("b", 2, 60)
+        assert lc.get("a") == 1          # a becomes most recent
+        lc.set("c", 3, 60)               # evicts b
+        assert lc.get("b") is cache._MISSING
+        stats = lc.stats()
+        assert stats["evictions"] == 1
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["entries"] == 2
+
+    def test_ttl_expiry(self):
+        import cache
+        lc = cache.LocalCache(max_entries=10)
+        with patch('cache.time.monotonic', return_value=100.0):
+            lc.set("a", 1, 5)
+        with patch('cache.time.monotonic', return_value=106.0):
+            assert lc.get("a") is cache._MISSING
+        assert lc.stats()["expirations"] == 1
+
+    def test_hot_key_skips_redis(self, mock_redis, l1):
+        import json
+        from cache import cache_get
+        mock_redis.get.return_value = json.dumps({"data": 1}).encode()
+        assert cache_get("hot", local_ttl=30) == {"data": 1}
+        assert cache_get("hot", local_ttl=30) == {"data": 1}
+        assert mock_redis.get.call_count == 1
+        # Without local_ttl Redis is always consulted
+        cache_get("hot")
+        assert mock_redis.get.call_count == 2
+
+    def test_delete_broadcasts_invalidation(self, mock_redis, l1):
+        import json
+        from cache import cache_set, cache_delete, INVALIDATION_CHANNEL
+        cache_set("tenant:a", {"x": 1}, local_ttl=30)
+        cache_delete("tenant:a")
+        channel, message = mock_redis.publish.call_args[0]
+        assert channel == INVALIDATION_CHANNEL
+        assert json.loads(message)["op"] == "delete"
+        assert l1.stats()["entries"] == 0
+
+    def test_remote_invalidation_evicts(self, l1):
+        import json
+        import cache
+        l1.set("tenant:a", 1, 60)
+        l1.set("tenant:b", 2, 60)
+        l1.set("other", 3, 60)
+        cache._handle_invalidation(json.dumps({"op": "delete", "key": "tenant:a", "origin": "w2"}))
+        assert l1.get("tenant:a") is cache._MISSING
+        cache._handle_invalidation(json.dumps({"op": "prefix", "key": "tenant:", "origin": "w2"}))
+        assert l1.get("tenant:b") is cache._MISSING
+        assert l1.get("other") == 3
+        # Own messages are ignored
+        l1.set("tenant:c", 4, 60)
+        cache._handle_invalidation(json.dumps({"op": "delete", "key": "tenant:c", "origin": cache._WORKER_ID}))
+        assert l1.get("tenant:c") == 4
+
+
+class TestNamespaceGenerations:
+    """Namespace invalidation is one INCR, keys embed the generation."""
+
+    def test_clear_namespace_is_single_incr(self, mock_redis):
+        from cache import cache_clear_prefix, cache_get
+        mock_redis.incr.return_value = 3
+        cache_clear_prefix("insights:")
+        mock_redis.incr.assert_called_once_with("openleg:_gen:insights")
+        mock_redis.keys.assert_not_called()
+        mock_redis.scan_iter.assert_not_called()
+
+        cache_get("insights:demand:261")
+        mock_redis.get.assert_called_with("openleg:insights:v3:demand:261")
+
+    def test_generation_read_from_redis(self, mock_redis):
+        from cache import cache_set
+        mock_redis.get.side_effect = lambda k: b"7" if k == "openleg:_gen:tenant" else None
+        cache_set("tenant:baden", {"a": 1})
+        assert mock_redis.setex.call_args[0][0] == "openleg:tenant:v7:baden"
+
+    def test_remote_bump_applies_generation(self, mock_redis):
+        import json
+        import cache
+        cache._handle_invalidation(json.dumps({"op": "prefix", "key": "tenant:", "gen": 4, "origin": "w2"}))
+        assert cache._redis_key("tenant:baden") == "openleg:tenant:v4:baden"
+
+    def test_sweeper_uses_scan_and_unlink(self, mock_redis):
+        from cache import cache_purge_prefix
+        keys = [f"openleg:tenant:v1:{i}".encode() for i in range(1200)]
+        mock_redis.scan_iter.return_value = iter(keys)
+        mock_redis.unlink.side_effect = lambda *batch: len(batch)
+        assert cache_purge_prefix("tenant:", background=False) == 1200
+        assert mock_redis.scan_iter.call_args[1]["match"] == "openleg:tenant:*"
+        assert mock_redis.unlink.call_count == 3
+
+    def test_sweeper_covers_generations_of_sub_prefix(self, mock_redis):
+        from cache import cache_purge_prefix
+        scans = {
+            "openleg:tenant:zurich*": [b"openleg:tenant:zurich:a"],
+            "openleg:tenant:v[0-9]*:zurich*": [b"openleg:tenant:v3:zurich:b", b"openleg:tenant:v3:x:zurich:c"],
+        }
+        mock_redis.scan_iter.side_effect = lambda match, count: iter(scans[match])
+        mock_redis.unlink.side_effect = lambda *batch: len(batch)
+        assert cache_purge_prefix("tenant:zurich", background=False) == 2
+        assert mock_redis.unlink.call_args[0] == (b"openleg:tenant:zurich:a", b"openleg:tenant:v3:zurich:b")
+
+    def test_non_namespace_prefix_is_swept_before_returning(self, mock_redis):
+        from cache import cache_clear_prefix
+        with patch('cache.cache_purge_prefix') as purge:
+            cache_clear_prefix("tenant:ba")
+        purge.assert_called_once_with("tenant:ba", background=False)
+        mock_redis.incr.assert_not_called()
+
+        scans = {"openleg:tenant:v[0-9]*:zurich*": [b"openleg:tenant:v2:zurich:a"]}
+        mock_redis.scan_iter.side_effect = lambda match, count: iter(scans.get(match, []))
+        mock_redis.unlink.side_effect = lambda *batch: len(batch)
+        with patch('threading.Thread') as thread:
+            cache_clear_prefix("tenant:zurich")
+        thread.assert_not_called()
+        mock_redis.unlink.assert_called_with(b"openleg:tenant:v2:zurich:a")
+
+
+class _DictRedis:
+    """Just enough of redis-py for the @cached tests."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value if isinstance(value, bytes) else str(value).encode()
+        return True
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value).encode()
+        return True
+
+    def eval(self, script, numkeys, key, token):
+        if self.data.get(key) == str(token).encode():
+            del self.data[key]
+            return 1
+        return 0
+
+    def delete(self, *keys):
+        return sum(1 for k in keys if self.data.pop(k, None) is not None)
+
+    def publish(self, channel, message):
+        return 0
+
+
+@pytest.fixture
+def dict_redis():
+    import cache
+    fake = _DictRedis()
+    cache._generations.clear()
+    with patch('cache._get_redis', return_value=fake), \
+         patch('cache._ensure_listener'):
+        yield fake
+    cache._generations.clear()
+
+
+class TestCachedDecorator:
+    """@cached: single-flight, stale-while-revalidate, metrics."""
+
+    def _counting(self, **kwargs):
+        from cache import cached
+        calls = []
+
+        @cached(key_fn=lambda x: str(x), **kwargs)
+        def compute(x):
+            calls.append(x)
+            return {"x": x, "n": len(calls)}
+
+        return compute, calls
+
+    def test_hit_skips_compute(self, dict_redis):
+        import uuid
+        compute, calls = self._counting(ttl=60, namespace=f"t{uuid.uuid4().hex[:6]}")
+        assert compute(1) == {"x": 1, "n": 1}
+        assert compute(1) == {"x": 1, "n": 1}
+        assert compute(2)["n"] == 2
+        assert calls == [1, 2]
+
+    def test_single_flight_waits_for_lock_holder(self, dict_redis):
+        import json
+        import time
+        import uuid
+        ns = f"t{uuid.uuid4().hex[:6]}"
+        compute, calls = self._counting(ttl=60, namespace=ns, wait_timeout=2)
+        # Another worker holds the lock and publishes its result shortly
+        dict_redis.data[f"openleg:{ns}:7:lock"] = b"other"
+        import threading
+
+        def publish():
+            time.sleep(0.1)
+            dict_redis.data[f"openleg:{ns}:7"] = json.dumps({"v": "theirs", "t": time.time()}).encode()
+        threading.Thread(target=publish).start()
+
+        assert compute(7) == "theirs"
+        assert calls == []
+        from cache import cache_stats
+        assert cache_stats()["functions"][ns]["waits"] == 1
+
+    def test_stale_value_served_while_refreshing(self, dict_redis):
+        import json
+        import time
+        import uuid
+        ns = f"t{uuid.uuid4().hex[:6]}"
+        compute, calls = self._counting(ttl=10, stale_ttl=100, namespace=ns)
+        dict_redis.data[f"openleg:{ns}:3"] = json.dumps({"v": "old", "t": time.time() - 50}).encode()
+
+        assert compute(3) == "old"
+        for _ in range(50):
+            if calls and f"openleg:{ns}:3:lock" not in dict_redis.data:
+                break
+            time.sleep(0.02)
+        assert calls == [3]
+        assert compute(3) == {"x": 3, "n": 1}
+        stats = __import__("cache").cache_stats()["functions"][ns]
+        assert stats["stale_hits"] == 1 and stats["refreshes"] == 1 and stats["hits"] == 1
+
+    def test_redis_down_calls_function(self):
+        import uuid
+        compute, calls = self._counting(ttl=60, namespace=f"t{uuid.uuid4().hex[:6]}")
+        with patch('cache._get_redis', side_effect=Exception("Connection refused")):
+            assert compute(1)["n"] == 1
+            assert compute(1)["n"] == 2
+
+    def test_decimal_and_datetime_round_trip(self, dict_redis):
+        from datetime import datetime
+        from decimal import Decimal
+        from cache import cached
+
+        @cached(key_fn=lambda: "k", ttl=60, namespace="decimal_roundtrip")
+        def load():
+            return [{"score": Decimal("1.5"), "at": datetime(2026, 1, 1)}]
+
+        load()
+        assert load() == [{"score": 1.5, "at": "2026-01-01T00:00:00"}]
+
+    def test_municipality_profiles_same_types_and_errors_not_cached(self, dict_redis):
+        from contextlib import contextmanager
+        from datetime import datetime
+        from decimal import Decimal
+        from unittest.mock import MagicMock
+        import database as db
+        db._load_municipality_profiles.invalidate_all()
+        cur = MagicMock()
+        cur.fetchall.return_value = [{"bfs_number": 4021, "score": Decimal("61.5"), "updated_at": datetime(2026, 1, 1)}]
+        conn = MagicMock()
+        conn.cursor.return_value.__enter__.return_value = cur
+        state = {"down": True}
+
+        @contextmanager
+        def get_connection():
+            if state["down"]:
+                raise Exception("connection refused")
+            yield conn
+
+        with patch.object(db, "get_connection", get_connection):
+            assert db.get_all_municipality_profiles("AG") == []
+            state["down"] = False
+            miss = db.get_all_municipality_profiles("AG")
+            hit = db.get_all_municipality_profiles("AG")
+        assert miss == hit == [{"bfs_number": 4021, "score": 61.5, "updated_at": "2026-01-01T00:00:00"}]
+        assert cur.execute.call_count == 1
+
+
+class TestSerialization:
+    """Format marker, compression, legacy JSON."""
+
+    def test_round_trip_every_serializer(self):
+        import cache
+        value = {"a": [1, 2.5, "x", None, True], "nested": {"k": "v"}}
+        for name in cache._serializers:
+            with patch.object(cache, "SERIALIZER", name):
+                raw = cache._dumps(value)
+                assert raw[1:2] == cache._serializers[name][0]
+                assert cache._loads(raw) == value
+
+    def test_large_values_are_compressed(self):
+        import cache
+        value = {"rows": ["same text"] * 2000}
+        raw = cache._dumps(value)
+        assert raw[2:3] == b"z"
+        assert len(raw) < cache.COMPRESS_THRESHOLD
+        assert cache._loads(raw) == value
+
+    def test_jsonable_keys_match_every_serializer(self):
+        import cache
+        value = cache.jsonable({261: {"2026": 1.5, 3: [{True: None}]}, None: 1})
+        assert value == {"261": {"2026": 1.5, "3": [{"true": None}]}, "null": 1}
+        for name in cache._serializers:
+            with patch.object(cache, "SERIALIZER", name):
+                assert cache._loads(cache._dumps(value)) == value
+
+    def test_corrupt_entry_is_a_miss(self, dict_redis):
+        import uuid
+        import cache
+        calls = []
+        namespace = f"t{uuid.uuid4().hex[:6]}"
+
+        @cache.cached(key_fn=lambda x: str(x), ttl=60, namespace=namespace)
+        def compute(x):
+            calls.append(x)
+            return {"x": x}
+
+        compute(1)
+        for key in [k for k in dict_redis.data if k.startswith(f"openleg:{namespace}:")]:
+            dict_redis.data[key] = cache.FORMAT_MAGIC + b"j" + b"z" + b"not zlib"
+        assert compute(1) == {"x": 1}
+        assert calls == [1, 1]
+
+    def test_legacy_json_still_reads(self, mock_redis):
+        import json
+        from cache import cache_get
+        mock_redis.get.return_value = json.dumps({"legacy": 1}).encode()
+        assert cache_get("old") == {"legacy": 1}
+
+
+class TestBatchOperations:
+    """cache_get_many / cache_set_many."""
+
+    def test_get_many_single_mget(self, mock_redis):
+        import json
+        import cache
+        mock_redis.mget.return_value = [cache._dumps({"n": 1}), None, json.dumps([2]).encode()]
+        result = cache.cache_get_many(["a", "b", "c"])
+        assert result == {"a": {"n": 1}, "c": [2]}
+        mock_redis.mget.assert_called_once_with(["openleg:a", "openleg:b", "openleg:c"])
+        mock_redis.get.assert_not_called()
+
+    def test_get_many_serves_l1_first(self, mock_redis, l1):
+        import cache
+        cache.local_cache.set("hot", "cached", 60)
+        mock_redis.mget.return_value = [None]
+        assert cache.cache_get_many(["hot", "cold"], local_ttl=60) == {"hot": "cached"}
+        mock_redis.mget.assert_called_once_with(["openleg:cold"])
+
+    def test_set_many_uses_one_pipeline(self, mock_redis):
+        import cache
+        cache.cache_set_many({"a": 1, "b": {"x": 2}}, ttl=30)
+        pipe = mock_redis.pipeline.return_value
+        assert [c[0][0] for c in pipe.setex.call_args_list] == ["openleg:a", "openleg:b"]
+        assert cache._loads(pipe.setex.call_args_list[1][0][2]) == {"x": 2}
+        pipe.execute.assert_called_once()
+        mock_redis.setex.assert_not_called()
+
+    def test_batch_ops_survive_redis_down(self):
+        with patch('cache._get_redis', side_effect=Exception("Connection refused")):
+            from cache import cache_get_many, cache_set_many
+            assert cache_get_many(["a"]) == {}
+            cache_set_many({"a": 1})  # should not raise
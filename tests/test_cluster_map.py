@@ -0,0 +1,52 @@
+"""Tests for the cluster map snapshot and /api/get_all_clusters."""
+from unittest.mock import patch
+
+ROWS = [
+    {"cluster_id": 1, "autarky_percent": 42.5, "polygon": [[47.0, 8.0], [47.1, 8.0], [47.0, 8.0]],
+     "members": [{"building_id": "a", "lat": 47.0, "lon": 8.0},
+                 {"building_id": "b", "lat": 47.1, "lon": 8.0}]},
+    {"cluster_id": 2, "autarky_percent": None, "polygon": None,
+     "members": [{"building_id": "c", "lat": 47.2, "lon": 8.1},
+                 {"building_id": "d", "lat": 47.21, "lon": 8.1},
+                 {"building_id": "e", "lat": 47.2, "lon": 8.11}]},
+    {"cluster_id": 3, "autarky_percent": 10, "polygon": [], "members": [{"building_id": "f", "lat": 47.3, "lon": 8.2}]},
+]
+
+
+class TestSnapshot:
+    def test_build_uses_stored_polygon_and_skips_singletons(self):
+        import json
+        import cluster_map
+        etag, body = cluster_map.build_snapshot(ROWS)
+        clusters = json.loads(body)["clusters"]
+        assert [c["cluster_id"] for c in clusters] == [1, 2]
+        assert clusters[0]["polygon"] == ROWS[0]["polygon"]
+        assert len(clusters[1]["polygon"]) >= 4  # computed for legacy rows
+        assert clusters[1]["autarky_percent"] == 0.0
+        assert etag == cluster_map.build_snapshot(ROWS)[0]
+
+    def test_publish_then_read_from_cache(self):
+        import cluster_map
+        stored = {}
+        with patch("database.get_cluster_map_rows", return_value=ROWS) as rows, \
+             patch("cache.cache_set_raw", side_effect=lambda k, v, ttl: stored.update({k: v})), \
+             patch("cache.cache_get_raw", side_effect=lambda k: stored.get(k)):
+            etag = cluster_map.publish_snapshot()
+            assert cluster_map.get_snapshot()[0] == etag
+            assert rows.call_count == 1
+
+    def test_db_error_keeps_previous_snapshot(self):
+        import cluster_map
+        with patch("database.get_cluster_map_rows", return_value=ROWS), \
+             patch("cache.cache_set_raw"), patch("cache.cache_get_raw", return_value=None):
+            etag = cluster_map.publish_snapshot()
+        with patch("database.get_cluster_map_rows", return_value=None), \
+             patch("cache.cache_get_raw", return_value=None), \
+             patch.object(cluster_map, "LOCAL_SNAPSHOT_TTL", 0):
+            assert cluster_map.publish_snapshot() is None
+            assert cluster_map.get_snapshot()[0] == etag
+
+    def test_with_polygon(self):
+        import cluster_map
+        info = cluster_map.with_polygon({"members": ROWS[1]["members"]})
+        assert info["polygon"][0] == info["polygon"][-1]
@@ -0,0 +1,292 @@
+"""Tests for the spatial grid index and incremental clustering."""
+import itertools
+
+import numpy as np
+import pytest
+from unittest.mock import patch
+
+
+def _random_buildings(n, seed=0):
+    rng = np.random.default_rng(seed)
+    lats = 47.37 + rng.normal(0, 0.004, n)
+    lons = 8.54 + rng.normal(0, 0.006, n)
+    return [
+        {"building_id": f"b{i}", "lat": float(lats[i]), "lon": float(lons[i]),
+         "annual_consumption_kwh": 4500.0, "potential_pv_kwp": 8.0}
+        for i in range(n)
+    ]
+
+
+def _partition(labels):
+    clusters = {}
+    for bid, label in labels.items():
+        if label >= 0:
+            clusters.setdefault(label, set()).add(bid)
+    return sorted(sorted(members) for members in clusters.values())
+
+
+def _dbscan_partition(buildings, radius=150, min_samples=2):
+    from sklearn.cluster import DBSCAN
+    coords = np.radians([[b["lat"], b["lon"]] for b in buildings])
+    labels = DBSCAN(eps=radius / 6371e3, min_samples=min_samples, metric="haversine",
+                    algorithm="ball_tree").fit(coords).labels_
+    return _partition({b["building_id"]: int(l) for b, l in zip(buildings, labels)})
+
+
+@pytest.fixture
+def no_db():
+    # Stands in for cluster_id_seq
+    with patch("database.next_cluster_id", side_effect=itertools.count().__next__):
+        yield
+
+
+class TestGridIndex:
+    def test_query_matches_brute_force(self):
+        from spatial_index import GridIndex, haversine_m
+        buildings = _random_buildings(400, seed=1)
+        index = GridIndex(cell_meters=150)
+        for b in buildings:
+            index.insert(b["building_id"], b["lat"], b["lon"])
+
+        lats = np.array([b["lat"] for b in buildings])
+        lons = np.array([b["lon"] for b in buildings])
+        for b in buildings[:50]:
+            dist = haversine_m(b["lat"], b["lon"], lats, lons)
+            expected = {buildings[i]["building_id"] for i in np.flatnonzero(dist <= 300)}
+            assert set(index.query_radius(b["lat"], b["lon"], 300)) == expected
+
+    def test_nearest_first_and_remove(self):
+        from spatial_index import GridIndex
+        index = GridIndex()
+        index.insert("far", 47.0010, 8.0)
+        index.insert("near", 47.0001, 8.0)
+        hits = index.query_radius(47.0, 8.0, 500, with_distance=True)
+        assert [k for k, _ in hits] == ["near", "far"]
+        assert hits[0][1] < hits[1][1]
+
+        assert index.remove("near")
+        assert not index.remove("near")
+        assert index.query_radius(47.0, 8.0, 500) == ["far"]
+        assert len(index) == 1
+
+
+class TestBuildingIndex:
+    def test_incremental_refresh_and_exclude(self):
+        from spatial_index import BuildingIndex
+        loaded = [{"building_id": "a", "lat": 47.0, "lon": 8.0}]
+        pulled = []
+        index = BuildingIndex(load_all=lambda: list(loaded),
+                              load_since=lambda since: pulled.append(since) or
+                              [{"building_id": "c", "lat": 47.0005, "lon": 8.0}],
+                              refresh_seconds=-1)
+        index.refresh()
+        index.add({"building_id": "b", "lat": 47.0002, "lon": 8.0})
+
+        hits = index.query(47.0, 8.0, 150, exclude="a")
+        assert [p["building_id"] for p, _ in hits] == ["b", "c"]
+        assert pulled  # other workers' registrations pulled incrementally
+
+        index.remove("b")
+        assert [p["building_id"] for p, _ in index.query(47.0, 8.0, 150)] == ["a", "c"]
+
+    def test_full_reload_drops_removed_buildings(self):
+        from spatial_index import BuildingIndex
+        loaded = [{"building_id": "a", "lat": 47.0, "lon": 8.0},
+                  {"building_id": "b", "lat": 47.0001, "lon": 8.0}]
+        index = BuildingIndex(load_all=lambda: list(loaded), load_since=lambda since: [])
+        assert len(index.query(47.0, 8.0, 150)) == 2
+        loaded.pop()
+        index.refresh(force=True)
+        assert len(index) == 1
+
+    def test_failed_or_empty_reload_keeps_index(self):
+        from spatial_index import BuildingIndex
+        loaded = [{"building_id": "a", "lat": 47.0, "lon": 8.0}]
+        state = {"fail": False}
+
+        def load_all():
+            if state["fail"]:
+                raise RuntimeError("connection lost")
+            return list(loaded)
+
+        index = BuildingIndex(load_all=load_all, load_since=lambda since: [])
+        index.refresh()
+        state["fail"] = True
+        index.refresh(force=True)
+        assert len(index.query(47.0, 8.0, 150)) == 1
+        state["fail"] = False
+        loaded.clear()
+        index.refresh(force=True)
+        assert len(index) == 1
+
+    def test_failed_sync_is_pulled_again(self):
+        from spatial_index import BuildingIndex
+        calls = []
+
+        def load_since(since):
+            calls.append(since)
+            if len(calls) == 1:
+                raise RuntimeError("connection lost")
+            return [{"building_id": "b", "lat": 47.0001, "lon": 8.0}]
+
+        index = BuildingIndex(load_all=lambda: [{"building_id": "a", "lat": 47.0, "lon": 8.0}],
+                              load_since=load_since, refresh_seconds=-1)
+        index.refresh()
+        index.refresh()
+        index.refresh()
+        assert calls[0] == calls[1]  # the watermark did not move past the failed pull
+        assert len(index) == 2
+
+
+class TestIncrementalClustering:
+    def test_inserts_match_dbscan(self, no_db):
+        from clustering import CityClusterState
+        buildings = _random_buildings(300, seed=2)
+        state = CityClusterState("city")
+        for b in buildings:
+            state.add_building(b)
+        assert _partition(state.labels) == _dbscan_partition(buildings)
+
+    def test_removals_split_like_dbscan(self, no_db):
+        from clustering import CityClusterState
+        buildings = _random_buildings(300, seed=3)
+        state = CityClusterState("city")
+        for b in buildings:
+            state.add_building(b)
+        removed = {b["building_id"] for b in buildings[::7]}
+        for bid in removed:
+            state.remove_building(bid)
+        remaining = [b for b in buildings if b["building_id"] not in removed]
+        assert _partition(state.labels) == _dbscan_partition(remaining)
+
+    def test_chain_split_keeps_id(self, no_db):
+        from clustering import CityClusterState
+        step = 0.001  # ~111 m between neighbours
+        chain = [{"building_id": f"c{i}", "lat": 47.0 + i * step, "lon": 8.0} for i in range(5)]
+        state = CityClusterState("city")
+        for b in chain:
+            state.add_building(b)
+        cid = state.labels["c0"]
+        assert len(set(state.labels.values())) == 1
+
+        state.remove_building("c1")
+        assert state.labels["c0"] == -1
+        assert {state.labels[b] for b in ("c2", "c3", "c4")} == {cid}
+
+    def test_merge_reuses_smallest_id(self, no_db):
+        from clustering import CityClusterState
+        state = CityClusterState("city")
+        for b in [{"building_id": "a0", "lat": 47.0, "lon": 8.0},
+                  {"building_id": "a1", "lat": 47.001, "lon": 8.0},
+                  {"building_id": "z0", "lat": 47.003, "lon": 8.0},
+                  {"building_id": "z1", "lat": 47.004, "lon": 8.0}]:
+            state.add_building(b)
+        assert state.labels["a0"] != state.labels["z0"]
+        low = min(state.labels["a0"], state.labels["z0"])
+        state.changed_buildings.clear()
+        state.touched_clusters.clear()
+
+        state.add_building({"building_id": "bridge", "lat": 47.002, "lon": 8.0})
+        assert set(state.labels.values()) == {low}
+        assert low in state.touched_clusters
+        assert state.removed_clusters == {low + 1}
+
+    def test_flush_writes_only_changes(self, no_db):
+        from clustering import CityClusterState
+        state = CityClusterState("city")
+        for b in _random_buildings(40, seed=4):
+            state.add_building(b)
+        with patch("database.save_clusters") as save, \
+             patch("database.delete_clusters"), \
+             patch("database.save_cluster_info") as save_info, \
+             patch("database.delete_cluster_info"):
+            state.flush()
+            save.reset_mock()
+            save_info.reset_mock()
+
+            state.add_building({"building_id": "new", "lat": 47.37, "lon": 8.54,
+                                "annual_consumption_kwh": 4000.0, "potential_pv_kwp": 5.0})
+            result = state.flush()
+
+        written = save.call_args[0][0] if save.called else {}
+        assert written == {bid: state.labels[bid] for bid in written}
+        assert "new" in written or state.labels["new"] == -1
+        assert result["clusters_updated"] == save_info.call_count
+        assert result["clusters_updated"] <= 1
+
+    def test_rebuild_reuses_stored_ids(self, no_db):
+        from clustering import CityClusterState
+        buildings = [{"building_id": "a", "lat": 47.0, "lon": 8.0},
+                     {"building_id": "b", "lat": 47.0005, "lon": 8.0}]
+        state = CityClusterState("city")
+        state.rebuild(buildings, {"a": 42, "b": 42})
+        assert state.labels == {"a": 42, "b": 42}
+        assert not state.changed_buildings
+        assert not state.removed_clusters
+
+
+class TestCrossProcessState:
+    def test_invalidation_drops_city_state(self, no_db):
+        import clustering
+        import cache
+        with patch.object(clustering, "_states", {"baden": object(), "zurich": object(), None: object()}):
+            cache._handle_invalidation('{"op": "delete", "key": "cluster_state:baden", "origin": "w2"}')
+            assert set(clustering._states) == {"zurich", None}
+            cache._handle_invalidation('{"op": "delete", "key": "cluster_state:-", "origin": "w2"}')
+            assert set(clustering._states) == {"zurich"}
+            cache._handle_invalidation('{"op": "prefix", "key": "cluster_state:", "origin": "w2"}')
+            assert clustering._states == {}
+
+    def test_every_change_is_broadcast(self, no_db):
+        import clustering
+        state = clustering.CityClusterState("baden")
+        state.loaded_at = state.synced_at = 1e12
+        pair = _random_buildings(2, seed=3)
+        pair[1].update(lat=pair[0]["lat"], lon=pair[0]["lon"] + 0.0005)
+        with patch.object(clustering, "_states", {"baden": state}), \
+             patch("cache.listen"), \
+             patch("cache.broadcast_invalidation") as broadcast, \
+             patch("database.get_building_profiles_since", side_effect=[[], pair, [], []]), \
+             patch("database.save_clusters"), patch("database.delete_clusters"), \
+             patch("database.delete_cluster_info"), patch("cluster_map.publish_snapshot"):
+            clustering.run_incremental("baden", added=[])
+            broadcast.assert_not_called()
+            clustering.run_incremental("baden", added=["b0", "b1"])
+            assert broadcast.call_count == 1
+            clustering.run_incremental("baden", removed=["b1"])
+            assert broadcast.call_count == 2
+            clustering.run_incremental("baden", removed=["unknown"])
+        assert broadcast.call_count == 2
+        broadcast.assert_called_with("cluster_state:baden")
+
+    def test_failed_run_drops_local_state(self):
+        import clustering
+        state = clustering.CityClusterState("baden")
+        state.loaded_at = state.synced_at = 1e12
+        pair = _random_buildings(2, seed=3)
+        pair[1].update(lat=pair[0]["lat"], lon=pair[0]["lon"] + 0.0005)
+        with patch.object(clustering, "_states", {"baden": state}), \
+             patch("cache.listen"), \
+             patch("database.next_cluster_id", side_effect=RuntimeError("database down")), \
+             patch("database.get_building_profiles_since", return_value=pair):
+            with pytest.raises(RuntimeError):
+                clustering.run_incremental("baden")
+            assert "baden" not in clustering._states
+
+
+class TestSchedule:
+    def test_registrations_collapse_into_one_job_per_city(self):
+        import clustering
+        import jobs
+        queue = jobs.JobQueue(store=jobs.MemoryJobStore())
+        queue.register(clustering.CLUSTERING_JOB, clustering._run_job)
+        with patch.object(jobs, "queue", queue):
+            first = clustering.schedule("baden", added=["a"])
+            assert clustering.schedule("baden", added=["b"]) == first
+            assert clustering.schedule("baden", removed=["c"]) == first
+            assert clustering.schedule("zurich", added=["d"]) != first
+
+        with patch("clustering.run_incremental") as run:
+            queue.store._jobs[first]["run_after"] = 0
+            assert queue.run_pending(clustering.CLUSTERING_JOB) == 1
+        run.assert_called_once_with("baden", added={"a", "b"}, removed={"c"})
@@ -77,6 +77,18 @@ class TestComputeMunicipalityDemandSignal:
         assert vd["demand_score"] > 0
         assert sig["demand_level"] in ("low", "medium", "high")
 
+    def test_uploads_count_compacted_meter_months(self):
+        """Buildings whose readings were all compacted into meter_month_blobs
+        still count as meter data uploads."""
+        mock_db = _make_db_mock([])
+        with patch("insights_engine.db", mock_db):
+            from insights_engine import compute_municipality_demand_signal
+            compute_municipality_demand_signal(bfs_number=261)
+
+        sql = mock_db.get_connection.return_value.cursor.return_value.execute.call_args_list[0][0][0]
+        assert "SELECT building_id FROM meter_month_blobs" in sql
+        assert "UNION" in sql
+
     def test_positive_case_high_demand_level(self):
         """Municipality with many verified buildings reaches 'high' demand level
         (demand_score >= 40)."""
@@ -0,0 +1,58 @@
+"""Tests for formation_wizard.get_formable_clusters proximity query."""
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+
+def _fake_db(rows, earthdistance=False):
+    cur = MagicMock()
+    cur.fetchone.return_value = {"lat": 47.4, "lon": 8.3}
+    cur.fetchall.return_value = rows
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cur
+
+    @contextmanager
+    def get_connection():
+        yield conn
+
+    return SimpleNamespace(get_connection=get_connection, HAS_EARTHDISTANCE=earthdistance), cur
+
+
+class TestFormableClusters:
+    def test_bounding_box_query_and_pagination(self):
+        import formation_wizard
+        rows = [{"building_id": f"b{i}", "address": "x", "email": "e", "lat": 47.4, "lon": 8.3,
+                 "distance": 10.0 * i, "total": 25} for i in range(10)]
+        db, cur = _fake_db(rows)
+
+        result = formation_wizard.get_formable_clusters(db, "me", radius_meters=150, limit=10, offset=10)
+
+        sql, params = cur.execute.call_args[0]
+        assert "HAVING" not in sql
+        assert "BETWEEN %(lat_min)s AND %(lat_max)s" in sql
+        assert params["lat_min"] < 47.4 < params["lat_max"]
+        assert params["lon_max"] - params["lon_min"] > params["lat_max"] - params["lat_min"]
+        assert (params["limit"], params["offset"]) == (10, 10)
+
+        cluster = result[0]
+        assert cluster["total_nearby"] == 25
+        assert cluster["potential_members"] == 26
+        assert cluster["has_more"] is True
+        assert "total" not in cluster["nearby_buildings"][0]
+
+    def test_earthdistance_prefilter_when_available(self):
+        import formation_wizard
+        db, cur = _fake_db([], earthdistance=True)
+        assert formation_wizard.get_formable_clusters(db, "me") == []
+        sql = cur.execute.call_args[0][0]
+        assert "earth_box(ll_to_earth" in sql
+        assert "BETWEEN" not in sql
+
+    def test_page_past_end_still_counts(self):
+        import formation_wizard
+        db, cur = _fake_db([])
+        cur.fetchone.side_effect = [{"lat": 47.4, "lon": 8.3}, {"total": 4}]
+        result = formation_wizard.get_formable_clusters(db, "me", offset=50)
+        assert result[0]["total_nearby"] == 4
+        assert result[0]["nearby_buildings"] == []
+        assert result[0]["has_more"] is False
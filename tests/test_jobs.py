@@ -0,0 +1,142 @@
+"""Tests for the background job queue (in-memory store)."""
+import time
+
+import pytest
+
+
+@pytest.fixture
+def queue():
+    import jobs
+    q = jobs.JobQueue(store=jobs.MemoryJobStore())
+    yield q
+    q.stop()
+
+
+class TestJobStore:
+    def test_dedup_merges_pending_payload(self, queue):
+        queue.register("cluster", lambda p: None)
+        a = queue.enqueue("cluster", {"city_id": "baden", "added": ["b1"]}, dedup_key="city:baden")
+        b = queue.enqueue("cluster", {"city_id": "baden", "added": ["b2", "b1"]}, dedup_key="city:baden")
+        assert a == b
+        job = queue.store.claim("cluster")[0]
+        assert job["payload"]["added"] == ["b1", "b2"]
+
+    def test_dedup_key_runs_single_flight(self, queue):
+        queue.register("cluster", lambda p: None)
+        queue.enqueue("cluster", {"n": 1}, dedup_key="city:baden")
+        running = queue.store.claim("cluster")[0]
+        second = queue.enqueue("cluster", {"n": 2}, dedup_key="city:baden")
+        assert second != running["id"]
+        assert queue.store.claim("cluster") == []
+
+        queue.store.complete(running["id"])
+        assert queue.store.claim("cluster")[0]["id"] == second
+
+    def test_merge_payload_unions_lists(self):
+        from jobs import merge_payload
+        assert merge_payload({"added": ["a"], "n": 1}, {"added": ["b", "a"], "n": 2}) == {"added": ["a", "b"], "n": 2}
+        assert merge_payload(None, {"n": 1}) == {"n": 1}
+
+    def test_unknown_job_type(self, queue):
+        with pytest.raises(ValueError):
+            queue.enqueue("nope", {})
+
+
+class TestJobQueue:
+    def test_retry_then_fail(self, queue, monkeypatch):
+        import jobs
+        monkeypatch.setattr(jobs, "JOB_RETRY_BASE_SECONDS", 0)
+        calls = []
+
+        def flaky(payload):
+            calls.append(payload)
+            raise RuntimeError("smtp down")
+
+        queue.register("mail", flaky, max_attempts=3)
+        job_id = queue.enqueue("mail", {"to": "a@example.ch"})
+        assert queue.run_pending("mail") == 3
+        assert len(calls) == 3
+        assert queue.store._jobs[job_id]["status"] == "failed"
+        m = queue.metrics()["mail"]
+        assert m["retried"] == 2
+        assert m["failed"] == 1
+        assert m["processed"] == 0
+
+    def test_worker_pool_processes_and_reports_metrics(self, queue):
+        seen = []
+        queue.register("mail", lambda p: seen.append(p["i"]), workers=2)
+        queue.start()
+        for i in range(20):
+            queue.enqueue("mail", {"i": i})
+
+        deadline = time.time() + 5
+        while len(seen) < 20 and time.time() < deadline:
+            time.sleep(0.01)
+        assert sorted(seen) == list(range(20))
+        m = queue.metrics()["mail"]
+        assert m["processed"] == 20
+        assert m["pending"] == 0
+        assert m["workers"] == 2
+        assert m["avg_wait_ms"] >= 0
+
+    def test_autostart_once_per_process(self, monkeypatch):
+        import os
+        import jobs
+        q = jobs.JobQueue(store=jobs.MemoryJobStore(), autostart=True)
+        seen = []
+        q.register("mail", lambda p: seen.append(p["i"]))
+        try:
+            q.enqueue("mail", {"i": 1})
+            assert q._started_pid == os.getpid()
+            threads = list(q._types["mail"].threads)
+            q.ensure_started()
+            assert q._types["mail"].threads == threads
+
+            # A forked child inherits _started_pid of the parent but none of its threads
+            q._started_pid = -1
+            q.ensure_started()
+            assert q._started_pid == os.getpid() and q._types["mail"].threads != threads
+            deadline = time.time() + 5
+            while not seen and time.time() < deadline:
+                time.sleep(0.01)
+            assert seen == [1]
+        finally:
+            q.stop()
+
+    def test_no_autostart_by_default(self, queue):
+        queue.register("mail", lambda p: None)
+        queue.enqueue("mail", {})
+        assert queue._types["mail"].threads == []
+
+    def test_stale_running_job_is_requeued(self, queue):
+        queue.register("mail", lambda p: None)
+        job_id = queue.enqueue("mail", {})
+        queue.store.claim("mail")
+        queue.store._jobs[job_id]["heartbeat_ts"] -= 3600
+        assert queue.store.requeue_stale(60) == 1
+        assert queue.run_pending("mail") == 1
+        assert queue.store._jobs[job_id]["status"] == "done"
+
+    def test_long_job_with_heartbeat_is_not_requeued(self, monkeypatch):
+        import threading
+        import jobs
+        monkeypatch.setattr(jobs, "JOB_HEARTBEAT_SECONDS", 0.01)
+        release = threading.Event()
+        q = jobs.JobQueue(store=jobs.MemoryJobStore())
+        q.register("billing", lambda p: release.wait(5))
+        try:
+            q.start()
+            job_id = q.enqueue("billing", {})
+            job = q.store._jobs[job_id]
+            deadline = time.time() + 5
+            while job["status"] != "running" and time.time() < deadline:
+                time.sleep(0.01)
+            job["started_ts"] -= 3600
+            job["heartbeat_ts"] -= 3600
+            while job["heartbeat_ts"] < time.time() - 60 and time.time() < deadline:
+                time.sleep(0.01)
+            assert q.store.requeue_stale(60) == 0
+            assert job["status"] == "running"
+        finally:
+            release.set()
+            q.stop()
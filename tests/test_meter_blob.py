@@ -0,0 +1,201 @@
+"""Tests for the compressed per-building monthly meter blob store."""
+import calendar
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+import pytest
+
+
+def _month(slots=31 * 96, seed=0):
+    rng = np.random.default_rng(seed)
+    values = np.column_stack([np.round(rng.gamma(2, 0.15, slots), 3),
+                              np.round(rng.uniform(0, 2, slots), 3),
+                              np.full(slots, np.nan)])
+    return values
+
+
+def _mock_connection(cur):
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cur
+
+    @contextmanager
+    def get_connection():
+        yield conn
+
+    return get_connection
+
+
+def _blob(building_id="b1", month=date(2026, 1, 1), index=None, values=None, flags=None, slots=31 * 96):
+    import meter_blob
+    values = _month(slots) if values is None else values
+    index = np.arange(slots) if index is None else index
+    flags = np.zeros(index.size, dtype=np.uint8) if flags is None else flags
+    payload = meter_blob.encode(slots, index, values[index], flags, codec="zlib")
+    return {"building_id": building_id, "month": month, "start_ts": datetime(month.year, month.month, 1),
+            "step_seconds": 900, "slots": slots, "codec": "zlib", "payload": memoryview(payload),
+            "source": "csv"}
+
+
+class TestCodec:
+    def test_roundtrip_with_gaps_nulls_and_flags(self):
+        import meter_blob
+        values = _month()
+        index = np.delete(np.arange(values.shape[0]), [10, 11, 500])
+        flags = np.zeros(index.size, dtype=np.uint8)
+        flags[3] = 2
+        payload = meter_blob.encode(values.shape[0], index, values[index], flags, codec="zlib")
+        decoded = meter_blob.decode(payload, values.shape[0], "zlib")
+        assert decoded.present.sum() == index.size
+        assert not decoded.present[[10, 11, 500]].any()
+        np.testing.assert_allclose(decoded.values[index, :2], values[index, :2])
+        assert np.isnan(decoded.values[:, 2]).all()
+        assert decoded.flags[index[3]] == 2
+        # a month of 15-min data shrinks well below the ~100 bytes per row of the row table
+        assert len(payload) < values.shape[0] * 8
+
+    def test_lossless_at_decimal_10_4_resolution_and_range(self):
+        import meter_blob
+        decoded = meter_blob.decode(
+            meter_blob.encode(3, np.arange(3), np.array([[0.0001, 0, 0], [1234.5678, 0, 0], [-0.2501, 0, 0]]),
+                              np.zeros(3), codec="zlib"), 3, "zlib")
+        assert decoded.values[:, 0].tolist() == [0.0001, 1234.5678, -0.2501]
+        with pytest.raises(ValueError):
+            meter_blob.encode(1, np.array([0]), np.array([[2e6, 0, 0]]), np.zeros(1), codec="zlib")
+
+    def test_decodes_version_1_whole_wh_payloads(self):
+        import struct
+        import zlib
+        import meter_blob
+        raw = bytes([1]) + struct.pack("<3i", 1500, 0, 0) + bytes([0x80]) + bytes([0x40]) + bytes([0])
+        decoded = meter_blob.decode(zlib.compress(raw), 1, "zlib")
+        assert decoded.values[0, 0] == 1.5 and decoded.present[0]
+        assert np.isnan(decoded.values[0, 1]) and decoded.values[0, 2] == 0.0
+
+    def test_grid_step(self):
+        from meter_blob import grid_step
+        assert grid_step(np.array([0, 900, 2700])) == 900
+        assert grid_step(np.array([0, 3600, 7200])) == 3600
+        assert grid_step(np.array([0])) == 900
+        assert grid_step(np.array([0, 930])) == 0
+
+
+class TestCompaction:
+    def test_encodes_month_and_deletes_rows(self):
+        import database as db
+        import meter_blob
+        start = datetime(2026, 1, 1)
+        rows = [{"epoch": calendar.timegm((start + timedelta(minutes=15 * i)).timetuple()),
+                 "consumption": 0.25 + i * 0.001, "production": 0.0, "feed_in": None,
+                 "flag": 0, "source": "csv_upload", "seq": 5} for i in range(96)]
+        cur = MagicMock()
+        cur.fetchone.return_value = {"high_water": 10}
+        cur.fetchall.side_effect = [[], rows]
+        with patch.object(db, "get_connection", _mock_connection(cur)):
+            moved = db._compact_meter_month("b1", date(2026, 1, 1))
+        assert moved[0] == 96
+        insert = next(c for c in cur.execute.call_args_list if "INSERT INTO meter_month_blobs" in c[0][0])
+        params = insert[0][1]
+        assert params[3:6] == (900, 31 * 96, meter_blob.CODEC)
+        decoded = meter_blob.decode(params[6], 31 * 96, params[5])
+        assert decoded.present[:96].all() and not decoded.present[96:].any()
+        np.testing.assert_allclose(decoded.values[:96, 0], [r["consumption"] for r in rows], atol=1e-9)
+        assert params[8] == 96 and params[9] == start
+        assert "DELETE FROM meter_readings" in cur.execute.call_args_list[-1][0][0]
+
+    def test_skips_rows_not_yet_rolled_up(self):
+        import database as db
+        cur = MagicMock()
+        cur.fetchone.return_value = {"high_water": 10}
+        cur.fetchall.side_effect = [[], [{"epoch": 1767225600, "consumption": 1.0, "production": 0.0,
+                                          "feed_in": 0.0, "flag": 0, "source": "csv", "seq": 11}]]
+        with patch.object(db, "get_connection", _mock_connection(cur)):
+            assert db._compact_meter_month("b1", date(2026, 1, 1)) is None
+        assert not any("INSERT INTO meter_month_blobs" in c[0][0] for c in cur.execute.call_args_list)
+
+    def test_cutoff_keeps_hot_month(self):
+        import database as db
+        cur = MagicMock()
+        cur.fetchall.return_value = [{"building_id": "b1", "month": date(2026, 1, 1)}]
+        with patch.object(db, "get_connection", _mock_connection(cur)), \
+             patch.object(db, "refresh_meter_rollups") as refresh, \
+             patch.object(db, "_compact_meter_month", return_value=(96, 400)) as compact:
+            result = db.compact_meter_months(before=datetime(2026, 3, 15))
+        refresh.assert_called_once()
+        assert cur.execute.call_args[0][1][0] == date(2026, 3, 1)
+        compact.assert_called_once_with("b1", date(2026, 1, 1))
+        assert result == {"months": 1, "readings": 96, "bytes": 400, "skipped": 0, "more": False}
+
+    def test_limit_bounds_one_run(self):
+        import database as db
+        cur = MagicMock()
+        cur.fetchall.return_value = [{"building_id": b, "month": date(2026, 1, 1)} for b in ("b1", "b2", "b3")]
+        with patch.object(db, "get_connection", _mock_connection(cur)), \
+             patch.object(db, "refresh_meter_rollups"), \
+             patch.object(db, "_compact_meter_month", return_value=(96, 400)) as compact:
+            result = db.compact_meter_months(before=datetime(2026, 3, 15), limit=2)
+        assert cur.execute.call_args[0][1][-1] == 3
+        assert compact.call_count == 2 and result["more"] is True
+
+
+class TestTransparentReads:
+    def test_ingest_into_compacted_month_thaws_it_first(self):
+        import database as db
+        cur = MagicMock()
+        blob = _blob(index=np.arange(4), slots=31 * 96)
+        cur.fetchall.return_value = [blob]
+        with patch.object(db, "get_connection", _mock_connection(cur)), \
+             patch("psycopg2.extras.execute_values") as ev:
+            db.save_meter_readings("b1", [(datetime(2026, 1, 1, 0, 15), 9.0, 0.0, 0.0)])
+        restored = ev.call_args_list[0][0][2]
+        assert [r[1] for r in restored] == [datetime(2026, 1, 1) + timedelta(minutes=15 * i) for i in range(4)]
+        assert restored[0][4] is None  # NULL feed-in survives the round trip
+        assert "DO NOTHING" in ev.call_args_list[0][0][1]
+        assert any("DELETE FROM meter_month_blobs" in c[0][0] for c in cur.execute.call_args_list)
+        assert ev.call_args_list[1][0][2][0][2] == 9.0
+
+    def test_get_meter_readings_merges_blob_rows(self):
+        import database as db
+        cur = MagicMock()
+        hot = [{"building_id": "b1", "timestamp": datetime(2026, 2, 1, 0, 15), "consumption_kwh": 1.0}]
+        cur.fetchall.side_effect = [hot, [_blob()]]
+        with patch.object(db, "get_connection", _mock_connection(cur)):
+            rows = db.get_meter_readings("b1", limit=3)
+        assert [r["timestamp"] for r in rows] == [datetime(2026, 2, 1, 0, 15), datetime(2026, 1, 31, 23, 45),
+                                                  datetime(2026, 1, 31, 23, 30)]
+        assert rows[1]["feed_in_kwh"] is None and rows[1]["source"] == "csv"
+
+    def test_load_meter_matrix_includes_blobs(self):
+        import database as db
+        cur = MagicMock()
+        cur.mogrify.side_effect = lambda sql, params: sql.encode()
+        cur.fetchall.return_value = [_blob(building_id="b2")]
+        with patch.object(db, "get_connection", _mock_connection(cur)):
+            m = db.load_meter_matrix(["b1", "b2"], datetime(2026, 1, 31), datetime(2026, 2, 1))
+        values = _month()
+        assert m.missing[:, 0].all() and not m.missing[:, 1].any()
+        np.testing.assert_allclose(m.consumption[:, 1], values[-96:, 0])
+
+
+class TestCompactionJob:
+    def test_job_runs_one_batch_and_requeues_while_more_remain(self):
+        import os
+        with patch.dict(os.environ, {"DATABASE_URL": "postgresql://x:x@localhost/x"}):
+            with patch("database.init_db", return_value=True), \
+                 patch("database._connection_pool", MagicMock()), \
+                 patch("database.is_db_available", return_value=True):
+                try:
+                    import app as app_module
+                except Exception:
+                    pytest.skip("App import requires live DB")
+        with patch.object(app_module.db, "compact_meter_months", return_value={"more": True}) as compact, \
+             patch.object(app_module.jobs, "enqueue") as enqueue:
+            app_module._run_meter_compaction_job({})
+        compact.assert_called_once_with(limit=app_module.METER_COMPACT_BATCH)
+        enqueue.assert_called_once_with('meter_compaction', {}, dedup_key='meter_compaction')
+
+        with patch.object(app_module.db, "compact_meter_months", return_value={"more": False}), \
+             patch.object(app_module.jobs, "enqueue") as enqueue:
+            app_module._run_meter_compaction_job({})
+        enqueue.assert_not_called()
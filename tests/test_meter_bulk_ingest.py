@@ -0,0 +1,96 @@
+"""Tests for COPY-based bulk ingestion of meter readings."""
+import csv
+import io
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
+
+
+def _readings(n, start=datetime(2026, 1, 1)):
+    return [(start + timedelta(minutes=15 * i), 0.25 + i * 0.001, 0.0, None) for i in range(n)]
+
+
+def _mock_connection(counts=None):
+    cur = MagicMock()
+    cur.fetchone.return_value = counts or {"inserted": 3, "updated": 1}
+    copied = {}
+
+    def copy_expert(sql, stream, size=8192):
+        copied["sql"] = sql
+        copied["data"] = stream.read()
+
+    cur.copy_expert.side_effect = copy_expert
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cur
+
+    @contextmanager
+    def get_connection():
+        yield conn
+
+    return get_connection, cur, copied
+
+
+class TestBulkIngest:
+    def test_copies_rows_and_reports_counts(self):
+        import database as db
+        get_connection, cur, copied = _mock_connection()
+        with patch.object(db, "get_connection", get_connection):
+            result = db.save_meter_readings_bulk("b1", _readings(4), source="csv_upload")
+        assert result == {"inserted": 3, "updated": 1, "total": 4}
+        assert "FROM STDIN" in copied["sql"]
+        rows = list(csv.reader(io.StringIO(copied["data"])))
+        assert len(rows) == 4
+        assert rows[0][:3] == ["0", "b1", "2026-01-01 00:00:00"]
+        assert rows[0][5] == ""  # None -> NULL
+        assert rows[0][6] == "csv_upload"
+        upsert_sql = cur.execute.call_args_list[-1][0][0]
+        assert "ON CONFLICT (building_id, timestamp)" in upsert_sql
+        assert "DISTINCT ON" in upsert_sql
+
+    def test_multi_building_rows(self):
+        import database as db
+        get_connection, cur, copied = _mock_connection()
+        rows = [("b1", datetime(2026, 1, 1), 1.0, 0.0, 0.0), ("b2", datetime(2026, 1, 1), 2.0, 0.0, 0.0)]
+        with patch.object(db, "get_connection", get_connection):
+            db.save_meter_readings_bulk(None, rows)
+        parsed = list(csv.reader(io.StringIO(copied["data"])))
+        assert [r[1] for r in parsed] == ["b1", "b2"]
+
+    def test_stream_spans_many_chunks(self):
+        import database as db
+        get_connection, cur, copied = _mock_connection()
+        with patch.object(db, "get_connection", get_connection):
+            db.save_meter_readings_bulk("b1", _readings(2500))
+        assert len(copied["data"].splitlines()) == 2500
+
+    def test_failure_returns_zero_counts(self):
+        import database as db
+
+        @contextmanager
+        def broken():
+            raise RuntimeError("db down")
+            yield
+
+        with patch.object(db, "get_connection", broken):
+            assert db.save_meter_readings_bulk("b1", _readings(2)) == {"inserted": 0, "updated": 0, "total": 0}
+
+
+class TestThresholdSwitch:
+    def test_large_batch_uses_copy(self):
+        import database as db
+        with patch.object(db, "METER_COPY_THRESHOLD", 10), \
+             patch.object(db, "save_meter_readings_bulk",
+                          return_value={"inserted": 8, "updated": 4, "total": 12}) as bulk:
+            assert db.save_meter_readings("b1", _readings(12)) == 12
+        bulk.assert_called_once()
+
+    def test_small_batch_uses_execute_values(self):
+        import database as db
+        get_connection, cur, copied = _mock_connection()
+        with patch.object(db, "METER_COPY_THRESHOLD", 10), \
+             patch.object(db, "get_connection", get_connection), \
+             patch.object(db, "save_meter_readings_bulk") as bulk, \
+             patch("psycopg2.extras.execute_values") as ev:
+            assert db.save_meter_readings("b1", _readings(3)) == 3
+        bulk.assert_not_called()
+        ev.assert_called_once()
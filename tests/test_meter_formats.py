@@ -58,6 +58,12 @@ class TestCkwFormat:
         assert abs(readings[0][1] - 0.25) < 0.01
         assert abs(readings[0][3] - 0.10) < 0.01
 
+    def test_parse_ascii_ruecklieferung(self):
+        csv = "Datum;Zeit;Bezug (kWh);Ruecklieferung (kWh)\n01.01.2026;00:15;0,25;0,30\n01.01.2026;00:30;0,30;0,40"
+        readings, errors = parse_meter_csv(csv)
+        assert len(readings) == 2
+        assert [round(r[3], 2) for r in readings] == [0.30, 0.40]
+
 
 class TestBkwFormat:
     """BKW: comma-separated, dot decimals."""
@@ -217,3 +223,56 @@ class TestGapDetection:
         readings, _ = parse_meter_csv(csv)
         quality = validate_readings_quality(readings)
         assert any('negative' in i for i in quality['issues'])
+
+
+class TestStreamingParser:
+    """Chunked parsing from file-like objects."""
+
+    def _big_csv(self, rows):
+        from datetime import datetime, timedelta
+        start = datetime(2025, 1, 1)
+        lines = ["Zeitstempel;Verbrauch (kWh);Produktion (kWh);Einspeisung (kWh)"]
+        for i in range(rows):
+            ts = (start + timedelta(minutes=15 * i)).strftime('%d.%m.%Y %H:%M')
+            lines.append(f"{ts};{i % 7},25;0,00;0,00")
+        return "\n".join(lines)
+
+    def test_yields_bounded_chunks(self):
+        import io
+        from meter_data import iter_meter_csv
+        chunks = list(iter_meter_csv(io.StringIO(self._big_csv(2500)), chunk_size=1000))
+        assert [len(r) for r, _ in chunks] == [1000, 1000, 500]
+        assert chunks[-1][0][-1][1] == pytest.approx((2499 % 7) + 0.25)
+
+    def test_binary_stream(self):
+        import io
+        from meter_data import iter_meter_csv
+        content = _load_fixture('ekz_sample.csv').encode('utf-8')
+        readings = [r for chunk, _ in iter_meter_csv(io.BytesIO(content)) for r in chunk]
+        assert len(readings) == 16
+
+    def test_matches_multi_format_parser(self):
+        from meter_data import _parse_timestamp
+        readings, errors = parse_meter_csv(self._big_csv(300))
+        assert not errors
+        assert readings[123][0] == _parse_timestamp("02.01.2025 06:45")
+
+    def test_off_format_row_falls_back(self):
+        csv = ("Zeitstempel;Verbrauch (kWh)\n01.01.2026 00:15;1,00\n"
+               "2026-01-01 00:30;2,00\nkaputt;3,00")
+        readings, errors = parse_meter_csv(csv)
+        assert len(readings) == 2
+        assert readings[1][0].minute == 30
+        assert errors == ["Zeile 4: Ungültiger Zeitstempel 'kaputt'"]
+
+    def test_ingest_stores_per_chunk(self):
+        import io
+        from unittest.mock import patch
+        import meter_data
+        with patch('database.save_meter_readings', side_effect=lambda b, r, source: len(r)) as save, \
+             patch('database.get_meter_reading_stats', return_value={}), \
+             patch('database.track_event'):
+            result = meter_data.ingest_csv('b1', io.StringIO(_load_fixture('ckw_sample.csv')), normalize=False)
+        assert result['success'] is True
+        assert result['readings_count'] == 10
+        assert save.call_count == 1
@@ -0,0 +1,98 @@
+"""Tests for the dense meter matrix loader (COPY TO STDOUT onto a shared grid)."""
+from contextlib import contextmanager
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+
+def _copy_out(responses):
+    """Mock connection whose COPY TO STDOUT writes one CSV payload (or list of pieces) per call."""
+    cur = MagicMock()
+    cur.mogrify.side_effect = lambda sql, params: sql.encode()
+    payloads = iter(responses)
+
+    def copy_expert(sql, buf, size=8192):
+        payload = next(payloads)
+        for piece in [payload] if isinstance(payload, str) else payload:
+            buf.write(piece)
+
+    cur.copy_expert.side_effect = copy_expert
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cur
+
+    @contextmanager
+    def get_connection():
+        yield conn
+
+    return get_connection, cur
+
+
+class TestMeterMatrix:
+    def test_bins_rows_onto_grid(self):
+        import numpy as np
+        import database as db
+        # column, slot, consumption, production, estimated; two 5-min readings land in slot 1
+        get_connection, cur = _copy_out(["0,0,1.5,0.0,0\n1,1,0.2,3.0,0\n1,1,0.3,1.0,1\n0,3,2.0,0.5,0\n"])
+        with patch.object(db, "get_connection", get_connection):
+            m = db.load_meter_matrix(["a", "b"], datetime(2026, 1, 1), datetime(2026, 1, 1, 1, 0))
+        assert m.consumption.shape == (4, 2) and m.consumption.dtype == np.float64
+        assert m.index[1] == np.datetime64("2026-01-01T00:15")
+        np.testing.assert_allclose(m.consumption[:, 0], [1.5, 0.0, 0.0, 2.0])
+        np.testing.assert_allclose(m.consumption[1], [0.0, 0.5])
+        np.testing.assert_allclose(m.production[1], [0.0, 4.0])
+        assert m.missing.sum() == 5
+        assert not m.missing[0, 0] and m.missing[0, 1]
+        assert m.estimated.sum() == 1 and m.estimated[1, 1]
+        assert "TO STDOUT" in cur.copy_expert.call_args[0][0]
+
+    def test_chunks_buildings_per_copy(self):
+        import database as db
+        get_connection, cur = _copy_out(["1,0,1.0,0.0,0\n", "", "0,0,2.0,0.0,0\n"])
+        ids = ["a", "b", "c", "d", "e"]
+        with patch.object(db, "get_connection", get_connection), \
+             patch.object(db, "METER_MATRIX_CHUNK", 2):
+            m = db.load_meter_matrix(ids + ["a"], datetime(2026, 1, 1), datetime(2026, 1, 1, 0, 15))
+        assert m.building_ids == ids
+        assert cur.copy_expert.call_count == 3
+        assert m.consumption[0].tolist() == [0.0, 1.0, 0.0, 0.0, 2.0]
+
+    def test_feeds_billing_engine(self):
+        from billing_engine import allocate_energy_matrix
+        import database as db
+        get_connection, _ = _copy_out(["0,0,1.0,2.0,0\n1,0,3.0,0.0,0\n"])
+        with patch.object(db, "get_connection", get_connection):
+            m = db.load_meter_matrix(["a", "b"], datetime(2026, 1, 1), datetime(2026, 1, 1, 0, 15))
+        alloc = allocate_energy_matrix(m.production.sum(axis=1), m.consumption)
+        assert alloc.sum() == 2.0
+
+    def test_output_is_binned_in_bounded_pieces(self):
+        import database as db
+        lines = [f"0,{slot},1.0,0.0,0\n" for slot in range(96)]
+        pieces = ["".join(lines)[i:i + 7] for i in range(0, len("".join(lines)), 7)]
+        get_connection, cur = _copy_out([pieces])
+        sizes = []
+        real_drain = db._CopyRowSink.drain
+
+        def drain(sink, final=True):
+            sizes.append(sink._size)
+            real_drain(sink, final)
+
+        with patch.object(db, "get_connection", get_connection), \
+             patch.object(db, "METER_MATRIX_BUFFER", 64), \
+             patch.object(db._CopyRowSink, "drain", drain):
+            m = db.load_meter_matrix(["a"], datetime(2026, 1, 1), datetime(2026, 1, 2))
+        assert m.consumption[:, 0].tolist() == [1.0] * 96 and not m.missing.any()
+        assert len(sizes) > 10 and max(sizes) < 64 + 7
+
+    def test_errors_propagate(self):
+        import database as db
+
+        @contextmanager
+        def broken():
+            raise RuntimeError("down")
+            yield
+
+        with patch.object(db, "get_connection", broken):
+            with pytest.raises(RuntimeError):
+                db.load_meter_matrix(["a"], datetime(2026, 1, 1), datetime(2026, 1, 2))
@@ -0,0 +1,161 @@
+"""Tests for resampling and gap-filling meter series onto the 15-minute grid."""
+import io
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import numpy as np
+
+
+def _series(start, n, minutes=15, value=lambda i: 0.3):
+    return [(start + timedelta(minutes=minutes * i), value(i), 0.0, 0.0) for i in range(n)]
+
+
+class TestResampling:
+    def test_hourly_splits_evenly(self):
+        from meter_normalize import normalize_readings, estimated_count, FLAG_RESAMPLED
+        series = normalize_readings(_series(datetime(2026, 1, 1), 3, minutes=60, value=lambda i: 1.0 + i))
+        assert series.source_interval == 3600
+        assert series.index[0] == np.datetime64("2026-01-01T00:00")
+        assert len(series.index) == 12
+        np.testing.assert_allclose(series.values[:, 0], np.repeat([0.25, 0.5, 0.75], 4))
+        assert (series.flags[:, 0] == FLAG_RESAMPLED).all()
+        assert estimated_count(series) == 0  # resampled, not gap-filled
+
+    def test_five_minute_sums_and_scales_partial_slots(self):
+        from meter_normalize import normalize_readings, FLAG_MEASURED, FLAG_RESAMPLED
+        readings = _series(datetime(2026, 1, 1), 12, minutes=5, value=lambda i: 0.1)
+        del readings[4]  # second slot only 2/3 covered
+        series = normalize_readings(readings)
+        np.testing.assert_allclose(series.values[:, 0], [0.3] * 4)
+        assert series.flags[:, 0].tolist() == [FLAG_MEASURED, FLAG_RESAMPLED, FLAG_MEASURED, FLAG_MEASURED]
+
+    def test_energy_is_preserved(self):
+        from meter_normalize import normalize_readings
+        from meter_normalize import FLAG_RESAMPLED
+        readings = _series(datetime(2026, 1, 1), 48, minutes=10, value=lambda i: 0.1 + i * 0.01)
+        series = normalize_readings(readings)
+        assert len(series.index) == 32
+        assert (series.flags[:, 0] == FLAG_RESAMPLED).all()
+        assert abs(series.values[:, 0].sum() - sum(r[1] for r in readings)) < 1e-9
+
+
+class TestGapFilling:
+    def test_short_gap_interpolated_long_gap_profiled(self):
+        from meter_normalize import normalize_readings, estimated_count, FLAG_INTERPOLATED, FLAG_PROFILE
+        readings = _series(datetime(2026, 1, 5), 96 * 14, value=lambda i: (i % 96) / 10)
+        del readings[900:950]  # 50 slots -> profile
+        del readings[500:503]  # 3 slots -> interpolation
+        series = normalize_readings(readings)
+        assert len(series.index) == 96 * 14
+        flags = series.flags[:, 0]
+        assert (flags[500:503] == FLAG_INTERPOLATED).all()
+        np.testing.assert_allclose(series.values[500:503, 0], [(500 % 96) / 10, (501 % 96) / 10, (502 % 96) / 10])
+        assert (flags[900:950] == FLAG_PROFILE).all()
+        # the profile repeats the same weekday/time of day from the other week
+        np.testing.assert_allclose(series.values[900:950, 0], [(i % 96) / 10 for i in range(900, 950)])
+        assert estimated_count(series) == 53
+
+    def test_gap_beyond_profile_limit_stays_missing(self):
+        from meter_normalize import normalize_readings, to_readings, PROFILE_MAX_SLOTS
+        readings = _series(datetime(2026, 1, 5), 96 * 14, value=lambda i: 1.0)
+        gap = PROFILE_MAX_SLOTS + 1
+        del readings[400:400 + gap]
+        series = normalize_readings(readings)
+        assert len(series.index) == 96 * 14 - gap
+        assert series.index[400] - series.index[399] == np.timedelta64(15 * (gap + 1), 'm')
+        assert not np.isnan(series.values[:, 0]).any()
+
+    def test_absent_column_is_null_not_estimated(self):
+        from meter_normalize import normalize_readings, to_readings, estimated_count
+        readings = [(t, c, 0.0, None) for t, c, *_ in _series(datetime(2026, 1, 5), 96)]
+        series = normalize_readings(readings)
+        assert estimated_count(series) == 0
+        assert {r[3] for r in to_readings(series)} == {None}
+
+    def test_dst_hours(self):
+        from meter_normalize import normalize_readings
+        spring = [r for r in _series(datetime(2026, 3, 29), 96) if r[0].hour != 2]
+        series = normalize_readings(spring)
+        assert len(series.index) == 92
+        assert not series.flags.any()
+
+        autumn = _series(datetime(2026, 10, 25), 96, value=lambda i: 0.2)
+        autumn += [r for r in autumn if r[0].hour == 2]
+        series = normalize_readings(autumn)
+        assert len(series.index) == 96
+        assert abs(series.values[:, 0].sum() - 0.2 * 100) < 1e-9
+
+    def test_to_readings_rows_carry_flag(self):
+        from meter_normalize import normalize_readings, to_readings, FLAG_INTERPOLATED
+        readings = _series(datetime(2026, 1, 1), 8)
+        del readings[3]
+        rows = to_readings(normalize_readings(readings))
+        assert len(rows) == 8
+        assert rows[3] == (datetime(2026, 1, 1, 0, 45), 0.3, 0.0, 0.0, FLAG_INTERPOLATED)
+        assert rows[0][4] == 0
+
+
+class TestStreaming:
+    def _stream(self, readings, window, chunk=100):
+        from meter_normalize import StreamNormalizer
+        normalizer = StreamNormalizer(window=window)
+        parts = [normalizer.add(readings[i:i + chunk]) for i in range(0, len(readings), chunk)]
+        return normalizer, parts + normalizer.finish()
+
+    def test_windows_match_whole_upload(self):
+        from meter_normalize import normalize_readings, estimated_count
+        readings = _series(datetime(2026, 1, 5), 96 * 14, value=lambda i: (i % 96) / 10)
+        del readings[900:950]  # profile gap
+        del readings[596:602]  # crosses a chunk boundary
+        del readings[300:303]
+        whole = normalize_readings(readings)
+        normalizer, parts = self._stream(readings, window=300)
+        assert sum(len(p.index) > 0 for p in parts) > 2
+        np.testing.assert_array_equal(np.concatenate([p.index for p in parts]), whole.index)
+        np.testing.assert_allclose(np.concatenate([p.values for p in parts]), whole.values)
+        np.testing.assert_array_equal(np.concatenate([p.flags for p in parts]), whole.flags)
+        assert normalizer.estimated == estimated_count(whole)
+
+    def test_out_of_order_readings_are_kept(self):
+        from meter_normalize import to_readings
+        readings = _series(datetime(2026, 1, 5), 96 * 7)
+        readings.append((datetime(2026, 1, 5, 1), 0.9, 0.0, 0.0))
+        normalizer, parts = self._stream(readings, window=200)
+        rows = {r[0]: r[1] for p in parts for r in to_readings(p)}
+        assert len(rows) == 96 * 7
+        assert rows[datetime(2026, 1, 5, 1)] == 0.9
+
+
+class TestIngest:
+    def test_upload_is_normalized_before_storage(self):
+        import meter_data
+        csv_text = "Zeitstempel;Verbrauch (kWh);Produktion (kWh);Einspeisung (kWh)\n" + "".join(
+            f"01.01.2026 {h:02d}:00;1,00;0;0\n" for h in range(3))
+        with patch("database.save_meter_readings", side_effect=lambda b, r, source: len(r)) as save, \
+             patch("database.get_meter_reading_stats", return_value={}), \
+             patch("database.track_event"), patch("jobs.enqueue"):
+            result = meter_data.ingest_csv("b1", io.StringIO(csv_text), normalize=True)
+        rows = save.call_args[0][1]
+        assert result["readings_count"] == 12
+        assert result["estimated_count"] == 0  # hourly data is resampled, nothing was gap-filled
+        assert result["quality"]["total_readings"] == 3
+        assert rows[1] == (datetime(2026, 1, 1, 0, 15), 0.25, 0.0, 0.0, 1)
+
+    def test_flag_is_written(self):
+        from contextlib import contextmanager
+        from unittest.mock import MagicMock
+        import database as db
+        cur = MagicMock()
+        conn = MagicMock()
+        conn.cursor.return_value.__enter__.return_value = cur
+
+        @contextmanager
+        def get_connection():
+            yield conn
+
+        with patch.object(db, "get_connection", get_connection), \
+             patch("psycopg2.extras.execute_values") as ev:
+            db.save_meter_readings("b1", [(datetime(2026, 1, 1), 0.5, 0.0, 0.0, 2),
+                                          (datetime(2026, 1, 1, 0, 15), 0.5, 0.0, 0.0)])
+        assert [v[-1] for v in ev.call_args[0][2]] == [2, 0]
+        assert "quality_flag = EXCLUDED.quality_flag" in ev.call_args[0][1]
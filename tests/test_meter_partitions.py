@@ -0,0 +1,207 @@
+"""Tests for monthly partitioning of meter_readings."""
+from contextlib import contextmanager
+from datetime import date, datetime
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+
+def _mock_connection(fetchone=None):
+    cur = MagicMock()
+    if fetchone is not None:
+        cur.fetchone.side_effect = fetchone
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cur
+
+    @contextmanager
+    def get_connection():
+        yield conn
+
+    return get_connection, cur
+
+
+@pytest.fixture
+def partitioned():
+    import database as db
+    db._meter_partitions.clear()
+    with patch.object(db, "METER_READINGS_PARTITIONED", True):
+        yield db
+    db._meter_partitions.clear()
+
+
+class TestPartitionHelpers:
+    def test_month_arithmetic(self):
+        import database as db
+        assert db._month_start(datetime(2026, 12, 31, 23, 45)) == date(2026, 12, 1)
+        assert db._next_month(date(2026, 12, 1)) == date(2027, 1, 1)
+        assert db._meter_partition_name(date(2026, 3, 1)) == "meter_readings_y2026m03"
+
+    def test_creates_missing_months_once(self, partitioned):
+        db = partitioned
+        cur = MagicMock()
+        cur.fetchone.return_value = {"existing": None}
+        created = db._ensure_meter_partitions(cur, {date(2026, 2, 1), date(2026, 1, 1)})
+        assert created == ["meter_readings_y2026m01", "meter_readings_y2026m02"]
+        ddl = [c for c in cur.execute.call_args_list if "PARTITION OF meter_readings" in c[0][0]]
+        assert ddl[0][0][1] == (date(2026, 1, 1), date(2026, 2, 1))
+
+        cur.reset_mock()
+        assert db._ensure_meter_partitions(cur, {date(2026, 1, 1)}) == []
+        cur.execute.assert_not_called()
+
+    def test_plain_table_is_left_alone(self):
+        import database as db
+        cur = MagicMock()
+        with patch.object(db, "METER_READINGS_PARTITIONED", False):
+            assert db._ensure_meter_partitions(cur, {date(2026, 1, 1)}) == []
+        cur.execute.assert_not_called()
+
+    def test_attach_runs_in_own_transaction(self, partitioned):
+        db = partitioned
+        get_connection, cur = _mock_connection()
+        cur.fetchone.return_value = None
+        with patch.object(db, "get_connection", get_connection):
+            created = db.ensure_meter_partitions({date(2026, 5, 1)})
+            assert created == ["meter_readings_y2026m05"]
+            sql = [" ".join(c[0][0].split()) for c in cur.execute.call_args_list]
+            assert "pg_advisory_xact_lock" in sql[0]
+            assert sql[2].startswith("CREATE TABLE IF NOT EXISTS meter_readings_y2026m05 (LIKE meter_readings")
+            assert sql[3].startswith("ALTER TABLE meter_readings ATTACH PARTITION meter_readings_y2026m05")
+            assert not any("PARTITION OF" in q for q in sql)
+
+            cur.reset_mock()
+            assert db.ensure_meter_partitions({date(2026, 5, 1)}) == []
+            cur.execute.assert_not_called()
+
+    def test_attached_partition_is_not_recreated(self, partitioned):
+        db = partitioned
+        get_connection, cur = _mock_connection()
+        cur.fetchone.return_value = {"attached": True}
+        with patch.object(db, "get_connection", get_connection):
+            assert db.ensure_meter_partitions({date(2026, 5, 1)}) == []
+        assert not any("ATTACH" in c[0][0] for c in cur.execute.call_args_list)
+        assert date(2026, 5, 1) in db._meter_partitions
+
+    def test_failed_attach_is_retried(self, partitioned):
+        db = partitioned
+        get_connection, cur = _mock_connection()
+        cur.execute.side_effect = RuntimeError("lock timeout")
+        with patch.object(db, "get_connection", get_connection):
+            assert db.ensure_meter_partitions({date(2026, 5, 1)}) == []
+        assert date(2026, 5, 1) not in db._meter_partitions
+
+    def test_default_months_are_current_and_ahead(self, partitioned):
+        db = partitioned
+        with patch.object(db, "METER_PARTITIONS_AHEAD", 2):
+            months = db._upcoming_months()
+        assert len(months) == 3 and months[0].day == 1
+        assert months[2] == db._next_month(db._next_month(months[0]))
+
+    def test_ingest_attaches_partitions_before_its_transaction(self, partitioned):
+        db = partitioned
+        get_connection, cur = _mock_connection()
+        cur.fetchone.return_value = None
+        with patch.object(db, "get_connection", get_connection), \
+             patch.object(db, "ensure_meter_partitions") as ensure, \
+             patch("psycopg2.extras.execute_values"):
+            ensure.side_effect = lambda months: cur.execute.assert_not_called()
+            db.save_meter_readings("b1", [(datetime(2026, 5, 3, 12, 0), 0.5, 0.0, None)])
+        ensure.assert_called_once_with({date(2026, 5, 1)})
+        assert not any("PARTITION" in c[0][0] for c in cur.execute.call_args_list)
+
+
+class TestRetentionAndMigration:
+    def test_drop_only_whole_months_before_cutoff(self, partitioned):
+        db = partitioned
+        get_connection, cur = _mock_connection()
+        partitions = [{"name": f"meter_readings_y2025m{m:02d}", "month": date(2025, m, 1), "estimated_rows": 0}
+                      for m in (10, 11, 12)]
+        with patch.object(db, "get_connection", get_connection), \
+             patch.object(db, "list_meter_partitions", return_value=partitions):
+            removed = db.drop_meter_partitions(datetime(2025, 12, 15))
+        assert removed == ["meter_readings_y2025m10", "meter_readings_y2025m11"]
+        sql = [c[0][0] for c in cur.execute.call_args_list]
+        assert sql[0] == "ALTER TABLE meter_readings DETACH PARTITION meter_readings_y2025m10"
+        assert sql[1] == "DROP TABLE meter_readings_y2025m10"
+
+    def test_detach_only_keeps_tables(self, partitioned):
+        db = partitioned
+        get_connection, cur = _mock_connection()
+        partitions = [{"name": "meter_readings_y2025m01", "month": date(2025, 1, 1), "estimated_rows": 0}]
+        with patch.object(db, "get_connection", get_connection), \
+             patch.object(db, "list_meter_partitions", return_value=partitions):
+            assert db.drop_meter_partitions(date(2026, 1, 1), detach_only=True) == ["meter_readings_y2025m01"]
+        assert not any("DROP TABLE" in c[0][0] for c in cur.execute.call_args_list)
+
+    def test_migration_skips_partitioned_table(self):
+        import database as db
+        get_connection, cur = _mock_connection([{"relkind": "p"}])
+        with patch.object(db, "get_connection", get_connection):
+            result = db.migrate_meter_readings_to_partitions()
+        assert result["migrated"] is False
+        assert result["reason"] == "already partitioned"
+
+    def test_migration_copies_months_then_swaps(self):
+        import database as db
+        get_connection, cur = _mock_connection()
+        cur.fetchone.side_effect = [
+            {"relkind": "r"},
+            {"lo": datetime(2025, 11, 20), "hi": datetime(2026, 1, 5), "seq": 900,
+             "started": datetime(2026, 2, 1, 3, 0)},
+        ] + [{"existing": None}] * 10
+        cur.fetchall.return_value = []
+        cur.rowcount = 10
+        with patch.object(db, "get_connection", get_connection), \
+             patch.object(db, "METER_READINGS_PARTITIONED", False):
+            result = db.migrate_meter_readings_to_partitions()
+            assert db.METER_READINGS_PARTITIONED is True
+        assert result["migrated"] and result["months"] == 3 and result["rows"] == 30
+        sql = [" ".join(c[0][0].split()) for c in cur.execute.call_args_list]
+        assert any("PARTITION OF meter_readings_part" in q and "meter_readings_y2025m11_new" in q for q in sql)
+        lock = sql.index("LOCK TABLE meter_readings IN EXCLUSIVE MODE")
+        assert sql[lock - 1] == "SELECT pg_advisory_xact_lock(%s)"
+        assert cur.execute.call_args_list[lock - 1][0][1] == (db.METER_ROLLUP_LOCK_ID,)
+        compacted = next(i for i, q in enumerate(sql) if q.startswith("DELETE FROM meter_readings_part p USING"))
+        assert cur.execute.call_args_list[compacted][0][1] == (datetime(2026, 2, 1, 3, 0),)
+        assert lock < compacted < sql.index("ALTER TABLE meter_readings RENAME TO meter_readings_legacy")
+        assert any("brin" in q for q in sql[lock:])
+
+
+class TestPartitionRoutes:
+    def _app(self):
+        import os
+        with patch.dict(os.environ, {"DATABASE_URL": "postgresql://x:x@localhost/x"}):
+            with patch("database.init_db", return_value=True), \
+                 patch("database._connection_pool", MagicMock()), \
+                 patch("database.is_db_available", return_value=True):
+                try:
+                    import app as app_module
+                except Exception:
+                    pytest.skip("App import requires live DB")
+        return app_module
+
+    def test_cron_attaches_ahead_and_applies_retention(self):
+        app_module = self._app()
+        client = app_module.app.test_client()
+        with patch.object(app_module, "USE_POSTGRES", True), \
+             patch.object(app_module, "CRON_SECRET", ""), \
+             patch.object(app_module, "METER_RETENTION_MONTHS", 24), \
+             patch.object(app_module.limiter, "enabled", False), \
+             patch.object(app_module.db, "ensure_meter_partitions", return_value=["meter_readings_y2030m01"]), \
+             patch.object(app_module.db, "drop_meter_partitions", return_value=[]) as drop:
+            resp = client.post("/api/cron/meter-partitions")
+        assert resp.status_code == 200 and resp.get_json()["created"] == ["meter_readings_y2030m01"]
+        cutoff = drop.call_args[0][0]
+        today = date.today()
+        assert cutoff.day == 1 and (today.year - cutoff.year) * 12 + today.month - cutoff.month == 24
+
+    def test_migration_job_fails_loudly(self):
+        app_module = self._app()
+        with patch.object(app_module.db, "migrate_meter_readings_to_partitions",
+                          return_value={"migrated": False, "reason": "lock timeout"}):
+            with pytest.raises(RuntimeError):
+                app_module._run_meter_partition_migration_job({})
+        with patch.object(app_module.db, "migrate_meter_readings_to_partitions",
+                          return_value={"migrated": False, "reason": "already partitioned"}) as migrate:
+            app_module._run_meter_partition_migration_job({"drop_legacy": True})
+        migrate.assert_called_once_with(drop_legacy=True)
@@ -0,0 +1,165 @@
+"""Tests for the vectorized meter data quality engine."""
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+
+def _series(start, n, value=0.3, step=15):
+    # slightly varying values so no flat-lines unless a test adds them
+    return [(start + timedelta(minutes=step * i), value + (i % 7) * 0.01, 0.0, None) for i in range(n)]
+
+
+class TestChecks:
+    def test_clean_series_is_good(self):
+        from meter_quality import analyze_readings
+        report = analyze_readings(_series(datetime(2026, 1, 1), 96 * 3))
+        assert report["quality"] == "good"
+        assert report["issues"] == []
+        assert report["completeness"] == 1.0
+        assert report["interval_seconds"] == 900
+
+    def test_gap_ranges_and_month_completeness(self):
+        from meter_quality import analyze_readings
+        readings = _series(datetime(2026, 1, 31), 192)
+        del readings[90:100]  # 2026-01-31 22:30 .. 2026-02-01 00:45
+        report = analyze_readings(readings)
+        assert report["gaps"]["count"] == 1
+        assert report["gaps"]["missing_intervals"] == 10
+        assert report["gaps"]["ranges"] == [
+            {"start": "2026-01-31 22:30:00", "end": "2026-02-01 01:00:00", "missing": 10}]
+        assert report["months"]["2026-01"]["expected"] == 96
+        assert report["months"]["2026-01"]["readings"] == 90
+        assert report["months"]["2026-02"] == {"readings": 92, "expected": 96, "completeness": 0.9583}
+        assert any("Datenlücken" in i for i in report["issues"])
+
+    def test_duplicates_and_conflicts(self):
+        from meter_quality import analyze_readings
+        readings = _series(datetime(2026, 1, 1), 20)
+        readings += [readings[3], (readings[5][0], 9.0, 0.0, None)]
+        report = analyze_readings(readings)
+        assert report["duplicates"]["count"] == 2
+        assert report["duplicates"]["conflicting"] == 1
+        assert report["unique_readings"] == 20
+
+    def test_dst_switch_is_not_a_gap_or_duplicate(self):
+        from meter_quality import analyze_readings
+        spring = [r for r in _series(datetime(2026, 3, 29), 96) if r[0].hour != 2]
+        autumn = _series(datetime(2026, 10, 25), 96)
+        autumn += [r for r in autumn if r[0].hour == 2]
+        report = analyze_readings(spring + autumn)
+        assert report["dst"]["skipped_hours"] == ["2026-03-29 02:00:00"]
+        assert report["dst"]["repeated_hour_readings"] == 4
+        assert report["duplicates"]["count"] == 0
+        # only the real gap between the two days remains
+        assert report["gaps"]["count"] == 1
+        assert report["gaps"]["ranges"][0]["start"] == "2026-03-30 00:00:00"
+
+        spring_only = analyze_readings(spring)
+        assert spring_only["gaps"]["count"] == 0
+        assert spring_only["months"]["2026-03"] == {"readings": 92, "expected": 92, "completeness": 1.0}
+
+    def test_flatline_negative_and_outlier(self):
+        from meter_quality import analyze_readings, FLATLINE_MIN_READINGS
+        readings = _series(datetime(2026, 1, 1), 96 * 7)
+        for i in range(200, 200 + FLATLINE_MIN_READINGS):
+            readings[i] = (readings[i][0], 0.5, 0.0, None)
+        readings[10] = (readings[10][0], -0.2, 0.0, None)
+        readings[400] = (readings[400][0], 25.0, 0.0, None)
+        report = analyze_readings(readings)
+        assert report["flatlines"]["count"] == 1
+        assert report["flatlines"]["ranges"][0]["readings"] == FLATLINE_MIN_READINGS
+        assert report["negatives"] == {"count": 1, "by_column": {"consumption": 1, "production": 0, "feed_in": 0}}
+        assert report["outliers"]["count"] == 1
+        assert report["outliers"]["timestamps"] == [str(readings[400][0])]
+        assert report["quality"] == "poor"
+
+    def test_epoch_arrays_and_accumulator_agree(self):
+        from meter_quality import QualityAccumulator, analyze, readings_to_arrays
+        readings = _series(datetime(2026, 1, 1), 500)
+        del readings[100:110]
+        acc = QualityAccumulator()
+        for i in range(0, len(readings), 64):
+            acc.add(readings[i:i + 64])
+        ts, values = readings_to_arrays(readings)
+        assert ts.dtype == np.int64
+        shuffled = np.random.default_rng(0).permutation(len(ts))
+        assert acc.report() == analyze(ts[shuffled], values[shuffled])
+
+    def test_no_data(self):
+        from meter_quality import QualityAccumulator
+        assert QualityAccumulator().report()["quality"] == "no_data"
+
+
+class TestSweep:
+    def test_sweeps_matrix_columns(self):
+        import database as db
+        import meter_data
+        end = datetime(2026, 2, 1)
+        index = np.datetime64(end - timedelta(days=1), 'm') + np.arange(96) * np.timedelta64(15, 'm')
+        missing = np.zeros((96, 2), dtype=bool)
+        missing[:, 1] = True
+        missing[:10, 1] = False
+        matrix = db.MeterMatrix(index, ["a", "b"], np.full((96, 2), 0.3) + np.arange(96)[:, None] % 5 * 0.01,
+                                np.zeros((96, 2)), missing, np.zeros((96, 2), dtype=bool))
+        with patch("database.get_meter_building_ids", return_value=["a", "b", "c"]), \
+             patch("database.load_meter_matrix", return_value=matrix) as load, \
+             patch.object(db, "METER_MATRIX_CHUNK", 2):
+            result = meter_data.sweep_meter_quality(days=1)
+        assert load.call_count == 2
+        assert result["buildings"]["a"]["quality"] == "good"
+        assert result["checked"] == 2
+
+    def test_estimated_slots_count_as_gaps(self):
+        import database as db
+        import meter_data
+        end = datetime(2026, 2, 1)
+        index = np.datetime64(end - timedelta(days=1), 'm') + np.arange(96) * np.timedelta64(15, 'm')
+        estimated = np.zeros((96, 1), dtype=bool)
+        estimated[20:80] = True  # gap-filled by meter_normalize on upload
+        matrix = db.MeterMatrix(index, ["a"], np.full((96, 1), 0.3), np.zeros((96, 1)),
+                                np.zeros((96, 1), dtype=bool), estimated)
+        with patch("database.get_meter_building_ids", return_value=["a"]), \
+             patch("database.load_meter_matrix", return_value=matrix):
+            result = meter_data.sweep_meter_quality(days=1)
+        assert result["buildings"]["a"]["completeness"] < 50
+
+    def test_unreadable_data_is_an_error_not_empty(self):
+        import meter_data
+        with patch("database.get_meter_building_ids", return_value=["a"]), \
+             patch("database.load_meter_matrix", side_effect=RuntimeError("connection lost")):
+            result = meter_data.sweep_meter_quality(days=1)
+        assert result["error"] == "connection lost" and result["checked"] == 0
+
+    def test_hourly_only_building_is_swept(self):
+        """Hourly uploads are resampled (flag 1) on every slot; that is measured energy, not a gap."""
+        from contextlib import contextmanager
+        from unittest.mock import MagicMock
+        import database as db
+        import meter_blob
+        import meter_data
+        import meter_normalize
+        day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=3)
+        hourly = [(day + timedelta(hours=h), 1.2 + h % 24 * 0.01, 0.0, None) for h in range(5 * 24)]
+        series = meter_normalize.normalize_readings(hourly)
+        assert (series.flags.max(axis=1) == meter_normalize.FLAG_RESAMPLED).all()
+        values = series.values
+        slots = len(series.index)
+        blob = {"building_id": "h", "month": day.date(), "start_ts": day, "step_seconds": 900, "slots": slots,
+                "codec": "zlib", "source": "csv", "payload": meter_blob.encode(
+                    slots, np.arange(slots), values, series.flags.max(axis=1), codec="zlib")}
+        cur = MagicMock()
+        cur.mogrify.side_effect = lambda sql, params: sql.encode()
+        cur.fetchall.return_value = [blob]
+        conn = MagicMock()
+        conn.cursor.return_value.__enter__.return_value = cur
+
+        @contextmanager
+        def get_connection():
+            yield conn
+
+        with patch("database.get_meter_building_ids", return_value=["h"]), \
+             patch.object(db, "get_connection", get_connection):
+            result = meter_data.sweep_meter_quality(days=1)
+        assert result["checked"] == 1 and result["buildings"]["h"]["completeness"] == 1.0
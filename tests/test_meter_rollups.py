@@ -0,0 +1,106 @@
+"""Tests for incremental meter rollups and the insights reading them."""
+from contextlib import contextmanager
+from unittest.mock import patch, MagicMock
+
+
+def _mock_connection(fetchone):
+    cur = MagicMock()
+    cur.fetchone.side_effect = fetchone
+    cur.rowcount = 4
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cur
+
+    @contextmanager
+    def get_connection():
+        yield conn
+
+    return get_connection, cur
+
+
+def _sql(cur):
+    return [" ".join(c[0][0].split()) for c in cur.execute.call_args_list]
+
+
+class TestRefreshRollups:
+    def test_nothing_new_keeps_high_water(self):
+        import database as db
+        get_connection, cur = _mock_connection([{"high_water": 120}, {"top": None}])
+        with patch.object(db, "get_connection", get_connection):
+            result = db.refresh_meter_rollups()
+        assert result == {"hours": 0, "days": 0, "profile_cells": 0, "high_water": 120,
+                          "backfilled": 4, "more": False}
+        statements = _sql(cur)
+        assert statements[0].startswith("SELECT pg_advisory_xact_lock(")
+        assert not any("rollup_state (name" in s for s in statements)
+
+    def test_recomputes_only_dirty_buckets(self):
+        import database as db
+        get_connection, cur = _mock_connection([{"high_water": 120}, {"top": 180}])
+        with patch.object(db, "get_connection", get_connection):
+            result = db.refresh_meter_rollups()
+        assert result == {"hours": 4, "days": 4, "profile_cells": 4, "high_water": 180,
+                          "backfilled": 4, "more": False}
+
+        statements = _sql(cur)
+        dirty = next(c for c in cur.execute.call_args_list if "rollup_dirty_hours ON COMMIT DROP" in c[0][0])
+        assert dirty[0][1] == (120, 180)
+        assert any(s.startswith("INSERT INTO meter_readings_hourly") for s in statements)
+        assert any("INSERT INTO meter_readings_daily" in s for s in statements)
+        assert any("INSERT INTO meter_profile_rollup" in s for s in statements)
+        # Day and profile cells come from the hourly rollup, not raw readings
+        assert all("JOIN meter_readings_hourly" in s for s in statements
+                   if "INSERT INTO meter_readings_daily" in s or "INSERT INTO meter_profile_rollup" in s)
+        assert cur.execute.call_args_list[-1][0][1] == (db.METER_ROLLUP_STATE, 180)
+
+    def test_unnumbered_readings_are_backfilled_in_batches(self):
+        import database as db
+        import meter_data
+        get_connection, cur = _mock_connection([{"high_water": 0}, {"top": None}])
+        with patch.object(db, "get_connection", get_connection), \
+             patch.object(db, "METER_SEQ_BACKFILL_BATCH", 4):
+            result = db.refresh_meter_rollups()
+        backfill = next(c for c in cur.execute.call_args_list if "WHERE ingest_seq IS NULL" in c[0][0])
+        assert backfill[0][0].lstrip().startswith("UPDATE meter_readings SET ingest_seq = nextval(")
+        assert backfill[0][1] == (4,)
+        assert result["backfilled"] == 4 and result["more"] is True
+
+        with patch("database.refresh_meter_rollups", return_value=result), \
+             patch("jobs.enqueue") as enqueue:
+            meter_data._run_rollup_job({})
+        enqueue.assert_called_once_with(meter_data.METER_ROLLUP_JOB, dedup_key='all')
+
+    def test_ingest_takes_shared_lock(self):
+        import database as db
+        from datetime import datetime
+        get_connection, cur = _mock_connection([])
+        with patch.object(db, "get_connection", get_connection), \
+             patch("psycopg2.extras.execute_values") as ev:
+            db.save_meter_readings("b1", [(datetime(2026, 1, 1), 0.5, 0.0, None)])
+        assert "pg_advisory_xact_lock_shared" in cur.execute.call_args_list[0][0][0]
+        assert "ingest_seq = EXCLUDED.ingest_seq" in ev.call_args[0][1]
+
+
+class TestRollupConsumers:
+    def test_ingest_enqueues_rollup_refresh(self):
+        import meter_data
+        csv_text = "Zeitstempel;Verbrauch (kWh);Produktion (kWh);Einspeisung (kWh)\n" \
+                   "01.01.2026 00:15;0,5;0;0\n01.01.2026 00:30;0,6;0;0\n"
+        with patch("meter_data.db") as db, patch("meter_data.jobs.enqueue") as enqueue:
+            db.save_meter_readings.return_value = 2
+            db.get_meter_reading_stats.return_value = {}
+            assert meter_data.ingest_csv("b1", csv_text)["success"]
+        enqueue.assert_called_once_with(meter_data.METER_ROLLUP_JOB, dedup_key="all")
+
+    def test_insights_read_profile_rollup(self):
+        import insights_engine
+        get_connection, cur = _mock_connection([])
+        cur.fetchall.return_value = [{"plz": "8953", "households": 3, "avg_load_kwh": 0.2,
+                                      "load_variability": 0.05, "peak_load_kwh": 1.2}]
+        with patch.object(insights_engine.db, "get_connection", get_connection):
+            result = insights_engine.compute_flexibility_potential()
+            insights_engine.compute_load_profiles()
+            insights_engine.compute_solar_index()
+        assert result["flexibility"][0]["flexibility_potential_kwh"] == 3.0
+        for sql in _sql(cur):
+            assert "meter_profile_rollup" in sql
+            assert "FROM meter_readings " not in sql
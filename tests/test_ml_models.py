@@ -0,0 +1,96 @@
+"""Tests for ml_models.py - profile generation and community simulation."""
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def _buildings(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "building_id": [f"b{i}" for i in range(n)],
+        "lat": 47.47 + rng.normal(0, 0.0005, n),
+        "lon": 8.30 + rng.normal(0, 0.0005, n),
+        "annual_consumption_kwh": rng.uniform(3000, 20000, n),
+        "potential_pv_kwp": rng.uniform(0, 30, n),
+    })
+
+
+class TestUnitProfiles:
+    def test_shared_and_read_only(self):
+        from ml_models import get_unit_profiles
+        units = get_unit_profiles()
+        assert units is get_unit_profiles()
+        assert len(units.index) == 35040
+        with pytest.raises(ValueError):
+            units.consumption_kw[0] = 1.0
+
+    def test_consumption_unit_integrates_to_one_kwh(self):
+        from ml_models import get_unit_profiles
+        assert get_unit_profiles().consumption_kw.sum() * 0.25 == pytest.approx(1.0)
+
+    def test_generate_mock_profiles_is_scaled_unit(self):
+        from ml_models import generate_mock_profiles, get_unit_profiles
+        df = generate_mock_profiles(5000, 8.0)
+        units = get_unit_profiles()
+        assert list(df.columns) == ["consumption_kw", "production_kw"]
+        np.testing.assert_array_equal(df["consumption_kw"].values, units.consumption_kw * 5000)
+        assert df["production_kw"].max() == pytest.approx(8.0)
+
+    def test_decimal_and_missing_inputs(self):
+        from ml_models import MockProfile
+        profile = MockProfile(Decimal("4000.00"), None)
+        assert profile.consumption_kw.sum() * 0.25 == pytest.approx(4000.0)
+        assert profile.production_kw.sum() == 0.0
+
+
+class TestCommunityAutarky:
+    def test_matches_per_building_sum(self):
+        from ml_models import calculate_community_autarky, generate_mock_profiles
+        df = _buildings(8)
+        profiles = [generate_mock_profiles(r.annual_consumption_kwh, r.potential_pv_kwp) for r in df.itertuples()]
+        consumption = sum(p["consumption_kw"].values for p in profiles)
+        production = sum(p["production_kw"].values for p in profiles)
+        net = (consumption - production) * 0.25
+        expected = 1 - net[net > 0].sum() / (consumption.sum() * 0.25)
+
+        autarky, total_cons, total_prod = calculate_community_autarky(df, None)
+        assert autarky == pytest.approx(expected)
+        assert total_cons == pytest.approx(df["annual_consumption_kwh"].sum())
+        assert total_prod == pytest.approx(production.sum() * 0.25)
+
+    def test_empty(self):
+        from ml_models import calculate_community_autarky
+        assert calculate_community_autarky(pd.DataFrame(), None) == (0.0, 0, 0)
+
+
+class TestBatchedSimulation:
+    def test_matches_per_cluster_simulation(self):
+        from ml_models import simulate_clusters, calculate_community_autarky
+        df = _buildings(30, seed=3)
+        labels = np.array([i % 4 for i in range(30)])
+        labels[:3] = -1
+        sim = simulate_clusters(labels, df["annual_consumption_kwh"], df["potential_pv_kwp"], block_size=3)
+        assert list(sim["cluster_ids"]) == [0, 1, 2, 3]
+        for i, cid in enumerate(sim["cluster_ids"]):
+            expected = calculate_community_autarky(df[labels == cid], None)
+            assert sim["autarky"][i] == pytest.approx(expected[0])
+            assert sim["total_consumption_kwh"][i] == pytest.approx(expected[1])
+            assert sim["total_production_kwh"][i] == pytest.approx(expected[2])
+
+    def test_all_noise(self):
+        from ml_models import simulate_clusters
+        sim = simulate_clusters([-1, -1], [1000, 2000], [1, 2])
+        assert len(sim["cluster_ids"]) == 0
+
+    def test_find_optimal_communities_ranked(self):
+        from ml_models import find_optimal_communities
+        df = _buildings(12)
+        ranked, clustered = find_optimal_communities(df, radius_meters=500, min_community_size=2)
+        assert ranked
+        assert ranked == sorted(ranked, key=lambda c: c["autarky_percent"], reverse=True)
+        first = ranked[0]
+        assert first["num_members"] == len(first["members"]) == len(first["building_ids"])
+        assert set(first["members"][0]) == {"building_id", "lat", "lon"}
+        assert (clustered["cluster"] == first["community_id"]).sum() == first["num_members"]
@@ -128,3 +128,318 @@ class TestSafeHelpers:
         assert _safe_float("3,14") == 3.14
         assert _safe_float(None) is None
         assert _safe_float("abc") is None
+
+
+@pytest.fixture
+def sparql_stub():
+    """Local SPARQL endpoint: one H4 tariff per requested municipality."""
+    import json
+    import re
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs
+
+    state = {"queries": [], "fail_first": 0, "broken_bfs": set()}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+            query = parse_qs(body)["query"][0]
+            bfs_numbers = [int(b) for b in re.findall(r"municipality/(\d+)>", query)]
+            state["queries"].append(bfs_numbers)
+            if state["fail_first"] > 0:
+                state["fail_first"] -= 1
+                return self._send(503, b"busy")
+            if state["broken_bfs"] & set(bfs_numbers):
+                return self._send(400, b"bad query")
+            bindings = [{"municipality": {"value": f"https://ld.admin.ch/municipality/{b}"},
+                         "operator": {"value": f"EW {b}"}, "category": {"value": "H4"},
+                         "total": {"value": "27.5"}, "grid": {"value": "9.5"}}
+                        for b in bfs_numbers]
+            self._send(200, json.dumps({"results": {"bindings": bindings}}).encode())
+
+        def _send(self, status, payload):
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state["url"] = f"http://127.0.0.1:{server.server_address[1]}/query"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+class TestConcurrentElcom:
+    """ElcomFetcher against a local stub endpoint."""
+
+    def test_batches_with_values_clause(self, sparql_stub):
+        from public_data import ElcomFetcher
+        bfs_numbers = list(range(100, 145))
+        with ElcomFetcher(endpoint=sparql_stub["url"], batch_size=20, workers=3) as fetcher:
+            tariffs, errors = fetcher.fetch_many(bfs_numbers, 2026)
+        assert errors == {}
+        assert sorted(tariffs) == bfs_numbers
+        assert tariffs[130][0]["operator_name"] == "EW 130"
+        assert tariffs[130][0]["grid_rp_kwh"] == 9.5
+        assert sorted(len(q) for q in sparql_stub["queries"]) == [5, 20, 20]
+
+    def test_retries_transient_errors(self, sparql_stub):
+        from public_data import ElcomFetcher
+        sparql_stub["fail_first"] = 2
+        with ElcomFetcher(endpoint=sparql_stub["url"], retries=3, backoff_seconds=0.01) as fetcher:
+            tariffs, errors = fetcher.fetch_many([261], 2026)
+            assert fetcher.stats["retries"] == 2
+        assert errors == {} and len(tariffs[261]) == 1
+
+    def test_failing_bfs_is_isolated(self, sparql_stub):
+        from public_data import ElcomFetcher
+        sparql_stub["broken_bfs"] = {242}
+        with ElcomFetcher(endpoint=sparql_stub["url"], batch_size=10, backoff_seconds=0.01) as fetcher:
+            tariffs, errors = fetcher.fetch_many([261, 242, 247], 2026)
+        assert set(errors) == {242}
+        assert len(tariffs[261]) == 1 and len(tariffs[247]) == 1
+
+
+class TestBulkRefresh:
+    """refresh_canton writes through one bulk transaction."""
+
+    def test_batch_flushes_in_chunks_and_dedupes(self):
+        import database as db
+        cur = MagicMock()
+        with patch("psycopg2.extras.execute_values") as ev:
+            batch = db.PublicDataBatch(cur, flush_size=3)
+            for bfs in (1, 2, 2, 3):
+                batch.add_profile({"bfs_number": bfs, "name": f"G{bfs}"})
+            batch.add_sonnendach({"bfs_number": 1})
+            batch.flush()
+        # profiles 1,2,2 flushed at the threshold (deduped to 2 rows), then 3, then sonnendach
+        assert [len(c[0][2]) for c in ev.call_args_list] == [2, 1, 1]
+        assert batch.saved == {"sonnendach": 1, "tariffs": 0, "profiles": 3}
+        assert batch.statements == 3
+
+    def test_refresh_canton_uses_single_batch(self, tmp_path):
+        import public_data
+        from contextlib import contextmanager
+        batch = MagicMock()
+        batch.statements = 3
+
+        @contextmanager
+        def fake_batch():
+            yield batch
+
+        tariffs = {261: [{"bfs_number": 261, "year": 2026, "category": "H4",
+                          "total_rp_kwh": 27.5, "grid_rp_kwh": 9.5}]}
+        with patch("public_data.PUBLIC_DATA_CACHE_DIR", str(tmp_path)), \
+             patch("public_data.load_energie_reporter", return_value=_dataset(
+                 [{"bfs_number": 261, "name": "Dietikon", "kanton": "ZH"}])), \
+             patch("public_data.load_sonnendach_municipal", return_value=_dataset(
+                 [{"bfs_number": 261, "potential_kwp": 100.0}])), \
+             patch("public_data.fetch_elcom_tariffs_many", return_value=(tariffs, {242: "timeout"})), \
+             patch("database.public_data_batch", fake_batch):
+            result = public_data.refresh_canton("ZH")
+
+        # Only Dietikon has data from any source on a first run
+        assert result["municipalities"] == 1
+        assert result["unchanged_municipalities"] == len(set(public_data.ZH_BFS_NUMBERS)) - 1
+        assert {"bfs": 242, "error": "elcom: timeout"} in result["errors"]
+        batch.add_sonnendach.assert_called_once()
+        batch.add_tariffs.assert_called_once_with(tariffs[261])
+        assert batch.add_profile.call_count == result["municipalities"]
+        assert result["db_statements"] == 3
+
+    def test_refresh_canton_reports_failed_transaction(self, tmp_path):
+        import public_data
+        from contextlib import contextmanager
+
+        @contextmanager
+        def broken_batch():
+            raise Exception("connection lost")
+            yield
+
+        with patch("public_data.PUBLIC_DATA_CACHE_DIR", str(tmp_path)), \
+             patch("public_data.load_energie_reporter", return_value=_dataset([{"bfs_number": 261}])), \
+             patch("public_data.load_sonnendach_municipal", return_value=_dataset([])), \
+             patch("public_data.fetch_elcom_tariffs_many", return_value=({}, {})), \
+             patch("database.public_data_batch", broken_batch):
+            result = public_data.refresh_canton("ZH")
+        assert result["municipalities"] == 0
+        assert result["errors"][-1]["error"] == "database: connection lost"
+        assert not list(tmp_path.iterdir())  # baseline not advanced
+
+    def test_unchanged_upstream_writes_only_changed_bfs(self, tmp_path):
+        import public_data
+        from contextlib import contextmanager
+        batch = MagicMock()
+        batch.statements = 1
+
+        @contextmanager
+        def fake_batch():
+            yield batch
+
+        tariffs = {bfs: [{"bfs_number": bfs, "year": 2026, "category": "H4", "total_rp_kwh": 27.5,
+                          "grid_rp_kwh": 9.5}] for bfs in public_data.ZH_BFS_NUMBERS}
+        er_rows = [{"bfs_number": bfs, "name": f"G{bfs}", "kanton": "ZH"} for bfs in public_data.ZH_BFS_NUMBERS]
+        with patch("public_data.PUBLIC_DATA_CACHE_DIR", str(tmp_path)), \
+             patch("public_data.load_sonnendach_municipal", return_value=_dataset([], changed=set())), \
+             patch("public_data.fetch_elcom_tariffs_many", return_value=(tariffs, {})), \
+             patch("database.public_data_batch", fake_batch):
+            with patch("public_data.load_energie_reporter", return_value=_dataset(er_rows)):
+                first = public_data.refresh_canton("ZH")
+            assert first["municipalities"] == len(public_data.ZH_BFS_NUMBERS)
+
+            batch.reset_mock()
+            with patch("public_data.load_energie_reporter", return_value=_dataset(er_rows, changed=set())):
+                second = public_data.refresh_canton("ZH")
+            assert second["municipalities"] == 0
+            batch.add_profile.assert_not_called()
+
+            with patch("public_data.load_energie_reporter", return_value=_dataset(er_rows, changed={261})):
+                third = public_data.refresh_canton("ZH")
+        assert third["municipalities"] == 1
+        assert batch.add_profile.call_args[0][0]["bfs_number"] == 261
+        batch.add_tariffs.assert_not_called()  # tariffs unchanged since the first run
+
+    def test_failed_profile_is_retried_next_run(self, tmp_path):
+        import public_data
+        from contextlib import contextmanager
+        batch = MagicMock()
+        batch.statements = 1
+
+        @contextmanager
+        def fake_batch():
+            yield batch
+
+        tariffs = {261: [{"bfs_number": 261, "year": 2026, "category": "H4", "total_rp_kwh": 27.5,
+                          "grid_rp_kwh": 9.5}]}
+        er_rows = [{"bfs_number": 261, "name": "Dietikon", "kanton": "ZH"}]
+        with patch("public_data.PUBLIC_DATA_CACHE_DIR", str(tmp_path)), \
+             patch("public_data.load_sonnendach_municipal", return_value=_dataset([], changed=set())), \
+             patch("public_data.fetch_elcom_tariffs_many", return_value=(tariffs, {})), \
+             patch("database.public_data_batch", fake_batch):
+            with patch("public_data.load_energie_reporter", return_value=_dataset(er_rows)), \
+                 patch("public_data.compute_energy_transition_score", side_effect=ValueError("bad row")):
+                first = public_data.refresh_canton("ZH")
+            assert first["municipalities"] == 0 and first["errors"][-1]["bfs"] == 261
+
+            # Upstream unchanged since (the raw baseline advanced), but 261 is still rewritten
+            with patch("public_data.load_energie_reporter", return_value=_dataset(er_rows, changed=set())):
+                second = public_data.refresh_canton("ZH")
+            assert second["retried"] == 1 and second["municipalities"] == 1
+            batch.add_tariffs.assert_called_once_with(tariffs[261])
+
+            batch.reset_mock()
+            with patch("public_data.load_energie_reporter", return_value=_dataset(er_rows, changed=set())):
+                third = public_data.refresh_canton("ZH")
+        assert third["retried"] == 0 and third["municipalities"] == 0
+
+
+def _dataset(rows, changed=None):
+    return {"rows": rows, "changed": changed != set(),
+            "changed_bfs": {r["bfs_number"] for r in rows} if changed is None else changed,
+            "diff": None, "resources": []}
+
+
+@pytest.fixture
+def csv_stub():
+    """Local opendata.swiss stand-in with ETag support."""
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    state = {"csv": "BFS_NR;GEMEINDENAME;KANTON\n261;Dietikon;ZH\n247;Schlieren;ZH\n",
+             "requests": [], "use_etag": True}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            import hashlib
+            if self.path.startswith("/package"):
+                body = json.dumps({"result": {"resources": [
+                    {"format": "CSV", "name": "gemeinden", "url": f"{state['base']}/data.csv"}]}}).encode()
+            else:
+                body = state["csv"].encode("utf-8")
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            state["requests"].append((self.path, self.headers.get("If-None-Match")))
+            if state["use_etag"] and self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            if state["use_etag"]:
+                self.send_header("ETag", etag)
+            self.send_header("Content-Type", "text/csv; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state["base"] = f"http://127.0.0.1:{server.server_address[1]}"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+class TestConditionalDatasets:
+    """Raw cache, conditional requests and per-BFS diff."""
+
+    def _load(self, csv_stub, tmp_path):
+        from public_data import load_dataset, RawResourceCache, _parse_energie_reporter_csv
+        return load_dataset(f"{csv_stub['base']}/package", _parse_energie_reporter_csv,
+                            cache=RawResourceCache(str(tmp_path)))
+
+    def _commit(self, data, tmp_path):
+        from public_data import RawResourceCache
+        for resource in data["resources"]:
+            RawResourceCache(str(tmp_path)).commit(resource)
+
+    def test_first_load_marks_everything_changed(self, csv_stub, tmp_path):
+        data = self._load(csv_stub, tmp_path)
+        assert data["changed"] and data["changed_bfs"] == {261, 247}
+        assert data["rows"][0]["name"] == "Dietikon"
+
+    def test_not_modified_skips_download(self, csv_stub, tmp_path):
+        self._commit(self._load(csv_stub, tmp_path), tmp_path)
+        data = self._load(csv_stub, tmp_path)
+        assert not data["changed"] and data["changed_bfs"] == set()
+        assert len(data["rows"]) == 2  # served from the raw cache
+        assert all(etag for _, etag in csv_stub["requests"][-2:])
+
+    def test_same_content_without_etag_is_unchanged(self, csv_stub, tmp_path):
+        csv_stub["use_etag"] = False
+        self._commit(self._load(csv_stub, tmp_path), tmp_path)
+        assert not self._load(csv_stub, tmp_path)["changed"]
+
+    def test_diff_per_bfs(self, csv_stub, tmp_path):
+        self._commit(self._load(csv_stub, tmp_path), tmp_path)
+        csv_stub["csv"] = "BFS_NR;GEMEINDENAME;KANTON\n261;Dietikon;ZH\n247;Schlieren-Neu;ZH\n242;Urdorf;ZH\n"
+        data = self._load(csv_stub, tmp_path)
+        assert data["changed_bfs"] == {247, 242}
+        assert data["diff"] == {"added": [242], "changed": [247], "removed": []}
+
+    def test_uncommitted_fetch_keeps_baseline(self, csv_stub, tmp_path):
+        self._load(csv_stub, tmp_path)  # processing failed, never committed
+        assert self._load(csv_stub, tmp_path)["changed_bfs"] == {261, 247}
+
+    def test_baseline_is_kept_per_scope(self, csv_stub, tmp_path):
+        from public_data import load_dataset, RawResourceCache, _parse_energie_reporter_csv
+        url = f"{csv_stub['base']}/package"
+        zh = RawResourceCache(str(tmp_path), scope="ZH")
+        for resource in load_dataset(url, _parse_energie_reporter_csv, cache=zh)["resources"]:
+            zh.commit(resource)
+        assert not load_dataset(url, _parse_energie_reporter_csv, cache=zh)["changed"]
+        ag = load_dataset(url, _parse_energie_reporter_csv, cache=RawResourceCache(str(tmp_path), scope="AG"))
+        assert ag["changed"] and ag["changed_bfs"] == {261, 247}
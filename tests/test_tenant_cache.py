@@ -16,11 +16,16 @@ def mock_redis():
 
 @pytest.fixture(autouse=True)
 def clear_tenant_cache():
-    """Clear in-memory fallback between tests."""
+    """Clear in-memory fallback and cache L1 between tests."""
+    import cache
     import tenant
     tenant._tenant_cache.clear()
+    cache.local_cache.clear()
+    cache._generations.clear()
     yield
     tenant._tenant_cache.clear()
+    cache.local_cache.clear()
+    cache._generations.clear()
 
 
 class TestTenantRedisCache:
@@ -83,6 +88,6 @@ class TestTenantInvalidation:
 
     def test_invalidate_all(self, mock_redis):
         from tenant import invalidate_cache
-        mock_redis.keys.return_value = [b"openleg:tenant:a", b"openleg:tenant:b"]
         invalidate_cache(None)
-        mock_redis.keys.assert_called_with("openleg:tenant:*")
+        mock_redis.incr.assert_called_once_with("openleg:_gen:tenant")
+        mock_redis.keys.assert_not_called()